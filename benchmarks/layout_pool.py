@@ -0,0 +1,81 @@
+"""
+Benchmark of the per-block figure setup with and without the layout pool.
+
+Usage: PYTHONPATH=. python benchmarks/layout_pool.py [n_blocks]
+
+Renders n_blocks barplots of the example block with the most variables twice:
+once building a new layout for every block and once reusing the layouts of the
+pool. Reports the time spent acquiring the layout and the total time per block.
+"""
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from niceplots.plotting import barplot
+from niceplots.utils.codebook import setup_codebook
+from niceplots.utils.config import setup_config
+from niceplots.utils.data import setup_data
+from niceplots.utils.layout_pool import LAYOUT_POOL
+
+EXAMPLE_DIR = Path(__file__).parent.parent / "examples"
+
+
+def run(n_blocks: int, reuse: bool, block, data, config, codebook) -> tuple:
+    acquire = LAYOUT_POOL.acquire
+    setup_time = 0.0
+
+    def timed_acquire(*args, **kwargs):
+        nonlocal setup_time
+        start = time.perf_counter()
+        result = acquire(*args, **kwargs)
+        setup_time += time.perf_counter() - start
+        return result
+
+    LAYOUT_POOL.acquire = timed_acquire
+    try:
+        start = time.perf_counter()
+        for _ in range(n_blocks):
+            if not reuse:
+                LAYOUT_POOL.clear()
+            barplot.plot_barplot(block, data, config, codebook)
+        total_time = time.perf_counter() - start
+    finally:
+        LAYOUT_POOL.acquire = acquire
+        LAYOUT_POOL.clear()
+    return setup_time / n_blocks, total_time / n_blocks
+
+
+def main(n_blocks: int) -> None:
+    with tempfile.TemporaryDirectory() as prefix:
+        config = setup_config(
+            Path(prefix),
+            EXAMPLE_DIR / "example_config.yml",
+            "benchmark",
+            "1",
+            "png",
+            False,
+        )
+        codebook = setup_codebook(config, EXAMPLE_DIR / "example_codebook.csv")
+        data = setup_data(
+            config, codebook, (EXAMPLE_DIR / "example_data.csv",), ("data",)
+        ).data
+        blocks, sizes = np.unique(codebook.codebook.block.dropna(), return_counts=True)
+        block = blocks[np.argmax(sizes)]
+
+        # warm up font cache and imports
+        run(1, False, block, data, config, codebook)
+        fresh = run(n_blocks, False, block, data, config, codebook)
+        pooled = run(n_blocks, True, block, data, config, codebook)
+
+    print(f"block {int(block)} ({np.max(sizes)} variables), {n_blocks} renders")
+    print(f"{'':10} {'setup [ms]':>12} {'total [ms]':>12}")
+    print(f"{'fresh':10} {1e3 * fresh[0]:12.2f} {1e3 * fresh[1]:12.2f}")
+    print(f"{'pooled':10} {1e3 * pooled[0]:12.2f} {1e3 * pooled[1]:12.2f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
@@ -0,0 +1,144 @@
+"""
+Calibration of the cost model of nice-plots plan (niceplots/utils/plan.py).
+
+Usage: PYTHONPATH=. python benchmarks/plan_calibration.py [n_rows]
+
+Times reading, checking and aggregating a data table of n_rows rows built from the
+example data, and rendering the pages of the example blocks with different numbers
+of variables, groups and lengths of text for each plot type. The render times are
+fitted by least squares to the features of the figures. Prints the constants of the
+cost model measured on this machine.
+"""
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from niceplots.plotting import barplot, histogram, lineplot, timeline
+from niceplots.utils.codebook import setup_codebook
+from niceplots.utils.config import setup_config
+from niceplots.utils.data import Data, setup_data
+from niceplots.utils.engine import get_engine
+from niceplots.utils.plan import get_figure_features
+
+EXAMPLE_DIR = Path(__file__).parent.parent / "examples"
+
+PLOT_TYPES = ["barplots", "lineplots", "histograms", "timelines"]
+
+GROUPS = [
+    {"nice_plots_default_group": "True"},
+    {"Group 1": "VAR02 == 1", "Others": "(VAR02 == 2) | (VAR02 == 4)"},
+    {"A": "VAR03 <= 2", "B": "VAR03 == 3", "C": "VAR03 >= 4"},
+]
+
+
+def calibrate_ingest(prefix: Path, n_rows: int) -> None:
+    config = setup_config(
+        prefix, EXAMPLE_DIR / "example_config.yml", "ingest", "1", "pdf", False
+    )
+    codebook = setup_codebook(config, EXAMPLE_DIR / "example_codebook.csv")
+    df = pd.read_csv(EXAMPLE_DIR / "example_data.csv")
+    df = df.iloc[np.arange(n_rows) % len(df)]
+    path = prefix / "data.csv"
+    df.to_csv(path, index=False)
+    n_bytes = path.stat().st_size
+    variables = list(codebook.codebook.variable)
+    plotted = list(codebook.codebook.variable[~codebook.codebook.block.isna()])
+    engine = get_engine(config.data.engine)
+
+    start = time.perf_counter()
+    frame = engine.read_csv(path, config.data.delimiter)
+    read_time = time.perf_counter() - start
+    data = Data(
+        frame,
+        "data",
+        config.data.groups,
+        codebook.codebook.variable,
+        config.data.no_answer_code,
+        True,
+        engine,
+    )
+    start = time.perf_counter()
+    data.check(codebook)
+    mask_time = time.perf_counter() - start
+    start = time.perf_counter()
+    data.get_aggregates(plotted)
+    aggregate_time = time.perf_counter() - start
+
+    print(f"CSV_BYTES_PER_SECOND = {n_bytes / read_time:.3g}")
+    print(f"MASK_SECONDS_PER_VALUE = {mask_time / (n_rows * len(variables)):.3g}")
+    print(
+        f"AGGREGATE_SECONDS_PER_VALUE = {aggregate_time / (n_rows * len(plotted)):.3g}"
+    )
+
+
+def render(plot_type: str, block, page, data, config, codebook) -> None:
+    if plot_type == "barplots":
+        barplot.plot_barplot(block, data, config, codebook, page=page)
+    elif plot_type == "lineplots":
+        lineplot.plot_lineplot(block, data, config, codebook, page=page)
+    elif plot_type == "histograms":
+        histogram.plot_histogram(block, data, config, codebook, page=page)
+    else:
+        variables = list(codebook.codebook.variable)
+        aggregates = [data.get_aggregates(variables)] * 3
+        timeline.plot_timeline(
+            block, aggregates, ["1", "2", "3"], config, codebook, page
+        )
+
+
+def calibrate_render(prefix: Path) -> None:
+    samples: dict[str, list] = {p: [] for p in PLOT_TYPES}
+    for groups in GROUPS:
+        config = setup_config(
+            prefix, EXAMPLE_DIR / "example_config.yml", "render", "1", "pdf", False
+        )
+        config.data.groups = groups
+        codebook = setup_codebook(config, EXAMPLE_DIR / "example_codebook.csv")
+        data = setup_data(
+            config, codebook, (EXAMPLE_DIR / "example_data.csv",), ("data",)
+        ).data
+        labels = codebook.codebook.label.copy()
+        for text_factor in [1, 4]:
+            codebook.codebook["label"] = labels * text_factor
+            for max_variables in [2, None]:
+                config.plotting.max_variables_per_page = max_variables
+                for block in codebook.blocks[~np.isnan(codebook.blocks)]:
+                    page = codebook.get_page_numbers(block, max_variables)[0]
+                    for plot_type in samples:
+                        n_segments_per_code = (
+                            3 if plot_type == "timelines" else len(groups)
+                        )
+                        features = get_figure_features(
+                            config, codebook, (block,), page, n_segments_per_code
+                        )
+                        start = time.perf_counter()
+                        render(plot_type, block, page, data, config, codebook)
+                        seconds = time.perf_counter() - start
+                        samples[plot_type].append((features, seconds))
+
+    print("RENDER_COSTS = {")
+    for plot_type, measured in samples.items():
+        # the first render of each plot type loads fonts and imports
+        features = np.array([f for f, _ in measured[1:]])
+        seconds = np.array([s for _, s in measured[1:]])
+        coefficients = np.clip(
+            np.linalg.lstsq(features, seconds, rcond=None)[0], 0, None
+        )
+        costs = ", ".join(f"{c:.2g}" for c in coefficients)
+        print(f'    "{plot_type}": ({costs}),')
+    print("}")
+
+
+def main(n_rows: int) -> None:
+    with tempfile.TemporaryDirectory() as prefix:
+        calibrate_ingest(Path(prefix), n_rows)
+        calibrate_render(Path(prefix))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
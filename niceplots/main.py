@@ -1,16 +1,44 @@
 # Authors: Dominik Zuercher, Valeria Glauser
 import os
+import time
+from concurrent.futures import Future
 from enum import Enum
+from functools import partial
 from pathlib import Path
-from typing import Tuple
+from typing import Any, Callable, Tuple
 
 import click
+import numpy as np
+import pandas as pd
 
-from niceplots.plotting import barplot, histogram, lineplot
-from niceplots.utils.codebook import setup_codebook
-from niceplots.utils.config import setup_config
-from niceplots.utils.data import setup_data
+from niceplots.utils.aggregate import Aggregates
+from niceplots.utils.codebook import CodeBook, setup_codebook
+from niceplots.utils.config import Configuration, get_cache, setup_config
+from niceplots.utils.data import (
+    DATA_CODEBOOK_COLUMNS,
+    Data,
+    DataCollection,
+    DataSummary,
+    append_data_object,
+    get_aggregates_paths,
+    get_data_columns,
+    get_max_resident_bytes,
+    get_output_data_path,
+    get_sampling_fractions,
+    get_statistics_path,
+    setup_data_object,
+)
+from niceplots.utils.fingerprint import fingerprint
+from niceplots.utils.group_filter import GroupFilter
 from niceplots.utils.nice_logger import init_logger, set_logger_level
+from niceplots.utils.pipeline import LazyResult, Node, Pipeline
+from niceplots.utils.plan import (
+    N_SAMPLE_ROWS,
+    RunPlan,
+    get_memory,
+    scan_data_file,
+)
+from niceplots.utils.selection import Selection
 
 logger = init_logger(__file__)
 
@@ -22,12 +50,18 @@ class PlotTypes(Enum):
     timelines = 4
 
 
+# names of the plots as used in the output files
+PLOT_NAMES = ["barplot", "lineplot", "histogram", "timeline"]
+
+
 def check_arguments(data_paths: Tuple[Path], data_labels: Tuple[str]) -> None:
     if len(data_labels) != len(data_paths):
         raise Exception(
             "Can only make time series plot if same number "
             "of labels and data sets provided."
         )
+    if len(set(data_labels)) != len(data_labels):
+        raise ValueError(f"The data_labels must be unique, got {data_labels}")
 
     for label in data_labels:
         if len(label) < 1:
@@ -36,6 +70,918 @@ def check_arguments(data_paths: Tuple[Path], data_labels: Tuple[str]) -> None:
             )
 
 
+def get_plot_types(plot_type: Tuple[str]) -> set[PlotTypes]:
+    plot_types = set()
+    for pt in plot_type:
+        if pt == "all":
+            plot_types.add(PlotTypes.barplots)
+            plot_types.add(PlotTypes.histograms)
+            plot_types.add(PlotTypes.lineplots)
+        elif pt == "barplots":
+            plot_types.add(PlotTypes.barplots)
+        elif pt == "lineplots":
+            plot_types.add(PlotTypes.lineplots)
+        elif pt == "histograms":
+            plot_types.add(PlotTypes.histograms)
+        elif pt == "timelines":
+            plot_types.add(PlotTypes.timelines)
+        else:
+            raise ValueError(f"Plot type {pt} is unknown")
+    return plot_types
+
+
+def add_setup_nodes(
+    pipeline: Pipeline,
+    codebook_path: Path,
+    config_path: Path,
+    name: str,
+    output_format: str,
+    verbosity: str,
+    prefix: Path,
+    full_rerun: bool,
+    make_fonts: bool = True,
+    draft: bool = False,
+) -> None:
+    """Adds the nodes setting up the configuration and the codebook to the pipeline."""
+    pipeline.add_node(
+        Node(
+            "config",
+            partial(
+                setup_config,
+                prefix,
+                config_path,
+                name,
+                verbosity,
+                output_format,
+                False,
+                write_config=True,
+                full_rerun=full_rerun,
+                make_fonts=make_fonts,
+                draft=draft,
+            ),
+            files=[path for path in [config_path] if path is not None],
+            params=(
+                str(prefix),
+                name,
+                verbosity,
+                output_format,
+                full_rerun,
+                make_fonts,
+                draft,
+            ),
+            parallel=False,
+            content_fingerprint=Configuration.get_fingerprint,
+        )
+    )
+    pipeline.add_node(
+        Node(
+            "codebook",
+            partial(
+                setup_codebook,
+                path_codebook=codebook_path,
+                write_codebook=True,
+                full_rerun=full_rerun,
+            ),
+            inputs=["config"],
+            files=[codebook_path],
+            params=full_rerun,
+            parallel=False,
+            content_fingerprint=CodeBook.get_fingerprint,
+        )
+    )
+
+
+def select_codebook(
+    codebook: CodeBook, config: Configuration, selection: Selection
+) -> CodeBook:
+    """
+    Codebook restricted to the selected blocks (including the blocks packed into
+    the same figure as a selected block).
+    """
+    figures = codebook.pack_blocks(
+        config.plotting.max_variables_small_block,
+        config.plotting.max_variables_per_page,
+    )
+    blocks = selection.select_blocks(codebook, figures)
+    logger.info(f"Selected blocks {blocks}")
+    return codebook.select(blocks)
+
+
+def add_selection_node(pipeline: Pipeline, selection: Selection) -> None:
+    """
+    Adds the node restricting the codebook to the selected blocks. The stages
+    downstream of it only read the columns, compute the aggregates and render the
+    figures of these blocks.
+    """
+    pipeline.add_node(
+        Node(
+            "codebook:selected",
+            partial(select_codebook, selection=selection),
+            inputs=["codebook", "config"],
+            params=(selection.blocks, selection.variables),
+            parallel=False,
+            content_fingerprint=CodeBook.get_fingerprint,
+        )
+    )
+
+
+def setup_data_node(
+    config: Configuration,
+    codebook: CodeBook,
+    group_filter: GroupFilter,
+    data_path: Path,
+    data_label: str,
+    full_rerun: bool,
+    select_columns: bool = False,
+) -> Data:
+    """
+    :param select_columns: Only read the columns used with the codebook (which is
+    restricted to the selected blocks).
+    """
+    columns = get_data_columns(codebook, group_filter) if select_columns else None
+    return setup_data_object(
+        config, codebook, data_path, data_label, full_rerun, group_filter, columns
+    )
+
+
+def get_data_key(
+    config: Configuration, codebook: CodeBook, group_filter: GroupFilter
+) -> tuple[str, str, str, str]:
+    """
+    A data set only depends on the data section of the configuration and the
+    codebook columns defining the variables (styling options are ignored).
+    """
+    return (
+        config.get_fingerprint(["data"]),
+        str(get_output_data_path(config)),
+        codebook.get_fingerprint(columns=DATA_CODEBOOK_COLUMNS),
+        group_filter.get_fingerprint(),
+    )
+
+
+def append_data_node(
+    config: Configuration,
+    codebook: CodeBook,
+    group_filter: GroupFilter,
+    data_path: Path,
+    data_label: str,
+) -> Data:
+    key = fingerprint(*get_data_key(config, codebook, group_filter))
+    return append_data_object(
+        config, codebook, data_path, data_label, key, group_filter
+    )
+
+
+def get_plotted_variables(codebook: CodeBook) -> list[str]:
+    return list(codebook.codebook.variable[~codebook.codebook.block.isna()])
+
+
+def get_data_aggregates(
+    data: LazyResult, codebook: CodeBook, config: Configuration
+) -> Aggregates:
+    data = data()
+    if config.plotting.draft:
+        # drafts are rendered from a stratified sample of the rows
+        data = data.get_sample(config.plotting.draft_rows_per_group)
+    return data.get_aggregates(get_plotted_variables(codebook))
+
+
+def get_aggregates_key(
+    data: LazyResult, codebook: CodeBook, config: Configuration
+) -> tuple[str, int, str, int | None]:
+    """
+    Aggregates only depend on the data (including the group definitions), the
+    no answer code, the codebook columns defining the variables and the sample
+    size of drafts. The data set is not loaded to compute the key.
+    """
+    return (
+        data.fingerprint,
+        config.data.no_answer_code,
+        codebook.get_fingerprint(columns=DATA_CODEBOOK_COLUMNS),
+        config.plotting.draft_rows_per_group if config.plotting.draft else None,
+    )
+
+
+def get_data_counts(data: LazyResult) -> tuple[np.ndarray, np.ndarray]:
+    """Rows per group of the data set and of the full data table."""
+    data = data()
+    return data.group_counts, data.population_counts
+
+
+def write_statistics(
+    data_collection: DataCollection,
+    codebook: CodeBook,
+    config: Configuration,
+    path: Path,
+) -> None:
+    data_collection.write_statistics(codebook, path)
+
+
+def get_statistics_key(
+    data_collection: DataCollection, codebook: CodeBook, config: Configuration
+) -> tuple[str, str, str]:
+    """
+    The statistics only depend on the data sets, the data section of the
+    configuration and the codebook columns defining and labelling the variables.
+    """
+    return (
+        data_collection.get_fingerprint(),
+        config.get_fingerprint(["data"]),
+        codebook.get_fingerprint(columns=DATA_CODEBOOK_COLUMNS + ["label", "block"]),
+    )
+
+
+def collect_data_node(
+    config: Configuration,
+    codebook: CodeBook,
+    *results: LazyResult | Aggregates | tuple[np.ndarray, np.ndarray],
+    data_labels: list[str],
+) -> DataCollection:
+    """
+    Collects the data sets (first third of results) with their cached aggregates
+    and group counts (second and last third of results). The data sets are only
+    loaded from the pipeline when the collection accesses them, such that its
+    resident limits apply. The aggregates of drafts are not attached as they only
+    hold a sample of the rows.
+    """
+    n_data = len(results) // 3
+    data_collection = DataCollection(config, codebook, get_output_data_path(config))
+    for data_label, data, aggregates, counts in zip(
+        data_labels,
+        results[:n_data],
+        results[n_data : 2 * n_data],
+        results[2 * n_data :],
+        strict=True,
+    ):
+        data_collection.add_data_loader(
+            data_label,
+            data,
+            data.fingerprint,
+            None if config.plotting.draft else aggregates,
+            counts,
+        )
+    logger.info(f"Got a Data Collection holding {n_data} data sets")
+    return data_collection
+
+
+def add_data_nodes(
+    pipeline: Pipeline,
+    config: Configuration,
+    data_paths: Tuple[Path],
+    data_labels: Tuple[str],
+    full_rerun: bool,
+    append: bool = False,
+    codebook_node: str = "codebook",
+) -> None:
+    """
+    Adds one node per data set, a node collecting all data sets and a node writing
+    the nice-plots data file to the pipeline.
+    :param append: Only read the rows appended to the data files since the last
+    run (see append_data_object). The nice-plots data file is not read.
+    :param codebook_node: Node providing the codebook (codebook:selected to only
+    read the columns of the selected blocks).
+    """
+    path_output_data = get_output_data_path(config)
+    # group filters are compiled once for all data sets
+    pipeline.add_node(
+        Node(
+            "groups",
+            lambda config: GroupFilter(config.data.groups),
+            inputs=["config"],
+            content_fingerprint=GroupFilter.get_fingerprint,
+        )
+    )
+    for data_path, data_label in zip(data_paths, data_labels, strict=True):
+        if append:
+            # the rows read by the last run are kept by append_data_object
+            func = partial(append_data_node, data_path=data_path, data_label=data_label)
+        else:
+            func = partial(
+                setup_data_node,
+                data_path=data_path,
+                data_label=data_label,
+                full_rerun=full_rerun,
+                select_columns=codebook_node != "codebook",
+            )
+        pipeline.add_node(
+            Node(
+                f"data:{data_label}",
+                func,
+                inputs=["config", codebook_node, "groups"],
+                # the nice-plots data file (read if not full_rerun) is written by
+                # write:data from these data sets and thus not part of their key
+                files=[data_path],
+                params=(data_label, full_rerun, append),
+                persist=not append,
+                content_fingerprint=lambda data: data.get_fingerprint(),
+                key_func=get_data_key,
+                # kept in the disk cache, so it can be dropped from memory
+                release=not append,
+                size=Data.get_n_bytes,
+            )
+        )
+        # the aggregates and counts are all that the plots need of a data set, it
+        # is only loaded if they are computed again
+        pipeline.add_node(
+            Node(
+                f"aggregates:{data_label}",
+                get_data_aggregates,
+                inputs=[f"data:{data_label}", codebook_node, "config"],
+                persist=True,
+                key_func=get_aggregates_key,
+                deferred_inputs=[f"data:{data_label}"],
+            )
+        )
+        pipeline.add_node(
+            Node(
+                f"counts:{data_label}",
+                get_data_counts,
+                inputs=[f"data:{data_label}"],
+                persist=True,
+                deferred_inputs=[f"data:{data_label}"],
+            )
+        )
+    pipeline.add_node(
+        Node(
+            "data",
+            partial(collect_data_node, data_labels=list(data_labels)),
+            inputs=["config", codebook_node]
+            + [f"data:{data_label}" for data_label in data_labels]
+            + [f"aggregates:{data_label}" for data_label in data_labels]
+            + [f"counts:{data_label}" for data_label in data_labels],
+            content_fingerprint=DataCollection.get_fingerprint,
+            lazy_inputs=[f"data:{data_label}" for data_label in data_labels],
+        )
+    )
+    pipeline.add_node(
+        Node(
+            "write:data",
+            DataCollection.write_output_data,
+            inputs=["data"],
+            outputs=[path_output_data],
+            persist=True,
+        )
+    )
+    path_statistics = get_statistics_path(config)
+    pipeline.add_node(
+        Node(
+            "write:statistics",
+            partial(write_statistics, path=path_statistics),
+            inputs=["data", codebook_node, "config"],
+            outputs=[path_statistics],
+            persist=True,
+            key_func=get_statistics_key,
+        )
+    )
+
+
+def add_aggregates_node(
+    pipeline: Pipeline, config: Configuration, codebook_node: str = "codebook"
+) -> None:
+    paths = get_aggregates_paths(config)
+    pipeline.add_node(
+        Node(
+            "write:aggregates",
+            partial(DataCollection.write_aggregates, paths=paths),
+            inputs=["data", codebook_node],
+            outputs=paths,
+            persist=True,
+        )
+    )
+
+
+def add_report_node(
+    pipeline: Pipeline,
+    config: Configuration,
+    plot_types: set[PlotTypes],
+    codebook_node: str = "codebook",
+) -> None:
+    # imported here such that the report can be written without plotting modules
+    from niceplots.utils.report import get_report_path, write_report
+
+    path = get_report_path(config)
+    # timelines are not drawn in the report
+    plot_names = [
+        PLOT_NAMES[p.value - 1]
+        for p in sorted(plot_types, key=lambda p: p.value)
+        if p != PlotTypes.timelines
+    ]
+    pipeline.add_node(
+        Node(
+            "write:report",
+            partial(write_report, plot_names=plot_names, path=path),
+            inputs=["data", codebook_node, "config"],
+            outputs=[path],
+            params=plot_names,
+            persist=True,
+        )
+    )
+
+
+def render_block(
+    exec_func: Callable,
+    block: float,
+    data_label: str | None,
+    counts: tuple[np.ndarray, np.ndarray],
+    aggregates: Aggregates,
+    config: Configuration,
+    codebook: CodeBook,
+    page: int | None = None,
+    writer: Any = None,
+) -> Future | Path | None:
+    """
+    Renders one block (or one page of a block split into several plots) from the
+    aggregates and the group counts of a data set. If a writer is given the plot
+    is written in the background and the future of the write is returned,
+    otherwise the path of the plot (None if no plot applies).
+    """
+    # the plots only read the aggregates, configuration and codebook such that
+    # blocks can be rendered concurrently
+    data = DataSummary(aggregates, *counts)
+    return exec_func(
+        block, data, config, codebook, data_label=data_label, page=page, writer=writer
+    )
+
+
+def get_render_key(
+    block: float | tuple,
+    section: str,
+    counts: tuple[np.ndarray, np.ndarray],
+    aggregates: Aggregates,
+    config: Configuration,
+    codebook: CodeBook,
+) -> tuple[str, str, str]:
+    """
+    A plot only depends on the codebook rows of its block (or blocks), the
+    aggregates of the variables in the block (and the sampled fractions of the
+    groups) and the configuration sections used by its plot type. New rows that do
+    not change the numbers of a block do not re-render it.
+    """
+    sections = ["data", "plotting", section]
+    blocks = block if isinstance(block, tuple) else (block,)
+    variables = list(codebook.codebook.variable[codebook.codebook.block.isin(blocks)])
+    # codebook columns with configuration options of other plot types are ignored
+    columns = [
+        column
+        for column in codebook.codebook.columns
+        if "." not in column or column.split(".")[0] in sections
+    ]
+    group_counts, population_counts = counts
+    sampled = get_sampling_fractions(group_counts, population_counts) is not None
+    return (
+        fingerprint(
+            aggregates.get_fingerprint(variables),
+            sampled and group_counts.tobytes(),
+            sampled and population_counts.tobytes(),
+        ),
+        config.get_fingerprint(sections),
+        codebook.get_fingerprint(block, columns),
+    )
+
+
+def render_timeline(
+    block: float,
+    data_labels: list[str],
+    config: Configuration,
+    codebook: CodeBook,
+    *aggregates: Aggregates,
+    page: int | None = None,
+    writer: Any = None,
+) -> Future | Path | None:
+    """
+    Renders the timeline of one block (or one page of a block) from the cached
+    aggregates of all data sets.
+    """
+    # imported here such that matplotlib is only loaded when plotting
+    from niceplots.plotting.timeline import plot_timeline
+
+    return plot_timeline(
+        block, list(aggregates), data_labels, config, codebook, page, writer
+    )
+
+
+def get_timeline_key(
+    block: float,
+    config: Configuration,
+    codebook: CodeBook,
+    *aggregates: Aggregates,
+) -> tuple[list[str], str, str]:
+    """
+    A timeline only depends on the aggregates of the variables in its block in
+    each data set, the codebook rows of the block and the configuration sections
+    used by timelines.
+    """
+    variables = list(codebook.codebook.variable[codebook.codebook.block == block])
+    columns = [
+        column
+        for column in codebook.codebook.columns
+        if "." not in column or column.split(".")[0] == "timelines"
+    ]
+    return (
+        [agg.get_fingerprint(variables) for agg in aggregates],
+        config.get_fingerprint(["data", "plotting", "timelines"]),
+        codebook.get_fingerprint(block, columns),
+    )
+
+
+def add_timeline_nodes(
+    pipeline: Pipeline,
+    render_nodes: list[str],
+    config: Configuration,
+    codebook: CodeBook,
+    data_labels: Tuple[str],
+    writer: Any = None,
+    codebook_node: str = "codebook",
+    blocks: list[int] | None = None,
+) -> None:
+    """
+    Adds one node per block (and page) drawing the trend of its variables across
+    all data sets. The nodes only depend on the aggregates of the data sets, which
+    are computed once per data set and shared by all blocks.
+    :param blocks: Only add the nodes of these blocks (all if None).
+    """
+    for block in codebook.blocks[~np.isnan(codebook.blocks)]:
+        if blocks is not None and int(block) not in blocks:
+            continue
+        for page in codebook.get_page_numbers(
+            block, config.plotting.max_variables_per_page
+        ):
+            name = f"timeline:{int(block)}"
+            if page is not None:
+                name = f"{name}:{page + 1}"
+            render_nodes.append(name)
+            if name in pipeline.nodes:
+                continue
+            pipeline.add_node(
+                Node(
+                    name,
+                    partial(
+                        render_timeline,
+                        block,
+                        list(data_labels),
+                        page=page,
+                        writer=writer,
+                    ),
+                    inputs=["config", codebook_node]
+                    + [f"aggregates:{data_label}" for data_label in data_labels],
+                    outputs=[config.get_plot_path("timeline", block, page=page)],
+                    params=list(data_labels),
+                    persist=True,
+                    key_func=partial(get_timeline_key, block),
+                )
+            )
+
+
+def add_render_node(
+    pipeline: Pipeline,
+    render_nodes: list[str],
+    name: str,
+    func: Callable,
+    data_label: str,
+    output: Path,
+    key_func: Callable,
+    codebook_node: str = "codebook",
+) -> None:
+    render_nodes.append(name)
+    if name in pipeline.nodes:
+        return
+    pipeline.add_node(
+        Node(
+            name,
+            func,
+            inputs=[
+                f"counts:{data_label}",
+                f"aggregates:{data_label}",
+                "config",
+                codebook_node,
+            ],
+            outputs=[output],
+            persist=True,
+            key_func=key_func,
+        )
+    )
+
+
+def update_render_nodes(
+    pipeline: Pipeline,
+    config: Configuration,
+    codebook: CodeBook,
+    plot_types: set[PlotTypes],
+    data_labels: Tuple[str],
+    writer: Any = None,
+    codebook_node: str = "codebook",
+    blocks: list[int] | None = None,
+    n_data_sets: int | None = None,
+) -> list[str]:
+    """
+    Makes sure that the pipeline holds one node per plot type, data set and block
+    of the codebook (one per page for large blocks, one per group of packed small
+    blocks). Nodes of blocks that no longer exist are removed.
+    Returns the names of the render nodes.
+    :param writer: OutputWriter used to write the plots in the background.
+    :param codebook_node: Node providing the codebook to the render nodes.
+    :param blocks: Only add the nodes of figures of these blocks (all if None).
+    The figures are packed from the full codebook such that the files match those
+    of a full run.
+    :param n_data_sets: Number of data sets of a full run (the output files are
+    labelled by data set if there are several). Defaults to len(data_labels).
+    """
+    # imported here such that matplotlib is only loaded when plotting
+    from niceplots.plotting import barplot, histogram, lineplot
+
+    render_nodes = []
+    for p in plot_types:
+        if p == PlotTypes.barplots:
+            exec_func, plot_name = barplot.plot_barplot, "barplot"
+            exec_func_blocks = barplot.plot_barplot_blocks
+        elif p == PlotTypes.lineplots:
+            exec_func, plot_name = lineplot.plot_lineplot, "lineplot"
+            exec_func_blocks = lineplot.plot_lineplot_blocks
+        elif p == PlotTypes.histograms:
+            exec_func, plot_name = histogram.plot_histogram, "histogram"
+            exec_func_blocks = histogram.plot_histogram_blocks
+        elif p == PlotTypes.timelines:
+            add_timeline_nodes(
+                pipeline,
+                render_nodes,
+                config,
+                codebook,
+                data_labels,
+                writer,
+                codebook_node,
+                blocks,
+            )
+            continue
+        else:
+            raise Exception(f"Plot type {p} does not exist.")
+
+        figures = codebook.pack_blocks(
+            config.plotting.max_variables_small_block,
+            config.plotting.max_variables_per_page,
+        )
+        if blocks is not None:
+            figures = [f for f in figures if all(int(b) in blocks for b in f)]
+        if n_data_sets is None:
+            n_data_sets = len(data_labels)
+        for data_label in data_labels:
+            # distinguish the output files of multiple data sets by their label
+            output_label = data_label if n_data_sets > 1 else None
+            for figure_blocks in figures:
+                if len(figure_blocks) > 1:
+                    # small blocks packed into one figure
+                    blocks_name = "-".join(str(int(b)) for b in figure_blocks)
+                    add_render_node(
+                        pipeline,
+                        render_nodes,
+                        f"{plot_name}:{data_label}:{blocks_name}",
+                        partial(
+                            render_block,
+                            exec_func_blocks,
+                            figure_blocks,
+                            output_label,
+                            writer=writer,
+                        ),
+                        data_label,
+                        config.get_plot_path(plot_name, figure_blocks, output_label),
+                        partial(get_render_key, figure_blocks, p.name),
+                        codebook_node,
+                    )
+                    continue
+                block = figure_blocks[0]
+                for page in codebook.get_page_numbers(
+                    block, config.plotting.max_variables_per_page
+                ):
+                    name = f"{plot_name}:{data_label}:{int(block)}"
+                    if page is not None:
+                        name = f"{name}:{page + 1}"
+                    add_render_node(
+                        pipeline,
+                        render_nodes,
+                        name,
+                        partial(
+                            render_block,
+                            exec_func,
+                            block,
+                            output_label,
+                            page=page,
+                            writer=writer,
+                        ),
+                        data_label,
+                        config.get_plot_path(plot_name, block, output_label, page),
+                        partial(get_render_key, block, p.name),
+                        codebook_node,
+                    )
+
+    for name in list(pipeline.nodes):
+        if name.split(":")[0] in PLOT_NAMES and name not in render_nodes:
+            logger.info(f"Removing plot {name} from pipeline.")
+            pipeline.remove_node(name)
+    return render_nodes
+
+
+class NicePlots:
+    """
+    Holds the pipeline of a nice-plots run. Rerunning only recomputes the stages
+    whose inputs changed.
+    :param selection: Blocks, variables and data labels the run is restricted to.
+    Only the columns, aggregates and figures of the selection are computed and
+    only the selected outputs are written (the nice-plots data file and the
+    statistics are not written by selective runs as they would be incomplete).
+    """
+
+    def __init__(
+        self,
+        data_paths: Tuple[Path],
+        codebook_path: Path,
+        config_path: Path,
+        name: str,
+        plot_type: Tuple[str],
+        output_format: str,
+        clear_cache: bool,
+        verbosity: str,
+        data_labels: Tuple[str],
+        prefix: Path,
+        full_rerun: bool,
+        n_workers: int = 4,
+        aggregates_only: bool = False,
+        report: bool = False,
+        draft: bool = False,
+        append: bool = False,
+        selection: Selection | None = None,
+    ) -> None:
+        check_arguments(data_paths, data_labels)
+        self.selection = Selection() if selection is None else selection
+        if append and not self.selection.is_empty():
+            raise ValueError(
+                "Selections (blocks, variables, labels) can not be combined with append"
+            )
+        # output files are named as in a run of all data sets
+        self.n_data_sets = len(data_labels)
+        selected_labels = self.selection.select_labels(data_labels)
+        data_paths = tuple(
+            path
+            for path, label in zip(data_paths, data_labels, strict=True)
+            if label in selected_labels
+        )
+        data_labels = tuple(selected_labels)
+
+        logger.info(f"Set configuration file path -> {config_path}")
+        logger.info(f"Set data file path(s) -> {data_paths}")
+        logger.info(f"Set codebook file path -> {codebook_path}")
+
+        self.data_paths = data_paths
+        self.data_labels = data_labels
+        self.full_rerun = full_rerun
+        self.append = append
+        self.aggregates_only = aggregates_only
+        self.report = report
+        self.plot_types = get_plot_types(plot_type)
+        self.input_files = [
+            path
+            for path in [config_path, codebook_path, *data_paths]
+            if path is not None
+        ]
+        self.render_nodes: list[str] = []
+        self.results: dict = {}
+        self.n_workers = n_workers
+        # writes the plots in the background (created once plotting is required)
+        self.writer = None
+
+        cache_directory = get_cache(clear_cache)
+        self.pipeline = Pipeline(Path(f"{cache_directory}/pipeline"), n_workers)
+        add_setup_nodes(
+            self.pipeline,
+            codebook_path,
+            config_path,
+            name,
+            output_format,
+            verbosity,
+            prefix,
+            full_rerun,
+            make_fonts=not (aggregates_only or report),
+            draft=draft,
+        )
+        self.codebook_node = "codebook"
+        if len(self.selection.blocks) + len(self.selection.variables) > 0:
+            add_selection_node(self.pipeline, self.selection)
+            self.codebook_node = "codebook:selected"
+
+    def run(self) -> list[str]:
+        """Runs the pipeline and returns the names of the plots that were rendered."""
+        # the data and plotting stages depend on the blocks defined in the codebook
+        results = self.pipeline.run(["codebook", self.codebook_node])
+        config, codebook = results["config"], results["codebook"]
+        # data sets read by the run at once
+        self.pipeline.max_resident = config.data.max_resident_data_sets
+        self.pipeline.max_resident_bytes = get_max_resident_bytes(config)
+        # blocks of the selected figures (None if all blocks are selected)
+        blocks = None
+        if self.codebook_node != "codebook":
+            selected = results[self.codebook_node]
+            blocks = [int(block) for block in selected.blocks]
+        # a selective run only computes its targets, not the outputs of a full run
+        selective = not self.selection.is_empty()
+        if "data" not in self.pipeline.nodes:
+            add_data_nodes(
+                self.pipeline,
+                config,
+                self.data_paths,
+                self.data_labels,
+                self.full_rerun,
+                self.append,
+                self.codebook_node,
+            )
+        if self.aggregates_only:
+            if "write:aggregates" not in self.pipeline.nodes:
+                add_aggregates_node(self.pipeline, config, self.codebook_node)
+            logger.info("Computing aggregates")
+            # only the aggregates and their inputs, not the data and statistics
+            self.results = self.pipeline.run(["write:aggregates"])
+            return []
+        if self.report:
+            if "write:report" not in self.pipeline.nodes:
+                add_report_node(
+                    self.pipeline, config, self.plot_types, self.codebook_node
+                )
+            logger.info("Writing report")
+            self.results = self.pipeline.run(["write:report"])
+            return []
+
+        if self.writer is None:
+            # imported here such that matplotlib is only loaded when plotting
+            from niceplots.utils.output_writer import OutputWriter
+
+            self.writer = OutputWriter(self.n_workers)
+        self.render_nodes = update_render_nodes(
+            self.pipeline,
+            config,
+            codebook,
+            self.plot_types,
+            self.data_labels,
+            self.writer,
+            self.codebook_node,
+            blocks,
+            self.n_data_sets,
+        )
+
+        logger.info("Producing plots")
+        self.results = self.pipeline.run(self.render_nodes if selective else None)
+        # render nodes of blocks without plot (e.g. no histogram applies) do not
+        # write a file
+        rendered = [
+            name
+            for name in self.render_nodes
+            if name in self.pipeline.executed
+            and self.pipeline.cache[name].result is not None
+        ]
+        logger.info(
+            f"Rendered {len(rendered)} of {len(self.render_nodes)} plots. The others were up to date."
+        )
+        return rendered
+
+    def get_file_states(self) -> dict[Path, tuple[int, int] | None]:
+        states: dict[Path, tuple[int, int] | None] = {}
+        for path in self.input_files:
+            if os.path.exists(path):
+                stat = os.stat(path)
+                states[path] = (stat.st_mtime_ns, stat.st_size)
+            else:
+                states[path] = None
+        return states
+
+    def watch(self, interval: float = 1.0, max_updates: int | None = None) -> None:
+        """
+        Watches the input files and reruns the pipeline whenever one of them
+        changes. Errors (e.g. in half edited files) are logged and watching
+        continues.
+        """
+        file_states = self.get_file_states()
+        n_updates = 0
+        logger.info(f"Watching {[str(path) for path in self.input_files]}")
+        while max_updates is None or n_updates < max_updates:
+            time.sleep(interval)
+            new_file_states = self.get_file_states()
+            changed = [
+                path
+                for path in self.input_files
+                if new_file_states[path] != file_states[path]
+            ]
+            if len(changed) == 0:
+                continue
+            file_states = new_file_states
+            n_updates += 1
+            logger.info(f"Detected changes in {[str(path) for path in changed]}")
+            start = time.time()
+            try:
+                rendered = self.run()
+            except Exception as error:
+                logger.error(f"Update failed: {error}")
+                continue
+            logger.info(
+                f"Updated {rendered} in {time.time() - start:.2f} seconds. Watching for changes..."
+            )
+
+
 def main(
     data_paths: Tuple[Path],
     codebook_path: Path,
@@ -48,74 +994,306 @@ def main(
     data_labels: Tuple[str],
     prefix: Path,
     full_rerun: bool,
+    n_workers: int = 4,
+    aggregates_only: bool = False,
+    report: bool = False,
+    draft: bool = False,
+    append: bool = False,
+    blocks: Tuple[str] = (),
+    variables: Tuple[str] = (),
+    labels: Tuple[str] = (),
 ) -> None:
     set_logger_level(logger, verbosity)
     logger.info("Starting nice-plots")
 
-    check_arguments(data_paths, data_labels)
-
-    logger.info(f"Set configuration file path -> {config_path}")
-    logger.info(f"Set data file path(s) -> {config_path}")
-    logger.info(f"Set codebook file path -> {config_path}")
-
-    config = setup_config(
-        prefix,
+    nice_plots = NicePlots(
+        data_paths,
+        codebook_path,
         config_path,
         name,
-        verbosity,
+        plot_type,
         output_format,
         clear_cache,
-        write_config=True,
-        full_rerun=full_rerun,
+        verbosity,
+        data_labels,
+        prefix,
+        full_rerun,
+        n_workers,
+        aggregates_only,
+        report,
+        draft,
+        append,
+        Selection(blocks, variables, labels),
     )
+    nice_plots.run()
+    logger.info("nice-plots finished without errors :)")
+
 
-    # Load codebook
-    codebook = setup_codebook(
-        config, codebook_path, write_codebook=True, full_rerun=full_rerun
+def aggregates(
+    data_paths: Tuple[Path],
+    codebook_path: Path,
+    config_path: Path | None = None,
+    name: str = "output1",
+    verbosity: str = "3",
+    data_labels: Tuple[str] = ("data",),
+    prefix: Path = Path(os.getcwd()),
+    full_rerun: bool = False,
+    clear_cache: bool = False,
+    n_workers: int = 4,
+) -> pd.DataFrame:
+    """
+    Computes the numbers behind the plots without plotting (matplotlib is not
+    imported). The aggregates are written to the output directory and returned
+    as long table with one row per data set, variable, group and code.
+    """
+    set_logger_level(logger, verbosity)
+    logger.info("Starting nice-plots (aggregates only)")
+
+    nice_plots = NicePlots(
+        data_paths,
+        codebook_path,
+        config_path,
+        name,
+        ("all",),
+        "pdf",
+        clear_cache,
+        verbosity,
+        data_labels,
+        prefix,
+        full_rerun,
+        n_workers,
+        aggregates_only=True,
     )
+    nice_plots.run()
+    logger.info("nice-plots finished without errors :)")
+    return nice_plots.results["write:aggregates"]
 
-    data_collection = setup_data(
+
+def plan(
+    data_paths: Tuple[Path],
+    codebook_path: Path,
+    config_path: Path | None = None,
+    plot_type: Tuple[str] = ("all",),
+    output_format: str = "pdf",
+    verbosity: str = "3",
+    data_labels: Tuple[str] = ("data",),
+    n_cores: int | None = None,
+    memory: int | None = None,
+    job_seconds: float = 3600,
+    n_sample_rows: int = N_SAMPLE_ROWS,
+    selection: Selection | None = None,
+) -> RunPlan:
+    """
+    Estimates the work, memory and runtime of a run from the codebook and the
+    first n_sample_rows rows of each data file without running it (nothing is
+    written). Uses the number of cores and the memory of this machine by default.
+    :param selection: Plan a run restricted to these blocks, variables and data
+    labels.
+    """
+    set_logger_level(logger, verbosity)
+    check_arguments(data_paths, data_labels)
+    config = Configuration(config_path, verbosity, output_format=output_format)
+    codebook = setup_codebook(config, codebook_path)
+    if selection is None:
+        selection = Selection()
+    if len(selection.blocks) + len(selection.variables) > 0:
+        codebook = select_codebook(codebook, config, selection)
+    selected_labels = selection.select_labels(data_labels)
+    group_filter = GroupFilter(config.data.groups)
+    data_estimates = [
+        scan_data_file(
+            data_path, data_label, config.data.delimiter, group_filter, n_sample_rows
+        )
+        for data_path, data_label in zip(data_paths, data_labels, strict=True)
+        if data_label in selected_labels
+    ]
+    plot_types = [
+        p.name for p in sorted(get_plot_types(plot_type), key=lambda p: p.value)
+    ]
+    return RunPlan(
         config,
         codebook,
+        data_estimates,
+        plot_types,
+        os.cpu_count() or 1 if n_cores is None else n_cores,
+        get_memory() if memory is None else memory,
+        job_seconds,
+    )
+
+
+def watch(
+    data_paths: Tuple[Path],
+    codebook_path: Path,
+    config_path: Path,
+    name: str,
+    plot_type: Tuple[str],
+    output_format: str,
+    clear_cache: bool,
+    verbosity: str,
+    data_labels: Tuple[str],
+    prefix: Path,
+    n_workers: int = 4,
+    interval: float = 1.0,
+    draft: bool = False,
+    append: bool = False,
+    blocks: Tuple[str] = (),
+    variables: Tuple[str] = (),
+    labels: Tuple[str] = (),
+) -> None:
+    set_logger_level(logger, verbosity)
+    logger.info("Starting nice-plots in watch mode")
+
+    # the edited files are the supplied ones -> ignore copies in output directory
+    nice_plots = NicePlots(
         data_paths,
+        codebook_path,
+        config_path,
+        name,
+        plot_type,
+        output_format,
+        clear_cache,
+        verbosity,
         data_labels,
-        write_data=True,
-        full_rerun=full_rerun,
+        prefix,
+        True,
+        n_workers,
+        draft=draft,
+        append=append,
+        selection=Selection(blocks, variables, labels),
     )
+    nice_plots.run()
+    try:
+        nice_plots.watch(interval)
+    except KeyboardInterrupt:
+        logger.info("Stopped watching.")
 
-    plot_types = set()
-    for pt in plot_type:
-        if pt == "all":
-            plot_types.add(PlotTypes.barplots)
-            plot_types.add(PlotTypes.histograms)
-            plot_types.add(PlotTypes.lineplots)
-        elif pt == "barplots":
-            plot_types.add(PlotTypes.barplots)
-        elif pt == "lineplots":
-            plot_types.add(PlotTypes.lineplots)
-        elif pt == "histograms":
-            plot_types.add(PlotTypes.histograms)
-        elif pt == "timelines":
-            plot_types.add(PlotTypes.timelines)
-        else:
-            raise ValueError(f"Plot type {pt} is unknown")
 
-    logger.info("Producing plots")
-    for p in plot_types:
-        if p == PlotTypes.barplots:
-            exec_func = barplot.plot_barplots
-        elif p == PlotTypes.lineplots:
-            exec_func = lineplot.plot_lineplots
-        elif p == PlotTypes.histograms:
-            exec_func = histogram.plot_histograms
-        elif p == PlotTypes.timelines:
-            raise NotImplementedError("Timelines is currently not implemented.")
-        else:
-            raise Exception(f"Plot type {p} does not exist.")
+def add_options(options: list[Callable]) -> Callable:
+    def decorator(func: Callable) -> Callable:
+        for option in reversed(options):
+            func = option(func)
+        return func
+
+    return decorator
 
-        logger.info(f"Producing plots of type {p}")
-        exec_func(config, codebook, data_collection)
-    logger.info("nice-plots finished without errors :)")
+
+COMMON_OPTIONS = [
+    click.option(
+        "-d",
+        "--data",
+        required=True,
+        multiple=True,
+        type=click.Path(path_type=Path),
+        help="Path to the data file, or list of such paths",
+    ),
+    click.option(
+        "-b",
+        "--codebook",
+        required=True,
+        type=click.Path(path_type=Path),
+        help="Path to the codebook file (in csv format)",
+    ),
+    click.option(
+        "-c",
+        "--config",
+        type=click.Path(path_type=Path),
+        help="Path to the nice-plots configuration file. See examples/example_config.yml for example.",
+    ),
+    click.option(
+        "-n",
+        "--name",
+        required=False,
+        default="output1",
+        type=str,
+        help="Name for output plots. Serves also as output directory name. NOTE: If there are configs and codebooks in the output directory they will be used instead of the global codebook and config files specified by the config_path and codebook_path arguments.",
+    ),
+    click.option(
+        "-t",
+        "--plot_type",
+        required=False,
+        default=["all"],
+        type=click.Choice(["barplots", "lineplots", "histograms", "timelines", "all"]),
+        multiple=True,
+        help="Type of plots to produce (all = barplots, lineplots and histograms). Timelines show the trend of each question across the data sets (see --data_labels).",
+    ),
+    click.option(
+        "-f",
+        "--output_format",
+        required=False,
+        default="pdf",
+        type=click.Choice(["pdf", "svg", "png"]),
+        help="Format of the output plots.",
+    ),
+    click.option(
+        "--clear_cache",
+        required=False,
+        is_flag=True,
+        default=False,
+        help="Reset cache directory before running.",
+    ),
+    click.option(
+        "-v",
+        "--verbosity",
+        required=False,
+        default="3",
+        type=click.Choice(["1", "2", "3", "4"]),
+        help="Verbosity level (1=error, 2=warning, 3=info, 4=debug). Defaults to 3.",
+    ),
+    click.option(
+        "--data_labels",
+        required=False,
+        multiple=True,
+        default=["data"],
+        help="Labels for the different data sets, one per data file in the same order. Used in the names of the plots and as time axis of the timelines.",
+    ),
+    click.option(
+        "-p",
+        "--prefix",
+        type=click.Path(path_type=Path),
+        default=os.getcwd(),
+        help="Location in which nice-plot output directories are written. Default is CWD.",
+    ),
+]
+
+N_WORKERS_OPTION = click.option(
+    "-j",
+    "--n_workers",
+    type=int,
+    default=4,
+    help="Maximum number of pipeline stages executed concurrently. Defaults to 4.",
+)
+
+DRAFT_OPTION = click.option(
+    "--draft",
+    is_flag=True,
+    default=False,
+    help="Render quick previews: watermarked low resolution png files drawn from a sample of the rows (at most draft_rows_per_group per group) with truncated text.",
+)
+
+APPEND_OPTION = click.option(
+    "--append",
+    is_flag=True,
+    default=False,
+    help="The data files only grow (e.g. surveys that are still open): only read and aggregate the rows added since the last run (detected by position or by id_column in the data section of the config). Files that were changed otherwise are read completely.",
+)
+
+SELECT_OPTIONS = [
+    click.option(
+        "--blocks",
+        multiple=True,
+        help="Only process these blocks: numbers or ranges like 2-5, separated by commas or given several times.",
+    ),
+    click.option(
+        "--variables",
+        multiple=True,
+        help="Only process the blocks of these variables: names, globs like VAR0* or ranges like VAR02..VAR09 (in the order of the codebook).",
+    ),
+    click.option(
+        "--labels",
+        multiple=True,
+        help="Only process the data sets with these data labels: labels, globs or ranges (in the order of --data_labels).",
+    ),
+]
 
 
 @click.group()
@@ -126,88 +1304,163 @@ def cli():
 @cli.command(
     name="run", help="Nice-plots is a tool to quickly visualize QM survey data"
 )
+@add_options(COMMON_OPTIONS)
 @click.option(
-    "-d",
-    "--data",
-    required=True,
-    multiple=True,
-    type=click.Path(path_type=Path),
-    help="Path to the data file, or list of such paths",
+    "--full_rerun",
+    type=bool,
+    default=False,
+    help="Ignore config, codebook and data files in target destination and directly use supplied files.",
 )
+@N_WORKERS_OPTION
 @click.option(
-    "-b",
-    "--codebook",
-    required=True,
-    type=click.Path(path_type=Path),
-    help="Path to the codebook file (in csv format)",
+    "--aggregates_only",
+    "--aggregates-only",
+    is_flag=True,
+    default=False,
+    help="Only write the numbers behind the plots (counts per code and group, n, mean, std, no answers) to aggregates_<name>.csv/.parquet without plotting.",
 )
 @click.option(
-    "-c",
-    "--config",
-    type=click.Path(path_type=Path),
-    help="Path to the nice-plots configuration file. See examples/example_config.yml for example.",
+    "--report",
+    is_flag=True,
+    default=False,
+    help="Write a self-contained HTML report (report_<name>.html) instead of the plots. It embeds the aggregates and draws the plots in the browser.",
 )
-@click.option(
-    "-n",
-    "--name",
-    required=False,
-    default="output1",
-    type=str,
-    help="Name for output plots. Serves also as output directory name. NOTE: If there are configs and codebooks in the output directory they will be used instead of the global codebook and config files specified by the config_path and codebook_path arguments.",
+@DRAFT_OPTION
+@APPEND_OPTION
+@add_options(SELECT_OPTIONS)
+def cli_main(
+    data: Tuple[Path],
+    codebook: Path,
+    config: Path,
+    name: str,
+    plot_type: Tuple[str],
+    output_format: str,
+    clear_cache: bool,
+    verbosity: str,
+    data_labels: Tuple[str],
+    prefix: Path,
+    full_rerun: bool,
+    n_workers: int,
+    aggregates_only: bool,
+    report: bool,
+    draft: bool,
+    append: bool,
+    blocks: Tuple[str],
+    variables: Tuple[str],
+    labels: Tuple[str],
+) -> None:
+    main(
+        data,
+        codebook,
+        config,
+        name,
+        plot_type,
+        output_format,
+        clear_cache,
+        verbosity,
+        data_labels,
+        prefix,
+        full_rerun,
+        n_workers,
+        aggregates_only,
+        report,
+        draft,
+        append,
+        blocks,
+        variables,
+        labels,
+    )
+
+
+@cli.command(
+    name="plan",
+    help="Estimate the figures, memory and runtime of a run without running it, from the codebook and the first rows of the data files. Recommends the number of workers and how to split long runs into jobs. Takes the options of run.",
 )
+@add_options(COMMON_OPTIONS)
 @click.option(
-    "-t",
-    "--plot_type",
-    required=False,
-    default=["all"],
-    type=click.Choice(["barplots", "lineplots", "histograms", "all"]),
-    multiple=True,
-    help="Type of plots to produce. If type=timeline expects a list of data_paths and also time_labels (DEPRECATED)",
+    "--full_rerun",
+    type=bool,
+    default=False,
+    help="Ignored (accepted such that run options can be planned).",
 )
 @click.option(
-    "-f",
-    "--output_format",
-    required=False,
-    default="pdf",
-    type=click.Choice(["pdf", "svg", "png"]),
-    help="Format of the output plots.",
+    "--cores",
+    type=int,
+    default=None,
+    help="Cores available to the run. Defaults to the cores of this machine.",
 )
 @click.option(
-    "--clear_cache",
-    required=False,
-    is_flag=True,
-    default=False,
-    help="Reset cache directory before running.",
+    "--memory",
+    type=float,
+    default=None,
+    help="Memory available to the run in GB. Defaults to the memory of this machine.",
 )
 @click.option(
-    "-v",
-    "--verbosity",
-    required=False,
-    default="3",
-    type=click.Choice(["1", "2", "3", "4"]),
-    help="Verbosity level (1=error, 2=warning, 3=info, 4=debug). Defaults to 3.",
+    "--job_minutes",
+    type=float,
+    default=60,
+    help="Longest runtime of a single job in minutes. Longer runs are split into jobs rendering consecutive blocks. Defaults to 60.",
 )
 @click.option(
-    "--data_labels",
-    required=False,
-    multiple=True,
-    default=["data"],
-    help="Labels for the different data sets (only used if plot_type=timeline).",
+    "--sample_rows",
+    type=int,
+    default=N_SAMPLE_ROWS,
+    help=f"Rows read from each data file to estimate its size. Defaults to {N_SAMPLE_ROWS}.",
 )
-@click.option(
-    "-p",
-    "--prefix",
-    type=click.Path(path_type=Path),
-    default=os.getcwd(),
-    help="Location in which nice-plot output directories are written. Default is CWD.",
+@add_options(SELECT_OPTIONS)
+def cli_plan(
+    data: Tuple[Path],
+    codebook: Path,
+    config: Path,
+    name: str,
+    plot_type: Tuple[str],
+    output_format: str,
+    clear_cache: bool,
+    verbosity: str,
+    data_labels: Tuple[str],
+    prefix: Path,
+    full_rerun: bool,
+    cores: int | None,
+    memory: float | None,
+    job_minutes: float,
+    sample_rows: int,
+    blocks: Tuple[str],
+    variables: Tuple[str],
+    labels: Tuple[str],
+) -> None:
+    run_plan = plan(
+        data,
+        codebook,
+        config,
+        plot_type,
+        output_format,
+        verbosity,
+        data_labels,
+        cores,
+        None if memory is None else int(memory * 2**30),
+        job_minutes * 60,
+        sample_rows,
+        Selection(blocks, variables, labels),
+    )
+    click.echo(run_plan.get_summary())
+
+
+@cli.command(
+    name="watch",
+    help="Keep nice-plots running and re-render the affected plots whenever the config, codebook or data files change. Always uses the supplied files (like --full_rerun).",
 )
+@add_options(COMMON_OPTIONS)
+@N_WORKERS_OPTION
 @click.option(
-    "--full_rerun",
-    type=bool,
-    default=False,
-    help="Ignore config, codebook and data files in target destination and directly use supplied files.",
+    "--interval",
+    type=float,
+    default=1.0,
+    help="Time between checks for changed files in seconds. Defaults to 1.",
 )
-def cli_main(
+@DRAFT_OPTION
+@APPEND_OPTION
+@add_options(SELECT_OPTIONS)
+def cli_watch(
     data: Tuple[Path],
     codebook: Path,
     config: Path,
@@ -218,9 +1471,15 @@ def cli_main(
     verbosity: str,
     data_labels: Tuple[str],
     prefix: Path,
-    full_rerun: bool,
+    n_workers: int,
+    interval: float,
+    draft: bool,
+    append: bool,
+    blocks: Tuple[str],
+    variables: Tuple[str],
+    labels: Tuple[str],
 ) -> None:
-    main(
+    watch(
         data,
         codebook,
         config,
@@ -231,7 +1490,13 @@ def cli_main(
         verbosity,
         data_labels,
         prefix,
-        full_rerun,
+        n_workers,
+        interval,
+        draft,
+        append,
+        blocks,
+        variables,
+        labels,
     )
 
 
@@ -1,21 +1,27 @@
 # Authors: Dominik Zuercher, Valeria Glauser
 import ast
+from concurrent.futures import Future
+from pathlib import Path
 from typing import Any
 
 import matplotlib as mpl
 import matplotlib.gridspec as gridspec
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 from matplotlib.axes import Axes
-from matplotlib.figure import Figure
+from matplotlib.figure import Figure, FigureBase
 from matplotlib.patches import Patch
+from matplotlib.transforms import Affine2D
 
+from niceplots.utils.aggregate import rebin
 from niceplots.utils.codebook import CodeBook
 from niceplots.utils.config import Configuration
-from niceplots.utils.data import Data, DataCollection
+from niceplots.utils.data import Data, DataCollection, DataSummary
+from niceplots.utils.layout_pool import LAYOUT_POOL
 from niceplots.utils.nice_logger import init_logger
+from niceplots.utils.output_writer import OutputWriter, write_figure
 from niceplots.utils.plotting_utils import WrapText
+from niceplots.utils.sampling import get_mean_error, get_share_error
 
 logger = init_logger(__file__)
 
@@ -30,14 +36,25 @@ def plot_barplots(
 ) -> None:
     for data_name in data_collection.data_object_names:
         data = getattr(data_collection, data_name)
+        # distinguish the output files of multiple data sets by their label
+        data_label = data_name if len(data_collection.data_object_names) > 1 else None
         blocks = codebook.blocks[~np.isnan(codebook.blocks)]
         for block in blocks:
-            plot_barplot(block, data, config, codebook)
+            for page in codebook.get_page_numbers(
+                block, config.plotting.max_variables_per_page
+            ):
+                plot_barplot(block, data, config, codebook, data_label, page)
 
 
 def plot_barplot(
-    block: int, data: Data, config: Configuration, codebook: CodeBook
-) -> None:
+    block: int,
+    data: Data | DataSummary,
+    config: Configuration,
+    codebook: CodeBook,
+    data_label: str | None = None,
+    page: int | None = None,
+    writer: OutputWriter | None = None,
+) -> Future | Path | None:
     """
     BARPLOTS:
     For each question and group plot a horizontal bar. Each segment of the bar corresponds one answer and its width
@@ -90,11 +107,122 @@ def plot_barplot(
     |                     | |                     | |                       |  |                    |
 
 
+    """
+    if config.barplots.renderer == "svg" and not config.plotting.draft:
+        # imported here as the svg renderer builds on the helpers of this module
+        from niceplots.plotting import barplot_svg
+
+        return barplot_svg.plot_barplot(
+            block, data, config, codebook, data_label, page, writer
+        )
+
+    # large blocks are split into pages sharing the colour scale and the legend
+    pages = codebook.get_pages(block, config.plotting.max_variables_per_page)
+    page_rows = pages[0 if page is None else page]
+    n_variables = page_rows.stop - page_rows.start
+    groups = list(config.data.groups.keys())
+
+    # blocks with the same geometry share their (empty) figure layout
+    layout_key = LAYOUT_POOL.get_key(
+        "barplot", n_variables, len(groups), layout=config.barplots.layout
+    )
+    fig, axes = LAYOUT_POOL.acquire(
+        layout_key, lambda: get_layout(config, n_variables, N_UNITS_LEGEND)
+    )
+    draw_block(fig, axes, block, page_rows, data, config, codebook, N_UNITS_LEGEND)
+
+    # save plot (the layout is reused once the figure was written)
+    return write_figure(
+        fig,
+        config.get_plot_path("barplot", block, data_label, page),
+        writer,
+        on_written=LAYOUT_POOL.release,
+        draft=config.plotting.draft,
+    )
+
+
+def plot_barplot_blocks(
+    blocks: tuple,
+    data: Data | DataSummary,
+    config: Configuration,
+    codebook: CodeBook,
+    data_label: str | None = None,
+    page: int | None = None,
+    writer: OutputWriter | None = None,
+) -> Future | Path | None:
+    """
+    SMALL MULTIPLES:
+    Several small blocks in one figure. Each block is drawn into its own panel with
+    the layout of plot_barplot, the panels are stacked vertically. Consecutive
+    blocks with the same legend share it (it is only drawn above the first one).
+    The page is ignored (small blocks are not split).
+    """
+    if config.barplots.renderer == "svg" and not config.plotting.draft:
+        from niceplots.plotting import barplot_svg
+
+        return barplot_svg.plot_barplot_blocks(
+            blocks, data, config, codebook, data_label, page, writer
+        )
+
+    legends = [get_legend_key(block, data, codebook) for block in blocks]
+    n_units_legend = [
+        N_UNITS_LEGEND if id_b == 0 or legends[id_b] != legends[id_b - 1] else 0
+        for id_b in range(len(blocks))
+    ]
+    n_variables = [int((codebook.codebook.block == block).sum()) for block in blocks]
+    heights = [
+        (n_v + n_u) * config.barplots.layout["height_question"]
+        for n_v, n_u in zip(n_variables, n_units_legend, strict=True)
+    ]
+    fig = Figure(figsize=(get_figure_width(config), sum(heights)))
+    panels = fig.subfigures(len(blocks), 1, squeeze=False, height_ratios=heights)
+    for panel, block, n_v, n_u in zip(
+        panels[:, 0], blocks, n_variables, n_units_legend, strict=True
+    ):
+        _, axes = get_layout(config, n_v, n_u, fig=panel)
+        draw_block(panel, axes, block, slice(0, n_v), data, config, codebook, n_u)
+
+    return write_figure(
+        fig,
+        config.get_plot_path("barplot", blocks, data_label),
+        writer,
+        draft=config.plotting.draft,
+    )
+
+
+def get_legend_key(block: float, data: Data | DataSummary, codebook: CodeBook) -> tuple:
+    """
+    Everything the legend of a block depends on (blocks with the same key can share
+    their legend).
+    """
+    codebook_block = codebook.codebook[codebook.codebook.block == block]
+    first = codebook_block.iloc[0]
+    key = (first["value_map"], first["barplots.color_scheme"], first["barplots.invert"])
+    if first["value_map"] == "":
+        # the legend shows the range of the values
+        variables = list(codebook_block["variable"])
+        key += data.get_aggregates(variables).get_range(variables)
+    return key
+
+
+def draw_block(
+    fig: FigureBase,
+    axes: list[Axes],
+    block: float,
+    page_rows: slice,
+    data: Data | DataSummary,
+    config: Configuration,
+    codebook: CodeBook,
+    n_units_legend: int,
+) -> None:
+    """
+    Draws the variables of a block (page_rows) into an empty layout. The legend is
+    not drawn if there is no space allocated for it (n_units_legend = 0).
     """
     # calculate some general properties that are constant within one block
     codebook_block = codebook.codebook[codebook.codebook.block == block]
-    variables = codebook_block["variable"]
-    n_variables = len(variables)
+    codebook_page = codebook_block.iloc[page_rows]
+    n_variables = len(codebook_page)
     groups = list(config.data.groups.keys())
     text_color = codebook_block.iloc[0]["barplots.text_color"]
     value_map = (
@@ -104,46 +232,36 @@ def plot_barplot(
     )
     color_scheme = codebook_block.iloc[0]["barplots.color_scheme"]
     invert = codebook_block.iloc[0]["barplots.invert"]
-
-    fig, axes = get_layout(config, n_variables, N_UNITS_LEGEND)
     geometry = get_geometry(config, groups)
 
     histograms, min_value, max_value = get_histograms(
-        config, groups, codebook_block, data, n_variables, value_map
+        config, groups, codebook_block, data, len(codebook_block), value_map
     )
+    histograms = histograms[page_rows]
     colors = get_colors(config, value_map, color_scheme, invert)
 
     add_bars(
         n_variables, axes, config, groups, geometry, histograms, colors, text_color
     )
-    add_question_labels(fig, config, codebook_block,
-                        n_variables, N_UNITS_LEGEND)
+    add_question_labels(fig, config, codebook_page, n_variables, n_units_legend)
     add_group_labels(fig, axes, groups, geometry, config)
-    add_question_summaries(
-        fig, config, data, codebook_block, axes, groups, geometry)
-    add_legend(
-        fig,
-        axes[0],
-        config,
-        colors,
-        value_map,
-        min_value,
-        max_value,
-        n_variables,
-        N_UNITS_LEGEND,
-    )
-
-    # save plot
-    fig.savefig(
-        f"{config.output_directory}/{config.output_name}_barplot_{int(block)}.{config.plotting.format}",
-        transparent=False,
-        bbox_inches="tight",
-    )
-    plt.close()
+    add_question_summaries(fig, config, data, codebook_page, axes, groups, geometry)
+    if n_units_legend > 0:
+        add_legend(
+            fig,
+            axes[0],
+            config,
+            colors,
+            value_map,
+            min_value,
+            max_value,
+            n_variables,
+            n_units_legend,
+        )
 
 
 def add_group_labels(
-    fig: Figure,
+    fig: FigureBase,
     axes: list[Axes],
     groups: list[str],
     geometry: dict,
@@ -166,6 +284,7 @@ def add_group_labels(
                 y_units="data",
                 width_units="inches",
                 width=config.barplots.layout["width_groups"],
+                truncate=config.plotting.draft,
                 figure=fig,
                 ax=ax,
             )
@@ -173,30 +292,28 @@ def add_group_labels(
 
 
 def add_question_summaries(
-    fig: Figure,
+    fig: FigureBase,
     config: Configuration,
-    data: Data,
+    data: Data | DataSummary,
     codebook_block: pd.DataFrame,
     axes: list[Axes],
     groups: list[str],
     geometry: dict,
 ) -> None:
-    no_answer_code = data.no_answer_code
+    statistics = data.get_statistics(list(codebook_block["variable"]))
+    std = statistics.std
+    fractions = data.get_sampling_fractions()
 
     for id_v, ax in enumerate(axes):
         for id_g, group in enumerate(groups):
-            code = codebook_block.iloc[id_v]
-            variable = code["variable"]
-
-            d = data.data[data.data["nice_plots_group"] == group]
-            d = d[variable]
-
-            # drop nans
-            d = d[~d.isna()]
-            # drop missing answers
-            d = d[~(d == code.missing_label)]
-
-            summary = get_summary(d, no_answer_code)
+            id_group = statistics.group_names.index(group)
+            summary = get_summary(
+                statistics.count[id_v, id_group],
+                statistics.n_no_answer[id_v, id_group],
+                statistics.mean[id_v, id_group],
+                std[id_v, id_group],
+                None if fractions is None else fractions[id_group],
+            )
 
             question_label = WrapText(
                 x=config.barplots.layout["width_question"]
@@ -212,20 +329,27 @@ def add_question_summaries(
                 y_units="data",
                 width_units="inches",
                 width=config.barplots.layout["width_summary"],
+                truncate=config.plotting.draft,
                 figure=fig,
                 ax=ax,
             )
             fig.add_artist(question_label)
 
 
-def get_summary(d: pd.DataFrame, no_answer_code: int) -> str:
-    n_no_answer = (d == no_answer_code).sum()
-    d = d[~(d == no_answer_code)]
-    mean = d.mean()
-    std = d.std()
-
-    if d.size > 0:
-        st = f"n = {d.size}\nm = {mean:.2f}\ns = {std:.2f}"
+def get_summary(
+    n: int, n_no_answer: int, mean: float, std: float, fraction: float | None = None
+) -> str:
+    """
+    :param fraction: fraction of the rows of the group in the sample (None if the
+        data is not sampled). The first line then shows the fraction and the
+        largest error of the shares, and the mean its error (95% confidence).
+    """
+    if n > 0 and fraction is not None:
+        st = f"n = {n} ({fraction:.0%}, ± {get_share_error(n, fraction):.0%})"
+        st += f"\nm = {mean:.2f} ± {get_mean_error(std, n, fraction):.2f}"
+        st += f"\ns = {std:.2f}\nE = {n_no_answer}"
+    elif n > 0:
+        st = f"n = {n}\nm = {mean:.2f}\ns = {std:.2f}"
         st += f"\nE = {n_no_answer}"
     else:
         st = "{:<9}".format("n = 0")
@@ -233,7 +357,7 @@ def get_summary(d: pd.DataFrame, no_answer_code: int) -> str:
 
 
 def add_question_labels(
-    fig: Figure,
+    fig: FigureBase,
     config: Configuration,
     codebook_block: pd.DataFrame,
     n_variables: int,
@@ -253,16 +377,14 @@ def add_question_labels(
             y_units="figure",
             width_units="inches",
             width=config.barplots.layout["width_question"],
+            truncate=config.plotting.draft,
             figure=fig,
         )
         fig.add_artist(question_label)
 
 
-def get_layout(
-    config: Configuration, n_variables: int, n_units_legend: int
-) -> tuple[Figure, list[Axes]]:
-    # calculate figuresize and get figure
-    fig_width = (
+def get_figure_width(config: Configuration) -> float:
+    return (
         config.barplots.layout["width_question"]
         + config.barplots.layout["width_groups"]
         + config.barplots.layout["width_plot"]
@@ -270,10 +392,23 @@ def get_layout(
         + 3 * config.barplots.layout["width_pad"]
     )
 
+
+def get_layout(
+    config: Configuration,
+    n_variables: int,
+    n_units_legend: int,
+    fig: FigureBase | None = None,
+) -> tuple[FigureBase, list[Axes]]:
+    """:param fig: Figure (or panel of a figure) to use. A new figure if None."""
+    # calculate figuresize and get figure
+    fig_width = get_figure_width(config)
+
     fig_height = (n_variables + n_units_legend) * config.barplots.layout[
         "height_question"
     ]
-    fig = plt.figure(figsize=(fig_width, fig_height))
+    if fig is None:
+        # not managed by pyplot such that blocks can be rendered in threads
+        fig = Figure(figsize=(fig_width, fig_height))
 
     # setup grid layout
     grid = gridspec.GridSpec(
@@ -346,7 +481,7 @@ def get_colors(
         n_bins = config.plotting.nbins
     else:
         n_bins = len(value_map.keys())
-    all_colors = plt.get_cmap(color_scheme)(np.linspace(0.15, 0.85, n_bins))
+    all_colors = mpl.colormaps[color_scheme](np.linspace(0.15, 0.85, n_bins))
     all_colors = np.asarray(all_colors)
     if invert is True:
         all_colors = np.flip(all_colors, axis=0)
@@ -389,6 +524,10 @@ def add_bars(
                 color=colors,
             )
 
+            if config.plotting.draft:
+                # drafts skip the labels of the segments
+                continue
+
             # add number indicating number of answers
             xcenters = offsets + widths / 2.0
             for ii, value in enumerate(widths_abs):
@@ -410,55 +549,32 @@ def get_histograms(
     config: Configuration,
     groups: list[str],
     codebook: pd.DataFrame,
-    data: Data,
+    data: Data | DataSummary,
     n_variables: int,
     value_map: Any | None,
 ) -> tuple[list, int, int]:
-    no_answer_code = data.no_answer_code
+    variables = list(codebook["variable"][:n_variables])
+    aggregates = data.get_aggregates(variables)
 
     min_value = 1000000
     max_value = -1000000
     if value_map is None:
         # assume numeric values
         # get min max range
-        for id_v in range(n_variables):
-            code = codebook.iloc[id_v]
-            variable = code["variable"]
-            d = data.data[variable]
-            # drop nans
-            d = d[~d.isna()]
-            # drop missing answers
-            d = d[~(d == code.missing_label)]
-            # drop no answer
-            d = d[~(d == no_answer_code)]
-            min_value = min(d.min(), min_value)
-            max_value = max(d.max(), max_value)
-
-    if value_map is None:
+        min_value, max_value = aggregates.get_range(variables)
         # no mapping provided (assume numeric values)
-        bin_edges = np.linspace(min_value, max_value,
-                                config.plotting.nbins + 1)
-    else:
-        bin_centers = np.asarray(list(value_map.keys()))
-        bin_edges = np.append(bin_centers, bin_centers[-1] + 1) - 0.5
+        bin_edges = np.linspace(min_value, max_value, config.plotting.nbins + 1)
 
     histograms = []
-    for id_v in range(n_variables):
-        code = codebook.iloc[id_v]
-        variable = code["variable"]
+    for variable in variables:
+        counts = aggregates.counts[variable]
+        if value_map is None:
+            counts = rebin(aggregates.codes[variable], counts, bin_edges)
+
         histograms_variable = {}
         for group in groups:
-            d = data.data[data.data["nice_plots_group"] == group]
-            d = d[variable]
-
-            # drop nans
-            d = d[~d.isna()]
-            # drop missing answers
-            d = d[~(d == no_answer_code)]
-
-            hist = np.histogram(d, bins=bin_edges)[0]
-            histograms_variable[group] = [
-                hist, np.cumsum(np.append(0, hist[:-1]))]
+            hist = counts[aggregates.group_names.index(group)]
+            histograms_variable[group] = [hist, np.cumsum(np.append(0, hist[:-1]))]
         histograms.append(histograms_variable)
     return histograms, min_value, max_value
 
@@ -481,41 +597,53 @@ def get_geometry(config: Configuration, groups: list[str]) -> dict:
         positions = np.append(positions, -1.0 * positions)
     else:
         # uneven number of bars
-        positions = (np.arange((n_bars - 1) / 2) + 1) * \
-            (bar_height + pad_groups)
+        positions = (np.arange((n_bars - 1) / 2) + 1) * (bar_height + pad_groups)
         positions = np.append(positions, -1.0 * positions)
         positions = np.append(0, positions)
     geometry["central_bar_positions"] = np.sort(positions)[::-1]
     return geometry
 
 
-def add_legend(
-    fig: Figure,
-    ax: Axes,
-    config: Configuration,
-    all_colors: np.array,
-    value_map: Any | None,
-    min_value: int,
-    max_value: int,
-    n_variables: int,
-    n_units_legend: int,
-) -> None:
+def get_category_names(
+    config: Configuration, value_map: Any | None, min_value: int, max_value: int
+) -> list[str] | None:
+    """
+    Names of the answer categories shown in the legend. None if only the first and
+    the last category are named (shown with a colour bar).
+    """
     if value_map is None:
         # assume numeric values
         edges = np.linspace(min_value, max_value, config.plotting.nbins + 1)
         lower_ends = edges[:-1]
         upper_ends = edges[1:]
-        category_names = [
+        return [
             f"{low} - {up} {config.plotting.unit}"
-            for low, up in zip(lower_ends, upper_ends)
+            for low, up in zip(lower_ends, upper_ends, strict=True)
         ]
-
     elif (pd.Series(value_map.values()).str.len() != 0).all():
         # full mapping provided
-        category_names = list(value_map.values())
+        return list(value_map.values())
     elif (len(list(value_map.values())[0]) != 0) and (
         len(list(value_map.values())[-1]) != 0
     ):
+        return None
+    else:
+        raise NotImplementedError(f"Mapping {value_map} not understood.")
+
+
+def add_legend(
+    fig: FigureBase,
+    ax: Axes,
+    config: Configuration,
+    all_colors: np.array,
+    value_map: Any | None,
+    min_value: int,
+    max_value: int,
+    n_variables: int,
+    n_units_legend: int,
+) -> None:
+    category_names = get_category_names(config, value_map, min_value, max_value)
+    if category_names is None:
         # mapping given but only for first and last element
         lower_category_name = list(value_map.values())[0]
         upper_category_name = list(value_map.values())[-1]
@@ -532,15 +660,16 @@ def add_legend(
             "width_pad"
         ],
 
-        # in fractions of figure size
-        inches_to_fig = fig.dpi_scale_trans + fig.transFigure.inverted()
+        # in fractions of figure (or panel) size
+        inches_to_fig = fig.dpi_scale_trans + Affine2D().scale(
+            1.0 / fig.bbox.width, 1.0 / fig.bbox.height
+        )
         left = inches_to_fig.transform(
             (
                 config.barplots.layout["width_question"]
                 + config.barplots.layout["width_groups"]
                 + 2 * config.barplots.layout["width_pad"]
-                + config.barplots.layout["width_plot"] *
-                (1 - WIDTH_COLORBAR_REL) / 2,
+                + config.barplots.layout["width_plot"] * (1 - WIDTH_COLORBAR_REL) / 2,
                 0,
             )
         )[0]
@@ -549,12 +678,11 @@ def add_legend(
             (config.barplots.layout["width_plot"] * WIDTH_COLORBAR_REL, 0.0)
         )[0]
         y_size = inches_to_fig.transform(
-            (0, HEIGHT_COLORBAR_REL *
-             config.barplots.layout["height_question"])
+            (0, HEIGHT_COLORBAR_REL * config.barplots.layout["height_question"])
         )[1]
 
         cax = fig.add_axes([left, bottom, x_size, y_size], frame_on=False)
-        plt.colorbar(
+        fig.colorbar(
             s_m,
             cax=cax,
             orientation="horizontal",
@@ -601,8 +729,6 @@ def add_legend(
             fontproperties=config.barplots.font_legend,
         )
         return
-    else:
-        raise NotImplementedError(f"Mapping {value_map} not understood.")
 
     patches = []
     for ii, category in enumerate(category_names):
@@ -0,0 +1,482 @@
+import ast
+import json
+import math
+from pathlib import Path
+from typing import Any
+from xml.sax.saxutils import escape, quoteattr
+
+import numpy as np
+from matplotlib.colors import to_hex
+
+from niceplots.plotting import barplot
+from niceplots.utils.codebook import CodeBook
+from niceplots.utils.config import Configuration
+from niceplots.utils.data import Data, DataSummary
+from niceplots.utils.font_metrics import get_line_layout, get_text_width, wrap_text
+from niceplots.utils.nice_logger import init_logger
+from niceplots.utils.output_writer import OutputWriter, save_text
+
+logger = init_logger(__file__)
+
+POINTS_PER_INCH = 72.0
+# matplotlib defaults of the figure elements drawn here (in points or font sizes)
+LINE_WIDTH_SPINES = 0.8
+PAD_SAVE = 0.1 * POINTS_PER_INCH
+LEGEND_BORDER_AXES_PAD = 0.5
+LEGEND_BORDER_PAD = 0.4
+LEGEND_HANDLE_LENGTH = 2.0
+LEGEND_HANDLE_HEIGHT = 0.7
+LEGEND_HANDLE_TEXT_PAD = 0.8
+LEGEND_LABEL_SPACING = 0.5
+LEGEND_COLUMN_SPACING = 2.0
+
+
+class SvgCanvas:
+    """
+    Collects the elements of an SVG image and the extent they cover. Coordinates
+    are in points with the origin at the top left corner (y pointing downwards).
+    """
+
+    def __init__(self) -> None:
+        self.elements: list[str] = []
+        self.extent = [math.inf, math.inf, -math.inf, -math.inf]
+
+    def add_extent(self, x0: float, y0: float, x1: float, y1: float) -> None:
+        self.extent = [
+            min(self.extent[0], x0),
+            min(self.extent[1], y0),
+            max(self.extent[2], x1),
+            max(self.extent[3], y1),
+        ]
+
+    def rect(
+        self,
+        x: float,
+        y: float,
+        width: float,
+        height: float,
+        fill: str = "none",
+        stroke: str | None = None,
+        line_width: float = LINE_WIDTH_SPINES,
+    ) -> None:
+        attributes = f'x="{x:.3f}" y="{y:.3f}" width="{width:.3f}" height="{height:.3f}" fill="{fill}"'
+        if stroke is not None:
+            attributes += f' stroke="{stroke}" stroke-width="{line_width}"'
+        self.elements.append(f"<rect {attributes}/>")
+        self.add_extent(x, y, x + width, y + height)
+
+    def text(
+        self,
+        x: float,
+        y: float,
+        text: str,
+        font: dict,
+        horizontal_alignment: str = "left",
+        vertical_alignment: str = "center",
+        color: str = "#000000",
+        width: float | None = None,
+    ) -> None:
+        """
+        Adds a text aligned like matplotlib text.
+        :param vertical_alignment: center, top, bottom or baseline (of the first
+        line).
+        :param width: Maximum width of the lines (in points), the text is wrapped
+        if given.
+        """
+        if width is None:
+            lines = text.split("\n")
+        else:
+            lines = wrap_text(text, width, font["size"], font["weight"])
+        height, ascent, line_step = get_line_layout(len(lines), font["size"])
+        if vertical_alignment == "center":
+            top = y - height / 2
+        elif vertical_alignment == "bottom":
+            top = y - height
+        elif vertical_alignment == "baseline":
+            top = y - ascent
+        else:
+            top = y
+        text_width = max(
+            get_text_width(line, font["size"], font["weight"]) for line in lines
+        )
+        anchor, left = {
+            "left": ("start", x),
+            "center": ("middle", x - text_width / 2),
+            "right": ("end", x - text_width),
+        }[horizontal_alignment]
+
+        spans = "".join(
+            f'<tspan x="{x:.3f}" y="{top + ascent + i * line_step:.3f}">{escape(line)}</tspan>'
+            for i, line in enumerate(lines)
+        )
+        self.elements.append(
+            f'<text font-family={quoteattr(font["family"])} font-size="{font["size"]}" '
+            f'font-weight="{font["weight"]}" font-style="{font["style"]}" '
+            f'text-anchor="{anchor}" fill="{color}">{spans}</text>'
+        )
+        self.add_extent(left, top, left + text_width, top + height)
+
+    def to_svg(self, pad: float = PAD_SAVE) -> str:
+        """
+        The image cropped to the extent of its elements plus pad (like matplotlib
+        figures saved with bbox_inches="tight").
+        """
+        x0, y0 = self.extent[0] - pad, self.extent[1] - pad
+        width = self.extent[2] - self.extent[0] + 2 * pad
+        height = self.extent[3] - self.extent[1] + 2 * pad
+        view_box = f"{x0:.3f} {y0:.3f} {width:.3f} {height:.3f}"
+        return "\n".join(
+            [
+                '<?xml version="1.0" encoding="utf-8" standalone="no"?>',
+                f'<svg xmlns="http://www.w3.org/2000/svg" version="1.1" '
+                f'width="{width:.3f}pt" height="{height:.3f}pt" viewBox="{view_box}">',
+                f'<rect x="{x0:.3f}" y="{y0:.3f}" width="{width:.3f}" '
+                f'height="{height:.3f}" fill="#ffffff"/>',
+                *self.elements,
+                "</svg>",
+                "",
+            ]
+        )
+
+
+def plot_barplot(
+    block: int,
+    data: Data | DataSummary,
+    config: Configuration,
+    codebook: CodeBook,
+    data_label: str | None = None,
+    page: int | None = None,
+    writer: OutputWriter | None = None,
+) -> Path:
+    """
+    Same plot as barplot.plot_barplot, written as SVG without matplotlib figures.
+    The layout follows the one of the matplotlib figure (see barplot.plot_barplot)
+    and text is wrapped using the font metrics table.
+    The SVG is written right away (the writer is not needed), its path is returned.
+    """
+    pages = codebook.get_pages(block, config.plotting.max_variables_per_page)
+    page_rows = pages[0 if page is None else page]
+    canvas = SvgCanvas()
+    draw_block(
+        canvas, 0.0, block, page_rows, data, config, codebook, barplot.N_UNITS_LEGEND
+    )
+    path = config.get_plot_path("barplot", block, data_label, page)
+    save_text(canvas.to_svg(), path)
+    return path
+
+
+def plot_barplot_blocks(
+    blocks: tuple,
+    data: Data | DataSummary,
+    config: Configuration,
+    codebook: CodeBook,
+    data_label: str | None = None,
+    page: int | None = None,
+    writer: OutputWriter | None = None,
+) -> Path:
+    """Same plot as barplot.plot_barplot_blocks, written as SVG (see plot_barplot)."""
+    legends = [barplot.get_legend_key(block, data, codebook) for block in blocks]
+    canvas = SvgCanvas()
+    top = 0.0
+    for id_b, block in enumerate(blocks):
+        n_units_legend = (
+            barplot.N_UNITS_LEGEND
+            if id_b == 0 or legends[id_b] != legends[id_b - 1]
+            else 0
+        )
+        n_variables = int((codebook.codebook.block == block).sum())
+        draw_block(
+            canvas,
+            top,
+            block,
+            slice(0, n_variables),
+            data,
+            config,
+            codebook,
+            n_units_legend,
+        )
+        top += (
+            (n_variables + n_units_legend)
+            * config.barplots.layout["height_question"]
+            * POINTS_PER_INCH
+        )
+    path = config.get_plot_path("barplot", blocks, data_label)
+    save_text(canvas.to_svg(), path)
+    return path
+
+
+def get_font(font: Any) -> dict:
+    """
+    Family, size (in points), weight and style of a font given as matplotlib
+    FontProperties or as dictionary of the configuration.
+    """
+    if isinstance(font, dict):
+        family = font.get("family", "sans-serif")
+        size = font.get("size", 10)
+        weight = font.get("weight", "normal")
+        style = font.get("style", "normal")
+    else:
+        family = font.get_family()
+        size = font.get_size_in_points()
+        weight = font.get_weight()
+        style = font.get_style()
+    families = [family] if isinstance(family, str) else list(family)
+    # the text is laid out with the metrics of DejaVu Sans
+    families += ["DejaVu Sans", "sans-serif"]
+    return {
+        "family": ", ".join(json.dumps(f) if " " in f else f for f in families),
+        "size": float(size),
+        "weight": weight,
+        "style": style,
+    }
+
+
+def draw_block(
+    canvas: SvgCanvas,
+    top: float,
+    block: float,
+    page_rows: slice,
+    data: Data | DataSummary,
+    config: Configuration,
+    codebook: CodeBook,
+    n_units_legend: int,
+) -> None:
+    """
+    Draws the variables of a block (page_rows) below top (in points). The legend
+    is not drawn if there is no space allocated for it (n_units_legend = 0).
+    """
+    codebook_block = codebook.codebook[codebook.codebook.block == block]
+    codebook_page = codebook_block.iloc[page_rows]
+    groups = list(config.data.groups.keys())
+    text_color = to_hex(codebook_block.iloc[0]["barplots.text_color"])
+    value_map = (
+        None
+        if codebook_block.iloc[0]["value_map"] == ""
+        else ast.literal_eval(codebook_block.iloc[0]["value_map"])
+    )
+    color_scheme = codebook_block.iloc[0]["barplots.color_scheme"]
+    invert = codebook_block.iloc[0]["barplots.invert"]
+    geometry = barplot.get_geometry(config, groups)
+
+    histograms, min_value, max_value = barplot.get_histograms(
+        config, groups, codebook_block, data, len(codebook_block), value_map
+    )
+    histograms = histograms[page_rows]
+    colors = [
+        to_hex(color)
+        for color in barplot.get_colors(config, value_map, color_scheme, invert)
+    ]
+
+    layout = {
+        key: config.barplots.layout[key] * POINTS_PER_INCH
+        for key in [
+            "width_question",
+            "width_groups",
+            "width_plot",
+            "width_summary",
+            "width_pad",
+            "height_question",
+        ]
+    }
+    x_plot = layout["width_question"] + layout["width_groups"] + 2 * layout["width_pad"]
+    top_plot = top + n_units_legend * layout["height_question"]
+    # centers of the bars relative to the center of a question (in points)
+    bar_centers = -geometry["central_bar_positions"] * layout["height_question"]
+    bar_height = geometry["bar_height"] * layout["height_question"]
+
+    canvas.rect(
+        x_plot,
+        top_plot,
+        layout["width_plot"],
+        len(codebook_page) * layout["height_question"],
+        stroke="#000000",
+    )
+    statistics = data.get_statistics(list(codebook_page["variable"]))
+    fractions = data.get_sampling_fractions()
+    for id_v, question in enumerate(codebook_page["label"]):
+        center = top_plot + (id_v + 0.5) * layout["height_question"]
+        canvas.text(
+            0.0,
+            center,
+            question,
+            get_font(config.barplots.font_questions),
+            width=layout["width_question"],
+        )
+        for id_g, group in enumerate(groups):
+            y_bar = center + bar_centers[id_g]
+            add_bar(
+                canvas,
+                x_plot,
+                y_bar,
+                bar_height,
+                layout["width_plot"],
+                histograms[id_v][group][0],
+                colors,
+                text_color,
+                get_font(config.barplots.font_plot),
+            )
+            if group != "nice_plots_default_group":
+                canvas.text(
+                    layout["width_question"]
+                    + layout["width_groups"]
+                    + layout["width_pad"],
+                    y_bar,
+                    group,
+                    get_font(config.barplots.font_groups),
+                    horizontal_alignment="right",
+                    width=layout["width_groups"],
+                )
+            id_group = statistics.group_names.index(group)
+            summary = barplot.get_summary(
+                statistics.count[id_v, id_group],
+                statistics.n_no_answer[id_v, id_group],
+                statistics.mean[id_v, id_group],
+                statistics.std[id_v, id_group],
+                None if fractions is None else fractions[id_group],
+            )
+            canvas.text(
+                x_plot + layout["width_plot"] + layout["width_pad"],
+                y_bar,
+                summary,
+                get_font(config.barplots.font_summary),
+                width=layout["width_summary"],
+            )
+
+    if n_units_legend > 0:
+        add_legend(
+            canvas,
+            x_plot,
+            top_plot,
+            layout,
+            config,
+            colors,
+            value_map,
+            min_value,
+            max_value,
+        )
+
+
+def add_bar(
+    canvas: SvgCanvas,
+    x_plot: float,
+    y: float,
+    height: float,
+    width_plot: float,
+    counts: np.ndarray,
+    colors: list[str],
+    text_color: str,
+    font: dict,
+) -> None:
+    """
+    Bar of one group and question centered at y. Each segment represents the
+    answers of one category (empty categories are skipped).
+    """
+    total = np.sum(counts)
+    if total == 0:
+        return
+    offset = 0.0
+    for count, color in zip(counts, colors, strict=True):
+        if count <= 0:
+            continue
+        width = count / total
+        canvas.rect(
+            x_plot + offset * width_plot,
+            y - height / 2,
+            width * width_plot,
+            height,
+            color,
+        )
+        if width >= 0.05:
+            # number indicating the number of answers (skipped for very narrow bins)
+            canvas.text(
+                x_plot + (offset + width / 2) * width_plot,
+                y,
+                str(int(count)),
+                font,
+                horizontal_alignment="center",
+                color=text_color,
+            )
+        offset += width
+
+
+def add_legend(
+    canvas: SvgCanvas,
+    x_plot: float,
+    top_plot: float,
+    layout: dict,
+    config: Configuration,
+    colors: list[str],
+    value_map: Any | None,
+    min_value: int,
+    max_value: int,
+) -> None:
+    """
+    Legend above the plot: the categories in two columns or a colour bar if only
+    the first and the last category are named.
+    """
+    font = get_font(config.barplots.font_legend)
+    category_names = barplot.get_category_names(config, value_map, min_value, max_value)
+    if category_names is None:
+        width_bar = layout["width_plot"] * barplot.WIDTH_COLORBAR_REL
+        height_bar = layout["height_question"] * barplot.HEIGHT_COLORBAR_REL
+        x_bar = x_plot + (layout["width_plot"] - width_bar) / 2
+        y_bar = top_plot - 0.1 * layout["height_question"] - height_bar
+        for id_c, color in enumerate(colors):
+            canvas.rect(
+                x_bar + id_c * width_bar / len(colors),
+                y_bar,
+                width_bar / len(colors),
+                height_bar,
+                color,
+            )
+        names = list(value_map.values())
+        canvas.text(
+            x_bar - layout["width_pad"],
+            y_bar + height_bar / 2,
+            names[0],
+            font,
+            horizontal_alignment="right",
+        )
+        canvas.text(
+            x_bar + width_bar + layout["width_pad"],
+            y_bar + height_bar / 2,
+            names[-1],
+            font,
+        )
+        return
+
+    # categories in two columns (filled column by column) as in matplotlib legends
+    size = font["size"]
+    height_row, ascent, _ = get_line_layout(1, size)
+    n_rows = math.ceil(len(category_names) / 2)
+    height_content = n_rows * height_row + (n_rows - 1) * LEGEND_LABEL_SPACING * size
+    top_content = (
+        top_plot - (LEGEND_BORDER_AXES_PAD + LEGEND_BORDER_PAD) * size - height_content
+    )
+    x_column = x_plot + (LEGEND_BORDER_AXES_PAD + LEGEND_BORDER_PAD) * size
+    x_text = x_column
+    for columns in [range(n_rows), range(n_rows, len(category_names))]:
+        x_text = x_column + (LEGEND_HANDLE_LENGTH + LEGEND_HANDLE_TEXT_PAD) * size
+        width_text = 0.0
+        for id_r, id_c in enumerate(columns):
+            baseline = (
+                top_content + id_r * (height_row + LEGEND_LABEL_SPACING * size) + ascent
+            )
+            canvas.rect(
+                x_column,
+                baseline - LEGEND_HANDLE_HEIGHT * size,
+                LEGEND_HANDLE_LENGTH * size,
+                LEGEND_HANDLE_HEIGHT * size,
+                colors[id_c],
+            )
+            name = category_names[id_c]
+            canvas.text(x_text, baseline, name, font, vertical_alignment="baseline")
+            width_text = max(width_text, get_text_width(name, size, font["weight"]))
+        x_column = x_text + width_text + LEGEND_COLUMN_SPACING * size
+    # the legend box includes the border pad
+    canvas.add_extent(
+        x_plot + LEGEND_BORDER_AXES_PAD * size,
+        top_content - LEGEND_BORDER_PAD * size,
+        x_column - (LEGEND_COLUMN_SPACING - LEGEND_BORDER_PAD) * size,
+        top_plot - LEGEND_BORDER_AXES_PAD * size,
+    )
@@ -1,20 +1,27 @@
 # Authors: Dominik Zuercher, Valeria Glauser
-import ast
+from concurrent.futures import Future
 from enum import Enum
+from pathlib import Path
 from typing import Any
 
 import matplotlib.gridspec as gridspec
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 from matplotlib.axes import Axes
-from matplotlib.figure import Figure
+from matplotlib.figure import Figure, FigureBase
 from matplotlib.patches import Patch
 
 from niceplots.utils.codebook import CodeBook
 from niceplots.utils.config import Configuration
-from niceplots.utils.data import Data, DataCollection
+from niceplots.utils.data import (
+    Data,
+    DataCollection,
+    DataSummary,
+    get_value_map,
+)
+from niceplots.utils.layout_pool import LAYOUT_POOL
 from niceplots.utils.nice_logger import init_logger
+from niceplots.utils.output_writer import OutputWriter, write_figure
 from niceplots.utils.plotting_utils import WrapText
 
 logger = init_logger(__file__)
@@ -34,14 +41,25 @@ def plot_histograms(
 ) -> None:
     for data_name in data_collection.data_object_names:
         data = getattr(data_collection, data_name)
+        # distinguish the output files of multiple data sets by their label
+        data_label = data_name if len(data_collection.data_object_names) > 1 else None
         blocks = codebook.blocks[~np.isnan(codebook.blocks)]
         for block in blocks:
-            plot_histogram(block, data, config, codebook)
+            for page in codebook.get_page_numbers(
+                block, config.plotting.max_variables_per_page
+            ):
+                plot_histogram(block, data, config, codebook, data_label, page)
 
 
 def plot_histogram(
-    block: int, data: Data, config: Configuration, codebook: CodeBook
-) -> None:
+    block: int,
+    data: Data | DataSummary,
+    config: Configuration,
+    codebook: CodeBook,
+    data_label: str | None = None,
+    page: int | None = None,
+    writer: OutputWriter | None = None,
+) -> Future | Path | None:
     """
     HISTOGRAMS:
     If a question block contains only a single question plot a bar in a histogram for each answer (per group).
@@ -88,47 +106,155 @@ def plot_histogram(
     |                     | |                       |
     |                     | |                       |
     """
-    # calculate some general properties that are constant within one block
-    codebook_block = codebook.codebook[codebook.codebook.block == block]
-    variables = codebook_block["variable"]
-    n_variables = len(variables)
+    hist_type = get_block_histogram_type(block, codebook)
+    if hist_type == HistogramType.Skip:
+        return
+
+    # large blocks are split into pages sharing the scale of the bars
+    pages = codebook.get_pages(block, config.plotting.max_variables_per_page)
+    page_rows = pages[0 if page is None else page]
+    n_bars = get_n_bars(block, page_rows, hist_type, codebook)
     groups = list(config.data.groups.keys())
-    value_map = (
-        None
-        if codebook_block.iloc[0]["value_map"] == ""
-        else ast.literal_eval(codebook_block.iloc[0]["value_map"])
+
+    # blocks with the same geometry share their (empty) figure layout
+    layout_key = LAYOUT_POOL.get_key(
+        "histogram", n_bars, len(groups), layout=config.histograms.layout
+    )
+    fig, axes = LAYOUT_POOL.acquire(
+        layout_key, lambda: get_layout(config, n_bars, N_UNITS_LEGEND, groups)
+    )
+    draw_block(
+        fig, axes, block, page_rows, hist_type, data, config, codebook, N_UNITS_LEGEND
+    )
+
+    # save plot (the layout is reused once the figure was written)
+    return write_figure(
+        fig,
+        config.get_plot_path("histogram", block, data_label, page),
+        writer,
+        on_written=LAYOUT_POOL.release,
+        draft=config.plotting.draft,
     )
-    # check if this kind of item can be made into a single histogram/multi-histogram
-    hist_type = get_histogram_type(n_variables, value_map)
 
-    if hist_type == HistogramType.Skip:
-        return
 
+def plot_histogram_blocks(
+    blocks: tuple,
+    data: Data | DataSummary,
+    config: Configuration,
+    codebook: CodeBook,
+    data_label: str | None = None,
+    page: int | None = None,
+    writer: OutputWriter | None = None,
+) -> Future | Path | None:
+    """
+    SMALL MULTIPLES:
+    Several small blocks in one figure. Each block is drawn into its own panel with
+    the layout of plot_histogram, the panels are stacked vertically. The legend
+    (the groups) is only drawn above the first panel. Blocks that cannot be shown
+    as histogram are left out. The page is ignored (small blocks are not split).
+    """
+    path = config.get_plot_path("histogram", blocks, data_label)
+    hist_types = {block: get_block_histogram_type(block, codebook) for block in blocks}
+    blocks = tuple(block for block in blocks if hist_types[block] != HistogramType.Skip)
+    if len(blocks) == 0:
+        return None
+
+    groups = list(config.data.groups.keys())
+    n_bars = [
+        get_n_bars(
+            block,
+            slice(0, int((codebook.codebook.block == block).sum())),
+            hist_types[block],
+            codebook,
+        )
+        for block in blocks
+    ]
+    n_units_legend = [N_UNITS_LEGEND] + [0] * (len(blocks) - 1)
+    heights = [
+        (n_b + n_u)
+        * (len(groups) + config.histograms.layout["height_rel_pad_questions"])
+        * config.histograms.layout["height_bar"]
+        for n_b, n_u in zip(n_bars, n_units_legend, strict=True)
+    ]
+    fig = Figure(figsize=(get_figure_width(config), sum(heights)))
+    panels = fig.subfigures(len(blocks), 1, squeeze=False, height_ratios=heights)
+    for panel, block, n_b, n_u in zip(
+        panels[:, 0], blocks, n_bars, n_units_legend, strict=True
+    ):
+        _, axes = get_layout(config, n_b, n_u, groups, fig=panel)
+        page_rows = slice(0, int((codebook.codebook.block == block).sum()))
+        draw_block(
+            panel,
+            axes,
+            block,
+            page_rows,
+            hist_types[block],
+            data,
+            config,
+            codebook,
+            n_u,
+        )
+
+    return write_figure(fig, path, writer, draft=config.plotting.draft)
+
+
+def get_block_histogram_type(block: float, codebook: CodeBook) -> HistogramType:
+    codebook_block = codebook.codebook[codebook.codebook.block == block]
+    return get_histogram_type(
+        len(codebook_block), get_value_map(codebook_block.iloc[0]["value_map"])
+    )
+
+
+def get_n_bars(
+    block: float, page_rows: slice, hist_type: HistogramType, codebook: CodeBook
+) -> int:
     if hist_type == HistogramType.Single:
-        n_bars = len(value_map.keys()) if value_map is not None else 0
-    else:
-        n_bars = n_variables
+        codebook_block = codebook.codebook[codebook.codebook.block == block]
+        value_map = get_value_map(codebook_block.iloc[0]["value_map"])
+        return len(value_map.keys()) if value_map is not None else 0
+    return page_rows.stop - page_rows.start
 
-    fig, axes = get_layout(config, n_bars, N_UNITS_LEGEND, groups)
+
+def draw_block(
+    fig: FigureBase,
+    axes: list[Axes],
+    block: float,
+    page_rows: slice,
+    hist_type: HistogramType,
+    data: Data | DataSummary,
+    config: Configuration,
+    codebook: CodeBook,
+    n_units_legend: int,
+) -> None:
+    """
+    Draws the variables of a block (page_rows) into an empty layout. The legend is
+    not drawn if there is no space allocated for it (n_units_legend = 0).
+    """
+    # calculate some general properties that are constant within one block
+    codebook_block = codebook.codebook[codebook.codebook.block == block]
+    codebook_page = codebook_block.iloc[page_rows]
+    n_variables = len(codebook_block)
+    n_bars = get_n_bars(block, page_rows, hist_type, codebook)
+    groups = list(config.data.groups.keys())
+    value_map = get_value_map(codebook_block.iloc[0]["value_map"])
     geometry = get_geometry(config, groups)
 
     hist_data, hist_data_abs, n_answers, n_no_answers = get_histogram_data(
         hist_type, groups, value_map, data, codebook_block, n_variables
     )
+    if hist_type == HistogramType.Multi:
+        hist_data = {group: hist[page_rows] for group, hist in hist_data.items()}
+        hist_data_abs = {
+            group: hist[page_rows] for group, hist in hist_data_abs.items()
+        }
 
     plot_bars(config, hist_data, geometry, axes, n_bars, groups)
     add_bar_label(fig, config, n_bars, axes, groups, hist_data, geometry, hist_data_abs)
-    add_labels(codebook_block, value_map, hist_type, axes, n_bars, fig, config)
-    add_summary(fig, axes, config, n_bars, groups, n_answers, n_no_answers)
-    add_legend(axes[0], config, groups)
-
-    # save plot
-    fig.savefig(
-        f"{config.output_directory}/{config.output_name}_histogram_{int(block)}.{config.plotting.format}",
-        transparent=False,
-        bbox_inches="tight",
-    )
-    plt.close()
+    add_labels(codebook_page, value_map, hist_type, axes, n_bars, fig, config)
+    fraction = data.group_counts.sum() / max(data.population_counts.sum(), 1)
+    add_summary(fig, axes, config, n_bars, groups, n_answers, n_no_answers, fraction)
+    if n_units_legend > 0:
+        add_legend(axes[0], config, groups)
 
 
 def add_legend(ax: Axes, config: Configuration, groups: list[str]) -> None:
@@ -149,14 +275,18 @@ def add_legend(ax: Axes, config: Configuration, groups: list[str]) -> None:
 
 
 def add_summary(
-    fig: Figure,
+    fig: FigureBase,
     axes: list[Axes],
     config: Configuration,
     n_bars: int,
     groups: list[str],
     n_answers: int,
     n_no_answers: int,
+    fraction: float = 1.0,
 ) -> None:
+    text = f"n = {int(n_answers)}\nE = {int(n_no_answers)}"
+    if fraction < 1:
+        text += f"\n{fraction:.0%} sample"
     summary = WrapText(
         x=config.histograms.layout["width_labels"]
         + config.histograms.layout["width_pad"]
@@ -169,7 +299,7 @@ def add_summary(
         )
         * config.histograms.layout["height_bar"]
         - config.histograms.layout["pad_summary_top"],
-        text=f"n = {int(n_answers)}\nE = {int(n_no_answers)}",
+        text=text,
         horizontalalignment="left",
         verticalalignment="top",
         fontproperties=config.histograms.font_summary,
@@ -177,6 +307,7 @@ def add_summary(
         y_units="inches",
         width_units="inches",
         width=config.histograms.layout["width_summary"],
+        truncate=config.plotting.draft,
         figure=fig,
         ax=axes[0],
     )
@@ -189,7 +320,7 @@ def add_labels(
     hist_type: HistogramType,
     axes: list[Axes],
     n_bars: int,
-    fig: Figure,
+    fig: FigureBase,
     config: Configuration,
 ) -> None:
     if hist_type == HistogramType.Single:
@@ -209,6 +340,7 @@ def add_labels(
             y_units="data",
             width_units="inches",
             width=config.histograms.layout["width_labels"],
+            truncate=config.plotting.draft,
             figure=fig,
             ax=ax,
         )
@@ -216,7 +348,7 @@ def add_labels(
 
 
 def add_bar_label(
-    fig: Figure,
+    fig: FigureBase,
     config: Configuration,
     n_bars: int,
     axes: list[Axes],
@@ -239,6 +371,7 @@ def add_bar_label(
                 y_units="data",
                 width_units="inches",
                 width=10,  # no wrap
+                truncate=config.plotting.draft,
                 figure=fig,
                 ax=ax,
             )
@@ -289,58 +422,34 @@ def get_histogram_data(
     hist_type: HistogramType,
     groups: list[str],
     value_map: Any | None,
-    data: Data,
+    data: Data | DataSummary,
     codebook: pd.DataFrame,
     n_variables: int,
 ) -> tuple[dict, dict, int, int]:
-    no_answer_code = data.no_answer_code
     max_value = 0
 
     hist_data_abs: dict = {}
 
+    variables = list(codebook["variable"][:n_variables])
+    aggregates = data.get_aggregates(variables)
+
     # get total number of answers
-    code = codebook.iloc[0]
-    variable = code["variable"]
-    d = data.data[variable]
-    # drop nans
-    d = d[~d.isna()]
-    n_no_answers = (d == no_answer_code).sum()
-    n_answers = ((d != no_answer_code) & (d != code.missing_label)).sum()
+    n_answers, n_no_answers = aggregates.totals[variables[0]]
 
     if hist_type == HistogramType.Single:
         for group in groups:
-            d = data.data[data.data["nice_plots_group"] == group]
             hist_data_abs[group] = []
-
-            code = codebook.iloc[0]
-            variable = code["variable"]
-            d = d[variable]
-            # drop nans
-            d = d[~d.isna()]
-            # drop no answers
-            d = d[~(d == no_answer_code)]
-            # drop missing answers
-            d = d[~(d == code.missing_label)]
-            for key in list(value_map.keys() if value_map is not None else []):
-                n = (d == key).sum()
+            if value_map is None:
+                continue
+            for n in aggregates.get_counts(variables[0], group):
                 hist_data_abs[group].append(n)
                 max_value = max(n, max_value)
     else:
         for group in groups:
-            data_group = data.data[data.data["nice_plots_group"] == group]
             hist_data_abs[group] = []
-            for id_v in range(n_variables):
-                code = codebook.iloc[id_v]
-                variable = code["variable"]
-                d = data_group[variable]
-                # drop nans
-                d = d[~d.isna()]
-                # drop no answers
-                d = d[~(d == no_answer_code)]
-                # drop missing answers
-                d = d[~(d == code.missing_label)]
+            for variable in variables:
                 # count number of Yes (1=Yes, 0=No)
-                n = d.sum()
+                n = aggregates.codes[variable] @ aggregates.get_counts(variable, group)
                 hist_data_abs[group].append(n)
                 max_value = max(n, max_value)
 
@@ -353,21 +462,32 @@ def get_histogram_data(
     return hist_data, hist_data_abs, n_answers, n_no_answers
 
 
-def get_layout(
-    config: Configuration, n_bars: int, n_units_legend: int, groups
-) -> tuple[Figure, list[Axes]]:
-    # calculate figuresize and get figure
-    fig_width = (
+def get_figure_width(config: Configuration) -> float:
+    return (
         config.histograms.layout["width_labels"]
         + config.histograms.layout["width_plot"]
         + config.histograms.layout["width_pad"]
     )
 
+
+def get_layout(
+    config: Configuration,
+    n_bars: int,
+    n_units_legend: int,
+    groups,
+    fig: FigureBase | None = None,
+) -> tuple[FigureBase, list[Axes]]:
+    """:param fig: Figure (or panel of a figure) to use. A new figure if None."""
+    # calculate figuresize and get figure
+    fig_width = get_figure_width(config)
+
     fig_height = (
         (n_bars + n_units_legend)
         * (len(groups) + config.histograms.layout["height_rel_pad_questions"])
     ) * config.histograms.layout["height_bar"]
-    fig = plt.figure(figsize=(fig_width, fig_height))
+    if fig is None:
+        # not managed by pyplot such that blocks can be rendered in threads
+        fig = Figure(figsize=(fig_width, fig_height))
 
     # setup grid layout
     grid = gridspec.GridSpec(
@@ -1,20 +1,24 @@
 # Authors: Dominik Zuercher, Valeria Glauser
 import ast
+from concurrent.futures import Future
+from pathlib import Path
 from typing import Any
 
 import matplotlib.gridspec as gridspec
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 from matplotlib.axes import Axes
-from matplotlib.figure import Figure
+from matplotlib.figure import Figure, FigureBase
 from matplotlib.patches import Patch
 
 from niceplots.utils.codebook import CodeBook
 from niceplots.utils.config import Configuration
-from niceplots.utils.data import Data, DataCollection
+from niceplots.utils.data import Data, DataCollection, DataSummary
+from niceplots.utils.layout_pool import LAYOUT_POOL
 from niceplots.utils.nice_logger import init_logger
+from niceplots.utils.output_writer import OutputWriter, write_figure
 from niceplots.utils.plotting_utils import WrapText
+from niceplots.utils.sampling import get_mean_errors
 
 logger = init_logger(__file__)
 
@@ -26,14 +30,25 @@ def plot_lineplots(
 ) -> None:
     for data_name in data_collection.data_object_names:
         data = getattr(data_collection, data_name)
+        # distinguish the output files of multiple data sets by their label
+        data_label = data_name if len(data_collection.data_object_names) > 1 else None
         blocks = codebook.blocks[~np.isnan(codebook.blocks)]
         for block in blocks:
-            plot_lineplot(block, data, config, codebook)
+            for page in codebook.get_page_numbers(
+                block, config.plotting.max_variables_per_page
+            ):
+                plot_lineplot(block, data, config, codebook, data_label, page)
 
 
 def plot_lineplot(
-    block: int, data: Data, config: Configuration, codebook: CodeBook
-) -> None:
+    block: int,
+    data: Data | DataSummary,
+    config: Configuration,
+    codebook: CodeBook,
+    data_label: str | None = None,
+    page: int | None = None,
+    writer: OutputWriter | None = None,
+) -> Future | Path | None:
     """
     LINEPLOTS:
     For each question a linegrid is plotted. The mean of each group is indicated by a cross.
@@ -74,11 +89,88 @@ def plot_lineplot(
     |                     | |                     | |                       |  |                    |
 
 
+    """
+    # large blocks are split into pages sharing the value range
+    pages = codebook.get_pages(block, config.plotting.max_variables_per_page)
+    page_rows = pages[0 if page is None else page]
+    n_variables = page_rows.stop - page_rows.start
+    groups = list(config.data.groups.keys())
+
+    # blocks with the same geometry share their (empty) figure layout
+    layout_key = LAYOUT_POOL.get_key(
+        "lineplot", n_variables, len(groups), layout=config.lineplots.layout
+    )
+    fig, axes = LAYOUT_POOL.acquire(
+        layout_key, lambda: get_layout(config, n_variables, N_UNITS_LEGEND)
+    )
+    draw_block(fig, axes, block, page_rows, data, config, codebook, N_UNITS_LEGEND)
+
+    # save plot (the layout is reused once the figure was written)
+    return write_figure(
+        fig,
+        config.get_plot_path("lineplot", block, data_label, page),
+        writer,
+        on_written=LAYOUT_POOL.release,
+        draft=config.plotting.draft,
+    )
+
+
+def plot_lineplot_blocks(
+    blocks: tuple,
+    data: Data | DataSummary,
+    config: Configuration,
+    codebook: CodeBook,
+    data_label: str | None = None,
+    page: int | None = None,
+    writer: OutputWriter | None = None,
+) -> Future | Path | None:
+    """
+    SMALL MULTIPLES:
+    Several small blocks in one figure. Each block is drawn into its own panel with
+    the layout of plot_lineplot, the panels are stacked vertically. The legend only
+    shows the groups and is drawn above the first panel.
+    The page is ignored (small blocks are not split).
+    """
+    n_units_legend = [N_UNITS_LEGEND] + [0] * (len(blocks) - 1)
+    n_variables = [int((codebook.codebook.block == block).sum()) for block in blocks]
+    heights = [
+        (n_v + n_u) * config.lineplots.layout["height_question"]
+        for n_v, n_u in zip(n_variables, n_units_legend, strict=True)
+    ]
+    fig = Figure(figsize=(get_figure_width(config), sum(heights)))
+    panels = fig.subfigures(len(blocks), 1, squeeze=False, height_ratios=heights)
+    for panel, block, n_v, n_u in zip(
+        panels[:, 0], blocks, n_variables, n_units_legend, strict=True
+    ):
+        _, axes = get_layout(config, n_v, n_u, fig=panel)
+        draw_block(panel, axes, block, slice(0, n_v), data, config, codebook, n_u)
+
+    return write_figure(
+        fig,
+        config.get_plot_path("lineplot", blocks, data_label),
+        writer,
+        draft=config.plotting.draft,
+    )
+
+
+def draw_block(
+    fig: FigureBase,
+    axes: list[Axes],
+    block: float,
+    page_rows: slice,
+    data: Data | DataSummary,
+    config: Configuration,
+    codebook: CodeBook,
+    n_units_legend: int,
+) -> None:
+    """
+    Draws the variables of a block (page_rows) into an empty layout. The legend is
+    not drawn if there is no space allocated for it (n_units_legend = 0).
     """
     # calculate some general properties that are constant within one block
     codebook_block = codebook.codebook[codebook.codebook.block == block]
-    variables = codebook_block["variable"]
-    n_variables = len(variables)
+    codebook_page = codebook_block.iloc[page_rows]
+    n_variables = len(codebook_page)
     groups = list(config.data.groups.keys())
     value_map = (
         None
@@ -86,32 +178,21 @@ def plot_lineplot(
         else ast.literal_eval(codebook_block.iloc[0]["value_map"])
     )
 
-    fig, axes = get_layout(config, n_variables, N_UNITS_LEGEND)
-
     min_value, max_value, min_label, max_label = plot_line_grid(
-        n_variables, codebook_block, data, axes, config, value_map
+        len(codebook_block), codebook_block, data, axes, config, value_map
     )
     plot_crosses(
-        groups, n_variables, codebook_block, data, axes, config, min_value, max_value
+        groups, n_variables, codebook_page, data, axes, config, min_value, max_value
     )
 
-    add_question_labels(fig, config, codebook_block,
-                        n_variables, N_UNITS_LEGEND)
-    add_edge_labels(fig, config, n_variables,
-                    N_UNITS_LEGEND, min_label, max_label)
-    add_legend(axes[0], config, groups)
-
-    # save plot
-    fig.savefig(
-        f"{config.output_directory}/{config.output_name}_lineplot_{int(block)}.{config.plotting.format}",
-        transparent=False,
-        bbox_inches="tight",
-    )
-    plt.close()
+    add_question_labels(fig, config, codebook_page, n_variables, n_units_legend)
+    add_edge_labels(fig, config, n_variables, n_units_legend, min_label, max_label)
+    if n_units_legend > 0:
+        add_legend(axes[0], config, groups)
 
 
 def add_question_labels(
-    fig: Figure,
+    fig: FigureBase,
     config: Configuration,
     codebook_block: pd.DataFrame,
     n_variables: int,
@@ -131,13 +212,14 @@ def add_question_labels(
             y_units="figure",
             width_units="inches",
             width=config.lineplots.layout["width_question"],
+            truncate=config.plotting.draft,
             figure=fig,
         )
         fig.add_artist(question_label)
 
 
 def add_edge_labels(
-    fig: Figure,
+    fig: FigureBase,
     config: Configuration,
     n_variables: int,
     n_units_legend: int,
@@ -163,6 +245,7 @@ def add_edge_labels(
             y_units="figure",
             width_units="inches",
             width=config.lineplots.layout["width_labels"],
+            truncate=config.plotting.draft,
             figure=fig,
         )
         fig.add_artist(edge_label)
@@ -181,6 +264,7 @@ def add_edge_labels(
             y_units="figure",
             width_units="inches",
             width=config.lineplots.layout["width_labels"],
+            truncate=config.plotting.draft,
             figure=fig,
         )
         fig.add_artist(edge_label)
@@ -189,13 +273,11 @@ def add_edge_labels(
 def plot_line_grid(
     n_variables: int,
     codebook: pd.DataFrame,
-    data: Data,
+    data: Data | DataSummary,
     axes: list[Axes],
     config: Configuration,
     value_map: Any | None,
 ) -> tuple[int, int, str, str]:
-    no_answer_code = data.no_answer_code
-
     min_value = 1000000
     max_value = -1000000
 
@@ -207,16 +289,8 @@ def plot_line_grid(
     if value_map is None:
         # assume numeric values
         # get min max range
-        for id_v in range(n_variables):
-            code = codebook.iloc[id_v]
-            variable = code["variable"]
-            d = data.data[variable]
-            # drop nans
-            d = d[~d.isna()]
-            # drop missing answers
-            d = d[~(d == no_answer_code)]
-            min_value = min(d.min(), min_value)
-            max_value = max(d.max(), max_value)
+        variables = list(codebook["variable"][:n_variables])
+        min_value, max_value = data.get_aggregates(variables).get_range(variables)
         min_label = str(int(min_value))
         max_label = str(int(max_value))
 
@@ -244,31 +318,26 @@ def plot_crosses(
     groups: list[str],
     n_variables: int,
     codebook: pd.DataFrame,
-    data: Data,
+    data: Data | DataSummary,
     axes: list[Axes],
     config: Configuration,
     min_value: int,
     max_value: int,
 ) -> None:
-    no_answer_code = data.no_answer_code
-
     # prep data (get means for each question/group)
+    statistics = data.get_statistics(list(codebook["variable"][:n_variables]))
+    # sampled data: error bars of the means (95% confidence) on the 0-1 scale
+    fractions = data.get_sampling_fractions()
+    errors = None
+    if fractions is not None:
+        errors = get_mean_errors(statistics.count, statistics.std, fractions)
+        errors = errors / (max_value - min_value)
     plotting_data: dict = {}
     for group in groups:
-        data_group = data.data[data.data["nice_plots_group"] == group]
         plotting_data[group] = []
+        id_group = statistics.group_names.index(group)
         for id_v in range(n_variables):
-            code = codebook.iloc[id_v]
-            variable = code["variable"]
-            d = data_group[variable]
-
-            # drop nans
-            d = d[~d.isna()]
-            # drop missing answers
-            d = d[~(d == code.missing_label)]
-            # drop no answer
-            d = d[~(d == no_answer_code)]
-            mean = np.mean(d)
+            mean = statistics.mean[id_v, id_group]
             # normalize to 0-1 scale
             mean = (mean - min_value) / (max_value - min_value)
 
@@ -278,9 +347,22 @@ def plot_crosses(
             plotting_data[group].append(mean)
 
     for id_g, group in enumerate(groups):
+        id_group = statistics.group_names.index(group)
         for id_v in range(n_variables):
             ax = axes[id_v]
 
+            if errors is not None and not np.isnan(errors[id_v, id_group]):
+                ax.errorbar(
+                    plotting_data[group][id_v],
+                    0,
+                    xerr=errors[id_v, id_group],
+                    color=config.lineplots.colors[id_g],
+                    lw=2,
+                    capsize=8,
+                    capthick=2,
+                    clip_on=False,
+                )
+
             # add X marker
             ax.plot(
                 plotting_data[group][id_v],
@@ -313,21 +395,31 @@ def plot_crosses(
                 )
 
 
-def get_layout(
-    config: Configuration, n_variables: int, n_units_legend: int
-) -> tuple[Figure, list[Axes]]:
-    # calculate figuresize and get figure
-    fig_width = (
+def get_figure_width(config: Configuration) -> float:
+    return (
         config.lineplots.layout["width_question"]
         + 2 * config.lineplots.layout["width_labels"]
         + config.lineplots.layout["width_plot"]
         + 3 * config.lineplots.layout["width_pad"]
     )
 
+
+def get_layout(
+    config: Configuration,
+    n_variables: int,
+    n_units_legend: int,
+    fig: FigureBase | None = None,
+) -> tuple[FigureBase, list[Axes]]:
+    """:param fig: Figure (or panel of a figure) to use. A new figure if None."""
+    # calculate figuresize and get figure
+    fig_width = get_figure_width(config)
+
     fig_height = (n_variables + n_units_legend) * config.lineplots.layout[
         "height_question"
     ]
-    fig = plt.figure(figsize=(fig_width, fig_height))
+    if fig is None:
+        # not managed by pyplot such that blocks can be rendered in threads
+        fig = Figure(figsize=(fig_width, fig_height))
 
     # setup grid layout
     grid = gridspec.GridSpec(
@@ -379,8 +471,7 @@ def add_legend(ax, config, groups) -> None:
         for ii, group in enumerate(groups):
             if group == "nice_plots_default_group":
                 continue
-            patches.append(
-                Patch(color=config.lineplots.colors[ii], label=group))
+            patches.append(Patch(color=config.lineplots.colors[ii], label=group))
         ax.legend(
             handles=patches,
             ncol=2,
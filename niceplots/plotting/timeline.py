@@ -0,0 +1,275 @@
+from concurrent.futures import Future
+from pathlib import Path
+
+import matplotlib.gridspec as gridspec
+import numpy as np
+import pandas as pd
+from matplotlib.axes import Axes
+from matplotlib.figure import Figure, FigureBase
+from matplotlib.patches import Patch
+
+from niceplots.utils.aggregate import Aggregates
+from niceplots.utils.codebook import CodeBook
+from niceplots.utils.config import Configuration
+from niceplots.utils.data import get_value_map
+from niceplots.utils.nice_logger import init_logger
+from niceplots.utils.output_writer import OutputWriter, write_figure
+from niceplots.utils.plotting_utils import WrapText
+
+logger = init_logger(__file__)
+
+# rotate the data labels if there are more of them
+MAX_HORIZONTAL_LABELS = 8
+
+# most codes labelled on the y axis
+MAX_TICKS = 10
+
+
+def plot_timeline(
+    block: float,
+    aggregates: list[Aggregates],
+    data_labels: list[str],
+    config: Configuration,
+    codebook: CodeBook,
+    page: int | None = None,
+    writer: OutputWriter | None = None,
+) -> Future | Path | None:
+    """
+    TIMELINES:
+    For each question the mean of each group (or the share of the codes in
+    config.timelines.shares) is plotted against the data sets, e.g. the waves of a
+    survey. Only the aggregates of the data sets are used.
+
+    Y-Layout: Each question gets a panel of height_question (in inches). The panels
+    are separated by height_rel_pad_questions * height_question. For the legend at
+    the top one height_question is allocated. The data labels are written below
+    the last panel.
+
+    X-Layout:
+
+      width_question   width_pad    width_plot    width_pad
+    |                     | |                       |  |
+    |                     | |                       |  |
+
+    Text is wrapped automatically to the correct width.
+    """
+    pages = codebook.get_pages(block, config.plotting.max_variables_per_page)
+    page_rows = pages[0 if page is None else page]
+    codebook_block = codebook.codebook[codebook.codebook.block == block]
+    codebook_page = codebook_block.iloc[page_rows]
+    groups = list(config.data.groups.keys())
+
+    values, min_value, max_value = get_timeline_data(
+        aggregates, codebook_block, codebook_page, config
+    )
+    fig, axes = get_layout(config, len(codebook_page))
+    plot_lines(axes, config, values, groups, aggregates[0].group_names)
+    add_value_labels(axes, config, min_value, max_value)
+    add_data_labels(axes, config, data_labels)
+    add_question_labels(fig, config, codebook_page)
+    add_legend(axes[0], config, groups)
+
+    return write_figure(
+        fig,
+        config.get_plot_path("timeline", block, page=page),
+        writer,
+        draft=config.plotting.draft,
+    )
+
+
+def get_timeline_data(
+    aggregates: list[Aggregates],
+    codebook_block: pd.DataFrame,
+    codebook_page: pd.DataFrame,
+    config: Configuration,
+) -> tuple[np.ndarray, float, float]:
+    """
+    Plotted values of the variables of the page for each data set and group,
+    shape (n_data, n_variables, n_groups), and the range of the values of the
+    block (shared by all pages).
+    """
+    variables = list(codebook_page["variable"])
+    if config.timelines.shares is not None:
+        values = [
+            agg.get_shares(variables, config.timelines.shares) for agg in aggregates
+        ]
+        return np.array(values), 0.0, 1.0
+
+    values = [agg.get_statistics(variables).mean for agg in aggregates]
+    value_map = get_value_map(codebook_block.iloc[0]["value_map"])
+    if value_map is not None:
+        codes = list(value_map.keys())
+        return np.array(values), min(codes), max(codes)
+    # no mapping provided (numeric values): range of the answers in all data sets
+    block_variables = list(codebook_block["variable"])
+    ranges = np.array([agg.get_range(block_variables) for agg in aggregates])
+    return np.array(values), ranges[:, 0].min(), ranges[:, 1].max()
+
+
+def plot_lines(
+    axes: list[Axes],
+    config: Configuration,
+    values: np.ndarray,
+    groups: list[str],
+    group_names: list[str],
+) -> None:
+    x = np.arange(values.shape[0])
+    for id_v, ax in enumerate(axes):
+        for id_g, group in enumerate(groups):
+            id_group = group_names.index(group)
+            # data sets without answers leave a gap
+            ax.plot(
+                x,
+                values[:, id_v, id_group],
+                marker="o",
+                markersize=5,
+                color=config.timelines.colors[id_g],
+                lw=2,
+                clip_on=False,
+            )
+
+
+def add_value_labels(
+    axes: list[Axes],
+    config: Configuration,
+    min_value: float,
+    max_value: float,
+) -> None:
+    """Horizontal grid lines labelled with the codes (or shares) on the right."""
+    if config.timelines.shares is not None:
+        ticks = np.linspace(0, 1, 5)
+        labels = [f"{tick:.0%}" for tick in ticks]
+    else:
+        ticks = np.arange(np.ceil(min_value), np.floor(max_value) + 1)
+        if len(ticks) > MAX_TICKS or len(ticks) < 2:
+            ticks = np.linspace(min_value, max_value, 5)
+        labels = [f"{tick:g}" for tick in ticks]
+    margin = 0.05 * max(max_value - min_value, 1e-6)
+    for ax in axes:
+        ax.set_ylim(min_value - margin, max_value + margin)
+        ax.hlines(
+            ticks,
+            0,
+            1,
+            transform=ax.get_yaxis_transform(),
+            color="0.85",
+            lw=1,
+            zorder=0,
+        )
+        for tick, label in zip(ticks, labels, strict=True):
+            ax.text(
+                1.01,
+                tick,
+                label,
+                transform=ax.get_yaxis_transform(),
+                horizontalalignment="left",
+                verticalalignment="center",
+                fontproperties=config.timelines.font_ticks,
+            )
+
+
+def add_data_labels(
+    axes: list[Axes], config: Configuration, data_labels: list[str]
+) -> None:
+    """Vertical grid lines at the data sets, labelled below the last panel."""
+    rotation = 0 if len(data_labels) <= MAX_HORIZONTAL_LABELS else 45
+    for ax in axes:
+        ax.set_xlim(-0.5, len(data_labels) - 0.5)
+        ax.vlines(
+            range(len(data_labels)),
+            0,
+            1,
+            transform=ax.get_xaxis_transform(),
+            color="0.85",
+            lw=1,
+            zorder=0,
+        )
+    for id_d, label in enumerate(data_labels):
+        axes[-1].text(
+            id_d,
+            -0.05,
+            label,
+            transform=axes[-1].get_xaxis_transform(),
+            rotation=rotation,
+            rotation_mode="anchor",
+            horizontalalignment="center" if rotation == 0 else "right",
+            verticalalignment="top",
+            fontproperties=config.timelines.font_ticks,
+        )
+
+
+def add_question_labels(
+    fig: FigureBase, config: Configuration, codebook_page: pd.DataFrame
+) -> None:
+    for ax, question in zip(fig.axes, codebook_page.label, strict=True):
+        question_label = WrapText(
+            x=0.0,
+            y=0.5,
+            text=question,
+            horizontalalignment="left",
+            verticalalignment="center",
+            fontproperties=config.timelines.font_questions,
+            x_units="inches",
+            y_units="axis",
+            width_units="inches",
+            width=config.timelines.layout["width_question"],
+            truncate=config.plotting.draft,
+            figure=fig,
+            ax=ax,
+        )
+        fig.add_artist(question_label)
+
+
+def get_layout(config: Configuration, n_variables: int) -> tuple[Figure, list[Axes]]:
+    layout = config.timelines.layout
+    fig_width = (
+        layout["width_question"] + layout["width_plot"] + 2 * layout["width_pad"]
+    )
+    # one unit for the legend, a padding below the last panel
+    n_units = n_variables * (1 + layout["height_rel_pad_questions"]) + 1
+    fig_height = n_units * layout["height_question"]
+    # not managed by pyplot such that blocks can be rendered in threads
+    fig = Figure(figsize=(fig_width, fig_height))
+
+    grid = gridspec.GridSpec(
+        nrows=n_variables,
+        ncols=1,
+        wspace=0.0,
+        hspace=layout["height_rel_pad_questions"],
+        left=(layout["width_question"] + layout["width_pad"]) / fig_width,
+        right=(layout["width_question"] + layout["width_pad"] + layout["width_plot"])
+        / fig_width,
+        top=1 - 1 / n_units,
+        bottom=layout["height_rel_pad_questions"] / n_units,
+        figure=fig,
+    )
+    axes = []
+    for id_v in range(n_variables):
+        ax = fig.add_subplot(grid[id_v])
+        ax.tick_params(
+            axis="both",
+            which="both",
+            bottom=False,
+            labelbottom=False,
+            left=False,
+            labelleft=False,
+        )
+        axes.append(ax)
+    return fig, axes
+
+
+def add_legend(ax: Axes, config: Configuration, groups: list[str]) -> None:
+    patches = []
+    for ii, group in enumerate(groups):
+        if group == "nice_plots_default_group":
+            continue
+        patches.append(Patch(color=config.timelines.colors[ii], label=group))
+    if len(patches) > 0:
+        ax.legend(
+            handles=patches,
+            ncol=2,
+            bbox_to_anchor=(0, 1),
+            loc="lower left",
+            frameon=False,
+            prop=config.timelines.font_legend,
+        )
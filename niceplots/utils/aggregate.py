@@ -0,0 +1,310 @@
+import numpy as np
+import pandas as pd
+
+from niceplots.utils.fingerprint import fingerprint
+
+# largest code for which codes are remapped using a lookup table
+MAX_LOOKUP_CODE = 1 << 16
+
+
+def get_code_index(values: np.ndarray, codes: np.ndarray) -> np.ndarray:
+    """Dense index of each value in codes (-1 if the value is not a code)."""
+    index = np.full(values.shape, -1, dtype=np.intp)
+    if codes.size == 0 or values.size == 0:
+        return index
+    integral = np.all(codes == np.round(codes))
+    if integral and codes.min() >= 0 and codes.max() < MAX_LOOKUP_CODE:
+        # lookup table from code to its position
+        lookup = np.full(int(codes.max()) + 1, -1, dtype=np.intp)
+        lookup[codes.astype(np.intp)] = np.arange(codes.size)
+        in_range = (
+            (values >= 0) & (values <= codes.max()) & (values == np.round(values))
+        )
+        index[in_range] = lookup[values[in_range].astype(np.intp)]
+    else:
+        order = np.argsort(codes, kind="stable")
+        positions = np.searchsorted(codes[order], values)
+        positions = np.minimum(positions, codes.size - 1)
+        found = codes[order][positions] == values
+        index[found] = order[positions[found]]
+    return index
+
+
+def get_bin_index(values: np.ndarray, bin_edges: np.ndarray) -> np.ndarray:
+    """
+    Index of the bin of each value (-1 if outside of the bins). As in
+    np.histogram the last bin includes its right edge.
+    """
+    n_bins = bin_edges.size - 1
+    index = np.searchsorted(bin_edges, values, side="right") - 1
+    index[values == bin_edges[-1]] = n_bins - 1
+    index[(index < 0) | (index >= n_bins) | np.isnan(values)] = -1
+    return index
+
+
+def count_per_group(
+    bin_index: np.ndarray, group_codes: np.ndarray, n_groups: int, n_bins: int
+) -> np.ndarray:
+    """
+    Counts the values of all groups in one pass over a combined (group, bin) index.
+    Returns an array of shape (n_groups, n_bins). Rows with negative bin or group
+    index are ignored.
+    """
+    valid = (bin_index >= 0) & (group_codes >= 0)
+    combined = group_codes[valid].astype(np.intp) * n_bins + bin_index[valid]
+    counts = np.bincount(combined, minlength=n_groups * n_bins)
+    return counts.reshape(n_groups, n_bins)
+
+
+class Statistics:
+    """
+    Summary statistics of the valid answers of a set of variables for each group.
+    All arrays have the shape (n_variables, n_groups). The statistics of disjoint
+    sets of rows can be merged.
+    :param variables: Names of the variables.
+    :param group_names: Names of the groups.
+    """
+
+    def __init__(self, variables: list[str], group_names: list[str]) -> None:
+        self.variables = list(variables)
+        self.group_names = list(group_names)
+        shape = (len(self.variables), len(self.group_names))
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.n_no_answer = np.zeros(shape, dtype=np.int64)
+        self.mean = np.full(shape, np.nan)
+        # sum of squared deviations from the mean
+        self.m2 = np.zeros(shape)
+
+    @property
+    def std(self) -> np.ndarray:
+        """Sample standard deviation (NaN for less than two answers)."""
+        std = np.full(self.m2.shape, np.nan)
+        np.sqrt(self.m2 / (self.count - 1), out=std, where=self.count > 1)
+        return std
+
+    def select(self, variables: list[str]) -> "Statistics":
+        index = [self.variables.index(variable) for variable in variables]
+        statistics = Statistics(variables, self.group_names)
+        statistics.count = self.count[index]
+        statistics.n_no_answer = self.n_no_answer[index]
+        statistics.mean = self.mean[index]
+        statistics.m2 = self.m2[index]
+        return statistics
+
+    def merge(self, other: "Statistics") -> "Statistics":
+        """Statistics of the union of the rows (pairwise update of Chan et al.)."""
+        if other.variables != self.variables or other.group_names != self.group_names:
+            raise ValueError(
+                "Can only merge statistics of the same variables and groups"
+            )
+        merged = Statistics(self.variables, self.group_names)
+        merged.count = self.count + other.count
+        merged.n_no_answer = self.n_no_answer + other.n_no_answer
+        has_count = merged.count > 0
+        mean_self = np.where(self.count > 0, self.mean, 0.0)
+        mean_other = np.where(other.count > 0, other.mean, 0.0)
+        delta = mean_other - mean_self
+        weight = np.divide(
+            other.count, merged.count, out=np.zeros(merged.count.shape), where=has_count
+        )
+        merged.mean = np.where(has_count, mean_self + delta * weight, np.nan)
+        merged.m2 = self.m2 + other.m2 + delta**2 * self.count * weight
+        return merged
+
+    def to_frame(self) -> pd.DataFrame:
+        """Long table with one row per variable and group."""
+        n_groups = len(self.group_names)
+        return pd.DataFrame(
+            {
+                "variable": np.repeat(self.variables, n_groups),
+                "group": np.tile(self.group_names, len(self.variables)),
+                "n": self.count.ravel(),
+                "n_no_answer": self.n_no_answer.ravel(),
+                "mean": self.mean.ravel(),
+                "std": self.std.ravel(),
+            }
+        )
+
+
+def get_group_moments(
+    values: np.ndarray,
+    group_codes: np.ndarray,
+    no_answer_group_codes: np.ndarray,
+    n_groups: int,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Count, no answer count, mean and sum of squared deviations of the values of
+    each group. All groups are computed in one pass per moment, the deviations are
+    taken from the group means (two-pass algorithm) for numerical stability.
+    :param values: Valid answers.
+    :param group_codes: Group index of each valid answer (-1 if not in any group).
+    :param no_answer_group_codes: Group index of each no answer.
+    """
+    grouped = group_codes >= 0
+    values = values[grouped]
+    group_codes = group_codes[grouped]
+    count = np.bincount(group_codes, minlength=n_groups)
+    n_no_answer = np.bincount(
+        no_answer_group_codes[no_answer_group_codes >= 0], minlength=n_groups
+    )
+    sums = np.bincount(group_codes, weights=values, minlength=n_groups)
+    mean = np.full(n_groups, np.nan)
+    np.divide(sums, count, out=mean, where=count > 0)
+    deviations = values - mean[group_codes]
+    m2 = np.bincount(group_codes, weights=deviations**2, minlength=n_groups)
+    return count, n_no_answer, mean, m2
+
+
+def rebin(codes: np.ndarray, counts: np.ndarray, bin_edges: np.ndarray) -> np.ndarray:
+    """Sums the counts per code (n_groups, n_codes) into bins (n_groups, n_bins)."""
+    n_bins = bin_edges.size - 1
+    bin_index = get_bin_index(codes, bin_edges)
+    in_bins = bin_index >= 0
+    rebinned = np.zeros((counts.shape[0], n_bins), dtype=counts.dtype)
+    for id_g in range(counts.shape[0]):
+        np.add.at(rebinned[id_g], bin_index[in_bins], counts[id_g, in_bins])
+    return rebinned
+
+
+class Aggregates:
+    """
+    The numbers behind the plots of one data set: the number of valid answers per
+    code and group and the moments of each variable per group. Variables without
+    code mapping are counted per distinct value. The plots are produced from the
+    aggregates only, they do not depend on the styling configuration.
+    :param group_names: Names of the groups.
+    """
+
+    def __init__(self, group_names: list[str]) -> None:
+        self.group_names = list(group_names)
+        # codes of each variable and number of answers (n_groups, n_codes)
+        self.codes: dict[str, np.ndarray] = {}
+        self.counts: dict[str, np.ndarray] = {}
+        # count, no answer count, mean, sum of squared deviations per group
+        self.moments: dict[str, tuple] = {}
+        # number of answers and no answers in all rows (including ungrouped rows)
+        self.totals: dict[str, tuple[int, int]] = {}
+
+    @property
+    def variables(self) -> list[str]:
+        return list(self.codes.keys())
+
+    def add_variable(
+        self,
+        variable: str,
+        codes: np.ndarray,
+        counts: np.ndarray,
+        moments: tuple,
+        totals: tuple[int, int],
+    ) -> None:
+        self.codes[variable] = codes
+        self.counts[variable] = counts
+        self.moments[variable] = moments
+        self.totals[variable] = totals
+
+    def update(self, other: "Aggregates") -> None:
+        """Adds the variables of other (aggregates of the same rows)."""
+        if other.group_names != self.group_names:
+            raise ValueError("Can only combine aggregates of the same groups")
+        for variable in other.variables:
+            self.add_variable(
+                variable,
+                other.codes[variable],
+                other.counts[variable],
+                other.moments[variable],
+                other.totals[variable],
+            )
+
+    def merge(self, other: "Aggregates") -> "Aggregates":
+        """
+        Aggregates of the union of the rows (other holds the aggregates of other rows
+        of the same variables). Counts per code and totals are added, the moments
+        are merged as in Statistics.merge.
+        """
+        if other.group_names != self.group_names or set(other.variables) != set(
+            self.variables
+        ):
+            raise ValueError(
+                "Can only merge aggregates of the same variables and groups"
+            )
+        variables = self.variables
+        statistics = self.get_statistics(variables).merge(
+            other.get_statistics(variables)
+        )
+        merged = Aggregates(self.group_names)
+        for id_v, variable in enumerate(variables):
+            codes = self.codes[variable]
+            counts = self.counts[variable] + 0
+            if np.array_equal(codes, other.codes[variable]):
+                counts += other.counts[variable]
+            else:
+                # variables without code mapping: counted per distinct value
+                codes = np.union1d(codes, other.codes[variable])
+                counts = np.zeros((len(self.group_names), codes.size), dtype=np.int64)
+                for aggregates in [self, other]:
+                    index = get_code_index(aggregates.codes[variable], codes)
+                    counts[:, index] += aggregates.counts[variable]
+            moments = (
+                statistics.count[id_v],
+                statistics.n_no_answer[id_v],
+                statistics.mean[id_v],
+                statistics.m2[id_v],
+            )
+            totals = (
+                self.totals[variable][0] + other.totals[variable][0],
+                self.totals[variable][1] + other.totals[variable][1],
+            )
+            merged.add_variable(variable, codes, counts, moments, totals)
+        return merged
+
+    def get_statistics(self, variables: list[str]) -> Statistics:
+        statistics = Statistics(variables, self.group_names)
+        for id_v, variable in enumerate(variables):
+            (
+                statistics.count[id_v],
+                statistics.n_no_answer[id_v],
+                statistics.mean[id_v],
+                statistics.m2[id_v],
+            ) = self.moments[variable]
+        return statistics
+
+    def get_shares(self, variables: list[str], codes: list) -> np.ndarray:
+        """
+        Share of the valid answers with one of the codes for each variable and
+        group, shape (n_variables, n_groups). NaN if a group has no answers.
+        """
+        shares = np.full((len(variables), len(self.group_names)), np.nan)
+        for id_v, variable in enumerate(variables):
+            counts = self.counts[variable]
+            selected = counts[:, np.isin(self.codes[variable], codes)].sum(axis=1)
+            total = counts.sum(axis=1)
+            np.divide(selected, total, out=shares[id_v], where=total > 0)
+        return shares
+
+    def get_fingerprint(self, variables: list[str]) -> str:
+        """Fingerprint of the aggregates of the given variables."""
+        items = []
+        for variable in variables:
+            moments = [
+                np.asarray(moment).tobytes() for moment in self.moments[variable]
+            ]
+            items += [variable, self.codes[variable].tobytes()]
+            items += [self.counts[variable].tobytes(), *moments, self.totals[variable]]
+        return fingerprint(self.group_names, *items)
+
+    def get_counts(self, variable: str, group: str) -> np.ndarray:
+        return self.counts[variable][self.group_names.index(group)]
+
+    def get_range(self, variables: list[str]) -> tuple[float, float]:
+        """
+        Smallest and largest code of the variables (the answers in all rows for
+        variables without code mapping).
+        """
+        min_value = 1000000
+        max_value = -1000000
+        for variable in variables:
+            codes = self.codes[variable]
+            if codes.size > 0:
+                min_value = min(codes.min(), min_value)
+                max_value = max(codes.max(), max_value)
+        return min_value, max_value
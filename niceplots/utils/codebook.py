@@ -1,3 +1,4 @@
+import copy
 import os
 from pathlib import Path
 
@@ -5,6 +6,7 @@ import numpy as np
 import pandas as pd
 
 from niceplots.utils.config import Configuration
+from niceplots.utils.fingerprint import fingerprint
 from niceplots.utils.nice_logger import init_logger, set_logger_level
 
 logger = init_logger(__file__)
@@ -143,6 +145,81 @@ class CodeBook:
                         f"Column {column} not unique for question block {block}. Found values: {self.codebook[self.codebook.block == block][column].drop_duplicates()}"
                     )
 
+    def select(self, blocks: list) -> "CodeBook":
+        """
+        Copy of the codebook holding the variables of the given blocks only
+        (variables that are not in any block are dropped).
+        """
+        selected = copy.copy(self)
+        selected.codebook = self.codebook[self.codebook.block.isin(blocks)]
+        selected.codebook = selected.codebook.reset_index(drop=True)
+        selected.blocks = selected.codebook.block.unique()
+        return selected
+
+    def get_fingerprint(
+        self, block: float | tuple | None = None, columns: list[str] | None = None
+    ) -> str:
+        """
+        Fingerprint of the codebook content (restricted to a block or a tuple of
+        blocks and/or columns).
+        """
+        codebook = self.codebook
+        if isinstance(block, tuple):
+            codebook = codebook[codebook.block.isin(block)]
+        elif block is not None:
+            codebook = codebook[codebook.block == block]
+        if columns is not None:
+            codebook = codebook[columns]
+        return fingerprint(codebook.to_csv(index=False))
+
+    def get_pages(self, block: float, max_variables: int | None) -> list[slice]:
+        """
+        Splits the variables of a block into pages of at most max_variables
+        variables. All pages hold about the same number of variables.
+        """
+        n_variables = int((self.codebook.block == block).sum())
+        if max_variables is None or n_variables <= max_variables:
+            return [slice(0, n_variables)]
+        n_pages = -(-n_variables // max_variables)
+        bounds = np.linspace(0, n_variables, n_pages + 1).round().astype(int)
+        return [
+            slice(start, end)
+            for start, end in zip(bounds[:-1], bounds[1:], strict=True)
+        ]
+
+    def pack_blocks(
+        self, max_variables_small: int, max_variables: int | None
+    ) -> list[tuple]:
+        """
+        Groups consecutive small blocks (at most max_variables_small variables) into
+        figures holding at most max_variables variables. Returns the blocks of each
+        figure (a single block for blocks that are not packed).
+        """
+        figures: list[tuple] = []
+        packed: list = []
+        n_packed = 0
+        for block in self.blocks[~np.isnan(self.blocks)]:
+            n_variables = int((self.codebook.block == block).sum())
+            if n_variables > max_variables_small:
+                figures.append(tuple(packed))
+                figures.append((block,))
+                packed, n_packed = [], 0
+                continue
+            if max_variables is not None and n_packed + n_variables > max_variables:
+                figures.append(tuple(packed))
+                packed, n_packed = [], 0
+            packed.append(block)
+            n_packed += n_variables
+        figures.append(tuple(packed))
+        return [blocks for blocks in figures if len(blocks) > 0]
+
+    def get_page_numbers(
+        self, block: float, max_variables: int | None
+    ) -> list[int | None]:
+        """Pages of a block (a single page None if the block is not split)."""
+        n_pages = len(self.get_pages(block, max_variables))
+        return list(range(n_pages)) if n_pages > 1 else [None]
+
     def summarize(self):
         logger.info(f"Got codebook defining {self.codebook.shape[0]} variables.")
         blocks = self.codebook.block[~self.codebook.block.isna()].unique()
@@ -171,9 +248,7 @@ def setup_codebook(
 ) -> CodeBook:
     set_logger_level(logger, config.verbosity)
 
-    path_output_codebook = Path(
-        f"{config.output_directory}/codebook_{config.output_name}.csv"
-    )
+    path_output_codebook = config.codebook_file
     codebook = CodeBook(config, path_output_codebook)
 
     # check if there is already a codebook in the output directory
@@ -189,7 +264,4 @@ def setup_codebook(
     if write_codebook:
         codebook.write_output_codebook()
     logger.info("Finished setting up nice-plots codebook.")
-
-    # get new values from codebook to add to config
-    config.codebook_file = codebook.path_codebook
     return codebook
@@ -0,0 +1,79 @@
+import json
+import os
+import shutil
+import uuid
+from pathlib import Path
+
+import numpy as np
+
+from niceplots.utils.nice_logger import init_logger
+
+logger = init_logger(__file__)
+
+# increase whenever the layout of the stores changes (older stores are ignored)
+COLUMN_STORE_VERSION = 1
+
+# file describing the columns of a store
+META_FILE = "columns.json"
+
+
+def get_small_dtype(values: np.ndarray) -> np.dtype:
+    """
+    Smallest integer type holding the values if they are all integral (codes),
+    else the type of the values.
+    """
+    if values.dtype.kind in "iub":
+        finite = True
+    elif values.dtype.kind == "f":
+        finite = bool(np.isfinite(values).all())
+    else:
+        return values.dtype
+    if values.size == 0 or not finite or not (values == np.round(values)).all():
+        return values.dtype
+    for dtype in [np.int8, np.int16, np.int32]:
+        info = np.iinfo(dtype)
+        if info.min <= values.min() and values.max() <= info.max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def write_columns(path: Path, columns: dict[str, np.ndarray], meta: dict) -> str:
+    """
+    Writes the columns as .npy files to the directory path (replacing an existing
+    store) and returns the id of the store. The store is written to a temporary
+    directory first such that readers never see a partial store.
+    """
+    store_id = uuid.uuid4().hex
+    path_tmp = Path(f"{path}.{os.getpid()}.tmp")
+    shutil.rmtree(path_tmp, ignore_errors=True)
+    path_tmp.mkdir(parents=True)
+    for id_c, values in enumerate(columns.values()):
+        np.save(path_tmp / f"{id_c}.npy", values, allow_pickle=False)
+    meta = dict(
+        meta, version=COLUMN_STORE_VERSION, id=store_id, columns=list(columns.keys())
+    )
+    with open(path_tmp / META_FILE, "w") as f:
+        json.dump(meta, f)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(path_tmp, path)
+    return store_id
+
+
+def read_columns(path: Path) -> tuple[dict[str, np.ndarray], dict] | None:
+    """
+    Opens the columns of a store memory-mapped (read-only, pages are only read
+    when accessed and shared between processes). Returns None if there is no
+    store of the current version.
+    """
+    try:
+        with open(Path(path) / META_FILE) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get("version") != COLUMN_STORE_VERSION:
+        return None
+    columns = {
+        name: np.load(Path(path) / f"{id_c}.npy", mmap_mode="r")
+        for id_c, name in enumerate(meta["columns"])
+    }
+    return columns, meta
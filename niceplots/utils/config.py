@@ -1,14 +1,20 @@
+import json
 import os
+import shutil
 from pathlib import Path
 from typing import Dict
 
 import yaml
-from matplotlib.font_manager import FontProperties
 
+from niceplots.utils.engine import ENGINES
+from niceplots.utils.fingerprint import fingerprint
 from niceplots.utils.nice_logger import init_logger, set_logger_level
 
 logger = init_logger(__file__)
 
+# environment variable overriding the cache directory
+CACHE_VARIABLE = "NICE_PLOTS_CACHE"
+
 
 class ConfigBase:
     def update(self, config_dict: Dict) -> None:
@@ -34,6 +40,23 @@ class DataConfiguration(ConfigBase):
         self.no_answer_code = 999
         self.groups: dict = {}
         self.delimiter = ","
+        self.engine = "pandas"
+        # build the aggregates from a stratified sample of the rows of each group
+        # (number of rows per group or target error of the shares, null = all rows)
+        self.sample_size = None
+        self.sample_error = None
+        self.sample_seed = 0
+        # column identifying the responses (e.g. "ID"). When appending, new
+        # responses are detected by it instead of by their position in the table
+        self.id_column = None
+        # data sets kept in memory at once (null = all). Released data sets are
+        # read again when needed, their aggregates are kept
+        self.max_resident_data_sets = None
+        # memory of the data sets kept in memory at once in MB (null = unlimited)
+        self.max_resident_memory = None
+        # keep the checked columns of each data set as memory-mapped .npy files in
+        # the output directory. Reruns map them instead of reading the data file
+        self.column_store = False
 
     def update(self, config_dict: Dict) -> None:
         for key, value in config_dict.items():
@@ -42,12 +65,81 @@ class DataConfiguration(ConfigBase):
                     value = {"nice_plots_default_group": "True"}
             setattr(self, key, value)
 
+    def check(self) -> None:
+        if self.engine not in ENGINES:
+            raise ValueError(
+                f"Data engine {self.engine} is unknown. Choose one of {list(ENGINES.keys())}"
+            )
+        if self.sample_size is not None and (
+            not isinstance(self.sample_size, int) or self.sample_size < 1
+        ):
+            raise ValueError(
+                f"sample_size must be a positive integer or null, got {self.sample_size}"
+            )
+        if self.id_column is not None and not isinstance(self.id_column, str):
+            raise ValueError(
+                f"id_column must be the name of a column or null, got {self.id_column}"
+            )
+        if self.sample_error is not None and (
+            not isinstance(self.sample_error, (int, float))
+            or not 0 < self.sample_error < 0.5
+        ):
+            raise ValueError(
+                f"sample_error must be a number between 0 and 0.5 or null, got {self.sample_error}"
+            )
+        if not isinstance(self.column_store, bool):
+            raise ValueError(
+                f"column_store must be true or false, got {self.column_store}"
+            )
+        for key in ["max_resident_data_sets", "max_resident_memory"]:
+            value = getattr(self, key)
+            if value is not None and (not isinstance(value, int) or value < 1):
+                raise ValueError(
+                    f"{key} must be a positive integer or null, got {value}"
+                )
+
 
 class PlottingConfiguration(ConfigBase):
     def __init__(self) -> None:
         self.format = "pdf"
         self.nbins = 5
         self.unit = ""
+        # blocks with more variables are split into several plots
+        self.max_variables_per_page = 30
+        # consecutive blocks with at most this many variables are packed into one
+        # figure (0 disables packing)
+        self.max_variables_small_block = 0
+        # drafts (set on the command line) are rendered fast at low resolution from
+        # a stratified sample with at most this many rows per group
+        self.draft = False
+        self.draft_rows_per_group = 200
+
+    def check(self) -> None:
+        if self.max_variables_per_page is not None and (
+            not isinstance(self.max_variables_per_page, int)
+            or self.max_variables_per_page < 1
+        ):
+            raise ValueError(
+                f"max_variables_per_page must be a positive integer or null, got {self.max_variables_per_page}"
+            )
+        if (
+            not isinstance(self.max_variables_small_block, int)
+            or self.max_variables_small_block < 0
+        ):
+            raise ValueError(
+                f"max_variables_small_block must be a non-negative integer, got {self.max_variables_small_block}"
+            )
+        if (
+            not isinstance(self.draft_rows_per_group, int)
+            or self.draft_rows_per_group < 1
+        ):
+            raise ValueError(
+                f"draft_rows_per_group must be a positive integer, got {self.draft_rows_per_group}"
+            )
+
+
+# engines rendering the barplots
+BARPLOT_RENDERERS = ("matplotlib", "svg")
 
 
 class BarplotsConfiguration(ConfigBase):
@@ -55,6 +147,7 @@ class BarplotsConfiguration(ConfigBase):
         self.color_scheme = "RdYlGn"
         self.text_color = "black"
         self.invert = False
+        self.renderer = "matplotlib"
         self.layout = {
             "width_question": 2,
             "width_groups": 1,
@@ -91,7 +184,16 @@ class BarplotsConfiguration(ConfigBase):
             "size": 12,  # in points
         }
 
+    def check(self) -> None:
+        if self.renderer not in BARPLOT_RENDERERS:
+            raise ValueError(
+                f"Barplot renderer {self.renderer} is unknown. Choose one of {list(BARPLOT_RENDERERS)}"
+            )
+
     def make_fonts(self) -> None:
+        # imported here such that matplotlib is only loaded when plotting
+        from matplotlib.font_manager import FontProperties
+
         self.font_legend = FontProperties(**self.font_legend)
         self.font_questions = FontProperties(**self.font_questions)
         self.font_groups = FontProperties(**self.font_groups)
@@ -166,9 +268,40 @@ class HistogramsConfiguration(ConfigBase):
 
 class TimelinesConfiguration(ConfigBase):
     def __init__(self) -> None:
-        self.dist = 0.6
-        self.height = 3.0
-        self.colors = ["blue", "red"]
+        self.colors = ["C0", "C1", "C2", "C3", "C4"]
+        # codes whose share of the answers is plotted instead of the mean
+        # (e.g. [4, 5] for the share of agreeing answers)
+        self.shares: list | None = None
+        self.layout = {
+            "width_question": 2,
+            "width_plot": 5.0,
+            "width_pad": 0.2,
+            "height_question": 1.5,
+            "height_rel_pad_questions": 0.3,
+        }
+        self.font_legend = {
+            "family": "sans-serif",
+            "style": "normal",
+            "size": 12,  # in points
+        }
+        self.font_questions = {
+            "family": "sans-serif",
+            "style": "normal",
+            "size": 12,  # in points
+        }
+        self.font_ticks = {
+            "family": "sans-serif",
+            "style": "normal",
+            "size": 8,  # in points
+        }
+
+    def check(self) -> None:
+        if self.shares is not None and (
+            not isinstance(self.shares, list) or len(self.shares) == 0
+        ):
+            raise ValueError(
+                f"timelines shares must be a non-empty list of codes or null, got {self.shares}"
+            )
 
 
 class Configuration:
@@ -181,6 +314,7 @@ class Configuration:
         output_directory: Path | None = None,
         output_format: str = "pdf",
         cache_directory: Path = Path("~/.cache/nice-plots"),
+        draft: bool = False,
     ) -> None:
         logger.info("Initializing nice-plots configuration.")
 
@@ -198,8 +332,13 @@ class Configuration:
         self.output_directory = output_directory
         self.verbosity = verbosity
         self.cache_directory = cache_directory
+        # copies of the codebook and the data in the output directory (set here
+        # such that the configuration is not modified once plotting started)
         self.codebook_file = Path("")
         self.data_file = Path("")
+        if output_directory is not None:
+            self.codebook_file = Path(f"{output_directory}/codebook_{output_name}.csv")
+            self.data_file = Path(f"{output_directory}/data_{output_name}.xlsx")
 
         if config_path is not None:
             # initialize using config file
@@ -216,7 +355,8 @@ class Configuration:
             self.barplots.update(config_dict["barplots"])
             self.lineplots.update(config_dict["lineplots"])
             self.histograms.update(config_dict["histograms"])
-            # self.timelines.update(config_dict["timelines"])
+            # older configuration files have no timelines section
+            self.timelines.update(config_dict.get("timelines", {}))
 
             logger.info(
                 f"Initializing configuration instance using configuration file in {config_path}"
@@ -224,6 +364,11 @@ class Configuration:
         else:
             logger.debug("Initializing configuration instance using default values")
 
+        self.plotting.draft = draft
+        if draft:
+            # drafts are always rendered by matplotlib as low resolution png
+            self.plotting.format = "png"
+
         self.sub_attrs = [
             "data",
             "plotting",
@@ -247,6 +392,38 @@ class Configuration:
     def make_fonts(self) -> None:
         self.barplots.make_fonts()
 
+    def get_fingerprint(self, sections: list[str] | None = None) -> str:
+        """Fingerprint of the configuration options (of the given sections only)."""
+        if sections is None:
+            sections = self.sub_attrs
+        # FontProperties are represented by their fontconfig pattern
+        content = [
+            json.dumps(vars(getattr(self, section)), sort_keys=True, default=str)
+            for section in sections
+        ]
+        return fingerprint(*sections, *content)
+
+    def get_plot_path(
+        self,
+        plot_name: str,
+        block: int | tuple,
+        data_label: str | None = None,
+        page: int | None = None,
+    ) -> Path:
+        """
+        Path of the output file of a plot. The data label is only added if given
+        (required if there are multiple data sets), the page only for blocks split
+        into several plots. Plots of several blocks are named after all blocks.
+        """
+        blocks = block if isinstance(block, tuple) else (block,)
+        name = "-".join(str(int(b)) for b in blocks)
+        suffix = "" if data_label is None else f"_{data_label}"
+        if page is not None:
+            suffix = f"_page{page + 1}{suffix}"
+        return Path(
+            f"{self.output_directory}/{self.output_name}_{plot_name}_{name}{suffix}.{self.plotting.format}"
+        )
+
     def write_output_config(self) -> None:
         config_dict = {}
         config_dict["data"] = vars(self.data)
@@ -273,13 +450,24 @@ class Configuration:
     def check_config(self) -> None:
         for attr in self.sub_attrs:
             getattr(self, attr).check()
+        if (
+            self.barplots.renderer == "svg"
+            and self.plotting.format != "svg"
+            and not self.plotting.draft
+        ):
+            raise ValueError(
+                f"The svg barplot renderer requires the svg output format, got {self.plotting.format}"
+            )
 
 
 def get_cache(clear_cache: bool) -> Path:
-    cache_directory = Path(os.path.expanduser("~/.cache/nice-plots"))
+    """Cache directory (NICE_PLOTS_CACHE if set, else ~/.cache/nice-plots)."""
+    cache_directory = Path(
+        os.environ.get(CACHE_VARIABLE, os.path.expanduser("~/.cache/nice-plots"))
+    )
     if (os.path.exists(cache_directory)) & clear_cache:
         logger.warning("Resetting cache")
-        os.rmdir(cache_directory)
+        shutil.rmtree(cache_directory)
     cache_directory.mkdir(parents=True, exist_ok=True)
     logger.info(f"Using cache in: {cache_directory}")
     return cache_directory
@@ -301,7 +489,14 @@ def setup_config(
     clear_cache: bool,
     write_config: bool = False,
     full_rerun: bool = True,
+    make_fonts: bool = True,
+    draft: bool = False,
 ) -> Configuration:
+    """
+    :param make_fonts: If False the fonts are not converted to matplotlib
+    FontProperties (not needed if nothing is plotted).
+    :param draft: Render fast low resolution previews (see PlottingConfiguration).
+    """
     set_logger_level(logger, verbosity)
 
     path_cache = get_cache(clear_cache)
@@ -321,10 +516,12 @@ def setup_config(
         path_output_dir,
         output_format,
         path_cache,
+        draft,
     )
     if write_config:
         config.write_output_config()
 
-    config.make_fonts()
+    if make_fonts:
+        config.make_fonts()
     logger.info("Finished setting up nice-plots configuration.")
     return config
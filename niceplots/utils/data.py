@@ -1,162 +1,1282 @@
+import ast
+import copy
+import hashlib
+import importlib.util
+import io
 import os
+import pickle
+import shutil
+from collections import OrderedDict
+from functools import partial
 from pathlib import Path
-from typing import List, Tuple
+from typing import Any, Callable, Iterator, List, Tuple
 
+import numpy as np
 import pandas as pd
-from pandas.api.types import is_numeric_dtype
 
+from niceplots.utils.aggregate import (
+    Aggregates,
+    Statistics,
+    count_per_group,
+    get_code_index,
+    get_group_moments,
+)
 from niceplots.utils.codebook import CodeBook
+from niceplots.utils.column_store import get_small_dtype, read_columns, write_columns
 from niceplots.utils.config import Configuration
+from niceplots.utils.engine import (
+    DataEngine,
+    PandasEngine,
+    get_engine,
+    get_numeric_codes,
+    get_usecols,
+)
+from niceplots.utils.fingerprint import fingerprint
+from niceplots.utils.group_filter import GroupFilter
 from niceplots.utils.nice_logger import init_logger, set_logger_level
+from niceplots.utils.sampling import POPULATION_COLUMN, get_sample_size, read_sample
 
 logger = init_logger(__file__)
 
+# codebook columns that define the variables (the others are styling options)
+DATA_CODEBOOK_COLUMNS = ["variable", "value_map", "missing_label"]
+
+# columns of a data set that are memory-mapped from its column store
+MAPPED_ATTRIBUTES = ["frame", "group_codes", "valid_masks", "no_answer_masks"]
+
+# bytes before the end of a data table that must be unchanged for rows to be appended
+APPEND_CHECK_BYTES = 1 << 16
+
+# column stores holding the rows appended to a data table in separate runs that are
+# kept before they are combined into one store
+MAX_APPEND_CHUNKS = 16
+
 
 class Data:
     def __init__(
         self,
-        df: pd.DataFrame,
+        df: Any,
         name: str,
         groups: dict,
         variables: pd.Series,
         no_answer_code: int,
         from_source: bool = False,
+        engine: DataEngine | None = None,
+        group_filter: GroupFilter | None = None,
     ) -> None:
         self.name = name
         self.groups = groups
+        self.group_names = list(groups.keys())
         self.variables = variables
         self.no_answer_code = no_answer_code
-        self.data = df.to_frame() if isinstance(df, pd.Series) else df
+        self.engine = PandasEngine() if engine is None else engine
+        df = df.to_frame() if isinstance(df, pd.Series) else df
+        self.frame = self.engine.from_pandas(df) if isinstance(df, pd.DataFrame) else df
+        # fingerprints of the data columns (computed on demand)
+        self._column_fingerprints: dict[str, str] = {}
+        # answer masks of the codebook variables (computed by check)
+        self.valid_masks: dict[str, np.ndarray] = {}
+        self.no_answer_masks: dict[str, np.ndarray] = {}
+        # code mappings of the codebook variables (set by check)
+        self.value_maps: dict[str, dict | None] = {}
+        # aggregates of the variables (computed on demand)
+        self.aggregates = Aggregates(self.group_names)
+        # path and id of the column store the data set is mapped from
+        self.column_store: tuple[Path, str] | None = None
 
         if from_source:
-            self.preprocess()
+            self.preprocess(
+                GroupFilter(groups) if group_filter is None else group_filter
+            )
+        else:
+            self.readin_groups()
+        # rows per group in the full data table (more than group_counts if the data
+        # set is a sample)
+        self.population_counts = self.get_population_counts()
+
+    @classmethod
+    def from_column_store(
+        cls,
+        path: Path,
+        store_id: str,
+        name: str,
+        groups: dict,
+        codebook: CodeBook,
+        no_answer_code: int,
+        engine: DataEngine | None = None,
+    ) -> "Data":
+        """
+        Data set mapped from a column store written by write_column_store. The
+        store holds the checked columns and masks, so the data set is not
+        preprocessed or checked again.
+        """
+        data = cls.__new__(cls)
+        data.name = name
+        data.groups = groups
+        data.group_names = list(groups.keys())
+        data.variables = codebook.codebook.variable
+        data.no_answer_code = no_answer_code
+        data.engine = PandasEngine() if engine is None else engine
+        data._column_fingerprints = {}
+        data.value_maps = get_value_maps(codebook)
+        data.aggregates = Aggregates(data.group_names)
+        data.map_column_store(path, store_id)
+        data.group_counts = np.bincount(
+            data.group_codes[data.group_codes >= 0], minlength=len(data.group_names)
+        )
+        data.population_counts = data.get_population_counts()
+        return data
+
+    def __getstate__(self) -> dict:
+        """
+        Data sets mapped from a column store are pickled by reference, such that
+        cached data sets are loaded without reading their columns.
+        """
+        state = self.__dict__.copy()
+        if self.column_store is not None:
+            for attribute in MAPPED_ATTRIBUTES:
+                state.pop(attribute)
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        """Maps the columns of data sets pickled by reference again."""
+        self.__dict__.update(state)
+        if "frame" not in state:
+            self.map_column_store(*self.column_store)
 
-    def preprocess(self):
+    def write_column_store(self, path: Path, key: str) -> None:
+        """
+        Writes the columns used by nice-plots (codes as smallest integer type), the
+        group codes and the masks as .npy files that can be memory-mapped.
+        :param key: Fingerprint of everything else the data set depends on
+        (configuration and codebook). Stores with another key are not used.
+        """
+        frame_columns = self.engine.get_columns(self.frame)
+        value_columns = [
+            column
+            for column in list(self.variables) + [POPULATION_COLUMN]
+            if column in frame_columns
+        ]
+        columns = {"group_codes": np.asarray(self.group_codes)}
+        for column in value_columns:
+            values = self.engine.get_values(self.frame, column)
+            columns[f"values:{column}"] = values.astype(get_small_dtype(values))
+        for variable in self.valid_masks:
+            columns[f"valid:{variable}"] = self.valid_masks[variable]
+            columns[f"no_answer:{variable}"] = self.no_answer_masks[variable]
+        meta = {
+            "key": key,
+            "name": self.name,
+            "group_names": self.group_names,
+            "value_columns": value_columns,
+            "variables": list(self.valid_masks),
+        }
+        self.column_store = (path, write_columns(path, columns, meta))
+        logger.info(f"Data Object {self.name}: Wrote column store to {path}")
+
+    def map_column_store(self, path: Path, store_id: str) -> None:
+        stored = read_columns(path)
+        if stored is None or stored[1]["id"] != store_id:
+            raise ValueError(
+                f"Data Object {self.name}: Column store {path} was removed or replaced"
+            )
+        columns, meta = stored
+        group_labels = np.array(self.group_names + [None], dtype=object)
+        df = pd.DataFrame(
+            {
+                **{
+                    column: columns[f"values:{column}"]
+                    for column in meta["value_columns"]
+                },
+                "nice_plots_group": group_labels[columns["group_codes"]],
+            },
+            copy=False,
+        )
+        self.frame = self.engine.from_pandas(df)
+        self.group_codes = columns["group_codes"]
+        self.valid_masks = {v: columns[f"valid:{v}"] for v in meta["variables"]}
+        self.no_answer_masks = {v: columns[f"no_answer:{v}"] for v in meta["variables"]}
+        self.column_store = (path, store_id)
+
+    @property
+    def data(self) -> pd.DataFrame:
+        return self.engine.to_pandas(self.frame)
+
+    def preprocess(self, group_filter: GroupFilter):
+        columns = self.engine.get_columns(self.frame)
         # check that all variables that are in the codebook are also in the data
-        if not set(self.variables).issubset(set(self.data.columns)):
-            missing_vars = set(self.variables) - set(self.data.columns)
+        if not set(self.variables).issubset(set(columns)):
+            missing_vars = set(self.variables) - set(columns)
             raise ValueError(
                 f"Data Object {self.name}: Did not find {missing_vars} in data, but they are in the codebook."
             )
         # add category column
-        if "nice_plots_group" in self.data.columns:
+        if "nice_plots_group" in columns:
             raise ValueError(
                 "Your data must not contain a column named: nice_plots_group"
             )
 
-        self.data["nice_plots_group"] = None
-        for group_name, group_string in self.groups.items():
-            try:
-                if isinstance(group_string, bool):
-                    if group_string:
-                        index_grouped = self.data.index
-                    else:
-                        index_grouped = pd.Index()
-                else:
-                    index_grouped = self.data.query(group_string).index
-            except BaseException as error:
-                raise ValueError(
-                    f"Unable to apply your group filter {group_string} named {group_name} to data {self.name}"
-                ) from error
-            self.data.loc[index_grouped, "nice_plots_group"] = group_name
+        try:
+            self.group_codes, self.group_counts = self.engine.assign_groups(
+                self.frame, group_filter
+            )
+        except ValueError as error:
+            raise ValueError(f"Data Object {self.name}: {error}") from error
+        group_labels = np.array(self.group_names + [None], dtype=object)
+        self.frame = self.engine.with_column(
+            self.frame, "nice_plots_group", group_labels[self.group_codes]
+        )
+
+    def readin_groups(self):
+        # groups were already assigned when writing the nice-plots data file
+        group_labels = self.engine.get_values(self.frame, "nice_plots_group")
+        self.group_codes = np.full(len(group_labels), -1, dtype=np.int16)
+        for id_g, group_name in enumerate(self.group_names):
+            self.group_codes[group_labels == group_name] = id_g
+        self.group_counts = np.bincount(
+            self.group_codes[self.group_codes >= 0], minlength=len(self.group_names)
+        )
+
+    def get_population_counts(self) -> np.ndarray:
+        if POPULATION_COLUMN not in self.engine.get_columns(self.frame):
+            return self.group_counts.copy()
+        population = self.engine.get_values(self.frame, POPULATION_COLUMN)
+        counts = self.group_counts.copy()
+        for id_g in range(len(self.group_names)):
+            in_group = self.group_codes == id_g
+            if in_group.any():
+                counts[id_g] = population[in_group][0]
+        return counts
+
+    def get_sampling_fractions(self) -> np.ndarray | None:
+        """
+        Fraction of the rows of each group held by the data set (None if the data
+        set holds all rows).
+        """
+        return get_sampling_fractions(self.group_counts, self.population_counts)
+
+    def compute_masks(self, codebook: CodeBook) -> None:
+        """
+        Computes for each variable in the codebook a mask of the valid answers (not
+        NaN, missing or no answer) and a mask of the no answers. All aggregations
+        use these masks.
+        """
+        drop_codes = {}
+        missing_codes = {}
+        for _, row in codebook.codebook.iterrows():
+            drop_codes[row.variable] = [self.no_answer_code, row.missing_label]
+            missing_codes[row.variable] = get_numeric_codes([row.missing_label])
+        self.valid_masks = self.engine.get_masks(self.frame, drop_codes)
+        self.aggregates = Aggregates(self.group_names)
+        self.value_maps = get_value_maps(codebook)
+        self.no_answer_masks = {}
+        for variable, missing in missing_codes.items():
+            values = self.engine.get_values(self.frame, variable)
+            # a missing code equal to the no answer code counts as missing
+            self.no_answer_masks[variable] = (values == self.no_answer_code) & ~np.isin(
+                values, missing
+            )
+
+    def get_group_mask(self, group: str) -> np.ndarray:
+        return self.group_codes == self.group_names.index(group)
+
+    def get_values(self, variable: str, group: str | None = None) -> np.ndarray:
+        """Valid answers of a variable (restricted to a group)."""
+        mask = self.valid_masks[variable]
+        if group is not None:
+            mask = mask & self.get_group_mask(group)
+        return self.engine.get_values(self.frame, variable)[mask]
+
+    def get_answers(self, variable: str) -> tuple[np.ndarray, np.ndarray]:
+        """Valid answers of a variable and the group codes of the corresponding rows."""
+        mask = self.valid_masks[variable]
+        values = self.engine.get_values(self.frame, variable)[mask]
+        return values, self.group_codes[mask]
+
+    def get_aggregates(self, variables: list[str]) -> Aggregates:
+        """
+        Aggregates of the variables. Variables that were not aggregated yet are
+        aggregated in one pass over their valid answers.
+        """
+        n_groups = len(self.group_names)
+        for variable in variables:
+            if variable in self.aggregates.codes:
+                continue
+            values, group_codes = self.get_answers(variable)
+            value_map = self.value_maps[variable]
+            if value_map is None:
+                codes = np.unique(values)
+            else:
+                codes = np.asarray(list(value_map.keys()), dtype=float)
+            counts = count_per_group(
+                get_code_index(values, codes), group_codes, n_groups, codes.size
+            )
+            moments = get_group_moments(
+                values,
+                group_codes,
+                self.group_codes[self.no_answer_masks[variable]],
+                n_groups,
+            )
+            totals = (values.size, int(self.no_answer_masks[variable].sum()))
+            self.aggregates.add_variable(variable, codes, counts, moments, totals)
+        return self.aggregates
+
+    def set_aggregates(self, aggregates: Aggregates) -> None:
+        """Uses aggregates computed before (e.g. loaded from the cache)."""
+        self.aggregates.update(aggregates)
+
+    def take(self, rows: np.ndarray) -> "Data":
+        """
+        Data set holding the given rows (positions) only. The masks of the data set
+        are kept, the aggregates are computed again.
+        """
+        data = copy.copy(self)
+        data.frame = self.engine.take(self.frame, rows)
+        data.group_codes = self.group_codes[rows]
+        data.group_counts = np.bincount(
+            data.group_codes[data.group_codes >= 0], minlength=len(self.group_names)
+        )
+        data.valid_masks = {v: mask[rows] for v, mask in self.valid_masks.items()}
+        data.no_answer_masks = {
+            v: mask[rows] for v, mask in self.no_answer_masks.items()
+        }
+        data._column_fingerprints = {}
+        data.column_store = None
+        data.aggregates = Aggregates(self.group_names)
+        return data
+
+    @classmethod
+    def concat(cls, data_sets: list["Data"]) -> "Data":
+        """
+        Data set holding the rows of all data sets (set up with the same groups and
+        codebook, their frames hold the same columns). The masks of the data sets
+        are kept, the aggregates are computed again.
+        """
+        first = data_sets[0]
+        if len(data_sets) == 1:
+            return first
+        data = copy.copy(first)
+        data.frame = first.engine.concat([d.frame for d in data_sets])
+        data.group_codes = np.concatenate([d.group_codes for d in data_sets])
+        data.group_counts = sum(d.group_counts for d in data_sets)
+        data.population_counts = sum(d.population_counts for d in data_sets)
+        data.valid_masks = {
+            v: np.concatenate([d.valid_masks[v] for d in data_sets])
+            for v in first.valid_masks
+        }
+        data.no_answer_masks = {
+            v: np.concatenate([d.no_answer_masks[v] for d in data_sets])
+            for v in first.no_answer_masks
+        }
+        data._column_fingerprints = {}
+        data.column_store = None
+        data.aggregates = Aggregates(first.group_names)
+        return data
+
+    def get_sample(self, n_rows_per_group: int, seed: int = 0) -> "Data":
+        """
+        Stratified sample of the data set holding at most n_rows_per_group rows of
+        each group (rows that are not in any group are dropped). The masks of the
+        data set are kept such that the sample is aggregated like the full data.
+        """
+        rng = np.random.default_rng(seed)
+        rows = [np.array([], dtype=np.intp)]
+        for id_g in range(len(self.group_names)):
+            rows_group = np.flatnonzero(self.group_codes == id_g)
+            if rows_group.size > n_rows_per_group:
+                rows_group = rng.choice(rows_group, n_rows_per_group, replace=False)
+            rows.append(rows_group)
+        return self.take(np.sort(np.concatenate(rows)))
+
+    def get_statistics(self, variables: list[str]) -> Statistics:
+        """
+        Count, no answer count, mean and standard deviation of the valid answers of
+        each variable and group.
+        """
+        return self.get_aggregates(variables).get_statistics(variables)
+
+    def get_n_no_answers(self, variable: str, group: str | None = None) -> int:
+        mask = self.no_answer_masks[variable]
+        if group is not None:
+            mask = mask & self.get_group_mask(group)
+        return int(mask.sum())
 
     def check(self, codebook: CodeBook):
         # check that values in each variable agree with the mapping in the codebook
         for _, row in codebook.codebook.iterrows():
             # TODO: at the moment restrict to numerical values
-            if not is_numeric_dtype(self.data[row.variable]):
+            if not self.engine.is_numeric(self.frame, row.variable):
                 raise ValueError(
                     f"Data Object {self.name}: Data is not numeric for variable {row.variable}. Nice-plots requires numberic data!"
                 )
-            if row.value_map is None:
-                # require numerical values
-                if not is_numeric_dtype(self.data[row.variable]):
-                    raise ValueError(
-                        f"Data Object {self.name}: No code mapping provided for variable {row.variable} but the data is not numeric!"
-                    )
-            else:
-                mapping = eval(row.value_map)
-                data_test = self.data[row.variable]
-                data_test = data_test[
-                    ~(
-                        data_test.isna()
-                        | (data_test == self.no_answer_code)
-                        | (data_test == row.missing_label)
-                    )
-                ]
-                if data_test.map(mapping).isna().sum() > 0:
+        self.compute_masks(codebook)
+
+        for _, row in codebook.codebook.iterrows():
+            mapping = get_value_map(row.value_map)
+            if mapping is not None:
+                data_test = self.get_values(row.variable)
+                if (~np.isin(data_test, list(mapping.keys()))).sum() > 0:
                     raise ValueError(
                         f"Data Object {self.name}: Could not apply code mapping {mapping} to data for variable {row.variable}. Is your data out of range?"
                     )
 
+    def get_fingerprint(self, variables: list[str] | None = None) -> str:
+        """
+        Fingerprint of the data content (restricted to the given variables).
+        Values are compared as floats such that the fingerprint does not depend on
+        the engine or on whether the data was read from the source or the
+        nice-plots data file.
+        """
+        if variables is None:
+            variables = list(self.variables)
+        for column in variables:
+            if column not in self._column_fingerprints:
+                values = np.array(
+                    self.engine.get_values(self.frame, column), dtype=float
+                )
+                # use a unique bit pattern for NaN
+                values[np.isnan(values)] = np.nan
+                self._column_fingerprints[column] = fingerprint(
+                    column, values.tobytes()
+                )
+        return fingerprint(
+            self.name,
+            [self._column_fingerprints[column] for column in variables],
+            self.group_names,
+            self.group_codes.tobytes(),
+            self.population_counts.tobytes(),
+        )
+
+    def get_n_bytes(self) -> int:
+        """Memory used by the data table, the group codes and the answer masks."""
+        masks = list(self.valid_masks.values()) + list(self.no_answer_masks.values())
+        return (
+            self.engine.get_n_bytes(self.frame)
+            + self.group_codes.nbytes
+            + sum(mask.nbytes for mask in masks)
+        )
+
     def summarize(self):
         logger.info(
-            f"Data Object {self.name}: Data has {self.data.shape[0]} rows. They break down in the following categories:"
+            f"Data Object {self.name}: Data has {len(self.group_codes)} rows. They break down in the following categories:"
         )
-        for group_name in self.groups.keys():
-            filter_condition = f'nice_plots_group == "{group_name}"'
-            logger.info(
-                f"\t Group {group_name}: {self.data.query(filter_condition).nice_plots_group.count()} rows"
-            )
-        if self.data.nice_plots_group.isna().any():
+        for group_name, count in zip(self.group_names, self.group_counts, strict=True):
+            logger.info(f"\t Group {group_name}: {count} rows")
+        n_ungrouped = (self.group_codes < 0).sum()
+        if n_ungrouped > 0:
             logger.warning(
-                f"{self.data.nice_plots_group.isna().sum()} rows are not associated to any group -> Not used in plots."
+                f"{n_ungrouped} rows are not associated to any group -> Not used in plots."
             )
 
 
+class DataSummary:
+    """
+    Aggregates of a data set and the number of rows per group, without the rows.
+    Provides the part of the Data interface used by the plots, such that plots
+    are rendered without reading the data set.
+    :param group_counts: Rows per group held by the data set.
+    :param population_counts: Rows per group in the full data table (more than
+    group_counts if the data set is a sample).
+    """
+
+    def __init__(
+        self,
+        aggregates: Aggregates,
+        group_counts: np.ndarray,
+        population_counts: np.ndarray,
+    ) -> None:
+        self.aggregates = aggregates
+        self.group_names = aggregates.group_names
+        self.group_counts = group_counts
+        self.population_counts = population_counts
+
+    def get_aggregates(self, variables: list[str]) -> Aggregates:
+        missing = [v for v in variables if v not in self.aggregates.codes]
+        if len(missing) > 0:
+            raise ValueError(f"Variables {missing} were not aggregated")
+        return self.aggregates
+
+    def get_statistics(self, variables: list[str]) -> Statistics:
+        return self.get_aggregates(variables).get_statistics(variables)
+
+    def get_sampling_fractions(self) -> np.ndarray | None:
+        return get_sampling_fractions(self.group_counts, self.population_counts)
+
+
 class DataCollection:
+    """
+    Lazy mapping from data labels to data sets. Data sets read from files are only
+    read when they are accessed (by label or as attribute) and at most
+    max_resident_data_sets data sets (or max_resident_memory MB) are kept in
+    memory. The least recently used data sets are released first and read again
+    when they are accessed. Their aggregates are kept, such that statistics and
+    plots do not need to read them again. Data sets added as objects are always
+    kept in memory.
+    """
+
     def __init__(
         self, config: Configuration, codebook: CodeBook, path_output_data: Path
     ) -> None:
+        self.config = config
         self.delimiter = config.data.delimiter
         self.groups = config.data.groups
         self.no_answer_code = config.data.no_answer_code
         self.path_data = path_output_data
+        self.codebook = codebook
         self.variables = codebook.codebook.variable
+        self.engine = get_engine(config.data.engine)
+        # compiled once and shared by all data sets
+        self.group_filter = GroupFilter(self.groups)
+        self.sample_size = get_sample_size(
+            config.data.sample_size, config.data.sample_error
+        )
+        self.sample_seed = config.data.sample_seed
+        self.max_resident_data_sets = config.data.max_resident_data_sets
+        self.max_resident_bytes = get_max_resident_bytes(config)
         self.data_object_names: List = []
+        # functions reading (and checking) the data sets that can be released
+        self._loaders: dict[str, Callable[[], Data]] = {}
+        # data sets in memory (least recently used first) and their size in bytes
+        self._resident: OrderedDict[str, Data] = OrderedDict()
+        self._resident_bytes: dict[str, int] = {}
+        # aggregates, fingerprints and group counts of the data sets (kept when
+        # released)
+        self._aggregates: dict[str, Aggregates] = {}
+        self._fingerprints: dict[str, str] = {}
+        self._counts: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+
+    def __getattr__(self, name: str) -> Data:
+        """Data sets are also accessible as attributes (e.g. data_collection.data)."""
+        if name in self.__dict__.get("data_object_names", []):
+            return self[name]
+        raise AttributeError(
+            f"{type(self).__name__} object has no attribute or data set {name}"
+        )
+
+    def __getitem__(self, name: str) -> Data:
+        """
+        Data set of the given label. Released data sets are loaded again, which may
+        release the least recently used ones.
+        """
+        if name in self._resident:
+            self._resident.move_to_end(name)
+            return self._resident[name]
+        if name not in self._loaders:
+            raise KeyError(f"Data Collection holds no data labeled {name}")
+        data = self._load(name)
+        self._resident[name] = data
+        self._resident_bytes[name] = data.get_n_bytes()
+        self._release_least_recently_used()
+        return data
+
+    def __iter__(self) -> Iterator[str]:
+        """Labels of the data sets."""
+        return iter(self.data_object_names)
+
+    def __len__(self) -> int:
+        """Number of data sets (resident or not)."""
+        return len(self.data_object_names)
+
+    def __contains__(self, name: object) -> bool:
+        """Whether the collection holds a data set with the given label."""
+        return name in self.data_object_names
+
+    def _load(self, name: str) -> Data:
+        data = self._loaders[name]()
+        if name in self._aggregates:
+            data.set_aggregates(self._aggregates[name])
+        else:
+            data.summarize()
+        # aggregates computed later are added to this object
+        self._aggregates[name] = data.aggregates
+        return data
+
+    def _release_least_recently_used(self) -> None:
+        """
+        Releases the least recently used data sets (except the most recent one)
+        until the limits are met. Data sets that cannot be read again are kept.
+        """
+        releasable = [
+            name for name in list(self._resident)[:-1] if name in self._loaders
+        ]
+        while len(releasable) > 0 and (
+            (
+                self.max_resident_data_sets is not None
+                and len(self._resident) > self.max_resident_data_sets
+            )
+            or (
+                self.max_resident_bytes is not None
+                and sum(self._resident_bytes.values()) > self.max_resident_bytes
+            )
+        ):
+            self.release(releasable.pop(0))
+
+    def release(self, name: str) -> None:
+        """
+        Removes a data set read from a file from memory (it is read again when
+        accessed). Its aggregates are kept.
+        """
+        if name in self._loaders and name in self._resident:
+            logger.debug(f"Releasing data set {name} from memory.")
+            self._resident.pop(name)
+            self._resident_bytes.pop(name)
+
+    def get_data_aggregates(self, name: str, variables: list[str]) -> Aggregates:
+        """
+        Aggregates of the variables in a data set. Only reads the data set if some
+        of the variables were not aggregated before.
+        """
+        aggregates = self._aggregates.get(name)
+        if aggregates is None or not set(variables).issubset(aggregates.variables):
+            aggregates = self[name].get_aggregates(variables)
+        return aggregates
+
+    def get_sampling_fractions(self, name: str) -> np.ndarray | None:
+        """
+        Fraction of the rows of each group held by a data set (None if it holds all
+        rows). Only reads the data set if its group counts are not known.
+        """
+        if name in self._counts:
+            return get_sampling_fractions(*self._counts[name])
+        return self[name].get_sampling_fractions()
 
     def write_output_data(self) -> None:
         with pd.ExcelWriter(self.path_data) as writer:
             for name in self.data_object_names:
-                getattr(self, name).data.to_excel(writer, sheet_name=name, index=False)
+                self[name].data.to_excel(writer, sheet_name=name, index=False)
 
     def readin_data_files(
         self, data_paths: Tuple[Path, ...], data_labels: Tuple[str, ...]
     ) -> None:
-        for path, label in zip(data_paths, data_labels):
+        for path, label in zip(data_paths, data_labels, strict=True):
             self.readin_data_file(path, label)
 
     def readin_data_file(self, path: Path, label: str) -> None:
-        df = pd.read_csv(path, sep=self.delimiter)
-        self._add_data_object(df, label, from_source=True)
+        self._add_loader(label, partial(self._read_data_file, path, label))
+
+    def _read_data_file(self, path: Path, label: str) -> Data:
+        if self.sample_size is None:
+            df = self.engine.read_csv(path, self.delimiter)
+        else:
+            df = read_sample(
+                path,
+                self.delimiter,
+                self.group_filter,
+                self.sample_size,
+                self.sample_seed,
+            )
+        return self._setup_data(df, label, True)
 
     def readin_niceplots_data_file(self, path: Path) -> None:
-        sheets = pd.read_excel(path, sheet_name=None)
-        for label, df in sheets.items():
-            self._add_data_object(df, label)
+        for label in pd.ExcelFile(path).sheet_names:
+            self._add_loader(label, partial(self._read_niceplots_data, path, label))
 
-    def _add_data_object(
-        self, df: pd.DataFrame, name: str, from_source: bool = False
-    ) -> None:
-        setattr(
-            self,
+    def _read_niceplots_data(self, path: Path, label: str) -> Data:
+        if self.config.data.column_store:
+            data = read_column_store(self.config, self.codebook, label, self.engine)
+            if data is not None:
+                return data
+        return self._setup_data(pd.read_excel(path, sheet_name=label), label, False)
+
+    def _setup_data(self, df: Any, name: str, from_source: bool) -> Data:
+        data = Data(
+            df,
             name,
-            Data(
-                df, name, self.groups, self.variables, self.no_answer_code, from_source
-            ),
+            self.groups,
+            self.variables,
+            self.no_answer_code,
+            from_source,
+            self.engine,
+            self.group_filter,
         )
+        data.check(self.codebook)
+        if self.config.data.column_store:
+            data.write_column_store(
+                get_column_store_path(self.config, name),
+                get_column_store_key(self.config, self.codebook),
+            )
+        return data
+
+    def _add_loader(self, name: str, loader: Callable[[], Data]) -> None:
+        if name in self.data_object_names:
+            raise ValueError(f"Data Collection already holds data labeled {name}")
+        self._loaders[name] = loader
         self.data_object_names.append(name)
 
+    def add_data_loader(
+        self,
+        name: str,
+        loader: Callable[[], Data],
+        data_fingerprint: str | None = None,
+        aggregates: Aggregates | None = None,
+        counts: tuple[np.ndarray, np.ndarray] | None = None,
+    ) -> None:
+        """
+        Adds a data set that is only read by the loader when accessed (and can be
+        released again).
+        :param data_fingerprint: Fingerprint of the data set if known (such that
+        get_fingerprint does not read it).
+        :param aggregates: Aggregates of the data set computed before.
+        :param counts: Rows per group of the data set and of the full data table.
+        """
+        self._add_loader(name, loader)
+        if data_fingerprint is not None:
+            self._fingerprints[name] = data_fingerprint
+        if aggregates is not None:
+            self._aggregates[name] = aggregates
+        if counts is not None:
+            self._counts[name] = counts
+
+    def add_data_object(self, data: Data) -> None:
+        if data.name in self.data_object_names:
+            raise ValueError(f"Data Collection already holds data labeled {data.name}")
+        self._resident[data.name] = data
+        self._resident_bytes[data.name] = 0
+        self._aggregates[data.name] = data.aggregates
+        self.data_object_names.append(data.name)
+
+    def get_fingerprint(self) -> str:
+        for name in self.data_object_names:
+            if name not in self._fingerprints:
+                self._fingerprints[name] = self[name].get_fingerprint()
+        return fingerprint(
+            str(self.path_data),
+            [self._fingerprints[name] for name in self.data_object_names],
+        )
+
+    def get_statistics_table(self, codebook: CodeBook) -> pd.DataFrame:
+        """Summary statistics of all variables in a block as long table."""
+        codebook_plotted = codebook.codebook[~codebook.codebook.block.isna()]
+        variables = list(codebook_plotted.variable)
+        labels = dict(
+            zip(codebook_plotted.variable, codebook_plotted.label, strict=True)
+        )
+        blocks = dict(
+            zip(codebook_plotted.variable, codebook_plotted.block, strict=True)
+        )
+        tables = []
+        for name in self.data_object_names:
+            aggregates = self.get_data_aggregates(name, variables)
+            table = aggregates.get_statistics(variables).to_frame()
+            table.insert(0, "data", name)
+            table.insert(1, "block", table.variable.map(blocks).astype(int))
+            table.insert(3, "label", table.variable.map(labels))
+            tables.append(table)
+        return pd.concat(tables, ignore_index=True)
+
+    def write_statistics(self, codebook: CodeBook, path: Path) -> None:
+        self.get_statistics_table(codebook).to_csv(path, index=False)
+
+    def get_aggregates(self, codebook: CodeBook) -> pd.DataFrame:
+        """
+        Tidy table of the numbers behind the plots with one row per data set,
+        variable, group and code: the number of answers with the code and the
+        summary statistics of the variable. Variables without code mapping are
+        counted per distinct value.
+        """
+        statistics = self.get_statistics_table(codebook)
+        statistics = statistics.set_index(["data", "variable", "group"])
+        codebook_plotted = codebook.codebook[~codebook.codebook.block.isna()]
+        tables = []
+        for name in self.data_object_names:
+            aggregates = self.get_data_aggregates(name, list(codebook_plotted.variable))
+            for _, row in codebook_plotted.iterrows():
+                value_map = get_value_map(row.value_map)
+                codes = aggregates.codes[row.variable]
+                counts = aggregates.counts[row.variable]
+                if value_map is None:
+                    code_labels = [""] * codes.size
+                else:
+                    code_labels = list(value_map.values())
+                n_groups = len(aggregates.group_names)
+                table = pd.DataFrame(
+                    {
+                        "data": name,
+                        "block": int(row.block),
+                        "variable": row.variable,
+                        "label": row.label,
+                        "group": np.repeat(aggregates.group_names, codes.size),
+                        "code": np.tile(codes, n_groups),
+                        "code_label": np.tile(
+                            np.asarray(code_labels, dtype=object), n_groups
+                        ),
+                        "count": counts.ravel(),
+                    }
+                )
+                tables.append(table)
+        aggregates = pd.concat(tables, ignore_index=True)
+        return aggregates.join(
+            statistics[["n", "n_no_answer", "mean", "std"]],
+            on=["data", "variable", "group"],
+        )
+
+    def write_aggregates(self, codebook: CodeBook, paths: list[Path]) -> pd.DataFrame:
+        """Writes the aggregates to the given paths (.csv or .parquet)."""
+        aggregates = self.get_aggregates(codebook)
+        for path in paths:
+            if str(path).endswith(".parquet"):
+                aggregates.to_parquet(path, index=False)
+            else:
+                aggregates.to_csv(path, index=False)
+            logger.info(f"Wrote aggregates to {path}")
+        return aggregates
+
     def check(self, codebook: CodeBook):
         for name in self.data_object_names:
-            getattr(self, name).check(codebook)
+            if name in self._loaders:
+                # checked when read
+                self[name]
+            else:
+                self[name].check(codebook)
+                self._aggregates[name] = self[name].aggregates
 
     def summarize(self):
         logger.info(
-            f"Got a Data Collection holding {len(self.data_object_names)} data sets"
+            f"Got a Data Collection holding {len(self.data_object_names)} data sets ({len(self._resident)} in memory)"
         )
         for name in self.data_object_names:
-            getattr(self, name).summarize()
+            if name not in self._loaders:
+                # data sets read from files are summarized when read
+                self[name].summarize()
+
+
+def get_sampling_fractions(
+    group_counts: np.ndarray, population_counts: np.ndarray
+) -> np.ndarray | None:
+    """
+    Fraction of the rows of each group held by a data set (None if it holds all
+    rows of the data table).
+    """
+    if np.array_equal(group_counts, population_counts):
+        return None
+    return group_counts / np.maximum(population_counts, 1)
+
+
+def get_max_resident_bytes(config: Configuration) -> int | None:
+    if config.data.max_resident_memory is None:
+        return None
+    return int(config.data.max_resident_memory * 2**20)
+
+
+def get_output_data_path(config: Configuration) -> Path:
+    return config.data_file
+
+
+def get_column_store_path(config: Configuration, data_label: str) -> Path:
+    return Path(f"{config.output_directory}/columns_{config.output_name}/{data_label}")
+
+
+def get_column_store_key(config: Configuration, codebook: CodeBook) -> str:
+    return fingerprint(
+        config.get_fingerprint(["data"]),
+        codebook.get_fingerprint(columns=DATA_CODEBOOK_COLUMNS),
+    )
+
+
+def read_column_store(
+    config: Configuration,
+    codebook: CodeBook,
+    data_label: str,
+    engine: DataEngine | None = None,
+) -> Data | None:
+    """
+    Maps the data set from its column store in the output directory. Returns None
+    if there is no store for the configuration and codebook.
+    """
+    path = get_column_store_path(config, data_label)
+    stored = read_columns(path)
+    if stored is None:
+        return None
+    meta = stored[1]
+    if meta["key"] != get_column_store_key(config, codebook):
+        logger.info(f"Ignoring outdated column store {path}")
+        return None
+    logger.warning(
+        f"Found already existing data labeled {data_label} in {path}. Using it instead of the data file"
+    )
+    return Data.from_column_store(
+        path,
+        meta["id"],
+        data_label,
+        config.data.groups,
+        codebook,
+        config.data.no_answer_code,
+        engine,
+    )
+
+
+def get_value_maps(codebook: CodeBook) -> dict[str, dict | None]:
+    return {
+        row.variable: get_value_map(row.value_map)
+        for _, row in codebook.codebook.iterrows()
+    }
+
+
+def get_value_map(value_map: str | None) -> dict | None:
+    """Parses the code mapping of a codebook row (None if there is no mapping)."""
+    if value_map is None or value_map == "":
+        return None
+    return ast.literal_eval(value_map)
+
+
+def get_aggregates_paths(config: Configuration) -> list[Path]:
+    """Output paths of the aggregates (parquet only if pandas can write it)."""
+    paths = [Path(f"{config.output_directory}/aggregates_{config.output_name}.csv")]
+    if any(importlib.util.find_spec(e) is not None for e in ["pyarrow", "fastparquet"]):
+        paths.append(
+            Path(f"{config.output_directory}/aggregates_{config.output_name}.parquet")
+        )
+    else:
+        logger.warning(
+            "Install pyarrow to also write the aggregates in parquet format: pip install pyarrow"
+        )
+    return paths
+
+
+def get_statistics_path(config: Configuration) -> Path:
+    return Path(f"{config.output_directory}/statistics_{config.output_name}.csv")
+
+
+def get_data_columns(codebook: CodeBook, group_filter: GroupFilter) -> set[str]:
+    """
+    Columns of a data table used by nice-plots: the variables of the codebook, the
+    columns used by the group filters and the columns added by nice-plots (such
+    that they are still found in the nice-plots data file and rejected in data
+    tables).
+    """
+    return (
+        set(codebook.codebook.variable)
+        | set(group_filter.columns)
+        | {"nice_plots_group", POPULATION_COLUMN}
+    )
+
+
+def setup_data_object(
+    config: Configuration,
+    codebook: CodeBook,
+    data_path: Path,
+    data_label: str,
+    full_rerun: bool = True,
+    group_filter: GroupFilter | None = None,
+    columns: set[str] | None = None,
+) -> Data:
+    """
+    Sets up a single data set. Uses the data stored in the nice-plots data file in
+    the output directory if it exists (unless full_rerun).
+    :param group_filter: Compiled group filters. Compiled from the config if None.
+    :param columns: Only read these columns of the data (see get_data_columns).
+    Column stores are neither read nor written as they hold all variables of the
+    codebook.
+    """
+    set_logger_level(logger, config.verbosity)
+
+    path_output_data = get_output_data_path(config)
+    engine = get_engine(config.data.engine)
+    use_column_store = config.data.column_store and columns is None
+    if use_column_store and not full_rerun:
+        data = read_column_store(config, codebook, data_label, engine)
+        if data is not None:
+            data.summarize()
+            return data
+    df = None
+    from_source = True
+    if os.path.exists(path_output_data) and not full_rerun:
+        sheets = pd.ExcelFile(path_output_data).sheet_names
+        if data_label in sheets:
+            logger.warning(
+                f"Found already existing data labeled {data_label} in {path_output_data}. Using it instead of {data_path}"
+            )
+            df = pd.read_excel(
+                path_output_data, sheet_name=data_label, usecols=get_usecols(columns)
+            )
+            from_source = False
+    sample_size = get_sample_size(config.data.sample_size, config.data.sample_error)
+    if df is None and sample_size is not None:
+        df = read_sample(
+            data_path,
+            config.data.delimiter,
+            GroupFilter(config.data.groups) if group_filter is None else group_filter,
+            sample_size,
+            config.data.sample_seed,
+            columns=columns,
+        )
+    elif df is None:
+        df = engine.read_csv(data_path, config.data.delimiter, columns)
+
+    data = Data(
+        df,
+        data_label,
+        config.data.groups,
+        codebook.codebook.variable,
+        config.data.no_answer_code,
+        from_source,
+        engine,
+        group_filter,
+    )
+    data.check(codebook)
+    data.summarize()
+    if use_column_store:
+        data.write_column_store(
+            get_column_store_path(config, data_label),
+            get_column_store_key(config, codebook),
+        )
+    return data
+
+
+class AppendState:
+    """
+    What was read of a growing data table: the aggregates of its rows (the rows
+    appended later are merged into them), the number of bytes read, a digest of
+    the bytes before that position, the ids of the responses (if
+    config.data.id_column is set) and the column stores holding the checked rows.
+    :param key: Fingerprint of everything else the data set depends on
+    (configuration and codebook). The table is read completely if it changes.
+    :param chunks: Path and id of the column stores of the rows read in earlier
+    runs (in the order of the rows).
+    """
+
+    def __init__(
+        self,
+        key: str,
+        aggregates: Aggregates,
+        size: int,
+        tail: str,
+        ids: np.ndarray | None,
+        chunks: list[tuple[Path, str]],
+    ) -> None:
+        self.key = key
+        self.aggregates = aggregates
+        self.size = size
+        self.tail = tail
+        self.ids = ids
+        self.chunks = chunks
+
+
+def get_append_state_path(
+    config: Configuration, data_path: Path, data_label: str
+) -> Path:
+    name = fingerprint(str(Path(data_path).resolve()), data_label)
+    return Path(f"{config.cache_directory}/append/{name}.pkl")
+
+
+def get_tail_digest(path: Path, size: int) -> str:
+    """Digest of the APPEND_CHECK_BYTES bytes before position size of a file."""
+    with open(path, "rb") as f:
+        f.seek(max(0, size - APPEND_CHECK_BYTES))
+        return hashlib.sha256(f.read(min(size, APPEND_CHECK_BYTES))).hexdigest()
+
+
+def read_appended_rows(
+    path: Path,
+    state: AppendState,
+    engine: DataEngine,
+    delimiter: str,
+    id_column: str | None,
+    size: int,
+) -> tuple[Any, int] | None:
+    """
+    Frame of the rows that were added to the data table (of size bytes) since the
+    state was saved and the number of bytes read. Without id_column only the bytes
+    after the rows read so far are parsed (with the header of the table), rows
+    that are not complete yet are left for the next run. Otherwise the rows whose
+    id was not read yet are selected.
+    Returns None if the table was changed otherwise (it has to be read again).
+    """
+    if id_column is not None:
+        frame = engine.read_csv(path, delimiter)
+        ids = engine.get_values(frame, id_column)
+        if not np.isin(state.ids, ids).all():
+            # responses were removed
+            return None
+        return engine.take(frame, np.flatnonzero(~np.isin(ids, state.ids))), size
+
+    if size < state.size or get_tail_digest(path, state.size) != state.tail:
+        return None
+    with open(path, "rb") as f:
+        header = f.readline()
+        start = max(state.size, len(header))
+        if state.size > 0:
+            # an empty table has no last row
+            f.seek(state.size - 1)
+            if f.read(1) != b"\n":
+                # the last row read was not complete
+                return None
+        f.seek(start)
+        rows = f.read(size - start)
+    rows = rows[: rows.rfind(b"\n") + 1]
+    return engine.read_csv(io.BytesIO(header + rows), delimiter), start + len(rows)
+
+
+def write_append_chunk(
+    config: Configuration, codebook: CodeBook, data: Data, path: Path, key: str
+) -> Data:
+    """
+    Writes the checked rows of data as column store and returns the data set
+    mapped from it.
+    """
+    data.write_column_store(path, key)
+    return Data.from_column_store(
+        *data.column_store,
+        data.name,
+        config.data.groups,
+        codebook,
+        config.data.no_answer_code,
+        data.engine,
+    )
+
+
+def read_append_chunks(
+    config: Configuration,
+    codebook: CodeBook,
+    data_label: str,
+    chunks: list[tuple[Path, str]],
+) -> list[Data] | None:
+    """Maps the rows read in earlier runs (None if a store was removed)."""
+    engine = get_engine(config.data.engine)
+    data_sets = []
+    for path, store_id in chunks:
+        stored = read_columns(path)
+        if stored is None or stored[1]["id"] != store_id:
+            return None
+        data_sets.append(
+            Data.from_column_store(
+                path,
+                store_id,
+                data_label,
+                config.data.groups,
+                codebook,
+                config.data.no_answer_code,
+                engine,
+            )
+        )
+    return data_sets
+
+
+def append_data_object(
+    config: Configuration,
+    codebook: CodeBook,
+    data_path: Path,
+    data_label: str,
+    key: str,
+    group_filter: GroupFilter | None = None,
+) -> Data:
+    """
+    Sets up a single data set from a data table that only grows (e.g. a survey that
+    is still open). Only the rows added since the last run are read, assigned to
+    groups, checked and aggregated. Their aggregates are merged into the ones of
+    the last run and the checked rows are kept as column stores in the cache
+    directory, such that the rows read before are mapped instead of read again.
+    The table is read completely the first time, if key changed or if rows were
+    modified or removed.
+    :param key: Fingerprint of the configuration and codebook entries the data set
+    depends on.
+    """
+    set_logger_level(logger, config.verbosity)
+    if get_sample_size(config.data.sample_size, config.data.sample_error) is not None:
+        raise ValueError("Sampled data sets cannot be appended to")
+    id_column = config.data.id_column
+    size = os.path.getsize(data_path)
+    engine = get_engine(config.data.engine)
+    variables = list(codebook.codebook.variable)
+
+    path_state = get_append_state_path(config, data_path, data_label)
+    path_chunks = path_state.with_suffix("")
+    state = None
+    if os.path.exists(path_state):
+        with open(path_state, "rb") as f:
+            state = pickle.load(f)
+        if state.key != key:
+            state = None
+    chunks = None
+    appended = None
+    if state is not None:
+        chunks = read_append_chunks(config, codebook, data_label, state.chunks)
+    if chunks is not None:
+        appended = read_appended_rows(
+            data_path, state, engine, config.data.delimiter, id_column, size
+        )
+
+    if appended is None:
+        logger.info(f"Aggregating all rows of {data_path}")
+        data = setup_data_object(
+            config, codebook, data_path, data_label, True, group_filter
+        )
+        aggregates = data.get_aggregates(variables)
+        ids = None if id_column is None else engine.get_values(data.frame, id_column)
+        shutil.rmtree(path_chunks, ignore_errors=True)
+        data = write_append_chunk(config, codebook, data, path_chunks / "0", key)
+        state = AppendState(
+            key,
+            aggregates,
+            size,
+            get_tail_digest(data_path, size),
+            ids,
+            [data.column_store],
+        )
+        data.aggregates = aggregates
+    else:
+        frame, size = appended
+        n_rows = engine.get_n_rows(frame)
+        logger.info(f"Appending {n_rows} new rows of {data_path} to {data_label}")
+        if n_rows > 0:
+            # only the new rows are assigned to groups, checked and aggregated
+            new_data = Data(
+                frame,
+                data_label,
+                config.data.groups,
+                codebook.codebook.variable,
+                config.data.no_answer_code,
+                True,
+                engine,
+                group_filter,
+            )
+            new_data.check(codebook)
+            state.aggregates = state.aggregates.merge(
+                new_data.get_aggregates(state.aggregates.variables)
+            )
+            if id_column is not None:
+                ids = engine.get_values(frame, id_column)
+                state.ids = np.concatenate([state.ids, ids])
+            # the stores are named by the position of their first row
+            n_rows_read = sum(len(chunk.group_codes) for chunk in chunks)
+            path_chunk = path_chunks / str(n_rows_read)
+            chunks.append(
+                write_append_chunk(config, codebook, new_data, path_chunk, key)
+            )
+            state.chunks.append(chunks[-1].column_store)
+        data = Data.concat(chunks)
+        if len(state.chunks) > MAX_APPEND_CHUNKS:
+            # combine the rows of many runs into one store
+            data.write_column_store(path_chunks / "0", key)
+            for path, _ in state.chunks[1:]:
+                shutil.rmtree(path, ignore_errors=True)
+            state.chunks = [data.column_store]
+        state.size = size
+        state.tail = get_tail_digest(data_path, size)
+        data.aggregates = state.aggregates
+
+    # only the aggregates and watermarks are kept in the state, the rows are in
+    # the column stores
+    path_state.parent.mkdir(parents=True, exist_ok=True)
+    path_tmp = Path(f"{path_state}.{os.getpid()}.tmp")
+    with open(path_tmp, "wb") as f:
+        pickle.dump(state, f)
+    os.replace(path_tmp, path_state)
+    return data
+
+
+def collect_data(
+    config: Configuration, codebook: CodeBook, *data_objects: Data
+) -> DataCollection:
+    """Combines data sets that were set up individually into a Data Collection."""
+    data_collection = DataCollection(config, codebook, get_output_data_path(config))
+    for data in data_objects:
+        data_collection.add_data_object(data)
+    logger.info(
+        f"Got a Data Collection holding {len(data_collection.data_object_names)} data sets"
+    )
+
+    return data_collection
 
 
 def setup_data(
@@ -171,7 +1291,7 @@ def setup_data(
 
     logger.info("Initializing nice-plots data.")
 
-    path_output_data = Path(f"{config.output_directory}/data_{config.output_name}.xlsx")
+    path_output_data = get_output_data_path(config)
     data_collection = DataCollection(config, codebook, path_output_data)
 
     # check if there is already a data file in the output directory
@@ -190,6 +1310,4 @@ def setup_data(
         data_collection.write_output_data()
     logger.info("Finished setting up nice-plots data.")
 
-    # get new values from data collection to add to config
-    config.data_file = data_collection.path_data
     return data_collection
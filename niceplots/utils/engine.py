@@ -0,0 +1,381 @@
+import ast
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Callable
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+
+from niceplots.utils.group_filter import ARITHMETICS, COMPARISONS, GroupFilter
+from niceplots.utils.nice_logger import init_logger
+
+logger = init_logger(__file__)
+
+
+class DataEngine(ABC):
+    """
+    Interface to the data frame library holding the survey data.
+    All results are returned as numpy arrays such that the plotting code does not
+    depend on the engine.
+    """
+
+    name = ""
+
+    @abstractmethod
+    def read_csv(
+        self, path: Path, delimiter: str, columns: set[str] | None = None
+    ) -> Any:
+        """Reads a data table (only the given columns that exist, all if None)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def from_pandas(self, df: pd.DataFrame) -> Any:
+        raise NotImplementedError
+
+    @abstractmethod
+    def to_pandas(self, frame: Any) -> pd.DataFrame:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_columns(self, frame: Any) -> list[str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_n_rows(self, frame: Any) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def is_numeric(self, frame: Any, column: str) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_values(self, frame: Any, column: str) -> np.ndarray:
+        """Values of a column (numeric columns as floats, NaN if missing)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def with_column(self, frame: Any, column: str, values: np.ndarray) -> Any:
+        raise NotImplementedError
+
+    @abstractmethod
+    def take(self, frame: Any, rows: np.ndarray) -> Any:
+        """Frame holding the given rows (positions) only."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_n_bytes(self, frame: Any) -> int:
+        """Memory used by the frame in bytes."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def concat(self, frames: list[Any]) -> Any:
+        """Frame holding the rows of all frames (with the same columns)."""
+        raise NotImplementedError
+
+    def assign_groups(
+        self, frame: Any, group_filter: GroupFilter
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Evaluates the compiled group filters. Returns the index of the group of each
+        row (-1 if no group applies, the last group wins if multiple apply) and the
+        number of rows per group.
+        """
+        group_filter.check_columns(self.get_columns(frame))
+        return group_filter.evaluate(
+            lambda column: self.get_values(frame, column), self.get_n_rows(frame)
+        )
+
+    @abstractmethod
+    def get_masks(
+        self, frame: Any, drop_codes: dict[str, list]
+    ) -> dict[str, np.ndarray]:
+        """
+        Masks selecting the rows of each variable that are not NaN and do not
+        contain any of the codes to drop.
+        """
+        raise NotImplementedError
+
+
+def get_usecols(columns: set[str] | None) -> Callable[[str], bool] | None:
+    """Column filter of pandas readers (columns that do not exist are ignored)."""
+    if columns is None:
+        return None
+    return lambda column: column in columns
+
+
+def get_numeric_codes(codes: list) -> list[float]:
+    """Codes that can be compared to numeric data (NaN or text codes never match)."""
+    numeric_codes = []
+    for code in codes:
+        try:
+            code = float(code)
+        except (TypeError, ValueError):
+            continue
+        if not np.isnan(code):
+            numeric_codes.append(code)
+    return numeric_codes
+
+
+class PandasEngine(DataEngine):
+    name = "pandas"
+
+    def read_csv(
+        self, path: Path, delimiter: str, columns: set[str] | None = None
+    ) -> pd.DataFrame:
+        return pd.read_csv(path, sep=delimiter, usecols=get_usecols(columns))
+
+    def from_pandas(self, df: pd.DataFrame) -> pd.DataFrame:
+        return df
+
+    def to_pandas(self, frame: pd.DataFrame) -> pd.DataFrame:
+        return frame
+
+    def get_columns(self, frame: pd.DataFrame) -> list[str]:
+        return list(frame.columns)
+
+    def get_n_rows(self, frame: pd.DataFrame) -> int:
+        return frame.shape[0]
+
+    def is_numeric(self, frame: pd.DataFrame, column: str) -> bool:
+        return is_numeric_dtype(frame[column])
+
+    def get_values(self, frame: pd.DataFrame, column: str) -> np.ndarray:
+        if self.is_numeric(frame, column):
+            return frame[column].to_numpy(dtype=float, na_value=np.nan)
+        return frame[column].to_numpy(dtype=object)
+
+    def with_column(
+        self, frame: pd.DataFrame, column: str, values: np.ndarray
+    ) -> pd.DataFrame:
+        frame[column] = values
+        return frame
+
+    def take(self, frame: pd.DataFrame, rows: np.ndarray) -> pd.DataFrame:
+        return frame.iloc[rows].reset_index(drop=True)
+
+    def get_n_bytes(self, frame: pd.DataFrame) -> int:
+        return int(frame.memory_usage(index=True, deep=True).sum())
+
+    def concat(self, frames: list[pd.DataFrame]) -> pd.DataFrame:
+        return pd.concat(frames, ignore_index=True)
+
+    def get_masks(
+        self, frame: pd.DataFrame, drop_codes: dict[str, list]
+    ) -> dict[str, np.ndarray]:
+        masks = {}
+        for variable, codes in drop_codes.items():
+            values = self.get_values(frame, variable)
+            masks[variable] = ~(
+                np.isnan(values) | np.isin(values, get_numeric_codes(codes))
+            )
+        return masks
+
+
+class PolarsEngine(DataEngine):
+    """
+    Multi-threaded columnar engine. Masks of all requested variables are evaluated
+    lazily in one parallel query.
+    """
+
+    name = "polars"
+
+    def __init__(self) -> None:
+        try:
+            import polars  # noqa: F401
+        except ImportError as error:
+            raise ValueError(
+                "The polars data engine requires polars. Install it using: pip install polars"
+            ) from error
+
+    @property
+    def pl(self) -> Any:
+        # not stored as attribute such that the engine can be pickled
+        import polars
+
+        return polars
+
+    def read_csv(
+        self, path: Path, delimiter: str, columns: set[str] | None = None
+    ) -> Any:
+        if columns is not None:
+            header = self.pl.read_csv(path, separator=delimiter, n_rows=0).columns
+            columns = [column for column in header if column in columns]
+        return self.pl.read_csv(
+            path, separator=delimiter, infer_schema_length=None, columns=columns
+        )
+
+    def from_pandas(self, df: pd.DataFrame) -> Any:
+        columns = []
+        for column in df.columns:
+            if is_numeric_dtype(df[column]):
+                # missing values are null in polars (NaN compares larger than numbers)
+                values = df[column].to_numpy()
+                columns.append(self.pl.Series(column, values, nan_to_null=True))
+            else:
+                values = [
+                    None if pd.isna(value) else str(value) for value in df[column]
+                ]
+                columns.append(self.pl.Series(column, values, dtype=self.pl.String))
+        return self.pl.DataFrame(columns)
+
+    def to_pandas(self, frame: Any) -> pd.DataFrame:
+        return pd.DataFrame(
+            {column: frame[column].to_numpy() for column in frame.columns}
+        )
+
+    def get_columns(self, frame: Any) -> list[str]:
+        return list(frame.columns)
+
+    def get_n_rows(self, frame: Any) -> int:
+        return frame.height
+
+    def is_numeric(self, frame: Any, column: str) -> bool:
+        return frame.schema[column].is_numeric()
+
+    def get_values(self, frame: Any, column: str) -> np.ndarray:
+        if self.is_numeric(frame, column):
+            return frame[column].cast(self.pl.Float64).to_numpy()
+        return frame[column].to_numpy()
+
+    def with_column(self, frame: Any, column: str, values: np.ndarray) -> Any:
+        return frame.with_columns(self.pl.Series(column, list(values)))
+
+    def take(self, frame: Any, rows: np.ndarray) -> Any:
+        return frame[rows]
+
+    def get_n_bytes(self, frame: Any) -> int:
+        return int(frame.estimated_size())
+
+    def concat(self, frames: list[Any]) -> Any:
+        # integer columns of one frame may be floats in another
+        return self.pl.concat(frames, how="vertical_relaxed")
+
+    def assign_groups(
+        self, frame: Any, group_filter: GroupFilter
+    ) -> tuple[np.ndarray, np.ndarray]:
+        group_filter.check_columns(self.get_columns(frame))
+        pl = self.pl
+        group_code = pl.lit(-1, dtype=pl.Int16)
+        # the last matching group wins
+        try:
+            for id_g, expression in enumerate(group_filter.expressions.values()):
+                condition = self.to_mask(self.to_expression(expression, group_filter))
+                group_code = (
+                    pl.when(condition)
+                    .then(pl.lit(id_g, dtype=pl.Int16))
+                    .otherwise(group_code)
+                )
+            # with_columns broadcasts literals (e.g. group filter "True") to all
+            # rows, sub-expressions shared by several groups are evaluated once
+            codes = (
+                frame.lazy()
+                .with_columns(group_code.alias("nice_plots_group_code"))
+                .select("nice_plots_group_code")
+                .collect()["nice_plots_group_code"]
+                .to_numpy()
+            )
+        except Exception as error:
+            # e.g. comparisons of text columns with numbers (never true with numpy)
+            # are not supported by polars, numpy also reports invalid filters
+            logger.debug(f"Evaluating the group filters with numpy: {error}")
+            return super().assign_groups(frame, group_filter)
+        group_codes = codes.astype(np.int16)
+        counts = np.bincount(
+            group_codes[group_codes >= 0], minlength=len(group_filter.groups)
+        )
+        return group_codes, counts
+
+    def to_mask(self, expression: Any) -> Any:
+        # truth values as in numpy (missing values are NaN and thus true)
+        return expression.cast(self.pl.Boolean).fill_null(True)
+
+    def to_expression(self, node: ast.AST, group_filter: GroupFilter) -> Any:
+        """Translates a compiled group filter into a polars expression."""
+        pl = self.pl
+        if isinstance(node, ast.BoolOp) or (
+            isinstance(node, ast.BinOp) and isinstance(node.op, (ast.BitAnd, ast.BitOr))
+        ):
+            is_and = isinstance(node.op, (ast.And, ast.BitAnd))
+            operands = (
+                node.values if isinstance(node, ast.BoolOp) else [node.left, node.right]
+            )
+            expressions = [
+                self.to_mask(self.to_expression(operand, group_filter))
+                for operand in operands
+            ]
+            return (
+                pl.all_horizontal(expressions)
+                if is_and
+                else pl.any_horizontal(expressions)
+            )
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            return -self.to_expression(node.operand, group_filter)
+        if isinstance(node, ast.UnaryOp):
+            return self.to_mask(self.to_expression(node.operand, group_filter)).not_()
+        if isinstance(node, ast.BinOp):
+            _, func = ARITHMETICS[type(node.op)]
+            return func(
+                self.to_expression(node.left, group_filter).cast(pl.Float64),
+                self.to_expression(node.right, group_filter),
+            )
+        if isinstance(node, ast.Compare):
+            expressions = []
+            left = node.left
+            for op, right in zip(node.ops, node.comparators, strict=True):
+                expressions.append(self.compare(op, left, right, group_filter))
+                left = right
+            return pl.all_horizontal(expressions)
+        if isinstance(node, ast.Name):
+            return pl.col(group_filter.aliases.get(node.id, node.id))
+        return pl.lit(node.value)
+
+    def compare(
+        self, op: ast.cmpop, left: ast.AST, right: ast.AST, group_filter: GroupFilter
+    ) -> Any:
+        # missing values behave like NaN in numpy: only != (and not in) are true
+        left_expression = self.to_expression(left, group_filter)
+        # A in [1, 2] and A == [1, 2] are equivalent (as in pandas queries)
+        if isinstance(right, (ast.List, ast.Tuple, ast.Set)):
+            if not isinstance(op, (ast.In, ast.NotIn, ast.Eq, ast.NotEq)):
+                raise ValueError(f"Cannot compare with list using {type(op).__name__}")
+            matches = self.pl.any_horizontal(
+                [self.pl.lit(False)]
+                + [
+                    left_expression == self.pl.lit(ast.literal_eval(element))
+                    for element in right.elts
+                ]
+            ).fill_null(False)
+            return matches.not_() if isinstance(op, (ast.NotIn, ast.NotEq)) else matches
+        right_expression = self.to_expression(right, group_filter)
+        if isinstance(op, ast.NotEq):
+            return (left_expression != right_expression).fill_null(True)
+        _, func = COMPARISONS[type(op)]
+        return func(left_expression, right_expression).fill_null(False)
+
+    def get_masks(
+        self, frame: Any, drop_codes: dict[str, list]
+    ) -> dict[str, np.ndarray]:
+        pl = self.pl
+        expressions = []
+        for variable, codes in drop_codes.items():
+            values = pl.col(variable).cast(pl.Float64)
+            valid = (
+                values.is_not_null()
+                & values.is_not_nan()
+                & values.is_in(get_numeric_codes(codes)).not_()
+            )
+            expressions.append(valid.fill_null(False).alias(variable))
+        masks = frame.lazy().select(expressions).collect()
+        return {variable: masks[variable].to_numpy() for variable in drop_codes}
+
+
+ENGINES = {"pandas": PandasEngine, "polars": PolarsEngine}
+
+
+def get_engine(name: str) -> DataEngine:
+    if name not in ENGINES:
+        raise ValueError(
+            f"Data engine {name} is unknown. Choose one of {list(ENGINES.keys())}"
+        )
+    return ENGINES[name]()
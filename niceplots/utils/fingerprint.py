@@ -0,0 +1,50 @@
+import hashlib
+import os
+import threading
+from pathlib import Path
+from typing import Any
+
+MISSING_FILE = "missing"
+
+# digests of files that have already been hashed, keyed by (path, size, mtime)
+_file_digests: dict[tuple[str, int, int], str] = {}
+_file_digests_lock = threading.Lock()
+
+
+def fingerprint(*items: Any) -> str:
+    """
+    Returns a stable sha256 hex digest of the given items.
+    Bytes are hashed directly, everything else via its repr.
+    """
+    h = hashlib.sha256()
+    for item in items:
+        if isinstance(item, (bytes, bytearray, memoryview)):
+            h.update(item)
+        else:
+            h.update(repr(item).encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def fingerprint_file(path: Path) -> str:
+    """
+    Returns the sha256 hex digest of the content of a file.
+    Digests are memoized per (path, size, modification time) such that unchanged
+    files are only read once per process.
+    """
+    if not os.path.exists(path):
+        return MISSING_FILE
+    stat = os.stat(path)
+    memo_key = (str(path), stat.st_size, stat.st_mtime_ns)
+    with _file_digests_lock:
+        if memo_key in _file_digests:
+            return _file_digests[memo_key]
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _file_digests_lock:
+        _file_digests[memo_key] = digest
+    return digest
@@ -0,0 +1,246 @@
+# Metrics of DejaVu Sans (the default sans-serif font of matplotlib) to lay out text
+# without matplotlib. Regenerate the tables with
+#   python -m niceplots.utils.font_metrics
+
+UNITS_PER_EM = 2048
+# vertical metrics used by matplotlib to place lines of text
+ASCENT = 1556 / UNITS_PER_EM
+DESCENT = 492 / UNITS_PER_EM
+LINE_GAP = 410 / UNITS_PER_EM
+
+# characters covered by the width tables (others get the width of DEFAULT_CHARACTER)
+CHARACTERS = (
+    "".join(chr(code) for code in range(32, 127))
+    + "".join(chr(code) for code in range(160, 256))
+    + "‘’‚“”„–—…•€"
+)
+DEFAULT_CHARACTER = "x"
+# characters covered by the kerning tables
+KERNING_CHARACTERS = "".join(chr(code) for code in range(32, 127)) + "‘’“”"
+
+# advance widths of the characters and kerning of pairs of characters in font units
+# fmt: off
+WIDTHS = {
+    "normal": (
+        651, 821, 942, 1716, 1303, 1946, 1597, 563, 799, 799, 1024, 1716,
+        651, 739, 651, 690, 1303, 1303, 1303, 1303, 1303, 1303, 1303, 1303,
+        1303, 1303, 690, 690, 1716, 1716, 1716, 1087, 2048, 1401, 1405, 1430,
+        1577, 1294, 1178, 1587, 1540, 604, 604, 1343, 1141, 1767, 1532, 1612,
+        1235, 1612, 1423, 1300, 1251, 1499, 1401, 2025, 1403, 1251, 1403, 799,
+        690, 799, 1716, 1024, 1024, 1255, 1300, 1126, 1300, 1260, 721, 1300,
+        1298, 569, 569, 1186, 569, 1995, 1298, 1253, 1300, 1300, 842, 1067,
+        803, 1298, 1212, 1675, 1212, 1212, 1075, 1303, 690, 1303, 1716, 651,
+        821, 1303, 1303, 1303, 1303, 690, 1024, 1024, 2048, 965, 1253, 1716,
+        739, 2048, 1024, 1024, 1716, 821, 821, 1024, 1303, 1303, 651, 1024,
+        821, 965, 1253, 1985, 1985, 1985, 1087, 1401, 1401, 1401, 1401, 1401,
+        1401, 1995, 1430, 1294, 1294, 1294, 1294, 604, 604, 604, 604, 1587,
+        1532, 1612, 1612, 1612, 1612, 1612, 1716, 1612, 1499, 1499, 1499, 1499,
+        1251, 1239, 1290, 1255, 1255, 1255, 1255, 1255, 1255, 2011, 1126, 1260,
+        1260, 1260, 1260, 569, 569, 569, 569, 1253, 1298, 1253, 1253, 1253,
+        1253, 1253, 1716, 1253, 1298, 1298, 1298, 1298, 1212, 1300, 1212, 651,
+        651, 651, 1061, 1061, 1061, 1024, 2048, 2048, 1208, 1303,
+    ),
+    "bold": (
+        713, 934, 1067, 1716, 1425, 2052, 1786, 627, 936, 936, 1071, 1716,
+        778, 850, 778, 748, 1425, 1425, 1425, 1425, 1425, 1425, 1425, 1425,
+        1425, 1425, 819, 819, 1716, 1716, 1716, 1188, 2048, 1585, 1561, 1503,
+        1700, 1399, 1399, 1681, 1714, 762, 762, 1587, 1305, 2038, 1714, 1741,
+        1501, 1741, 1577, 1475, 1397, 1663, 1585, 2259, 1579, 1483, 1485, 936,
+        748, 936, 1716, 1024, 1024, 1382, 1466, 1214, 1466, 1389, 891, 1466,
+        1458, 702, 702, 1362, 702, 2134, 1458, 1407, 1466, 1466, 1010, 1219,
+        979, 1458, 1335, 1892, 1321, 1335, 1192, 1458, 748, 1458, 1716, 713,
+        934, 1425, 1425, 1303, 1425, 748, 1024, 1024, 2048, 1155, 1323, 1716,
+        850, 2048, 1024, 1024, 1716, 897, 897, 1024, 1507, 1303, 778, 1024,
+        897, 1155, 1323, 2120, 2120, 2120, 1188, 1585, 1585, 1585, 1585, 1585,
+        1585, 2222, 1503, 1399, 1399, 1399, 1399, 762, 762, 762, 762, 1716,
+        1714, 1741, 1741, 1741, 1741, 1741, 1716, 1741, 1663, 1663, 1663, 1663,
+        1483, 1511, 1473, 1382, 1382, 1382, 1382, 1382, 1382, 2146, 1214, 1389,
+        1389, 1389, 1389, 702, 702, 702, 702, 1407, 1458, 1407, 1407, 1407,
+        1407, 1407, 1716, 1407, 1458, 1458, 1458, 1458, 1335, 1466, 1335, 778,
+        778, 778, 1346, 1346, 1346, 1024, 2048, 2048, 1309, 1425,
+    ),
+}
+KERNING = {
+    "normal": {
+        "-A": -45, "-B": -73, "-G": 75, "-J": 114, "-O": 57, "-Q": 75, "-T": -188,
+        "-V": -120, "-W": -83, "-X": -102, "-Y": -243, "-o": 38, "-v": -55, "-y": -36,
+        "A-": -45, "A.": -36, "A:": -36, "AA": 57, "AC": -36, "AG": -36, "AO": -36,
+        "AQ": -36, "AT": -159, "AV": -131, "AW": -112, "AY": -159, "Ac": -36, "Ad": -36,
+        "Ae": -36, "Af": -73, "Ao": -36, "Aq": -36, "At": -36, "Av": -120, "Aw": -83,
+        "Ay": -139, "A“": -264, "A”": -253, "BC": -36, "BG": -36, "BO": -36, "BS": -36,
+        "BV": -63, "BW": -73, "BY": -112, "B“": -112, "B”": -112, "CY": -36, "C”": 38,
+        "DA": -36, "DV": -36, "DY": -112, "D“": -45, "D”": -55, "F.": -329, "F:": -159,
+        "FA": -188, "FS": -36, "FT": -36, "Fa": -188, "Fe": -112, "Fi": -149, "Fo": -73,
+        "Fr": -149, "Fu": -112, "Fy": -188, "F“": -45, "GT": -73, "GY": -102, "G“": -45,
+        "G”": -45, "H.": -36, "H“": -73, "H”": -63, "J-": -73, "JA": -36, "J“": -73,
+        "J”": -63, "K-": -215, "KA": -36, "KC": -112, "KO": -112, "KT": -159, "KU": -55,
+        "KW": -73, "KY": -73, "Ka": -36, "Ke": -102, "Ko": -102, "Ku": -102, "Ky": -149,
+        "K“": -63, "K”": -63, "L-": -36, "LA": 47, "LO": -73, "LT": -282, "LU": -102,
+        "LV": -225, "LW": -188, "LY": -272, "Le": -36, "Lo": -36, "Lu": -36, "Ly": -188,
+        "L“": -415, "L”": -538, "O-": 57, "O.": -83, "O:": -36, "OA": -36, "OV": -36,
+        "OX": -131, "OY": -112, "O“": -45, "O”": -36, "P-": -45, "P.": -319, "PA": -131,
+        "PY": -45, "Pa": -92, "Pe": -73, "Pi": -45, "Pn": -36, "Po": -73, "Pr": -36,
+        "Ps": -36, "Pu": -36, "P“": 38, "P”": 38, "Q-": 57, "Q“": -45, "Q”": -36,
+        "R-": -83, "R.": -73, "R:": -63, "RA": -83, "RC": -102, "RT": -149, "RV": -112,
+        "RW": -83, "RY": -131, "Ra": -45, "Re": -92, "Ro": -92, "Ru": -92, "Ry": -112,
+        "R“": -149, "R”": -131, "SA": 38, "T-": -188, "T.": -243, "T:": -225, "TA": -159,
+        "TC": -120, "TT": -36, "Ta": -339, "Tc": -348, "Te": -348, "Ti": -63, "To": -348,
+        "Tr": -301, "Ts": -339, "Tu": -311, "Tw": -339, "Ty": -319, "T”": -45, "UZ": -36,
+        "V-": -120, "V.": -264, "V:": -167, "VA": -131, "VO": -36, "Va": -159, "Ve": -159,
+        "Vi": -45, "Vo": -159, "Vu": -139, "Vy": -55, "W-": -83, "W.": -235, "W:": -120,
+        "WA": -112, "Wa": -131, "We": -120, "Wi": -45, "Wo": -120, "Wr": -92, "Wu": -73,
+        "Wy": -36, "W“": -36, "X-": -102, "XC": -149, "XO": -131, "XT": -36, "Xe": -92,
+        "X“": -159, "X”": -83, "Y-": -243, "Y.": -415, "Y:": -272, "YA": -159, "YC": -112,
+        "YO": -112, "Ya": -282, "Ye": -272, "Yi": -73, "Yo": -272, "Yu": -235, "Y“": -112,
+        "Y”": -36, "Z-": -36, "Z“": -36, "Z”": -36, "ex": -36, "f-": -112, "f.": -149,
+        "f:": -73, "ft": -36, "fw": -36, "fy": -36, "f“": 65, "ka": -36, "ke": -73,
+        "ko": -73, "ku": -63, "ky": -73, "n“": -149, "n”": -112, "o-": 38, "o.": -36,
+        "ox": -63, "o“": -149, "o”": -73, "r-": -131, "r.": -188, "r:": -36, "rc": -45,
+        "rd": -36, "re": -45, "rg": -36, "rh": -36, "rm": -36, "rn": -36, "ro": -45,
+        "rq": -36, "rr": -36, "rx": -55, "r”": 86, "v-": -55, "v.": -159, "v:": -112,
+        "v”": -36, "w.": -188, "w:": -112, "xc": -36, "xe": -63, "xo": -63, "y-": -36,
+        "y.": -292, "y:": -149, "“A": -264, "“B": -63, "“C": -73, "“D": -63, "“F": -63,
+        "“G": -73, "“H": -63, "“J": -63, "“K": -63, "“L": -63, "“O": -73, "“P": -63,
+        "“Q": -73, "“R": -63, "“X": -120, "“Z": -36, "“f": -73, "“n": -112, "“o": -149,
+        "“r": -112, "“v": -73, "“w": -73, "“y": -73,
+    },
+    "bold": {
+        "-T": -301, "-V": -149, "-W": -92, "-X": -167, "-Y": -301, "A,": 38, "A.": 38,
+        "A:": 38, "A;": 38, "AT": -159, "AU": -63, "AV": -139, "AW": -92, "AY": -196,
+        "Av": -73, "Ay": -73, "A’": -188, "A”": -188, "BV": -83, "BW": -112, "BY": -112,
+        "C-": 47, "CS": 38, "C’": 75, "C”": 75, "D-": 38, "DY": -149, "F,": -329,
+        "F-": -63, "F.": -301, "F:": -112, "F;": -112, "FA": -235, "Fa": -120, "Fe": -83,
+        "Fo": -83, "Fr": -131, "Fu": -102, "Fy": -112, "F’": 38, "GT": -36, "GY": -45,
+        "K-": -178, "KC": -92, "KO": -92, "KU": -36, "Ke": -36, "Ko": -36, "Ku": -36,
+        "Ky": -131, "LO": -73, "LT": -339, "LU": -73, "LV": -282, "LW": -159, "LY": -319,
+        "Ly": -139, "L’": -471, "L”": -491, "O,": -45, "O-": 38, "O.": -45, "OA": -55,
+        "OV": -55, "OX": -73, "OY": -73, "P,": -376, "P-": -36, "P.": -376, "PA": -188,
+        "Pa": -55, "Ps": -36, "Py": 38, "P’": 57, "P”": 38, "Q-": 38, "R,": 38,
+        "R.": 38, "RT": -92, "RY": -112, "Ry": -92, "SS": -92, "T,": -292, "T-": -301,
+        "T.": -311, "T:": -112, "T;": -112, "TA": -159, "TT": 47, "Ta": -264, "Tc": -272,
+        "Te": -272, "To": -272, "Tr": -225, "Ts": -272, "Tu": -225, "Tw": -225, "Ty": -243,
+        "UA": -63, "V,": -264, "V-": -149, "V.": -264, "V:": -92, "V;": -92, "VA": -139,
+        "VO": -36, "Va": -112, "Ve": -112, "Vi": -36, "Vo": -112, "Vu": -73, "W,": -167,
+        "W-": -92, "W.": -167, "W:": -63, "W;": -63, "WA": -92, "Wa": -73, "We": -73,
+        "Wo": -73, "Wr": -36, "X-": -167, "XC": -73, "XO": -73, "Xe": -55, "Y,": -339,
+        "Y-": -301, "Y.": -339, "Y:": -178, "Y;": -178, "YA": -196, "YC": -73, "YO": -73,
+        "Ya": -188, "Ye": -188, "Yo": -188, "Yu": -149, "Z-": -36, "ay": -63, "f,": -112,
+        "f-": -36, "f.": -112, "f’": 141, "f”": 86, "ke": -55, "ko": -55, "r,": -301,
+        "r.": -292, "r’": 86, "r”": 38, "v,": -167, "v.": -167, "w,": -131, "w.": -131,
+        "y,": -159, "y.": -188, "‘A": -235, "‘J": -92, "‘V": 38, "‘Y": 75, "“A": -264,
+        "“J": -92, "“Y": 38,
+    },
+}
+# fmt: on
+WIDTH_TABLES = {
+    weight: dict(zip(CHARACTERS, widths, strict=True))
+    for weight, widths in WIDTHS.items()
+}
+BOLD_WEIGHTS = ("semibold", "demibold", "demi", "bold", "heavy", "extra bold", "black")
+
+
+def get_text_width(text: str, size: float, weight: str | int = "normal") -> float:
+    """
+    Width of a line of text in points.
+    :param size: Font size in points.
+    """
+    bold = weight in BOLD_WEIGHTS or (isinstance(weight, int) and weight >= 600)
+    widths = WIDTH_TABLES["bold" if bold else "normal"]
+    kerning = KERNING["bold" if bold else "normal"]
+    default = widths[DEFAULT_CHARACTER]
+    width = sum(widths.get(c, default) for c in text)
+    width += sum(kerning.get(text[i : i + 2], 0) for i in range(len(text) - 1))
+    return width * size / UNITS_PER_EM
+
+
+def wrap_text(
+    text: str, width: float, size: float, weight: str | int = "normal"
+) -> list[str]:
+    """
+    Splits the text into lines of at most width points the same way matplotlib
+    wraps text (words are only split at spaces, explicit line breaks are kept).
+    """
+    lines = []
+    for line in text.split("\n"):
+        words = line.split(" ")
+        while len(words) > 1:
+            for i in range(2, len(words) + 1):
+                if get_text_width(" ".join(words[:i]), size, weight) > width:
+                    lines.append(" ".join(words[: i - 1]))
+                    words = words[i - 1 :]
+                    break
+            else:
+                break
+        lines.append(" ".join(words))
+    return lines
+
+
+def get_line_layout(n_lines: int, size: float) -> tuple[float, float, float]:
+    """
+    Vertical layout of a text with n_lines lines as done by matplotlib. Returns the
+    height of the text, the distance of the first baseline from the top and the
+    distance between the baselines (all in points).
+    """
+    gap = 0.0 if n_lines == 1 else LINE_GAP
+    ascent = (ASCENT + gap / 2) * size
+    descent = (DESCENT + gap / 2) * size
+    return n_lines * (ascent + descent), ascent, ascent + descent
+
+
+def build_tables() -> str:
+    """Source of the WIDTHS and KERNING tables (requires matplotlib)."""
+    import json
+
+    from matplotlib.font_manager import FontProperties, findfont
+    from matplotlib.ft2font import FT2Font, Kerning, LoadFlags
+
+    fonts = {}
+    for weight in ("normal", "bold"):
+        font = FT2Font(findfont(FontProperties(family="DejaVu Sans", weight=weight)))
+        font.set_size(UNITS_PER_EM, 72)
+        fonts[weight] = font
+
+    rows = ["# fmt: off", "WIDTHS = {"]
+    for weight, font in fonts.items():
+        widths = [
+            str(
+                round(
+                    font.load_char(ord(c), flags=LoadFlags.NO_HINTING).linearHoriAdvance
+                    / 65536
+                )
+            )
+            for c in CHARACTERS
+        ]
+        rows.append(f'    "{weight}": (')
+        rows.extend(get_table_rows(widths, 12))
+        rows.append("    ),")
+    rows.extend(["}", "KERNING = {"])
+    for weight, font in fonts.items():
+        index = {c: font.get_char_index(ord(c)) for c in KERNING_CHARACTERS}
+        pairs = []
+        for first in KERNING_CHARACTERS:
+            for second in KERNING_CHARACTERS:
+                # in 26.6 fixed point
+                kerning = font.get_kerning(
+                    index[first], index[second], Kerning.UNFITTED
+                )
+                if kerning != 0:
+                    pairs.append(
+                        f"{json.dumps(first + second, ensure_ascii=False)}: {kerning // 64}"
+                    )
+        rows.append(f'    "{weight}": {{')
+        rows.extend(get_table_rows(pairs, 7))
+        rows.append("    },")
+    rows.extend(["}", "# fmt: on"])
+    return "\n".join(rows)
+
+
+def get_table_rows(entries: list[str], n_columns: int) -> list[str]:
+    return [
+        "        " + ", ".join(entries[start : start + n_columns]) + ","
+        for start in range(0, len(entries), n_columns)
+    ]
+
+
+if __name__ == "__main__":
+    print(build_tables())
@@ -0,0 +1,318 @@
+import ast
+import io
+import operator
+import re
+import tokenize
+from typing import Any, Callable
+
+import numpy as np
+
+from niceplots.utils.fingerprint import fingerprint
+from niceplots.utils.nice_logger import init_logger
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+logger = init_logger(__file__)
+
+# below this number of rows numexpr is slower than numpy
+NUMEXPR_MIN_ROWS = 10000
+
+COMPARISONS = {
+    ast.Eq: ("==", operator.eq),
+    ast.NotEq: ("!=", operator.ne),
+    ast.Lt: ("<", operator.lt),
+    ast.LtE: ("<=", operator.le),
+    ast.Gt: (">", operator.gt),
+    ast.GtE: (">=", operator.ge),
+}
+
+ARITHMETICS = {
+    ast.Add: ("+", operator.add),
+    ast.Sub: ("-", operator.sub),
+    ast.Mult: ("*", operator.mul),
+    ast.Div: ("/", operator.truediv),
+    ast.Mod: ("%", operator.mod),
+    ast.Pow: ("**", operator.pow),
+}
+
+
+def get_group_filter_error(group_name: str, group_string: Any) -> str:
+    return f"Unable to apply your group filter {group_string} named {group_name}"
+
+
+def replace_logical_operators(expression: str) -> str:
+    """
+    Replaces & and | by and and or. As in pandas queries they then bind weaker than
+    comparisons, e.g. A == 1 & B == 2 is (A == 1) & (B == 2) and not the chained
+    comparison A == (1 & B) == 2. The operators are still evaluated elementwise.
+    """
+    tokens = []
+    for token in tokenize.generate_tokens(io.StringIO(expression).readline):
+        if token.type == tokenize.OP and token.string in ["&", "|"]:
+            token = token._replace(
+                type=tokenize.NAME, string="and" if token.string == "&" else "or"
+            )
+        tokens.append((token.type, token.string))
+    return tokenize.untokenize(tokens)
+
+
+class GroupFilter:
+    """
+    Group filters (in pandas query syntax) compiled into expression trees.
+    The filters are parsed once and can be applied to any number of data sets.
+    Sub-expressions shared by several groups (e.g. VAR02 == 1) are evaluated only
+    once per data set.
+    :param groups: Mapping from group name to filter string (or bool).
+    """
+
+    def __init__(self, groups: dict) -> None:
+        self.groups = groups
+        self.group_names = list(groups.keys())
+        # names of quoted column names (`column name`) in the expressions
+        self.aliases: dict[str, str] = {}
+        self.expressions: dict[str, ast.AST] = {}
+        for group_name, group_string in groups.items():
+            self.expressions[group_name] = self.parse(group_name, group_string)
+
+        self.columns: dict[str, list[str]] = {}
+        for group_name, expression in self.expressions.items():
+            for node in ast.walk(expression):
+                if isinstance(node, ast.Name):
+                    column = self.aliases.get(node.id, node.id)
+                    self.columns.setdefault(column, []).append(group_name)
+
+    def parse(self, group_name: str, group_string: Any) -> ast.AST:
+        if isinstance(group_string, bool):
+            return ast.Constant(group_string)
+
+        def replace_quoted(match: re.Match) -> str:
+            alias = f"nice_plots_column_{len(self.aliases)}"
+            self.aliases[alias] = match.group(1)
+            return alias
+
+        try:
+            expression = ast.parse(
+                replace_logical_operators(
+                    re.sub(r"`([^`]*)`", replace_quoted, str(group_string)).strip()
+                ),
+                mode="eval",
+            ).body
+            self.validate(expression)
+        except (SyntaxError, ValueError, tokenize.TokenError) as error:
+            raise ValueError(
+                f"{get_group_filter_error(group_name, group_string)}: {error}"
+            ) from error
+        return expression
+
+    def validate(self, node: ast.AST) -> None:
+        if isinstance(node, ast.BoolOp):
+            for value in node.values:
+                self.validate(value)
+        elif isinstance(node, ast.BinOp) and (
+            isinstance(node.op, (ast.BitAnd, ast.BitOr)) or type(node.op) in ARITHMETICS
+        ):
+            self.validate(node.left)
+            self.validate(node.right)
+        elif isinstance(node, ast.UnaryOp) and isinstance(
+            node.op, (ast.Not, ast.Invert, ast.USub)
+        ):
+            self.validate(node.operand)
+        elif isinstance(node, ast.Compare):
+            operands = [node.left] + node.comparators
+            for op, right in zip(node.ops, node.comparators, strict=True):
+                if isinstance(op, (ast.In, ast.NotIn)):
+                    if not isinstance(right, (ast.List, ast.Tuple, ast.Set)):
+                        raise ValueError(
+                            f"Expected a list after {type(op).__name__}, got {ast.unparse(right)}"
+                        )
+                elif type(op) not in COMPARISONS:
+                    raise ValueError(f"Unsupported comparison {type(op).__name__}")
+            for operand in operands:
+                if isinstance(operand, (ast.List, ast.Tuple, ast.Set)):
+                    for element in operand.elts:
+                        ast.literal_eval(element)
+                else:
+                    self.validate(operand)
+        elif not isinstance(node, (ast.Name, ast.Constant)):
+            raise ValueError(f"Unsupported expression {ast.unparse(node)}")
+
+    def check_columns(self, columns: list[str]) -> None:
+        """
+        Raises an error listing the columns that are used by the filters but do
+        not exist.
+        """
+        unknown = {
+            column: group_names
+            for column, group_names in self.columns.items()
+            if column not in columns
+        }
+        if len(unknown) > 0:
+            details = ", ".join(
+                f"{column} (used by {group_names})"
+                for column, group_names in unknown.items()
+            )
+            raise ValueError(f"Group filters reference unknown columns: {details}")
+
+    def get_fingerprint(self) -> str:
+        return fingerprint(
+            [
+                (group_name, ast.dump(expression), self.aliases)
+                for group_name, expression in self.expressions.items()
+            ]
+        )
+
+    def evaluate(
+        self, get_column: Callable[[str], np.ndarray], n_rows: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Evaluates the group filters. Returns the index of the group of each row
+        (-1 if no group applies, the last group wins if multiple apply) and the
+        number of rows per group.
+        :param get_column: Callable returning the values of a column as numpy array.
+        :param n_rows: Number of rows of the data.
+        """
+        evaluation = Evaluation(self.aliases, get_column, n_rows)
+        group_codes = np.full(n_rows, -1, dtype=np.int16)
+        for id_g, (group_name, expression) in enumerate(self.expressions.items()):
+            try:
+                mask = evaluation.evaluate(expression)
+                mask = np.broadcast_to(np.asarray(mask, dtype=bool), (n_rows,))
+            except BaseException as error:
+                raise ValueError(
+                    f"{get_group_filter_error(group_name, self.groups[group_name])}: {error}"
+                ) from error
+            group_codes[mask] = id_g
+        counts = np.bincount(group_codes[group_codes >= 0], minlength=len(self.groups))
+        return group_codes, counts
+
+
+class Evaluation:
+    """
+    Evaluation of expression trees on one data set. Results of all sub-expressions
+    are cached, commutative operations are normalized such that e.g. (A | B) and
+    (B | A) share their result.
+    """
+
+    def __init__(
+        self,
+        aliases: dict[str, str],
+        get_column: Callable[[str], np.ndarray],
+        n_rows: int,
+    ) -> None:
+        self.aliases = aliases
+        self.get_column = get_column
+        self.use_numexpr = numexpr is not None and n_rows >= NUMEXPR_MIN_ROWS
+        self.results: dict[str, Any] = {}
+
+    def evaluate(self, node: ast.AST) -> Any:
+        key = self.get_key(node)
+        if key not in self.results:
+            self.results[key] = self._evaluate(node)
+        return self.results[key]
+
+    def get_key(self, node: ast.AST) -> str:
+        logical_op = self.get_logical_op(node)
+        if logical_op is not None:
+            operands = sorted(
+                self.get_key(operand) for operand in self.flatten(node, logical_op)
+            )
+            return f"{logical_op}({', '.join(operands)})"
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            # not and ~ are equivalent
+            return f"Invert({self.get_key(node.operand)})"
+        return ast.dump(node)
+
+    @staticmethod
+    def get_logical_op(node: ast.AST) -> str | None:
+        if isinstance(node, ast.BoolOp):
+            return "&" if isinstance(node.op, ast.And) else "|"
+        if isinstance(node, ast.BinOp) and isinstance(node.op, ast.BitAnd):
+            return "&"
+        if isinstance(node, ast.BinOp) and isinstance(node.op, ast.BitOr):
+            return "|"
+        return None
+
+    def flatten(self, node: ast.AST, logical_op: str) -> list[ast.AST]:
+        if self.get_logical_op(node) != logical_op:
+            return [node]
+        children = (
+            node.values if isinstance(node, ast.BoolOp) else [node.left, node.right]
+        )
+        operands = []
+        for child in children:
+            operands.extend(self.flatten(child, logical_op))
+        return operands
+
+    def _evaluate(self, node: ast.AST) -> Any:
+        logical_op = self.get_logical_op(node)
+        if logical_op is not None:
+            operands = [
+                np.asarray(self.evaluate(operand), dtype=bool)
+                for operand in self.flatten(node, logical_op)
+            ]
+            combined = operands[0]
+            for operand in operands[1:]:
+                combined = self.apply(
+                    logical_op,
+                    operator.and_ if logical_op == "&" else operator.or_,
+                    combined,
+                    operand,
+                )
+            return combined
+        if isinstance(node, ast.UnaryOp):
+            operand = self.evaluate(node.operand)
+            if isinstance(node.op, ast.USub):
+                return self.apply("-", operator.neg, operand)
+            return self.apply("~", operator.invert, np.asarray(operand, dtype=bool))
+        if isinstance(node, ast.BinOp):
+            symbol, func = ARITHMETICS[type(node.op)]
+            return self.apply(
+                symbol, func, self.evaluate(node.left), self.evaluate(node.right)
+            )
+        if isinstance(node, ast.Compare):
+            combined = None
+            left = node.left
+            for op, right in zip(node.ops, node.comparators, strict=True):
+                result = self.compare(op, left, right)
+                combined = (
+                    result
+                    if combined is None
+                    else self.apply("&", operator.and_, combined, result)
+                )
+                left = right
+            return combined
+        if isinstance(node, ast.Name):
+            return self.get_column(self.aliases.get(node.id, node.id))
+        return node.value
+
+    def compare(self, op: ast.cmpop, left: ast.AST, right: ast.AST) -> Any:
+        # A in [1, 2] and A == [1, 2] are equivalent (as in pandas queries)
+        if isinstance(right, (ast.List, ast.Tuple, ast.Set)):
+            if not isinstance(op, (ast.In, ast.NotIn, ast.Eq, ast.NotEq)):
+                raise ValueError(f"Cannot compare with list using {type(op).__name__}")
+            values = [ast.literal_eval(element) for element in right.elts]
+            result = np.isin(self.evaluate(left), values)
+            return ~result if isinstance(op, (ast.NotIn, ast.NotEq)) else result
+        symbol, func = COMPARISONS[type(op)]
+        return self.apply(symbol, func, self.evaluate(left), self.evaluate(right))
+
+    def apply(self, symbol: str, func: Callable, *operands: Any) -> Any:
+        if self.use_numexpr and all(self.supports_numexpr(o) for o in operands):
+            names = [f"x{i}" for i in range(len(operands))]
+            if len(operands) == 1:
+                expression = f"{symbol}{names[0]}"
+            else:
+                expression = f"{names[0]} {symbol} {names[1]}"
+            return numexpr.evaluate(
+                expression, local_dict=dict(zip(names, operands, strict=True))
+            )
+        return func(*operands)
+
+    @staticmethod
+    def supports_numexpr(operand: Any) -> bool:
+        if isinstance(operand, np.ndarray):
+            return operand.dtype.kind in "biuf"
+        return isinstance(operand, (bool, int, float))
@@ -0,0 +1,135 @@
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+from matplotlib.axes import Axes
+from matplotlib.figure import Figure
+
+from niceplots.utils.nice_logger import init_logger
+
+logger = init_logger(__file__)
+
+# maximum number of idle template figures kept alive
+MAX_TEMPLATES = 16
+
+
+class Template:
+    """
+    A figure with its empty layout (subplots, spines, ticks and limits) and the
+    state required to strip it back to the empty layout after it was used.
+    """
+
+    def __init__(self, fig: Figure, axes: list[Axes]) -> None:
+        self.fig = fig
+        self.axes = axes
+        self.fig_axes = list(fig.axes)
+        self.fig_artists = list(fig.artists)
+        self.fig_texts = list(fig.texts)
+        self.fig_legends = list(fig.legends)
+        self.ax_children = {id(ax): set(ax.get_children()) for ax in fig.axes}
+        self.ax_limits = {
+            id(ax): (
+                ax.get_xlim(),
+                ax.get_ylim(),
+                ax.get_autoscalex_on(),
+                ax.get_autoscaley_on(),
+                ax.dataLim.frozen(),
+                ax.ignore_existing_data_limits,
+            )
+            for ax in fig.axes
+        }
+
+    def reset(self) -> None:
+        """Removes all artists added since the layout was built."""
+        fig = self.fig
+        for ax in list(fig.axes):
+            if ax not in self.fig_axes:
+                fig.delaxes(ax)
+        for artist in fig.artists + fig.texts + fig.legends:
+            if (
+                artist not in self.fig_artists
+                and artist not in self.fig_texts
+                and artist not in self.fig_legends
+            ):
+                artist.remove()
+
+        for ax in self.fig_axes:
+            children = self.ax_children[id(ax)]
+            for artist in ax.get_children():
+                if artist not in children:
+                    artist.remove()
+            ax.containers.clear()
+            xlim, ylim, autoscalex, autoscaley, data_lim, ignore = self.ax_limits[
+                id(ax)
+            ]
+            ax.dataLim.set(data_lim)
+            ax.ignore_existing_data_limits = ignore
+            ax.set_xlim(xlim, auto=autoscalex)
+            ax.set_ylim(ylim, auto=autoscaley)
+
+
+class LayoutPool:
+    """
+    Pool of empty figure layouts. Blocks with the same geometry (plot type, number
+    of variables or bars, number of groups and layout configuration) reuse the
+    figure of an earlier block instead of building a new one. Only the data
+    artists are removed when a figure is returned to the pool.
+    :param max_templates: Maximum number of idle figures kept in the pool.
+    """
+
+    def __init__(self, max_templates: int = MAX_TEMPLATES) -> None:
+        self.max_templates = max_templates
+        self.templates: OrderedDict[Hashable, list[Template]] = OrderedDict()
+        # templates that are currently in use, by figure
+        self.in_use: dict[int, tuple[Hashable, Template]] = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_key(plot_name: str, *geometry: Any, layout: dict) -> Hashable:
+        return (plot_name, *geometry, json.dumps(layout, sort_keys=True, default=str))
+
+    def acquire(
+        self, key: Hashable, build: Callable[[], tuple[Figure, list[Axes]]]
+    ) -> tuple[Figure, list[Axes]]:
+        """
+        Returns an empty layout for the key. The layout is built if there is no
+        idle figure with the same key.
+        :param key: Key of the layout (see get_key).
+        :param build: Callable building the layout.
+        """
+        with self.lock:
+            idle = self.templates.get(key, [])
+            template = idle.pop() if len(idle) > 0 else None
+            if len(idle) == 0:
+                self.templates.pop(key, None)
+        if template is None:
+            template = Template(*build())
+        else:
+            logger.debug(f"Reusing layout {key[:-1]}")
+        with self.lock:
+            self.in_use[id(template.fig)] = (key, template)
+        return template.fig, template.axes
+
+    def release(self, fig: Figure) -> None:
+        """Strips the data artists from a figure and returns it to the pool."""
+        with self.lock:
+            key, template = self.in_use.pop(id(fig))
+        template.reset()
+        with self.lock:
+            self.templates.setdefault(key, []).append(template)
+            self.templates.move_to_end(key)
+            while self.n_templates > self.max_templates:
+                # figures are not managed by pyplot, dropping them frees them
+                self.templates.popitem(last=False)
+
+    @property
+    def n_templates(self) -> int:
+        return sum(len(idle) for idle in self.templates.values())
+
+    def clear(self) -> None:
+        with self.lock:
+            self.templates.clear()
+
+
+LAYOUT_POOL = LayoutPool()
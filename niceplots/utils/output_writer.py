@@ -0,0 +1,195 @@
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable
+
+import matplotlib as mpl
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.transforms import Bbox
+
+from niceplots.utils.nice_logger import init_logger
+from niceplots.utils.plotting_utils import get_extent
+
+logger = init_logger(__file__)
+
+# formats drawn by the vector backends (at 72 dpi)
+VECTOR_FORMATS = ("pdf", "svg", "svgz", "eps", "ps", "pgf")
+
+# resolution of drafts and size of their watermark relative to the figure width
+DRAFT_DPI = 50
+DRAFT_WATERMARK_SIZE = 0.15
+
+
+def replace_file(path: Path, write: Callable[[Path], None]) -> None:
+    """
+    Writes a file atomically: write is called with a temporary file in the output
+    directory that replaces the output file once it is complete.
+    """
+    path = Path(path)
+    path_tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}")
+    try:
+        write(path_tmp)
+        os.replace(path_tmp, path)
+    finally:
+        if os.path.exists(path_tmp):
+            os.remove(path_tmp)
+
+
+def save_figure(fig: Figure, path: Path, draft: bool = False) -> None:
+    """
+    Saves the figure atomically (see replace_file).
+    The figure is cropped to its content like with bbox_inches="tight", but the
+    extent is measured from the layout instead of drawing the figure twice.
+    :param draft: Save a watermarked low resolution figure without cropping.
+    """
+    file_format = Path(path).suffix[1:]
+    if draft:
+        add_watermark(fig)
+        replace_file(
+            path,
+            lambda path_tmp: fig.savefig(
+                path_tmp, format=file_format, transparent=False, dpi=DRAFT_DPI
+            ),
+        )
+        return
+    extent = get_figure_extent(fig, file_format)
+    replace_file(
+        path,
+        lambda path_tmp: fig.savefig(
+            path_tmp,
+            format=file_format,
+            transparent=False,
+            bbox_inches=extent.padded(mpl.rcParams["savefig.pad_inches"]),
+        ),
+    )
+
+
+def add_watermark(fig: Figure) -> None:
+    fig.text(
+        0.5,
+        0.5,
+        "DRAFT",
+        fontsize=DRAFT_WATERMARK_SIZE * fig.get_figwidth() * 72,
+        color="red",
+        alpha=0.3,
+        rotation=30,
+        horizontalalignment="center",
+        verticalalignment="center",
+        fontweight="bold",
+    )
+
+
+def save_text(text: str, path: Path) -> None:
+    """Saves a text file (e.g. an SVG image) atomically (see replace_file)."""
+    replace_file(path, lambda path_tmp: path_tmp.write_text(text, encoding="utf-8"))
+
+
+def get_figure_extent(fig: Figure, file_format: str) -> Bbox:
+    """
+    Extent of the figure content in inches, measured at the resolution the figure
+    is drawn at in the given format.
+    """
+    dpi = fig.dpi
+    if file_format in VECTOR_FORMATS:
+        fig.set_dpi(72.0)
+    try:
+        # the canvas (and its renderer) stays with the figure when it is reused
+        canvas = fig.canvas if isinstance(fig.canvas, FigureCanvasAgg) else None
+        if canvas is None:
+            canvas = FigureCanvasAgg(fig)
+        extent = get_extent(fig, canvas.get_renderer())
+        return extent.transformed(fig.dpi_scale_trans.inverted())
+    finally:
+        fig.set_dpi(dpi)
+
+
+class OutputWriter:
+    """
+    Encodes and writes finished figures in background threads such that the next
+    block can be built while the previous one is written. At most max_pending
+    figures are waiting to be written, further submissions block until a figure was
+    written (limits the memory held by finished figures).
+    :param n_workers: Number of writer threads.
+    :param max_pending: Maximum number of figures held by the writer.
+    """
+
+    def __init__(self, n_workers: int = 2, max_pending: int | None = None) -> None:
+        self.n_workers = max(1, n_workers)
+        self.max_pending = 2 * self.n_workers if max_pending is None else max_pending
+        self.slots = threading.BoundedSemaphore(max(1, self.max_pending))
+        self.executor: ThreadPoolExecutor | None = None
+        self.lock = threading.Lock()
+
+    def submit(
+        self,
+        fig: Figure,
+        path: Path,
+        on_written: Callable[[Figure], None] | None = None,
+        draft: bool = False,
+    ) -> Future:
+        """
+        Queues the figure for writing. Returns a future that completes once the
+        file was written (holding the exception if writing failed).
+        :param on_written: Called with the figure after writing it (also on failure).
+        :param draft: Write a draft (see save_figure).
+        """
+        self.slots.acquire()
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=self.n_workers, thread_name_prefix="nice-plots-writer"
+                )
+            try:
+                return self.executor.submit(self.write, fig, path, on_written, draft)
+            except BaseException:
+                self.slots.release()
+                raise
+
+    def write(
+        self,
+        fig: Figure,
+        path: Path,
+        on_written: Callable[[Figure], None] | None,
+        draft: bool = False,
+    ) -> Path:
+        try:
+            save_figure(fig, path, draft)
+            logger.debug(f"Wrote {path}")
+            return path
+        finally:
+            try:
+                if on_written is not None:
+                    on_written(fig)
+            finally:
+                self.slots.release()
+
+    def shutdown(self) -> None:
+        """Waits for all pending figures to be written."""
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True)
+                self.executor = None
+
+
+def write_figure(
+    fig: Figure,
+    path: Path,
+    writer: OutputWriter | None = None,
+    on_written: Callable[[Figure], None] | None = None,
+    draft: bool = False,
+) -> Future | Path:
+    """
+    Writes the figure in the background if a writer is given, otherwise right
+    away. Returns the future of the background write (holding the path) or the
+    path of the written file.
+    """
+    if writer is not None:
+        return writer.submit(fig, path, on_written, draft)
+    try:
+        save_figure(fig, path, draft)
+    finally:
+        if on_written is not None:
+            on_written(fig)
+    return path
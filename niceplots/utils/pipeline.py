@@ -0,0 +1,493 @@
+import os
+import pickle
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Callable, Iterable
+
+from niceplots.utils.fingerprint import fingerprint, fingerprint_file
+from niceplots.utils.nice_logger import init_logger
+
+logger = init_logger(__file__)
+
+# increase whenever the structure of cached results changes (invalidates the cache)
+CACHE_VERSION = 7
+# results of a node kept in the cache directory (e.g. of several output directories)
+CACHE_ENTRIES_PER_NODE = 4
+
+
+class Node:
+    """
+    A single stage of a nice-plots pipeline.
+    :param name: Unique name of the node.
+    :param func: Callable producing the result of the node. It is called with the
+    results of the input nodes (in the order given by inputs). If it returns a
+    Future the node finishes in the background (its result is only cached once the
+    future completed, the run waits for it before returning). Such nodes should not
+    have dependents.
+    :param inputs: Names of the nodes whose results are required by func.
+    :param files: Files read by func. Their content enters the key of the node.
+    :param params: Plain parameters of func. They enter the key of the node.
+    :param outputs: Files written by func. If they change or disappear the node is
+    recomputed.
+    :param persist: If True the result is cached on disk and reused across runs.
+    :param parallel: If False the node is always executed in the calling thread.
+    :param content_fingerprint: Callable returning a fingerprint of the result.
+    Downstream nodes are keyed by it. Defaults to the key of the node.
+    :param key_func: Callable returning the parts of the input results the node
+    actually depends on. It is called with the results of the input nodes and its
+    return value replaces the fingerprints of the inputs in the key of the node.
+    :param release: If True (and persist) the result counts towards the resident
+    limits of the pipeline. If the pipeline has limits the result is dropped from
+    memory once the nodes of a run that depend on it finished and loaded from the
+    disk cache when needed again.
+    :param lazy_inputs: Inputs passed to func (and key_func) as LazyResult instead
+    of their result. The results are only loaded when called and are not kept in
+    memory for this node.
+    :param deferred_inputs: Inputs passed to func (and key_func) as LazyResult that
+    are kept in memory until the node finished. Results of release nodes that are
+    up to date are only loaded from the disk cache if the node is executed.
+    :param size: Callable returning the size of the result in bytes (for the
+    resident limits of the pipeline).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[..., Any],
+        inputs: Iterable[str] = (),
+        files: Iterable[Path] = (),
+        params: Any = None,
+        outputs: Iterable[Path] = (),
+        persist: bool = False,
+        parallel: bool = True,
+        content_fingerprint: Callable[[Any], str] | None = None,
+        key_func: Callable[..., Any] | None = None,
+        release: bool = False,
+        lazy_inputs: Iterable[str] = (),
+        size: Callable[[Any], int] | None = None,
+        deferred_inputs: Iterable[str] = (),
+    ) -> None:
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.files = tuple(files)
+        self.params = params
+        self.outputs = tuple(outputs)
+        self.persist = persist
+        self.parallel = parallel
+        self.content_fingerprint = content_fingerprint
+        self.key_func = key_func
+        self.release = release and persist
+        self.lazy_inputs = tuple(lazy_inputs)
+        self.size = size
+        self.deferred_inputs = tuple(deferred_inputs)
+
+
+class CacheEntry:
+    """
+    :param released: The result was dropped from memory (it is only cached on
+    disk).
+    """
+
+    def __init__(
+        self, key: str, fingerprint: str, result: Any, released: bool = False
+    ) -> None:
+        self.key = key
+        self.fingerprint = fingerprint
+        self.result = result
+        self.released = released
+
+
+class LazyResult:
+    """
+    Result of a node that is only loaded (from memory or the disk cache of the
+    pipeline) when called.
+    """
+
+    def __init__(self, pipeline: "Pipeline", name: str, fingerprint: str) -> None:
+        self.pipeline = pipeline
+        self.name = name
+        self.fingerprint = fingerprint
+
+    def __call__(self) -> Any:
+        return self.pipeline.load(self.name)
+
+
+class Pipeline:
+    """
+    Small dependency graph executor.
+    Each node is keyed by its name, parameters, the content of the files it reads and
+    the fingerprints of its inputs. Nodes whose key did not change since their last
+    execution are not recomputed. Independent nodes are executed concurrently.
+    :param cache_directory: Directory used to persist results of nodes with
+    persist=True. If None results are only cached in memory.
+    :param n_workers: Maximum number of nodes that are executed concurrently.
+    :param max_resident: Most results of release nodes held in memory at once. A
+    release node only starts once earlier results were released (None = no limit).
+    :param max_resident_bytes: Same as max_resident for the size of the results.
+    :param max_cache_entries: Most results of a node persisted in the cache
+    directory. The least recently used ones are removed when a result is persisted.
+    """
+
+    def __init__(
+        self,
+        cache_directory: Path | None = None,
+        n_workers: int = 1,
+        max_resident: int | None = None,
+        max_resident_bytes: int | None = None,
+        max_cache_entries: int = CACHE_ENTRIES_PER_NODE,
+    ) -> None:
+        self.cache_directory = cache_directory
+        self.max_cache_entries = max(1, max_cache_entries)
+        self.n_workers = max(1, n_workers)
+        self.max_resident = max_resident
+        self.max_resident_bytes = max_resident_bytes
+        self.nodes: dict[str, Node] = {}
+        self.cache: dict[str, CacheEntry] = {}
+        self.executed: list[str] = []
+        # state of a run: results of release nodes held in memory (and their size
+        # in bytes), number of unfinished nodes holding each result, number of
+        # nodes reading it before they are evaluated and the targets
+        self.resident: dict[str, int] = {}
+        self.n_consumers: dict[str, int] = {}
+        self.n_readers: dict[str, int] = {}
+        self.targets: set[str] = set()
+        # nodes whose result is still computed in the background
+        self.background: list[tuple[Node, str, Future]] = []
+        self.lock = threading.Lock()
+
+    def add_node(self, node: Node) -> None:
+        if node.name in self.nodes:
+            raise ValueError(f"Pipeline already contains a node named {node.name}")
+        unknown_inputs = [i for i in node.inputs if i not in self.nodes]
+        if len(unknown_inputs) > 0:
+            raise ValueError(
+                f"Node {node.name} depends on unknown nodes {unknown_inputs}. Nodes must be added after their inputs."
+            )
+        self.nodes[node.name] = node
+
+    def remove_node(self, name: str) -> None:
+        dependents = [n.name for n in self.nodes.values() if name in n.inputs]
+        if len(dependents) > 0:
+            raise ValueError(
+                f"Cannot remove node {name}. Nodes {dependents} depend on it."
+            )
+        self.nodes.pop(name)
+        self.cache.pop(name, None)
+
+    def run(self, targets: Iterable[str] | None = None) -> dict[str, Any]:
+        """
+        Executes all nodes required to produce the targets (all nodes if None)
+        and returns their results keyed by node name (results of release nodes
+        are only returned if they are targets).
+        """
+        targets = None if targets is None else list(targets)
+        needed = self._get_needed(targets)
+        self.executed = []
+        self.background = []
+        fingerprints: dict[str, str] = {}
+        results: dict[str, Any] = {}
+        pending = [name for name in self.nodes if name in needed]
+        running: dict[Future, str] = {}
+        self.resident = {}
+        self.n_consumers = {name: 0 for name in pending}
+        self.n_readers = {name: 0 for name in pending}
+        for name in pending:
+            for i in self._get_held_inputs(self.nodes[name]):
+                self.n_consumers[i] += 1
+            for i in self._get_eager_inputs(self.nodes[name]):
+                self.n_readers[i] += 1
+        self.targets = set() if targets is None else set(targets)
+
+        with ThreadPoolExecutor(max_workers=self.n_workers) as executor:
+            while len(pending) > 0 or len(running) > 0:
+                ready = [
+                    name
+                    for name in pending
+                    if all(i in fingerprints for i in self.nodes[name].inputs)
+                ]
+                # release nodes last, such that they only start if nothing else can
+                ready.sort(key=lambda name: self.nodes[name].release)
+                # if nothing runs the held results can only be released by nodes
+                # waiting for more results than allowed: exceed the limits
+                force = len(running) == 0
+                ran_inline = False
+                for name in ready:
+                    node = self.nodes[name]
+                    if node.release and not (force or self._can_hold()):
+                        continue
+                    force = False
+                    pending.remove(name)
+                    need_result = self.n_readers[name] > 0 or name in self.targets
+                    if node.release:
+                        self.resident[name] = 0
+                    if node.parallel and self.n_workers > 1:
+                        future = executor.submit(
+                            self._evaluate, node, results, fingerprints, need_result
+                        )
+                        running[future] = name
+                    else:
+                        entry = self._evaluate(node, results, fingerprints, need_result)
+                        self._collect(node, entry, results, fingerprints)
+                        ran_inline = True
+                if ran_inline or len(running) == 0:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    node = self.nodes[running.pop(future)]
+                    self._collect(node, future.result(), results, fingerprints)
+        self._wait_for_background()
+        return results
+
+    def _get_eager_inputs(self, node: Node) -> list[str]:
+        return [
+            i
+            for i in node.inputs
+            if i not in node.lazy_inputs and i not in node.deferred_inputs
+        ]
+
+    def _get_held_inputs(self, node: Node) -> list[str]:
+        return [i for i in node.inputs if i not in node.lazy_inputs]
+
+    def has_limits(self) -> bool:
+        return self.max_resident is not None or self.max_resident_bytes is not None
+
+    def _can_hold(self) -> bool:
+        """Whether another result of a release node can be held in memory."""
+        if len(self.resident) == 0:
+            return True
+        if self.max_resident is not None and len(self.resident) >= self.max_resident:
+            return False
+        return (
+            self.max_resident_bytes is None
+            or sum(self.resident.values()) < self.max_resident_bytes
+        )
+
+    def _collect(
+        self,
+        node: Node,
+        entry: CacheEntry,
+        results: dict[str, Any],
+        fingerprints: dict[str, str],
+    ) -> None:
+        """
+        Adds the result of a finished node to the results of the run and releases
+        the results of release nodes that are no longer used by the run.
+        """
+        fingerprints[node.name] = entry.fingerprint
+        results[node.name] = entry.result
+        if node.release:
+            has_size = node.size is not None and entry.result is not None
+            self.resident[node.name] = node.size(entry.result) if has_size else 0
+        inputs = self._get_held_inputs(node)
+        for i in inputs:
+            self.n_consumers[i] -= 1
+        for name in [node.name] + inputs:
+            if (
+                self.has_limits()
+                and name in self.resident
+                and self.n_consumers[name] == 0
+                and name not in self.targets
+            ):
+                self._release(name, results)
+
+    def _release(self, name: str, results: dict[str, Any]) -> None:
+        """Drops the result of a release node from memory (it stays cached on disk)."""
+        logger.debug(f"Releasing the result of node {name} from memory.")
+        results.pop(name)
+        self.resident.pop(name)
+        entry = self.cache.get(name)
+        if entry is not None:
+            self.cache[name] = CacheEntry(
+                entry.key, entry.fingerprint, None, released=True
+            )
+
+    def load(self, name: str) -> Any:
+        """
+        Result of a node of the last run, loaded from the disk cache if it was
+        released from memory.
+        """
+        entry = self.cache.get(name)
+        if entry is not None and not entry.released:
+            return entry.result
+        if entry is not None:
+            loaded = self._load(self.nodes[name], entry.key)
+            if loaded is not None:
+                return loaded.result
+        raise ValueError(f"The result of node {name} is not cached")
+
+    def _get_inputs(
+        self, node: Node, results: dict[str, Any], fingerprints: dict[str, str]
+    ) -> list[Any]:
+        return [
+            (
+                LazyResult(self, i, fingerprints[i])
+                if i in node.lazy_inputs or i in node.deferred_inputs
+                else results[i]
+            )
+            for i in node.inputs
+        ]
+
+    def _get_needed(self, targets: Iterable[str] | None) -> set[str]:
+        if targets is None:
+            return set(self.nodes.keys())
+        needed: set[str] = set()
+        stack = list(targets)
+        while len(stack) > 0:
+            name = stack.pop()
+            if name not in self.nodes:
+                raise ValueError(f"Pipeline does not contain a node named {name}")
+            if name not in needed:
+                needed.add(name)
+                stack.extend(self.nodes[name].inputs)
+        return needed
+
+    def _evaluate(
+        self,
+        node: Node,
+        results: dict[str, Any],
+        fingerprints: dict[str, str],
+        need_result: bool = True,
+    ) -> CacheEntry:
+        """
+        :param need_result: If False an up to date result of a release node is not
+        loaded from the disk cache (only its fingerprint).
+        """
+        inputs = self._get_inputs(node, results, fingerprints)
+        if node.key_func is None:
+            input_key = [fingerprints[i] for i in node.inputs]
+        else:
+            input_key = node.key_func(*inputs)
+        key = fingerprint(
+            CACHE_VERSION,
+            node.name,
+            node.params,
+            [fingerprint_file(f) for f in node.files],
+            input_key,
+        )
+
+        # in memory cache
+        entry = self.cache.get(node.name)
+        if (
+            entry is not None
+            and entry.key == key
+            and (not entry.released or not need_result)
+            and all(os.path.exists(f) for f in node.outputs)
+        ):
+            logger.debug(f"Node {node.name} is up to date.")
+            return entry
+
+        # on disk cache
+        if node.persist:
+            entry = self._load(node, key, need_result or not node.release)
+            if entry is not None:
+                logger.debug(f"Node {node.name} loaded from cache.")
+                self.cache[node.name] = entry
+                return entry
+
+        logger.debug(f"Executing node {node.name}")
+        result = node.func(*inputs)
+        if isinstance(result, Future):
+            # the node finishes in the background (e.g. writing its outputs), it
+            # is cached once the future completed
+            with self.lock:
+                self.background.append((node, key, result))
+            return CacheEntry(key, key, None)
+        return self._finish(node, key, result)
+
+    def _finish(self, node: Node, key: str, result: Any) -> CacheEntry:
+        content_fingerprint = (
+            key
+            if node.content_fingerprint is None
+            else node.content_fingerprint(result)
+        )
+        entry = CacheEntry(key, content_fingerprint, result)
+        self.cache[node.name] = entry
+        self.executed.append(node.name)
+        if node.persist:
+            self._dump(node, entry)
+        return entry
+
+    def _wait_for_background(self) -> None:
+        """
+        Waits for the nodes finishing in the background and caches their results.
+        Raises an error listing all nodes that failed.
+        """
+        errors = []
+        for node, key, future in self.background:
+            error = future.exception()
+            if error is None:
+                self._finish(node, key, future.result())
+            else:
+                self.cache.pop(node.name, None)
+                errors.append(f"{node.name}: {error!r}")
+        self.background = []
+        if len(errors) > 0:
+            raise RuntimeError(
+                f"{len(errors)} pipeline stages failed:\n" + "\n".join(errors)
+            )
+
+    def _get_cache_path(self, node: Node, key: str) -> Path | None:
+        if self.cache_directory is None:
+            return None
+        # one directory per node such that its stale results can be removed
+        return Path(f"{self.cache_directory}/{fingerprint(node.name)}/{key}.pkl")
+
+    def _load(
+        self, node: Node, key: str, with_result: bool = True
+    ) -> CacheEntry | None:
+        """
+        :param with_result: If False only the header of the cache entry is read and
+        the entry is marked as released.
+        """
+        path = self._get_cache_path(node, key)
+        if path is None or not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                _, content_fingerprint, output_digests = pickle.load(f)
+                # outputs must still be the ones that were written by this node
+                if output_digests != [fingerprint_file(o) for o in node.outputs]:
+                    return None
+                if with_result:
+                    entry = CacheEntry(key, content_fingerprint, pickle.load(f))
+                else:
+                    entry = CacheEntry(key, content_fingerprint, None, released=True)
+        except BaseException as error:
+            logger.warning(f"Ignoring unreadable cache entry {path} ({error})")
+            return None
+        try:
+            # mark the entry as recently used
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    def _dump(self, node: Node, entry: CacheEntry) -> None:
+        path = self._get_cache_path(node, entry.key)
+        if path is None:
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        output_digests = [fingerprint_file(f) for f in node.outputs]
+        path_tmp = Path(f"{path}.{os.getpid()}.tmp")
+        with open(path_tmp, "wb") as f:
+            # the header is followed by the result such that it can be read alone
+            pickle.dump((entry.key, entry.fingerprint, output_digests), f)
+            pickle.dump(entry.result, f)
+        os.replace(path_tmp, path)
+        self._prune(path.parent)
+
+    def _prune(self, directory: Path) -> None:
+        """Removes the least recently used results beyond max_cache_entries."""
+        entries = []
+        for path in directory.glob("*.pkl"):
+            try:
+                entries.append((path.stat().st_mtime_ns, path))
+            except FileNotFoundError:
+                # removed by another process
+                continue
+        entries.sort(reverse=True)
+        for _, path in entries[self.max_cache_entries :]:
+            logger.debug(f"Removing stale cache entry {path}")
+            path.unlink(missing_ok=True)
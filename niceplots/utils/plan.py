@@ -0,0 +1,411 @@
+import math
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from niceplots.utils.codebook import CodeBook
+from niceplots.utils.config import Configuration
+from niceplots.utils.data import get_value_map
+from niceplots.utils.engine import PandasEngine
+from niceplots.utils.group_filter import GroupFilter
+from niceplots.utils.nice_logger import init_logger
+from niceplots.utils.sampling import get_sample_size
+
+logger = init_logger(__file__)
+
+# rows read to estimate the size of the data tables and the shares of the groups
+N_SAMPLE_ROWS = 10000
+
+# cost model measured with benchmarks/plan_calibration.py (one core, pdf output)
+# reading the data tables (bytes per second) and evaluating the masks and the
+# aggregates (seconds per value of a variable)
+CSV_BYTES_PER_SECOND = 4.3e7
+MASK_SECONDS_PER_VALUE = 1.8e-8
+AGGREGATE_SECONDS_PER_VALUE = 4.6e-8
+# seconds per figure, per variable, per bar segment (codes x groups) and per
+# character of text
+RENDER_COSTS = {
+    "barplots": (0.049, 0.019, 0.0032, 4.1e-05),
+    "lineplots": (0.0041, 0.021, 0.00074, 9.1e-05),
+    "histograms": (0.036, 0, 2.6e-05, 0),
+    "timelines": (0.033, 8.6e-05, 0.0013, 0.00015),
+}
+
+# memory of a value of the data table (numeric columns), of the two masks of a value
+# and peak memory of reading a table relative to the table
+BYTES_PER_VALUE = 8
+BYTES_PER_MASK_VALUE = 2
+INGEST_PEAK_FACTOR = 2.0
+# memory of a worker rendering a figure
+RENDER_BYTES = 200 * 2**20
+
+
+class DataEstimate:
+    """
+    Size of a data table estimated from its header and first rows.
+    :param exact: True if the sample held the whole table.
+    """
+
+    def __init__(
+        self,
+        label: str,
+        n_rows: int,
+        n_columns: int,
+        n_bytes: int,
+        group_counts: np.ndarray,
+        exact: bool,
+    ) -> None:
+        self.label = label
+        self.n_rows = n_rows
+        self.n_columns = n_columns
+        self.n_bytes = n_bytes
+        self.group_counts = group_counts
+        self.exact = exact
+
+
+def scan_data_file(
+    path: Path,
+    label: str,
+    delimiter: str,
+    group_filter: GroupFilter,
+    n_sample_rows: int = N_SAMPLE_ROWS,
+) -> DataEstimate:
+    """
+    Estimates the number of rows of a data table from the bytes of its first rows
+    and the rows of each group from the shares of the groups in these rows.
+    """
+    n_bytes = os.path.getsize(path)
+    with open(path, "rb") as f:
+        lines = [f.readline()]
+        while len(lines) <= n_sample_rows and lines[-1] != b"":
+            lines.append(f.readline())
+        exact = f.read(1) == b""
+    lines = [line for line in lines if line.strip() != b""]
+    sample = pd.read_csv(path, sep=delimiter, nrows=len(lines) - 1)
+    n_sample = max(len(sample), 1)
+    if exact:
+        n_rows = len(sample)
+    else:
+        header_bytes = len(lines[0])
+        row_bytes = sum(len(line) for line in lines[1:]) / n_sample
+        n_rows = round((n_bytes - header_bytes) / row_bytes)
+    _, counts = PandasEngine().assign_groups(sample, group_filter)
+    group_counts = np.round(counts / n_sample * n_rows).astype(np.int64)
+    return DataEstimate(
+        label, n_rows, len(sample.columns), n_bytes, group_counts, exact
+    )
+
+
+def get_figures(
+    config: Configuration, codebook: CodeBook, plot_type: str
+) -> list[tuple[tuple, int | None]]:
+    """
+    Blocks and page of each figure of a plot type (per data set, timelines are
+    drawn once for all data sets), as rendered by the pipeline.
+    """
+    max_variables = config.plotting.max_variables_per_page
+    if plot_type == "timelines":
+        figures = [(block,) for block in codebook.blocks[~np.isnan(codebook.blocks)]]
+    else:
+        figures = codebook.pack_blocks(
+            config.plotting.max_variables_small_block, max_variables
+        )
+    pages = []
+    for blocks in figures:
+        if len(blocks) > 1:
+            pages.append((blocks, None))
+            continue
+        for page in codebook.get_page_numbers(blocks[0], max_variables):
+            pages.append((blocks, page))
+    return pages
+
+
+def get_figure_features(
+    config: Configuration,
+    codebook: CodeBook,
+    blocks: tuple,
+    page: int | None,
+    n_segments_per_code: int,
+) -> np.ndarray:
+    """
+    Work of a figure as used by the cost model: one figure, the variables, the bar
+    segments (codes x segments per code, e.g. groups) and the characters of text.
+    """
+    rows = []
+    for block in blocks:
+        codebook_block = codebook.codebook[codebook.codebook.block == block]
+        if page is not None:
+            pages = codebook.get_pages(block, config.plotting.max_variables_per_page)
+            codebook_block = codebook_block.iloc[pages[page]]
+        rows.append(codebook_block)
+    codebook_figure = pd.concat(rows)
+    n_segments = 0
+    n_chars = 0
+    for _, row in codebook_figure.iterrows():
+        value_map = get_value_map(row.value_map)
+        n_codes = config.plotting.nbins if value_map is None else len(value_map)
+        n_segments += n_codes * n_segments_per_code
+        n_chars += len(str(row.label))
+        if value_map is not None:
+            n_chars += sum(len(str(label)) for label in value_map.values())
+    return np.array([1, len(codebook_figure), n_segments, n_chars], dtype=float)
+
+
+def format_bytes(n_bytes: float) -> str:
+    for unit in ["B", "KB", "MB", "GB"]:
+        if n_bytes < 1024:
+            return f"{n_bytes:.0f} {unit}"
+        n_bytes /= 1024
+    return f"{n_bytes:.1f} TB"
+
+
+def format_seconds(seconds: float) -> str:
+    if seconds < 60:
+        return f"{seconds:.1f} s"
+    if seconds < 3600:
+        return f"{seconds / 60:.1f} min"
+    return f"{seconds / 3600:.1f} h"
+
+
+def format_blocks(blocks: list[int]) -> str:
+    """Block selector (see --blocks) of the blocks: ranges of consecutive numbers."""
+    ranges: list[list[int]] = []
+    for block in sorted(int(block) for block in blocks):
+        if len(ranges) > 0 and ranges[-1][1] == block - 1:
+            ranges[-1][1] = block
+        else:
+            ranges.append([block, block])
+    return ",".join(
+        f"{first}" if first == last else f"{first}-{last}" for first, last in ranges
+    )
+
+
+class RunPlan:
+    """
+    Estimated work, memory and runtime of a nice-plots run, computed from the
+    codebook, the configuration and estimates of the size of the data tables.
+    :param plot_types: Plot types to render (configuration sections, e.g.
+    barplots).
+    :param n_cores: Cores available to the run.
+    :param memory: Memory available to the run in bytes.
+    :param job_seconds: Longest runtime of a job. Longer runs are split into shards
+    of blocks.
+    """
+
+    def __init__(
+        self,
+        config: Configuration,
+        codebook: CodeBook,
+        data_estimates: list[DataEstimate],
+        plot_types: list[str],
+        n_cores: int,
+        memory: int | None = None,
+        job_seconds: float = 3600,
+    ) -> None:
+        self.data_estimates = data_estimates
+        self.plot_types = plot_types
+        self.n_cores = max(1, n_cores)
+        self.memory = memory
+        self.job_seconds = job_seconds
+        self.n_groups = len(config.data.groups)
+        self.n_variables = len(codebook.codebook)
+        self.n_plotted = int((~codebook.codebook.block.isna()).sum())
+
+        sample_size = get_sample_size(config.data.sample_size, config.data.sample_error)
+        self.ingest_seconds = []
+        self.resident_bytes = []
+        for data in data_estimates:
+            n_rows = data.n_rows
+            if sample_size is not None:
+                n_rows = int(np.minimum(data.group_counts, sample_size).sum())
+            self.ingest_seconds.append(
+                data.n_bytes / CSV_BYTES_PER_SECOND
+                + data.n_rows * self.n_variables * MASK_SECONDS_PER_VALUE
+                + n_rows * self.n_plotted * AGGREGATE_SECONDS_PER_VALUE
+            )
+            self.resident_bytes.append(
+                n_rows * data.n_columns * BYTES_PER_VALUE
+                + n_rows * self.n_variables * BYTES_PER_MASK_VALUE
+            )
+        if config.data.max_resident_data_sets is not None:
+            n_resident = config.data.max_resident_data_sets
+            self.resident_bytes = sorted(self.resident_bytes)[-n_resident:]
+
+        self.blocks = self.get_blocks(config, codebook)
+
+    def get_blocks(self, config: Configuration, codebook: CodeBook) -> pd.DataFrame:
+        """
+        Work of each block: variables, pages, bar segments and characters of text,
+        and the figures and estimated render seconds per plot type (figures of
+        packed small blocks are split by their variables).
+        """
+        blocks = codebook.blocks[~np.isnan(codebook.blocks)]
+        table = pd.DataFrame({"block": blocks.astype(int)})
+        features = np.array(
+            [
+                get_figure_features(config, codebook, (block,), None, self.n_groups)
+                for block in blocks
+            ]
+        )
+        table["variables"] = features[:, 1].astype(int)
+        table["pages"] = [
+            len(
+                codebook.get_page_numbers(block, config.plotting.max_variables_per_page)
+            )
+            for block in blocks
+        ]
+        table["segments"] = features[:, 2].astype(int)
+        table["text"] = features[:, 3].astype(int)
+        n_data = len(self.data_estimates)
+        for plot_type in self.plot_types:
+            figures = np.zeros(len(blocks))
+            seconds = np.zeros(len(blocks))
+            # timelines have one segment per data set and group, the other plot
+            # types are drawn once per data set
+            n_segments_per_code = n_data if plot_type == "timelines" else self.n_groups
+            n_copies = 1 if plot_type == "timelines" else n_data
+            for figure_blocks, page in get_figures(config, codebook, plot_type):
+                cost = float(
+                    np.dot(
+                        RENDER_COSTS[plot_type],
+                        get_figure_features(
+                            config, codebook, figure_blocks, page, n_segments_per_code
+                        ),
+                    )
+                )
+                index = np.isin(blocks, figure_blocks)
+                share = table.variables[index] / table.variables[index].sum()
+                figures[index] += n_copies * share
+                seconds[index] += n_copies * cost * share
+            table[f"{plot_type} figures"] = figures
+            table[f"{plot_type} seconds"] = seconds
+        return table
+
+    def get_render_seconds(self, plot_type: str | None = None) -> float:
+        plot_types = self.plot_types if plot_type is None else [plot_type]
+        return float(sum(self.blocks[f"{p} seconds"].sum() for p in plot_types))
+
+    def get_n_figures(self, plot_type: str | None = None) -> int:
+        plot_types = self.plot_types if plot_type is None else [plot_type]
+        return int(round(sum(self.blocks[f"{p} figures"].sum() for p in plot_types)))
+
+    def get_peak_bytes(self, n_workers: int) -> float:
+        """
+        Memory of the data sets kept in memory, of reading the largest data table
+        and of rendering with n_workers workers.
+        """
+        if len(self.resident_bytes) == 0:
+            return n_workers * RENDER_BYTES
+        return (
+            sum(self.resident_bytes)
+            + (INGEST_PEAK_FACTOR - 1) * max(self.resident_bytes)
+            + n_workers * RENDER_BYTES
+        )
+
+    def get_wall_seconds(
+        self, n_workers: int, render_seconds: float | None = None
+    ) -> float:
+        """
+        Runtime with n_workers workers, assuming the data sets and the figures are
+        processed concurrently (an upper bound on the speedup, the workers are
+        threads).
+        """
+        if render_seconds is None:
+            render_seconds = self.get_render_seconds()
+        ingest = max(self.ingest_seconds, default=0.0)
+        ingest = max(ingest, sum(self.ingest_seconds) / n_workers)
+        return ingest + render_seconds / n_workers
+
+    def get_n_workers(self) -> int:
+        """
+        Most workers that are useful (at most one per core and figure) and whose
+        peak memory fits into the available memory.
+        """
+        n_tasks = max(self.get_n_figures(), len(self.data_estimates), 1)
+        n_workers = min(self.n_cores, n_tasks)
+        while (
+            n_workers > 1
+            and self.memory is not None
+            and self.get_peak_bytes(n_workers) > self.memory
+        ):
+            n_workers -= 1
+        return n_workers
+
+    def get_shards(self, n_workers: int) -> list[list[int]]:
+        """
+        Consecutive blocks rendered by each job such that every job (reading all
+        data sets) stays below job_seconds. A single shard if no split is needed.
+        """
+        ingest = self.get_wall_seconds(n_workers, 0.0)
+        render = self.get_render_seconds() / n_workers
+        budget = self.job_seconds - ingest
+        if ingest + render <= self.job_seconds or budget <= 0:
+            return [list(self.blocks.block)]
+        n_shards = math.ceil(render / budget)
+        seconds = sum(self.blocks[f"{p} seconds"] for p in self.plot_types)
+        bounds = np.cumsum(seconds) / seconds.sum() * n_shards
+        shard_ids = np.minimum(np.ceil(bounds - 1e-9) - 1, n_shards - 1).astype(int)
+        return [
+            list(self.blocks.block[shard_ids == id_s])
+            for id_s in range(n_shards)
+            if (shard_ids == id_s).any()
+        ]
+
+    def get_summary(self) -> str:
+        n_workers = self.get_n_workers()
+        lines = []
+        n_rows = sum(data.n_rows for data in self.data_estimates)
+        n_bytes = sum(data.n_bytes for data in self.data_estimates)
+        estimated = "" if all(d.exact for d in self.data_estimates) else "about "
+        lines.append(
+            f"{len(self.data_estimates)} data sets with {estimated}{n_rows} rows ({format_bytes(n_bytes)}), {self.n_plotted} plotted variables in {len(self.blocks)} blocks, {self.n_groups} groups"
+        )
+        lines.append("")
+        table = self.blocks.copy()
+        for column in table.columns:
+            if column.endswith("seconds"):
+                table[column] = table[column].map(format_seconds)
+            elif column.endswith("figures"):
+                table[column] = table[column].map(lambda n: f"{n:g}")
+        lines.append(table.to_string(index=False))
+        lines.append("")
+        figures = ", ".join(f"{p} {self.get_n_figures(p)}" for p in self.plot_types)
+        lines.append(f"Figures: {self.get_n_figures()} ({figures})")
+        lines.append(
+            f"Memory: {format_bytes(sum(self.resident_bytes))} data in memory, {format_bytes(self.get_peak_bytes(1))} peak with one worker, {format_bytes(RENDER_BYTES)} per additional worker"
+        )
+        render = ", ".join(
+            f"{p} {format_seconds(self.get_render_seconds(p))}" for p in self.plot_types
+        )
+        lines.append(
+            f"Runtime with one worker: ingest and aggregation {format_seconds(sum(self.ingest_seconds))}, rendering {format_seconds(self.get_render_seconds())} ({render})"
+        )
+        lines.append(
+            f"Recommended: --n_workers {n_workers} (about {format_seconds(self.get_wall_seconds(n_workers))}, {format_bytes(self.get_peak_bytes(n_workers))} peak)"
+        )
+        if self.memory is not None and self.get_peak_bytes(1) > self.memory:
+            lines.append(
+                f"Warning: the run needs more than the available {format_bytes(self.memory)}. Sample the data (sample_size or sample_error) or bound the data sets in memory (max_resident_data_sets)."
+            )
+        if max(self.ingest_seconds, default=0.0) > self.job_seconds:
+            lines.append(
+                "Warning: reading a data table takes longer than a job. Sample the data (sample_size or sample_error) or keep a column store (column_store)."
+            )
+        shards = self.get_shards(n_workers)
+        if len(shards) > 1:
+            lines.append(
+                f"Sharding: {len(shards)} jobs of at most {format_seconds(self.job_seconds)}, run with:"
+            )
+            for shard in shards:
+                lines.append(f"\t--blocks {format_blocks(shard)}")
+        return "\n".join(lines)
+
+
+def get_memory() -> int | None:
+    """Physical memory of the machine in bytes (None if unknown)."""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return None
@@ -1,12 +1,18 @@
 # Authors: Dominik Zuercher, Valeria Glauser
 from matplotlib.axes import Axes
-from matplotlib.figure import Figure
+from matplotlib.backend_bases import RendererBase
+from matplotlib.figure import Figure, FigureBase
+from matplotlib.font_manager import FontProperties
 from matplotlib.text import Text
+from matplotlib.transforms import Bbox
 
 from niceplots.utils.nice_logger import init_logger
 
 logger = init_logger(__file__)
 
+# average width of a character relative to the font size (to truncate text)
+CHARACTER_WIDTH_REL = 0.6
+
 
 class WrapText(Text):
     """
@@ -16,6 +22,8 @@ class WrapText(Text):
     :param width_units: either 'pixels', 'inches' or 'figure'.
     If 'figure' or 'inches' then figure needs to be passed
     :param figure: Figure object
+    :param truncate: If True lines that are too long are truncated (estimated from
+    the number of characters) instead of wrapped. Cheaper, used for drafts.
     """
 
     def __init__(
@@ -29,13 +37,14 @@ class WrapText(Text):
         width_units: str = "display",
         figure: Figure | None = None,
         ax: Axes | None = None,
+        truncate: bool = False,
         **kwargs,
     ):
         # width needs to be given in display units
         if width_units == "display":
             self.width = width
         elif width_units == "figure":
-            if not isinstance(figure, Figure):
+            if not isinstance(figure, FigureBase):
                 raise ValueError(
                     "If width_units=figure need to pass a valid Figure object."
                 )
@@ -46,7 +55,7 @@ class WrapText(Text):
                     "If width_units=axis need to pass a valid Axis object."
                 )
         elif width_units == "inches":
-            if not isinstance(figure, Figure):
+            if not isinstance(figure, FigureBase):
                 raise ValueError(
                     "If width_units=inches need to pass a valid Figure object."
                 )
@@ -56,7 +65,7 @@ class WrapText(Text):
 
         # x needs to be given in figure units
         if x_units == "display":
-            if not isinstance(figure, Figure):
+            if not isinstance(figure, FigureBase):
                 raise ValueError(
                     "If x_units=figure need to pass a valid Figure object."
                 )
@@ -65,26 +74,24 @@ class WrapText(Text):
             pass
         elif x_units == "axis":
             if not isinstance(ax, Axes):
-                raise ValueError(
-                    "If x_units=axis need to pass a valid Axis object.")
+                raise ValueError("If x_units=axis need to pass a valid Axis object.")
             x = axis_to_figure(x, 0.0, ax)[0]
         elif x_units == "inches":
-            if not isinstance(figure, Figure):
+            if not isinstance(figure, FigureBase):
                 raise ValueError(
                     "If x_units=inches need to pass a valid Figure object."
                 )
             x = inches_to_figure(x, 0.0, figure)[0]
         elif x_units == "data":
             if not isinstance(ax, Axes):
-                raise ValueError(
-                    "If x_units=data need to pass a valid Axis object.")
+                raise ValueError("If x_units=data need to pass a valid Axis object.")
             x = data_to_figure(x, 0.0, ax)[0]
         else:
             raise ValueError(f"x_unit {x_units} not known")
 
         # y needs to be given in figure units
         if y_units == "display":
-            if not isinstance(figure, Figure):
+            if not isinstance(figure, FigureBase):
                 raise ValueError(
                     "If y_units=figure need to pass a valid Figure object."
                 )
@@ -93,16 +100,14 @@ class WrapText(Text):
             pass
         elif y_units == "axis":
             if not isinstance(ax, Axes):
-                raise ValueError(
-                    "If y_units=axis need to pass a valid Axis object.")
+                raise ValueError("If y_units=axis need to pass a valid Axis object.")
             y = axis_to_figure(0.0, y, ax)[1]
         elif y_units == "data":
             if not isinstance(ax, Axes):
-                raise ValueError(
-                    "If y_units=data need to pass a valid Axis object.")
+                raise ValueError("If y_units=data need to pass a valid Axis object.")
             y = data_to_figure(0.0, y, ax)[1]
         elif y_units == "inches":
-            if not isinstance(figure, Figure):
+            if not isinstance(figure, FigureBase):
                 raise ValueError(
                     "If y_units=inches need to pass a valid Figure object."
                 )
@@ -112,7 +117,9 @@ class WrapText(Text):
         # Note: width must be in points because pdfrenderer is used as backend
         dpi = figure.dpi if figure is not None else 96.0
         self.width = self.width * 72.0 / dpi
-        super().__init__(x=x, y=y, text=text, wrap=True, **kwargs)
+        if truncate:
+            text = truncate_text(text, self.width, kwargs.get("fontproperties"))
+        super().__init__(x=x, y=y, text=text, wrap=not truncate, **kwargs)
 
     ####################################
     # Overriding matplotlib Text methods
@@ -121,36 +128,81 @@ class WrapText(Text):
         return self.width
 
 
+def truncate_text(
+    text: str, width: float, fontproperties: FontProperties | dict | None = None
+) -> str:
+    """
+    Truncates each line of the text to the number of characters fitting into the
+    width (in points) without measuring the text.
+    """
+    if fontproperties is None:
+        fontproperties = FontProperties()
+    elif isinstance(fontproperties, dict):
+        fontproperties = FontProperties(**fontproperties)
+    size = fontproperties.get_size_in_points()
+    n_characters = max(1, int(width / (CHARACTER_WIDTH_REL * size)))
+    lines = [
+        line if len(line) <= n_characters else line[: n_characters - 1] + "…"
+        for line in text.split("\n")
+    ]
+    return "\n".join(lines)
+
+
 def figure_to_display(
     width: float, height: float, figure: Figure
 ) -> tuple[float, float]:
-    return figure.transFigure.transform((width, height))
+    return figure.transSubfigure.transform((width, height))
 
 
 def display_to_figure(
     width: float, height: float, figure: Figure
 ) -> tuple[float, float]:
-    return figure.transFigure.inverted().transform((width, height))
+    return figure.transSubfigure.inverted().transform((width, height))
 
 
 def axis_to_figure(width: float, height: float, ax: Axes) -> tuple[float, float]:
     in_display_units = ax.transAxes.transform((width, height))
-    return ax.figure.transFigure.inverted().transform(in_display_units)
+    return ax.figure.transSubfigure.inverted().transform(in_display_units)
 
 
 def data_to_figure(width: float, height: float, ax: Axes) -> tuple[float, float]:
     in_display_units = ax.transData.transform((width, height))
-    return ax.figure.transFigure.inverted().transform(in_display_units)
+    return ax.figure.transSubfigure.inverted().transform(in_display_units)
 
 
 def inches_to_figure(
     width: float, height: float, figure: Figure
 ) -> tuple[float, float]:
+    # relative to the lower left corner of the (sub)figure
     in_display_units = figure.dpi_scale_trans.transform((width, height))
-    return figure.transFigure.inverted().transform(in_display_units)
+    in_display_units = in_display_units + figure.bbox.p0
+    return figure.transSubfigure.inverted().transform(in_display_units)
 
 
 def inches_to_display(
     width: float, height: float, figure: Figure
 ) -> tuple[float, float]:
     return figure.dpi_scale_trans.transform((width, height))
+
+
+def get_extent(fig: FigureBase, renderer: RendererBase) -> Bbox:
+    """
+    Extent (in display units) of the axes, texts and legends of a figure and its
+    panels. The layouts have no ticks and all other artists are drawn within
+    these, such that this gives the same box as fig.get_tightbbox without drawing
+    the figure first.
+    """
+    extents = []
+    for ax in fig.axes:
+        extents.append(ax.bbox)
+        extents.extend(text.get_window_extent(renderer) for text in ax.texts)
+        if ax.legend_ is not None:
+            extents.append(ax.legend_.get_window_extent(renderer))
+    for artist in fig.texts + fig.artists + fig.legends:
+        if artist.get_visible():
+            extents.append(artist.get_window_extent(renderer))
+    extents.extend(get_extent(panel, renderer) for panel in fig.subfigs)
+    extents = [bbox for bbox in extents if bbox.width or bbox.height]
+    if len(extents) == 0:
+        return fig.bbox
+    return Bbox.union(extents)
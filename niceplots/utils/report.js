@@ -0,0 +1,515 @@
+// Draws the plots of a nice-plots report in the browser from the aggregates
+// embedded by niceplots/utils/report.py. The geometry follows the matplotlib
+// layouts in niceplots/plotting (all lengths in points).
+(function () {
+  "use strict";
+
+  const POINTS_PER_INCH = 72;
+  const SVG_NS = "http://www.w3.org/2000/svg";
+  const DEFAULT_GROUP = "nice_plots_default_group";
+  // as in barplot.py and histogram.py
+  const BARPLOT_UNITS_LEGEND = 2;
+  const LINEPLOT_UNITS_LEGEND = 2;
+  const HISTOGRAM_UNITS_LEGEND = 1;
+  const WIDTH_COLORBAR_REL = 0.5;
+  const HEIGHT_COLORBAR_REL = 0.2;
+  const MARGIN_FACTOR = 1.1;
+  const LINE_SPACING = 1.2;
+  // as in sampling.py
+  const Z_95 = 1.959964;
+
+  const report = JSON.parse(document.getElementById("aggregates").textContent);
+  const options = report.options;
+  const context = document.createElement("canvas").getContext("2d");
+
+  function inches(layout) {
+    const points = {};
+    for (const key in layout) {
+      points[key] = layout[key] * POINTS_PER_INCH;
+    }
+    return points;
+  }
+
+  function cssFont(font) {
+    const family = String(font.family || "sans-serif").replace("_", "-");
+    return [
+      font.style || "normal",
+      font.weight || "normal",
+      `${font.size}px`,
+      `"${family}", "DejaVu Sans", sans-serif`,
+    ].join(" ");
+  }
+
+  // greedy wrapping of each paragraph at the given width (as WrapText)
+  function wrap(text, font, width) {
+    context.font = cssFont(font);
+    const lines = [];
+    for (const paragraph of String(text).split("\n")) {
+      let line = "";
+      for (const word of paragraph.split(" ")) {
+        const candidate = line === "" ? word : `${line} ${word}`;
+        if (line !== "" && width && context.measureText(candidate).width > width) {
+          lines.push(line);
+          line = word;
+        } else {
+          line = candidate;
+        }
+      }
+      lines.push(line);
+    }
+    return lines;
+  }
+
+  function textWidth(text, font) {
+    context.font = cssFont(font);
+    return context.measureText(text).width;
+  }
+
+  class Canvas {
+    constructor(width, height) {
+      this.svg = document.createElementNS(SVG_NS, "svg");
+      this.svg.setAttribute("width", `${width}pt`);
+      this.svg.setAttribute("height", `${height}pt`);
+      this.svg.setAttribute("viewBox", `0 0 ${width} ${height}`);
+      this.svg.style.overflow = "visible";
+    }
+
+    add(name, attributes) {
+      const element = document.createElementNS(SVG_NS, name);
+      for (const key in attributes) {
+        element.setAttribute(key, attributes[key]);
+      }
+      this.svg.appendChild(element);
+      return element;
+    }
+
+    rect(x, y, width, height, fill, stroke) {
+      this.add("rect", {
+        x: x,
+        y: y,
+        width: width,
+        height: height,
+        fill: fill || "none",
+        stroke: stroke || "none",
+        "stroke-width": 0.8,
+      });
+    }
+
+    line(x1, y1, x2, y2, color, width) {
+      this.add("line", {
+        x1: x1,
+        y1: y1,
+        x2: x2,
+        y2: y2,
+        stroke: color,
+        "stroke-width": width,
+      });
+    }
+
+    marker(x, y, size, color) {
+      // filled X marker of matplotlib (size in points)
+      const d = size / 2;
+      const t = size / 6;
+      const points = [
+        [-d, -d + t], [-d + t, -d], [0, -t], [d - t, -d], [d, -d + t], [t, 0],
+        [d, d - t], [d - t, d], [0, t], [-d + t, d], [-d, d - t], [-t, 0],
+      ];
+      this.add("polygon", {
+        points: points.map((p) => `${x + p[0]},${y + p[1]}`).join(" "),
+        fill: color,
+      });
+    }
+
+    // multiline text; align is start, middle or end, baseline center or top
+    text(x, y, text, font, align, width, baseline, color) {
+      const lines = wrap(text, font, width);
+      const step = LINE_SPACING * font.size;
+      let top = y - (lines.length * step) / 2;
+      if (baseline === "top") {
+        top = y;
+      }
+      const element = this.add("text", {
+        x: x,
+        "text-anchor": align || "start",
+        fill: color || "black",
+        style: `font: ${cssFont(font)}`,
+      });
+      lines.forEach((line, i) => {
+        const span = document.createElementNS(SVG_NS, "tspan");
+        span.setAttribute("x", x);
+        span.setAttribute("y", top + (i + 0.5) * step);
+        span.setAttribute("dominant-baseline", "central");
+        span.textContent = line;
+        element.appendChild(span);
+      });
+    }
+
+    // legend in two columns (filled column by column) above the plot at (x, y)
+    legend(x, y, entries, font) {
+      const size = font.size;
+      const rows = Math.ceil(entries.length / 2);
+      const step = 1.7 * size;
+      let column = x + 0.9 * size;
+      for (const ids of [[0, rows], [rows, entries.length]]) {
+        let widthText = 0;
+        for (let i = ids[0]; i < ids[1]; i++) {
+          const center = y - 0.9 * size - (rows - (i - ids[0]) - 0.5) * step;
+          this.rect(column, center - 0.35 * size, 2 * size, 0.7 * size, entries[i][0]);
+          this.text(column + 2.8 * size, center, entries[i][1], font);
+          widthText = Math.max(widthText, textWidth(entries[i][1], font));
+        }
+        column += 2.8 * size + widthText + 2 * size;
+      }
+    }
+  }
+
+  function getGroups(data) {
+    return options.groups.map((group) => data.groups.indexOf(group));
+  }
+
+  function getRange(block, data) {
+    let min = Infinity;
+    let max = -Infinity;
+    for (const variable of block.variables) {
+      for (const code of data.variables[variable].codes) {
+        min = Math.min(min, code);
+        max = Math.max(max, code);
+      }
+    }
+    return [min, max];
+  }
+
+  function linspace(start, stop, n) {
+    return Array.from({ length: n }, (_, i) =>
+      n > 1 ? start + ((stop - start) * i) / (n - 1) : start
+    );
+  }
+
+  // counts per code summed into the bins (the last bin includes its right edge)
+  function rebin(codes, counts, edges) {
+    const nBins = edges.length - 1;
+    const binned = new Array(nBins).fill(0);
+    codes.forEach((code, i) => {
+      let index = edges.findIndex((edge) => edge > code) - 1;
+      if (index === -2 && code === edges[nBins]) {
+        index = nBins - 1;
+      }
+      if (index >= 0 && index < nBins) {
+        binned[index] += counts[i];
+      }
+    });
+    return binned;
+  }
+
+  // as get_summary in barplot.py: sampled data sets (fraction not null) show the
+  // sampled fraction, the largest error of the shares and the error of the mean
+  function getSummary(variable, id, fraction) {
+    const n = variable.n[id];
+    if (n === 0) {
+      return "n = 0";
+    }
+    let count = `${n}`;
+    let mean = variable.mean[id].toFixed(2);
+    if (fraction !== null) {
+      const shareError = Z_95 * Math.sqrt(0.25 / n) * Math.sqrt(1 - fraction);
+      count += ` (${Math.round(100 * fraction)}%, ± ${Math.round(100 * shareError)}%)`;
+      if (variable.mean_error[id] !== null) {
+        mean += ` ± ${variable.mean_error[id].toFixed(2)}`;
+      }
+    }
+    const std = variable.std[id] === null ? "nan" : variable.std[id].toFixed(2);
+    return `n = ${count}\nm = ${mean}\ns = ${std}\nE = ${variable.E[id]}`;
+  }
+
+  // positions of the bar centers relative to the center of a question
+  function getBarPositions(nBars, barHeight, pad) {
+    let positions = [];
+    if (nBars % 2 === 0) {
+      for (let i = 0; i < nBars / 2; i++) {
+        positions.push((pad + barHeight) / 2 + i * (barHeight + pad));
+      }
+    } else {
+      positions.push(0);
+      for (let i = 0; i < (nBars - 1) / 2; i++) {
+        positions.push((i + 1) * (barHeight + pad));
+      }
+    }
+    positions = positions.concat(positions.filter((p) => p > 0).map((p) => -p));
+    return positions.sort((a, b) => b - a);
+  }
+
+  function plotBarplot(block, data) {
+    const config = options.barplots;
+    const layout = inches(config.layout);
+    const groups = getGroups(data);
+    const nVariables = block.variables.length;
+    const width =
+      layout.width_question + layout.width_groups + layout.width_plot +
+      layout.width_summary + 3 * layout.width_pad;
+    const canvas = new Canvas(
+      width, (nVariables + BARPLOT_UNITS_LEGEND) * layout.height_question
+    );
+    const xPlot = layout.width_question + layout.width_groups + 2 * layout.width_pad;
+    const topPlot = BARPLOT_UNITS_LEGEND * layout.height_question;
+    const padGroups = config.layout.height_rel_pad_groups;
+    const barHeight =
+      (1 - config.layout.height_rel_pad_questions - (groups.length - 1) * padGroups) /
+      groups.length;
+    const positions = getBarPositions(groups.length, barHeight, padGroups);
+
+    let [min, max] = getRange(block, data);
+    const edges = linspace(min, max, options.plotting.nbins + 1);
+    canvas.rect(xPlot, topPlot, layout.width_plot, nVariables * layout.height_question,
+      "none", "black");
+    block.variables.forEach((name, idV) => {
+      const variable = data.variables[name];
+      const center = topPlot + (idV + 0.5) * layout.height_question;
+      canvas.text(0, center, block.labels[idV], config.font_questions, "start",
+        layout.width_question);
+      groups.forEach((id, idG) => {
+        const y = center - positions[idG] * layout.height_question;
+        let counts = variable.counts[id];
+        if (block.value_map === null) {
+          counts = rebin(variable.codes, counts, edges);
+        }
+        const total = counts.reduce((a, b) => a + b, 0);
+        let offset = 0;
+        counts.forEach((count, idC) => {
+          if (count <= 0) {
+            return;
+          }
+          const w = count / total;
+          canvas.rect(xPlot + offset * layout.width_plot,
+            y - (barHeight * layout.height_question) / 2, w * layout.width_plot,
+            barHeight * layout.height_question, block.colors[idC]);
+          if (w >= 0.05) {
+            canvas.text(xPlot + (offset + w / 2) * layout.width_plot, y,
+              String(count), config.font_plot, "middle", null, "center",
+              block.text_color);
+          }
+          offset += w;
+        });
+        if (options.groups[idG] !== DEFAULT_GROUP) {
+          canvas.text(xPlot - layout.width_pad, y, options.groups[idG],
+            config.font_groups, "end", layout.width_groups);
+        }
+        canvas.text(xPlot + layout.width_plot + layout.width_pad, y,
+          getSummary(variable, id, data.fractions === null ? null : data.fractions[id]),
+          config.font_summary, "start",
+          layout.width_summary);
+      });
+    });
+
+    // legend: named categories or a colour bar between the first and last name
+    const names =
+      block.value_map === null
+        ? edges.slice(0, -1).map((low, i) =>
+            `${low} - ${edges[i + 1]} ${options.plotting.unit}`)
+        : block.value_map.map((entry) => entry[1]);
+    if (names.every((name) => name !== "")) {
+      canvas.legend(xPlot, topPlot,
+        names.map((name, i) => [block.colors[i], name]), config.font_legend);
+    } else {
+      const widthBar = layout.width_plot * WIDTH_COLORBAR_REL;
+      const heightBar = layout.height_question * HEIGHT_COLORBAR_REL;
+      const xBar = xPlot + (layout.width_plot - widthBar) / 2;
+      const yBar = topPlot - 0.1 * layout.height_question - heightBar;
+      block.colors.forEach((color, i) => {
+        canvas.rect(xBar + (i * widthBar) / block.colors.length, yBar,
+          widthBar / block.colors.length, heightBar, color);
+      });
+      canvas.text(xBar - layout.width_pad, yBar + heightBar / 2, names[0],
+        config.font_legend, "end");
+      canvas.text(xBar + widthBar + layout.width_pad, yBar + heightBar / 2,
+        names[names.length - 1], config.font_legend, "start");
+    }
+    return canvas.svg;
+  }
+
+  function plotLineplot(block, data) {
+    const config = options.lineplots;
+    const layout = inches(config.layout);
+    const groups = getGroups(data);
+    const nVariables = block.variables.length;
+    const width =
+      layout.width_question + 2 * layout.width_labels + layout.width_plot +
+      3 * layout.width_pad;
+    const canvas = new Canvas(
+      width, (nVariables + LINEPLOT_UNITS_LEGEND) * layout.height_question
+    );
+    const xPlot = layout.width_question + layout.width_labels + 2 * layout.width_pad;
+    const topPlot = LINEPLOT_UNITS_LEGEND * layout.height_question;
+
+    let min, max, labels, nBins;
+    if (block.value_map === null) {
+      [min, max] = getRange(block, data);
+      labels = [String(Math.trunc(min)), String(Math.trunc(max))];
+      nBins = options.plotting.nbins;
+    } else {
+      const entries = block.value_map;
+      [min, max] = [entries[0][0], entries[entries.length - 1][0]];
+      labels = [entries[0][1], entries[entries.length - 1][1]];
+      nBins = entries.length;
+    }
+    if (config.invert) {
+      labels.reverse();
+    }
+    const edgeHeight = (config.layout.rel_edge_line_height * layout.height_question) / 2;
+    const crosses = [];
+    block.variables.forEach((name, idV) => {
+      const variable = data.variables[name];
+      const center = topPlot + (idV + 0.5) * layout.height_question;
+      canvas.text(0, center, block.labels[idV], config.font_questions, "start",
+        layout.width_question);
+      canvas.text(xPlot - layout.width_pad, center, labels[0], config.font_labels,
+        "end", layout.width_labels);
+      canvas.text(xPlot + layout.width_plot + layout.width_pad, center, labels[1],
+        config.font_labels, "start", layout.width_labels);
+      canvas.line(xPlot, center, xPlot + layout.width_plot, center, "black", 3);
+      for (const x of linspace(0, 1, nBins)) {
+        const xEdge = xPlot + x * layout.width_plot;
+        canvas.line(xEdge, center - edgeHeight, xEdge, center + edgeHeight, "black", 3);
+      }
+      crosses.push(groups.map((id) => {
+        if (variable.mean[id] === null) {
+          return [NaN, center];
+        }
+        let mean = (variable.mean[id] - min) / (max - min);
+        if (config.invert) {
+          mean = 1 - mean;
+        }
+        // error bar of the mean of sampled data sets (95% confidence)
+        let error = 0;
+        if (variable.mean_error !== null && variable.mean_error[id] !== null) {
+          error = (variable.mean_error[id] / (max - min)) * layout.width_plot;
+        }
+        return [xPlot + mean * layout.width_plot, center, error];
+      }));
+    });
+    groups.forEach((_, idG) => {
+      const color = config.colors[idG];
+      crosses.forEach((points, idV) => {
+        const [x, y] = points[idG];
+        if (idV > 0 && !isNaN(x) && !isNaN(crosses[idV - 1][idG][0])) {
+          canvas.line(crosses[idV - 1][idG][0], crosses[idV - 1][idG][1], x, y, color, 3);
+        }
+      });
+      crosses.forEach((points) => {
+        const [x, y, error] = points[idG];
+        if (isNaN(x)) {
+          return;
+        }
+        if (error > 0) {
+          canvas.line(x - error, y, x + error, y, color, 2);
+          canvas.line(x - error, y - 4, x - error, y + 4, color, 2);
+          canvas.line(x + error, y - 4, x + error, y + 4, color, 2);
+        }
+        canvas.marker(x, y, 20, color);
+      });
+    });
+    const entries = options.groups
+      .map((group, i) => [config.colors[i], group])
+      .filter((entry) => entry[1] !== DEFAULT_GROUP);
+    canvas.legend(xPlot, topPlot, entries, config.font_legend);
+    return canvas.svg;
+  }
+
+  function plotHistogram(block, data) {
+    const config = options.histograms;
+    const layout = inches(config.layout);
+    const groups = getGroups(data);
+    const nVariables = block.variables.length;
+    let labels, counts;
+    if (block.value_map === null) {
+      return null;
+    } else if (nVariables === 1) {
+      // answers of a single question
+      labels = block.value_map.map((entry) => entry[1]);
+      counts = groups.map((id) => data.variables[block.variables[0]].counts[id]);
+    } else if (block.value_map.length === 2) {
+      // number of yes (1=Yes, 0=No) of each question
+      labels = block.labels;
+      counts = groups.map((id) =>
+        block.variables.map((name) => {
+          const variable = data.variables[name];
+          return variable.codes.reduce((a, code, i) => a + code * variable.counts[id][i], 0);
+        })
+      );
+    } else {
+      return null;
+    }
+    const maxCount = Math.trunc(Math.max(0, ...counts.flat()) * MARGIN_FACTOR);
+    const nBars = labels.length;
+    const heightRow =
+      (groups.length + config.layout.height_rel_pad_questions) * layout.height_bar;
+    const width = layout.width_labels + layout.width_plot + layout.width_pad;
+    const canvas = new Canvas(width, (nBars + HISTOGRAM_UNITS_LEGEND) * heightRow);
+    const xPlot = layout.width_labels + layout.width_pad;
+    const topPlot = HISTOGRAM_UNITS_LEGEND * heightRow;
+    const barHeight = (1 - config.layout.height_rel_pad_questions) / groups.length;
+    // as histogram.get_geometry
+    let positions = [];
+    if (groups.length % 2 === 0) {
+      for (let i = 0; i < groups.length / 2; i++) {
+        positions.push(0.5 * barHeight + i * barHeight);
+      }
+      positions = positions.concat(positions.map((p) => -p));
+    } else {
+      for (let i = 0; i < (groups.length - 1) / 2; i++) {
+        positions.push(i * barHeight);
+      }
+      positions = [0].concat(positions, positions.map((p) => -p));
+    }
+
+    canvas.rect(xPlot, topPlot, layout.width_plot, nBars * heightRow, "none", "black");
+    labels.forEach((label, idV) => {
+      const center = topPlot + (idV + 0.5) * heightRow;
+      canvas.text(layout.width_labels, center, label, config.font_labels, "end",
+        layout.width_labels);
+      groups.forEach((_, idG) => {
+        const y = center - positions[idG] * heightRow;
+        const value = maxCount > 0 ? counts[idG][idV] / maxCount : 0;
+        canvas.rect(xPlot, y - (barHeight * heightRow) / 2, value * layout.width_plot,
+          barHeight * heightRow, config.colors[idG]);
+        canvas.text(xPlot + (value + config.layout.bar_label_pad) * layout.width_plot,
+          y, String(counts[idG][idV]), config.font_bar_labels, "start");
+      });
+    });
+    const [n, nNoAnswer] = data.variables[block.variables[0]].totals;
+    canvas.text(
+      xPlot + layout.width_plot - layout.width_summary - layout.pad_summary_right,
+      topPlot + layout.pad_summary_top, `n = ${n}\nE = ${nNoAnswer}`,
+      config.font_summary, "start", layout.width_summary, "top");
+    const entries = options.groups
+      .map((group, i) => [config.colors[i], group])
+      .filter((entry) => entry[1] !== DEFAULT_GROUP);
+    canvas.legend(xPlot, topPlot, entries, config.font_legend);
+    return canvas.svg;
+  }
+
+  const PLOTS = {
+    barplot: plotBarplot,
+    lineplot: plotLineplot,
+    histogram: plotHistogram,
+  };
+
+  const container = document.getElementById("plots");
+  const dataNames = Object.keys(report.data);
+  for (const block of report.blocks) {
+    for (const plotType of options.plot_types) {
+      for (const dataName of dataNames) {
+        const svg = PLOTS[plotType](block, report.data[dataName]);
+        if (svg === null) {
+          continue;
+        }
+        const figure = document.createElement("figure");
+        const caption = document.createElement("figcaption");
+        caption.textContent =
+          `${plotType} ${block.block}` + (dataNames.length > 1 ? ` (${dataName})` : "");
+        figure.appendChild(caption);
+        figure.appendChild(svg);
+        container.appendChild(figure);
+      }
+    }
+  }
+})();
@@ -0,0 +1,194 @@
+import json
+from pathlib import Path
+
+import numpy as np
+
+from niceplots.utils.codebook import CodeBook
+from niceplots.utils.config import Configuration
+from niceplots.utils.data import DataCollection, get_value_map
+from niceplots.utils.nice_logger import init_logger
+from niceplots.utils.sampling import get_mean_errors
+
+logger = init_logger(__file__)
+
+# script drawing the plots in the browser (bundled into the report)
+PATH_SCRIPT = Path(__file__).with_name("report.js")
+
+# decimals of the means and standard deviations in the report
+N_DECIMALS = 4
+
+# configuration options used by the script
+LAYOUT_OPTIONS = {
+    "barplots": ["layout", "font_legend", "font_questions", "font_groups"]
+    + ["font_summary", "font_plot"],
+    "lineplots": ["layout", "invert", "font_legend", "font_questions"]
+    + ["font_labels"],
+    "histograms": ["layout", "font_legend", "font_labels", "font_summary"]
+    + ["font_bar_labels"],
+}
+
+TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>nice-plots: {name}</title>
+<style>
+body {{ font-family: "DejaVu Sans", sans-serif; margin: 2em; }}
+figure {{ margin: 0 0 2em 0; }}
+figcaption {{ font-size: 10pt; color: #666; }}
+</style>
+</head>
+<body>
+<h1>{name}</h1>
+<div id="plots"></div>
+<script id="aggregates" type="application/json">{aggregates}</script>
+<script>
+{script}
+</script>
+</body>
+</html>
+"""
+
+
+def get_report_path(config: Configuration) -> Path:
+    return Path(f"{config.output_directory}/report_{config.output_name}.html")
+
+
+def get_colors(colors: list, n_colors: int | None = None) -> list[str]:
+    """
+    Converts matplotlib colors (or the name of a colormap sampled as in the
+    barplots) to hex strings understood by the browser.
+    """
+    # imported here such that only the colors are loaded (no rendering)
+    import matplotlib as mpl
+
+    if n_colors is not None:
+        colors = mpl.colormaps[colors](np.linspace(0.15, 0.85, n_colors))
+    return [mpl.colors.to_hex(color) for color in colors]
+
+
+def round_values(values: np.ndarray) -> list:
+    """Rounded values as list (NaN as null)."""
+    values = np.round(np.asarray(values, dtype=float), N_DECIMALS)
+    return [None if np.isnan(value) else value for value in values.tolist()]
+
+
+def get_blocks(config: Configuration, codebook: CodeBook) -> list[dict]:
+    """Codebook entries of the blocks: variables, code mapping and styling options."""
+    blocks = []
+    for block in codebook.blocks[~np.isnan(codebook.blocks)]:
+        codebook_block = codebook.codebook[codebook.codebook.block == block]
+        first = codebook_block.iloc[0]
+        value_map = get_value_map(first["value_map"])
+        n_codes = config.plotting.nbins if value_map is None else len(value_map)
+        colors = get_colors(first["barplots.color_scheme"], n_codes)
+        if first["barplots.invert"]:
+            colors = colors[::-1]
+        blocks.append(
+            {
+                "block": int(block),
+                "variables": list(codebook_block.variable),
+                "labels": list(codebook_block.label),
+                "value_map": (
+                    None if value_map is None else [list(i) for i in value_map.items()]
+                ),
+                "colors": colors,
+                "text_color": get_colors([first["barplots.text_color"]])[0],
+            }
+        )
+    return blocks
+
+
+def get_data(data_collection: DataCollection, codebook: CodeBook) -> dict:
+    """
+    Aggregates of the plotted variables of each data set: counts per group and
+    code, number of answers, no answers, mean and standard deviation per group.
+    For sampled data sets also the sampled fraction of each group and the half
+    width of the 95% confidence interval of the means (null otherwise).
+    """
+    variables = list(codebook.codebook.variable[~codebook.codebook.block.isna()])
+    report_data = {}
+    for name in data_collection.data_object_names:
+        aggregates = data_collection.get_data_aggregates(name, variables)
+        statistics = aggregates.get_statistics(variables)
+        std = statistics.std
+        fractions = data_collection.get_sampling_fractions(name)
+        mean_errors = None
+        if fractions is not None:
+            mean_errors = get_mean_errors(statistics.count, std, fractions)
+        report_variables = {}
+        for id_v, variable in enumerate(variables):
+            report_variables[variable] = {
+                "codes": aggregates.codes[variable].tolist(),
+                "counts": aggregates.counts[variable].tolist(),
+                "n": statistics.count[id_v].tolist(),
+                "E": statistics.n_no_answer[id_v].tolist(),
+                "mean": round_values(statistics.mean[id_v]),
+                "std": round_values(std[id_v]),
+                "mean_error": (
+                    None if mean_errors is None else round_values(mean_errors[id_v])
+                ),
+                "totals": list(aggregates.totals[variable]),
+            }
+        report_data[name] = {
+            "groups": aggregates.group_names,
+            "fractions": None if fractions is None else round_values(fractions),
+            "variables": report_variables,
+        }
+    return report_data
+
+
+def get_report(
+    data_collection: DataCollection,
+    codebook: CodeBook,
+    config: Configuration,
+    plot_names: list[str],
+) -> dict:
+    """
+    Everything the script needs to draw the plots: the aggregates of the data
+    sets, the blocks of the codebook and the layout options of the configuration.
+    """
+    options: dict = {
+        "plot_types": plot_names,
+        "groups": list(config.data.groups.keys()),
+        "plotting": {
+            "nbins": config.plotting.nbins,
+            "unit": config.plotting.unit,
+            "max_variables_per_page": config.plotting.max_variables_per_page,
+        },
+    }
+    for section, keys in LAYOUT_OPTIONS.items():
+        options[section] = {key: getattr(getattr(config, section), key) for key in keys}
+    options["lineplots"]["colors"] = get_colors(config.lineplots.colors)
+    options["histograms"]["colors"] = get_colors(config.histograms.colors)
+    return {
+        "name": config.output_name,
+        "options": options,
+        "blocks": get_blocks(config, codebook),
+        "data": get_data(data_collection, codebook),
+    }
+
+
+def write_report(
+    data_collection: DataCollection,
+    codebook: CodeBook,
+    config: Configuration,
+    plot_names: list[str],
+    path: Path,
+) -> None:
+    """
+    Writes a self-contained HTML report. The aggregates are embedded as JSON and
+    the plots are drawn by the browser.
+    """
+    report = get_report(data_collection, codebook, config, plot_names)
+    # compact JSON that cannot end the script element
+    aggregates = json.dumps(report, separators=(",", ":"), allow_nan=False)
+    aggregates = aggregates.replace("</", "<\\/")
+    html = TEMPLATE.format(
+        name=config.output_name,
+        aggregates=aggregates,
+        script=PATH_SCRIPT.read_text(encoding="utf-8"),
+    )
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(html)
+    logger.info(f"Wrote report to {path}")
@@ -0,0 +1,131 @@
+import math
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from niceplots.utils.engine import PandasEngine, get_usecols
+from niceplots.utils.group_filter import GroupFilter
+from niceplots.utils.nice_logger import init_logger
+
+logger = init_logger(__file__)
+
+# column holding the number of rows of the group of each row in the full data table
+POPULATION_COLUMN = "nice_plots_population"
+
+# rows read at once when sampling
+CHUNK_SIZE = 100000
+
+# quantile of the standard normal distribution for 95% confidence intervals
+Z_95 = 1.959964
+
+
+def get_sample_size(
+    sample_size: int | None = None, sample_error: float | None = None
+) -> int | None:
+    """
+    Number of rows sampled per group (None if the data is not sampled). For a
+    target error the sample is large enough that the 95% confidence interval of
+    any share is at most +- sample_error wide (worst case of a share of 50%).
+    """
+    sizes = []
+    if sample_size is not None:
+        sizes.append(sample_size)
+    if sample_error is not None:
+        sizes.append(math.ceil((Z_95 / (2 * sample_error)) ** 2))
+    return max(sizes) if len(sizes) > 0 else None
+
+
+def get_mean_error(std: float, n: int, fraction: float) -> float:
+    """
+    Half width of the 95% confidence interval of a mean estimated from n answers
+    of a random sample holding the given fraction of the rows.
+    """
+    return Z_95 * std / np.sqrt(n) * np.sqrt(1 - fraction)
+
+
+def get_mean_errors(
+    count: np.ndarray, std: np.ndarray, fractions: np.ndarray
+) -> np.ndarray:
+    """
+    Half widths of the 95% confidence intervals of the means of each variable and
+    group (count and std of shape (n_variables, n_groups), fractions of the rows of
+    each group in the sample). NaN for groups without answers.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        errors = get_mean_error(std, count, fractions)
+    errors[count == 0] = np.nan
+    return errors
+
+
+def get_share_error(n: int, fraction: float) -> float:
+    """
+    Upper bound of the half width of the 95% confidence intervals of the shares of
+    the answers (reached for a share of 50%).
+    """
+    return Z_95 * np.sqrt(0.25 / n) * np.sqrt(1 - fraction)
+
+
+def get_smallest_keys(
+    keys: np.ndarray, group_codes: np.ndarray, n_rows_per_group: int
+) -> np.ndarray:
+    """Mask of the rows with the n_rows_per_group smallest keys of each group."""
+    order = np.lexsort((keys, group_codes))
+    sorted_codes = group_codes[order]
+    rank = np.arange(order.size) - np.searchsorted(sorted_codes, sorted_codes)
+    mask = np.zeros(order.size, dtype=bool)
+    mask[order[rank < n_rows_per_group]] = True
+    return mask
+
+
+def read_sample(
+    path: Path,
+    delimiter: str,
+    group_filter: GroupFilter,
+    n_rows_per_group: int,
+    seed: int = 0,
+    chunk_size: int = CHUNK_SIZE,
+    columns: set[str] | None = None,
+) -> pd.DataFrame:
+    """
+    Reads a reproducible sample of the data table stratified by group, holding at
+    most n_rows_per_group rows of each group. The table is read in chunks such that
+    only the sample is kept in memory. Every row gets a random key (drawn in the
+    order of the rows, such that the sample does not depend on the chunk size) and
+    the rows with the smallest keys of each group are kept. Rows that are not in
+    any group are dropped. The number of rows of each group in the full table is
+    added as column POPULATION_COLUMN. Only the given columns are read (all if
+    None).
+    """
+    engine = PandasEngine()
+    rng = np.random.default_rng(seed)
+    population = np.zeros(len(group_filter.group_names), dtype=np.int64)
+    samples = []
+    keys = np.array([])
+    group_codes = np.array([], dtype=np.int64)
+    for chunk in pd.read_csv(
+        path, sep=delimiter, chunksize=chunk_size, usecols=get_usecols(columns)
+    ):
+        if POPULATION_COLUMN in chunk.columns:
+            raise ValueError(
+                f"Your data must not contain a column named: {POPULATION_COLUMN}"
+            )
+        chunk_codes, counts = engine.assign_groups(chunk, group_filter)
+        population += counts
+        chunk_keys = rng.random(len(chunk))
+        grouped = chunk_codes >= 0
+        samples.append(chunk[grouped])
+        keys = np.concatenate([keys, chunk_keys[grouped]])
+        group_codes = np.concatenate([group_codes, chunk_codes[grouped]])
+
+        mask = get_smallest_keys(keys, group_codes, n_rows_per_group)
+        samples = [pd.concat(samples, ignore_index=True)[mask]]
+        keys = keys[mask]
+        group_codes = group_codes[mask]
+
+    sample = pd.concat(samples, ignore_index=True)
+    sample[POPULATION_COLUMN] = population[group_codes]
+    logger.info(
+        f"Sampled {len(sample)} of {population.sum()} grouped rows of {path} (at most {n_rows_per_group} rows per group)."
+    )
+    return sample
@@ -0,0 +1,135 @@
+import fnmatch
+from typing import Sequence
+
+from niceplots.utils.codebook import CodeBook
+from niceplots.utils.nice_logger import init_logger
+
+logger = init_logger(__file__)
+
+# separator of the first and last name of a range of variables or data labels
+RANGE_SEPARATOR = ".."
+
+
+def split_items(selectors: Sequence[str]) -> list[str]:
+    """Items of selectors given as several options and/or separated by commas."""
+    return [
+        item.strip()
+        for selector in selectors
+        for item in selector.split(",")
+        if item.strip() != ""
+    ]
+
+
+def match_names(items: list[str], names: list[str], kind: str) -> list[str]:
+    """
+    Names matched by any of the items (in the order of names): exact names, globs
+    (e.g. VAR0*) or ranges first..last in the order of names.
+    """
+    selected = set()
+    for item in items:
+        if RANGE_SEPARATOR in item and item not in names:
+            first, last = item.split(RANGE_SEPARATOR, 1)
+            for name in [first, last]:
+                if name not in names:
+                    raise ValueError(f"Range {item} ends at unknown {kind} {name}")
+            start, end = names.index(first), names.index(last)
+            if start > end:
+                raise ValueError(f"Range {item} is empty ({last} is before {first})")
+            matched = names[start : end + 1]
+        else:
+            matched = fnmatch.filter(names, item)
+        if len(matched) == 0:
+            raise ValueError(f"{item} does not match any {kind}")
+        selected.update(matched)
+    return [name for name in names if name in selected]
+
+
+def match_blocks(items: list[str], blocks: list[int]) -> list[int]:
+    """
+    Blocks matched by any of the items: block numbers or ranges first-last (or
+    first..last).
+    """
+    selected = set()
+    for item in items:
+        bounds = item.replace(RANGE_SEPARATOR, "-").split("-")
+        try:
+            first, last = int(bounds[0]), int(bounds[-1])
+        except ValueError as error:
+            raise ValueError(
+                f"Blocks must be numbers or ranges like 2-5, got {item}"
+            ) from error
+        if len(bounds) > 2 or first > last:
+            raise ValueError(f"Blocks must be numbers or ranges like 2-5, got {item}")
+        matched = [block for block in blocks if first <= block <= last]
+        if len(matched) == 0:
+            raise ValueError(f"{item} does not match any block")
+        selected.update(matched)
+    return [block for block in blocks if block in selected]
+
+
+class Selection:
+    """
+    Blocks, variables and data labels a run is restricted to. Each selector holds
+    items given as several options and/or separated by commas. Blocks are selected
+    by number or range (2-5), variables and data labels by name, glob (VAR0*) or
+    range (VAR02..VAR09, in the order of the codebook or of the data labels).
+    Variables select the blocks they belong to (blocks are always plotted
+    completely). Empty selectors select everything.
+    """
+
+    def __init__(
+        self,
+        blocks: Sequence[str] = (),
+        variables: Sequence[str] = (),
+        labels: Sequence[str] = (),
+    ) -> None:
+        self.blocks = split_items(blocks)
+        self.variables = split_items(variables)
+        self.labels = split_items(labels)
+
+    def is_empty(self) -> bool:
+        return len(self.blocks) + len(self.variables) + len(self.labels) == 0
+
+    def select_labels(self, data_labels: Sequence[str]) -> list[str]:
+        if len(self.labels) == 0:
+            return list(data_labels)
+        return match_names(self.labels, list(data_labels), "data label")
+
+    def select_blocks(
+        self, codebook: CodeBook, figures: list[tuple] | None = None
+    ) -> list[int]:
+        """
+        Selected blocks. If the figures of the blocks are given the blocks plotted
+        in the same figure as a selected block are selected as well.
+        """
+        codebook_plotted = codebook.codebook[~codebook.codebook.block.isna()]
+        blocks = [int(block) for block in codebook_plotted.block.unique()]
+        if len(self.blocks) > 0:
+            blocks = match_blocks(self.blocks, blocks)
+        if len(self.variables) > 0:
+            variables = match_names(
+                self.variables, list(codebook_plotted.variable), "plotted variable"
+            )
+            codebook_selected = codebook_plotted[
+                codebook_plotted.variable.isin(variables)
+            ]
+            blocks = [b for b in blocks if (codebook_selected.block == b).any()]
+            if len(blocks) == 0:
+                raise ValueError(
+                    f"The variables {self.variables} are not in the blocks {self.blocks}"
+                )
+        if figures is not None:
+            blocks = expand_packed_blocks(blocks, figures)
+        return blocks
+
+
+def expand_packed_blocks(blocks: list[int], figures: list[tuple]) -> list[int]:
+    """
+    Adds the blocks that are plotted in the same figure as a selected block (small
+    blocks packed into one figure), such that the figure is complete.
+    """
+    selected = set(blocks)
+    for figure_blocks in figures:
+        if any(int(block) in selected for block in figure_blocks):
+            selected.update(int(block) for block in figure_blocks)
+    return sorted(selected)
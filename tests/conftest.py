@@ -4,6 +4,16 @@ from pathlib import Path
 
 import pytest
 
+from niceplots.utils.config import CACHE_VARIABLE
+
+
+@pytest.fixture(autouse=True)
+def cache_directory(tmp_path, monkeypatch):
+    # every test starts with an empty cache (and leaves the user's cache alone)
+    path = tmp_path / "cache"
+    monkeypatch.setenv(CACHE_VARIABLE, str(path))
+    return path
+
 
 @pytest.fixture()
 def get_test_inputs(request):
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+from niceplots.utils.aggregate import (
+    Statistics,
+    count_per_group,
+    get_bin_index,
+    get_code_index,
+    get_group_moments,
+    rebin,
+)
+
+
+@pytest.mark.parametrize(
+    "codes", [[1, 2, 3, 4, 5], [5, 4, 3, 2, 1], [-2, 0, 2.5, 1e6], [0, 10, 3]]
+)
+def test_code_counts(codes):
+    rng = np.random.default_rng(2)
+    codes = np.asarray(codes, dtype=float)
+    values = rng.choice(np.append(codes, [7.5, -9]), 1000)
+    group_codes = rng.integers(-1, 3, 1000)
+
+    counts = count_per_group(get_code_index(values, codes), group_codes, 3, codes.size)
+    for id_g in range(3):
+        d = values[group_codes == id_g]
+        assert np.array_equal(counts[id_g], [(d == code).sum() for code in codes])
+
+
+def test_bin_counts():
+    rng = np.random.default_rng(3)
+    values = rng.uniform(0, 10, 1000)
+    values[:10] = 10.0
+    group_codes = rng.integers(-1, 2, 1000)
+    bin_edges = np.linspace(1, 10, 6)
+
+    counts = count_per_group(get_bin_index(values, bin_edges), group_codes, 2, 5)
+    for id_g in range(2):
+        expected = np.histogram(values[group_codes == id_g], bins=bin_edges)[0]
+        assert np.array_equal(counts[id_g], expected)
+
+
+def test_statistics():
+    rng = np.random.default_rng(4)
+    values = rng.normal(1e6, 1.0, 1000)
+    group_codes = rng.integers(-1, 3, 1000)
+    no_answer_group_codes = rng.integers(-1, 3, 50)
+
+    def get_statistics(rows):
+        statistics = Statistics(["VAR"], ["a", "b", "c"])
+        (
+            statistics.count[0],
+            statistics.n_no_answer[0],
+            statistics.mean[0],
+            statistics.m2[0],
+        ) = get_group_moments(values[rows], group_codes[rows], no_answer_group_codes, 3)
+        return statistics
+
+    statistics = get_statistics(slice(None))
+    for id_g in range(3):
+        d = values[group_codes == id_g]
+        assert statistics.count[0, id_g] == d.size
+        assert statistics.n_no_answer[0, id_g] == (no_answer_group_codes == id_g).sum()
+        assert np.isclose(statistics.mean[0, id_g], d.mean())
+        assert np.isclose(statistics.std[0, id_g], d.std(ddof=1))
+
+    # statistics of disjoint parts can be merged
+    merged = get_statistics(slice(0, 300)).merge(get_statistics(slice(300, None)))
+    assert np.array_equal(merged.count, statistics.count)
+    assert np.allclose(merged.mean, statistics.mean)
+    assert np.allclose(merged.std, statistics.std)
+
+    table = statistics.to_frame()
+    assert list(table.group) == ["a", "b", "c"]
+    assert list(table.columns) == [
+        "variable",
+        "group",
+        "n",
+        "n_no_answer",
+        "mean",
+        "std",
+    ]
+
+
+def test_rebin():
+    rng = np.random.default_rng(5)
+    values = rng.integers(0, 20, 500).astype(float)
+    group_codes = rng.integers(0, 2, 500)
+    codes = np.unique(values)
+    counts = count_per_group(get_code_index(values, codes), group_codes, 2, codes.size)
+    bin_edges = np.linspace(0, 19, 6)
+
+    rebinned = rebin(codes, counts, bin_edges)
+    for id_g in range(2):
+        expected = np.histogram(values[group_codes == id_g], bins=bin_edges)[0]
+        assert np.array_equal(rebinned[id_g], expected)
@@ -1,3 +1,8 @@
+import io
+from pathlib import Path
+from xml.etree import ElementTree
+
+import numpy as np
 import pytest
 
 from niceplots.plotting import barplot
@@ -24,3 +29,41 @@ def test_barplots(get_test_inputs):
     data = setup_data(config, codebook, data_paths, data_labels)
 
     barplot.plot_barplots(config, codebook, data)
+
+
+def test_barplots_svg(tmp_path):
+    example_dir = Path(__file__).parent.parent / "examples"
+    config_path = tmp_path / "example_config.yml"
+    config_path.write_text(
+        (example_dir / "example_config.yml")
+        .read_text()
+        .replace('renderer: "matplotlib"', 'renderer: "svg"')
+    )
+    config = setup_config(tmp_path, config_path, "test_svg", "4", "svg", False)
+    codebook = setup_codebook(config, example_dir / "example_codebook.csv")
+    data = setup_data(config, codebook, (example_dir / "example_data.csv",), ("data",))
+
+    barplot.plot_barplots(config, codebook, data)
+
+    for block in codebook.blocks[~np.isnan(codebook.blocks)]:
+        svg = ElementTree.parse(config.get_plot_path("barplot", block)).getroot()
+        width, height = (float(svg.get(key)[:-2]) for key in ["width", "height"])
+
+        # same extent as the matplotlib figure (up to the text metrics)
+        n_variables = int((codebook.codebook.block == block).sum())
+        fig, axes = barplot.get_layout(config, n_variables, barplot.N_UNITS_LEGEND)
+        barplot.draw_block(
+            fig,
+            axes,
+            block,
+            slice(0, n_variables),
+            data.data,
+            config,
+            codebook,
+            barplot.N_UNITS_LEGEND,
+        )
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format="svg", bbox_inches="tight")
+        reference = ElementTree.fromstring(buffer.getvalue())
+        for key, value in [("width", width), ("height", height)]:
+            assert value == pytest.approx(float(reference.get(key)[:-2]), abs=1)
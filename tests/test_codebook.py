@@ -17,3 +17,14 @@ def test_codebook(get_test_inputs):
     codebook = setup_codebook(config, codebook_path)
 
     assert config.codebook_file == codebook.path_codebook
+
+    # blocks are split into pages of about equal size
+    block = codebook.codebook.block.value_counts().idxmax()
+    n_variables = int((codebook.codebook.block == block).sum())
+    assert codebook.get_pages(block, None) == [slice(0, n_variables)]
+    assert codebook.get_page_numbers(block, n_variables) == [None]
+    pages = codebook.get_pages(block, n_variables // 2)
+    assert len(pages) == 2
+    assert pages[0].stop == pages[1].start
+    assert pages[-1].stop == n_variables
+    assert codebook.get_page_numbers(block, 1) == list(range(n_variables))
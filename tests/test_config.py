@@ -15,3 +15,9 @@ def test_config(get_test_inputs):
     # non default format
     assert config.plotting.format == "svg"
     assert tuple(config.data.groups.keys()) == ("Group 1", "Others")
+
+    # the svg barplot renderer requires the svg format
+    config.barplots.renderer = "svg"
+    config.plotting.format = "pdf"
+    with pytest.raises(ValueError):
+        config.check_config()
@@ -1,8 +1,22 @@
+import pickle
+
+import numpy as np
+import pandas as pd
 import pytest
 
+from niceplots.utils import data as data_module
 from niceplots.utils.codebook import setup_codebook
 from niceplots.utils.config import setup_config
-from niceplots.utils.data import setup_data
+from niceplots.utils.data import (
+    Data,
+    append_data_object,
+    get_append_state_path,
+    get_column_store_path,
+    read_column_store,
+    setup_data,
+    setup_data_object,
+)
+from niceplots.utils.engine import PandasEngine
 
 
 @pytest.mark.parametrize(
@@ -46,3 +60,264 @@ def test_multi_data(get_test_inputs):
     data = setup_data(config, codebook, data_paths, data_labels)
 
     assert config.data_file == data.path_data
+
+
+@pytest.mark.parametrize(
+    "get_test_inputs", [["test_data_masks"]], indirect=["get_test_inputs"]
+)
+def test_data_masks(get_test_inputs):
+    name = get_test_inputs[0]
+    prefix = get_test_inputs[1]
+    config_path = get_test_inputs[2]
+    codebook_path = get_test_inputs[3]
+
+    config = setup_config(prefix, config_path, name, "4", "pdf", False)
+    codebook = setup_codebook(config, codebook_path)
+    codebook.codebook.loc[0, "missing_label"] = -1
+    row = codebook.codebook.iloc[0]
+    no_answer_code = config.data.no_answer_code
+    values = [1, 2, no_answer_code, np.nan, 3, no_answer_code]
+    groups = {"all": "True", "low": f"{row.variable} < 3"}
+    df = pd.DataFrame({variable: values for variable in codebook.codebook.variable})
+    data = Data(
+        df,
+        "data",
+        groups,
+        codebook.codebook.variable,
+        no_answer_code,
+        from_source=True,
+    )
+    data.compute_masks(codebook)
+
+    assert np.array_equal(data.get_values(row.variable), [1, 2, 3])
+    assert np.array_equal(data.get_values(row.variable, "low"), [1, 2])
+    assert data.get_n_no_answers(row.variable) == 2
+    assert data.get_n_no_answers(row.variable, "low") == 0
+    assert data.get_n_no_answers(row.variable, "all") == 2
+
+    # missing codes are neither valid answers nor no answers
+    codebook.codebook.loc[0, "missing_label"] = 2
+    data.compute_masks(codebook)
+    assert np.array_equal(data.get_values(row.variable), [1, 3])
+    codebook.codebook.loc[0, "missing_label"] = no_answer_code
+    data.compute_masks(codebook)
+    assert np.array_equal(data.get_values(row.variable), [1, 2, 3])
+    assert data.get_n_no_answers(row.variable) == 0
+
+
+@pytest.mark.parametrize(
+    "get_test_inputs", [["test_data_sample"]], indirect=["get_test_inputs"]
+)
+def test_data_sample(get_test_inputs):
+    name = get_test_inputs[0]
+    prefix = get_test_inputs[1]
+    config_path = get_test_inputs[2]
+    codebook_path = get_test_inputs[3]
+    data_path = get_test_inputs[4]
+
+    config = setup_config(prefix, config_path, name, "4", "pdf", False)
+    codebook = setup_codebook(config, codebook_path)
+    data = setup_data(config, codebook, (data_path,), ("data",)).data
+    variables = list(codebook.codebook.variable)
+
+    sample = data.get_sample(15)
+    # at most 15 rows of each group, rows that are not in any group are dropped
+    assert list(sample.group_counts) == [min(15, n) for n in data.group_counts]
+    assert len(sample.group_codes) == sum(sample.group_counts)
+    assert len(sample.data) == len(sample.group_codes)
+    # the sample is aggregated like the full data, which is not modified
+    statistics = sample.get_statistics(variables)
+    assert (statistics.count.sum(axis=1) <= sample.group_counts.sum()).all()
+    assert len(data.aggregates.variables) == 0
+
+    # groups with fewer rows are kept completely
+    sample = data.get_sample(len(data.group_codes))
+    assert np.array_equal(
+        sample.get_statistics(variables).count, data.get_statistics(variables).count
+    )
+
+
+@pytest.mark.parametrize(
+    "get_test_inputs", [["test_data_append"]], indirect=["get_test_inputs"]
+)
+@pytest.mark.parametrize("id_column", [None, "ID"])
+def test_data_append(get_test_inputs, tmp_path, monkeypatch, id_column):
+    name = get_test_inputs[0]
+    prefix = get_test_inputs[1]
+    config_path = get_test_inputs[2]
+    codebook_path = get_test_inputs[3]
+    data_path = get_test_inputs[4]
+
+    config = setup_config(prefix, config_path, name, "4", "pdf", False)
+    config.cache_directory = tmp_path
+    config.data.id_column = id_column
+    codebook = setup_codebook(config, codebook_path)
+    variables = list(codebook.codebook.variable)
+    df = pd.read_csv(data_path)
+    path = tmp_path / "data.csv"
+
+    def append(rows: slice) -> Data:
+        df.iloc[rows].to_csv(path, index=False)
+        return append_data_object(config, codebook, path, "data", "key")
+
+    def assert_equal_full(data: Data) -> None:
+        full = setup_data_object(config, codebook, path, "data")
+        assert np.array_equal(data.group_counts, full.group_counts)
+        statistics = data.get_statistics(variables)
+        full_statistics = full.get_statistics(variables)
+        assert np.array_equal(statistics.count, full_statistics.count)
+        assert np.array_equal(statistics.n_no_answer, full_statistics.n_no_answer)
+        assert np.allclose(statistics.mean, full_statistics.mean, equal_nan=True)
+        assert np.allclose(statistics.std, full_statistics.std, equal_nan=True)
+        for variable in variables:
+            codes = full.aggregates.codes[variable]
+            assert np.array_equal(data.aggregates.codes[variable], codes)
+            counts = full.aggregates.counts[variable]
+            assert np.array_equal(data.aggregates.counts[variable], counts)
+
+    # number of rows assigned to groups by each run
+    assigned = []
+    assign_groups = PandasEngine.assign_groups
+
+    def count_assigned(self, frame, group_filter):
+        assigned.append(len(frame))
+        return assign_groups(self, frame, group_filter)
+
+    monkeypatch.setattr(PandasEngine, "assign_groups", count_assigned)
+    append(slice(0, 30))
+    data = append(slice(0, 45))
+    assert len(data.group_codes) == 45
+    assert_equal_full(data)
+    # only the new rows are read, assigned to groups and checked
+    assert assigned[:2] == [30, 15]
+    # the state only holds the aggregates, the rows are in column stores
+    with open(get_append_state_path(config, path, "data"), "rb") as f:
+        state = pickle.load(f)
+    assert state.size == path.stat().st_size
+    assert len(state.chunks) == 2
+    assert not any(isinstance(value, Data) for value in vars(state).values())
+    # unchanged table
+    assert len(append(slice(0, 45)).group_codes) == 45
+
+    if id_column is None:
+        # rows were modified -> the table is read again
+        data = append(slice(10, 55))
+        assert (
+            data.get_fingerprint()
+            == setup_data_object(config, codebook, path, "data").get_fingerprint()
+        )
+    else:
+        # new responses are found anywhere in the table
+        data = append(slice(None, None, -1))
+    assert len(data.group_codes) == (45 if id_column is None else 55)
+    assert_equal_full(data)
+
+    if id_column is None:
+        # a row that is still being written is read by the next run
+        text = path.read_text()
+        row = df.iloc[[0]].to_csv(header=False, index=False)
+        path.write_text(text + row[:3])
+        assert (
+            len(append_data_object(config, codebook, path, "data", "key").group_codes)
+            == 45
+        )
+        # the stores of many runs are combined
+        monkeypatch.setattr(data_module, "MAX_APPEND_CHUNKS", 1)
+        path.write_text(text + row)
+        data = append_data_object(config, codebook, path, "data", "key")
+        assert assigned[-1] == 1
+        assert len(data.group_codes) == 46
+        assert_equal_full(data)
+        with open(get_append_state_path(config, path, "data"), "rb") as f:
+            assert len(pickle.load(f).chunks) == 1
+        assert_equal_full(append_data_object(config, codebook, path, "data", "key"))
+
+
+@pytest.mark.parametrize(
+    "get_test_inputs", [["test_data_resident"]], indirect=["get_test_inputs"]
+)
+def test_data_resident(get_test_inputs):
+    name = get_test_inputs[0]
+    prefix = get_test_inputs[1]
+    config_path = get_test_inputs[2]
+    codebook_path = get_test_inputs[3]
+    data_path = get_test_inputs[4]
+    data_labels = ("wave1", "wave2", "wave3")
+
+    config = setup_config(prefix, config_path, name, "4", "pdf", False)
+    codebook = setup_codebook(config, codebook_path)
+    variables = list(codebook.codebook.variable[~codebook.codebook.block.isna()])
+    full = setup_data(config, codebook, (data_path,) * 3, data_labels)
+    expected = full.get_aggregates(codebook)
+
+    config.data.max_resident_data_sets = 1
+    data = setup_data(config, codebook, (data_path,) * 3, data_labels)
+    # all data sets were read and checked, only the last one is kept
+    assert list(data) == list(data_labels)
+    assert list(data._resident) == ["wave3"]
+    # data sets are read again when accessed (also as attribute)
+    assert data.wave1.name == "wave1"
+    assert list(data._resident) == ["wave1"]
+    assert not hasattr(data, "wave4")
+
+    # aggregates are kept when a data set is released
+    aggregates = data.get_data_aggregates("wave1", variables)
+    data.release("wave1")
+    assert len(data._resident) == 0
+    assert data.get_data_aggregates("wave1", variables) is aggregates
+    assert len(data._resident) == 0
+    pd.testing.assert_frame_equal(data.get_aggregates(codebook), expected)
+    assert list(data._resident) == ["wave3"]
+    assert data.get_fingerprint() == full.get_fingerprint()
+
+    # at most one and a half data sets fit into the memory limit
+    n_bytes = data.wave1.get_n_bytes()
+    config.data.max_resident_data_sets = None
+    config.data.max_resident_memory = 1.5 * n_bytes / 2**20
+    data = setup_data(config, codebook, (data_path,) * 3, data_labels)
+    assert list(data._resident) == ["wave3"]
+    assert data.wave1.name == "wave1"
+    assert data.wave2.name == "wave2"
+    assert list(data._resident) == ["wave2"]
+    assert sum(data._resident_bytes.values()) == n_bytes
+
+
+@pytest.mark.parametrize(
+    "get_test_inputs", [["test_data_column_store"]], indirect=["get_test_inputs"]
+)
+def test_data_column_store(get_test_inputs):
+    name = get_test_inputs[0]
+    prefix = get_test_inputs[1]
+    config_path = get_test_inputs[2]
+    codebook_path = get_test_inputs[3]
+    data_path = get_test_inputs[4]
+
+    config = setup_config(prefix, config_path, name, "4", "pdf", False)
+    config.data.column_store = True
+    codebook = setup_codebook(config, codebook_path)
+    variables = list(codebook.codebook.variable)
+    data = setup_data_object(config, codebook, data_path, "data")
+    path = get_column_store_path(config, "data")
+    assert data.column_store[0] == path
+
+    # reruns map the columns instead of reading the data file
+    mapped = setup_data_object(config, codebook, data_path, "data", full_rerun=False)
+    assert isinstance(mapped.group_codes, np.memmap)
+    assert mapped.get_fingerprint() == data.get_fingerprint()
+    assert np.array_equal(
+        mapped.get_statistics(variables).count, data.get_statistics(variables).count
+    )
+    # mapped data sets are pickled by reference
+    assert "frame" not in mapped.__getstate__()
+    assert (
+        pickle.loads(pickle.dumps(mapped)).get_fingerprint() == data.get_fingerprint()
+    )
+
+    # stores of other codebooks are ignored, replaced stores are not mapped
+    codebook.codebook.loc[0, "missing_label"] = 99
+    assert read_column_store(config, codebook, "data") is None
+    state = pickle.dumps(mapped)
+    data = setup_data(config, codebook, (data_path,), ("data",))["data"]
+    assert data.column_store[1] != mapped.column_store[1]
+    with pytest.raises(ValueError):
+        pickle.loads(state)
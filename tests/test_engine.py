@@ -0,0 +1,165 @@
+import ast
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from niceplots import main
+from niceplots.plotting.barplot import get_histograms
+from niceplots.utils.codebook import setup_codebook
+from niceplots.utils.config import setup_config
+from niceplots.utils.data import Data
+from niceplots.utils.engine import DataEngine, get_engine
+from niceplots.utils.group_filter import GroupFilter
+
+pytest.importorskip("polars")
+
+
+def test_group_filters(monkeypatch):
+    df = pd.DataFrame(
+        {
+            "A": [1, 2, np.nan, 4, 2, -3],
+            "B": ["x", "y", None, "x", "z", "y"],
+            "C D": [0, 1, 1, 0, 1, 0],
+        }
+    )
+    groups = {
+        "one": "(A > 1) & (B != 'x')",
+        "two": "B in ['x']",
+        "three": "A == 2 | `C D` == 1 & B != 'z'",
+        "four": "not A % 2 == 0 or A + 1 > 3",
+        "five": "1 < A <= 4 and B not in ['x', 'z']",
+        "six": "~(A != 4) | -A >= 3",
+        "seven": "A == [2, 4] & (A * 2 < 8)",
+        "eight": True,
+    }
+    pandas_engine = get_engine("pandas")
+    polars_engine = get_engine("polars")
+    # the polars engine does not fall back to numpy
+    monkeypatch.setattr(DataEngine, "assign_groups", None)
+    for name, group_string in groups.items():
+        group_filter = GroupFilter({name: group_string})
+        codes, counts = polars_engine.assign_groups(
+            polars_engine.from_pandas(df.copy()), group_filter
+        )
+        expected_codes, expected_counts = GroupFilter.evaluate(
+            group_filter,
+            lambda column: pandas_engine.get_values(df, column),
+            df.shape[0],
+        )
+        assert np.array_equal(codes, expected_codes), name
+        assert np.array_equal(counts, expected_counts), name
+    monkeypatch.undo()
+
+    group_filter = GroupFilter(groups | {"text": "B == 1"})
+    codes = {}
+    for engine_name in ["pandas", "polars"]:
+        engine = get_engine(engine_name)
+        codes[engine_name], _ = engine.assign_groups(
+            engine.from_pandas(df.copy()), group_filter
+        )
+    assert np.array_equal(codes["pandas"], codes["polars"])
+
+    with pytest.raises(ValueError):
+        polars_engine.assign_groups(
+            polars_engine.from_pandas(df), GroupFilter({"bad": "A < [1, 2]"})
+        )
+    with pytest.raises(ValueError):
+        get_engine("unknown")
+    # engines have to implement the whole interface
+    with pytest.raises(TypeError):
+        DataEngine()
+
+
+@pytest.mark.parametrize(
+    "get_test_inputs", [["test_engines"]], indirect=["get_test_inputs"]
+)
+def test_engines(get_test_inputs):
+    name = get_test_inputs[0]
+    prefix = get_test_inputs[1]
+    config_path = get_test_inputs[2]
+    codebook_path = get_test_inputs[3]
+    data_path = get_test_inputs[4]
+
+    config = setup_config(prefix, config_path, name, "4", "pdf", False)
+    codebook = setup_codebook(config, codebook_path)
+    data = {}
+    for engine_name in ["pandas", "polars"]:
+        engine = get_engine(engine_name)
+        data[engine_name] = Data(
+            engine.read_csv(data_path, config.data.delimiter),
+            engine_name,
+            config.data.groups,
+            codebook.codebook.variable,
+            config.data.no_answer_code,
+            from_source=True,
+            engine=engine,
+        )
+        data[engine_name].check(codebook)
+
+    pandas_data = data["pandas"]
+    polars_data = data["polars"]
+    assert np.array_equal(pandas_data.group_codes, polars_data.group_codes)
+    assert np.array_equal(pandas_data.group_counts, polars_data.group_counts)
+    for variable in codebook.codebook.variable:
+        for group in [None] + pandas_data.group_names:
+            assert np.array_equal(
+                pandas_data.get_values(variable, group),
+                polars_data.get_values(variable, group),
+            )
+            assert pandas_data.get_n_no_answers(
+                variable, group
+            ) == polars_data.get_n_no_answers(variable, group)
+    variables = list(codebook.codebook.variable)
+    # fingerprints only differ by the name of the data objects
+    polars_data.name = pandas_data.name
+    assert pandas_data.get_fingerprint(variables) == polars_data.get_fingerprint(
+        variables
+    )
+
+    codebook_block = codebook.codebook[codebook.codebook.block == 1]
+    value_map = ast.literal_eval(codebook_block.iloc[0]["value_map"])
+    histograms = [
+        get_histograms(
+            config,
+            pandas_data.group_names,
+            codebook_block,
+            data[engine_name],
+            codebook_block.shape[0],
+            value_map,
+        )
+        for engine_name in ["pandas", "polars"]
+    ]
+    for hist_pandas, hist_polars in zip(
+        histograms[0][0], histograms[1][0], strict=True
+    ):
+        for group in pandas_data.group_names:
+            assert np.array_equal(hist_pandas[group][0], hist_polars[group][0])
+
+
+def test_polars_barplots(tmp_path):
+    example_dir = os.path.dirname(__file__) + "/../examples/"
+    for f in ["example_codebook.csv", "example_data.csv"]:
+        shutil.copy(example_dir + f, tmp_path / f)
+    config = Path(example_dir + "example_config.yml").read_text()
+    config_path = tmp_path / "example_config.yml"
+    config_path.write_text(config.replace('engine: "pandas"', 'engine: "polars"'))
+
+    main.main(
+        (tmp_path / "example_data.csv",),
+        tmp_path / "example_codebook.csv",
+        config_path,
+        "test_polars",
+        ("barplots",),
+        "pdf",
+        False,
+        "4",
+        ("data",),
+        tmp_path,
+        True,
+    )
+    plots = [f for f in os.listdir(tmp_path / "test_polars") if f.endswith(".pdf")]
+    assert len(plots) == 5
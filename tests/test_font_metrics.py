@@ -0,0 +1,26 @@
+import io
+
+import pytest
+from matplotlib.backends.backend_svg import RendererSVG
+from matplotlib.font_manager import FontProperties
+
+from niceplots.utils import font_metrics
+from niceplots.utils.font_metrics import get_text_width, wrap_text
+
+
+def test_font_metrics():
+    # the tables are up to date
+    source = open(font_metrics.__file__, encoding="utf-8").read()
+    assert font_metrics.build_tables() in source
+
+    # unhinted reference, as the text is laid out in vector output
+    renderer = RendererSVG(100, 100, io.StringIO())
+    for weight in ["normal", "bold"]:
+        font = FontProperties(family="DejaVu Sans", size=12, weight=weight)
+        for text in ["Talks a lot", "Notices other people’s weak points", "m = 2.80"]:
+            width, _, _ = renderer.get_text_width_height_descent(text, font, False)
+            assert get_text_width(text, 12, weight) == pytest.approx(width, rel=1e-3)
+
+    lines = wrap_text("Notices other people’s weak points\nn = 10", 144, 12)
+    assert lines == ["Notices other people’s", "weak points", "n = 10"]
+    assert all(get_text_width(line, 12) <= 144 for line in lines)
@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from niceplots.utils import group_filter as group_filter_module
+from niceplots.utils.group_filter import GroupFilter
+
+
+def get_data(n_rows: int) -> pd.DataFrame:
+    rng = np.random.default_rng(1)
+    df = pd.DataFrame(
+        {
+            "VAR01": rng.integers(1, 6, n_rows).astype(float),
+            "VAR02": rng.integers(1, 5, n_rows).astype(float),
+            "VAR 03": rng.integers(0, 3, n_rows),
+        }
+    )
+    df.loc[::7, "VAR01"] = np.nan
+    return df
+
+
+GROUPS = {
+    "Group 1": "VAR02 == 1",
+    "Others": "(VAR02 == 2) | (VAR02 == 4)",
+    "Mixed": "(VAR02 == 4) | (VAR02 == 2) and VAR01 != 3",
+    "Chain": "1 < VAR01 <= 4 and not VAR02 in [1, 3]",
+    "Quoted": "`VAR 03` * 2 >= VAR01 - 1",
+    "Negation": "~(VAR01 > 2)",
+    # & and | bind weaker than comparisons (as in pandas queries)
+    "Plain and": "VAR02 == 1 & VAR01 == 2",
+    "Plain or": "VAR02 == 3 | VAR01 >= 4 & `VAR 03` == 0",
+}
+
+
+@pytest.mark.parametrize("n_rows", [100, 20000])
+def test_group_filter(n_rows):
+    df = get_data(n_rows)
+    group_filter = GroupFilter(GROUPS)
+    codes, counts = group_filter.evaluate(
+        lambda column: df[column].to_numpy(dtype=float), n_rows
+    )
+
+    # same result as pandas queries (last group wins)
+    expected = np.full(n_rows, -1)
+    for id_g, group_string in enumerate(GROUPS.values()):
+        expected[df.index.isin(df.query(group_string).index)] = id_g
+    assert np.array_equal(codes, expected)
+    assert np.array_equal(
+        counts, np.bincount(expected[expected >= 0], minlength=len(GROUPS))
+    )
+
+
+def test_group_filter_shared_expressions(monkeypatch):
+    df = get_data(100)
+    requested = []
+
+    def get_column(column):
+        requested.append(column)
+        return df[column].to_numpy(dtype=float)
+
+    evaluations = []
+    evaluate = group_filter_module.Evaluation._evaluate
+
+    def count_evaluations(self, node):
+        evaluations.append(node)
+        return evaluate(self, node)
+
+    monkeypatch.setattr(group_filter_module.Evaluation, "_evaluate", count_evaluations)
+    group_filter = GroupFilter(
+        {
+            "a": "VAR02 == 1",
+            "b": "(VAR02 == 1) | (VAR02 == 4)",
+            "c": "(VAR02 == 4) | (VAR02 == 1)",
+        }
+    )
+    group_filter.evaluate(get_column, 100)
+    # columns are read once, VAR02, 1, 4, both comparisons and the disjunction
+    assert requested == ["VAR02"]
+    assert len(evaluations) == 6
+
+
+def test_group_filter_errors():
+    group_filter = GroupFilter({"a": "VAR02 == 1", "b": "(VAR99 == 1) | (VAR98 > 2)"})
+    with pytest.raises(ValueError, match="VAR99.*VAR98"):
+        group_filter.check_columns(["VAR01", "VAR02"])
+
+    with pytest.raises(ValueError, match="named b"):
+        GroupFilter({"a": "VAR02 == 1", "b": "VAR02 =="})
+
+    with pytest.raises(ValueError, match="Unsupported"):
+        GroupFilter({"a": "VAR02.abs() == 1"})
@@ -0,0 +1,60 @@
+import matplotlib.image as mpimg
+import numpy as np
+import pytest
+
+from niceplots.plotting import barplot, histogram, lineplot
+from niceplots.utils.codebook import setup_codebook
+from niceplots.utils.config import setup_config
+from niceplots.utils.data import setup_data
+from niceplots.utils.layout_pool import LAYOUT_POOL
+
+
+@pytest.mark.parametrize(
+    "get_test_inputs", [["test_layout_pool"]], indirect=["get_test_inputs"]
+)
+def test_layout_pool(get_test_inputs):
+    name, prefix, config_path, codebook_path, data_path = get_test_inputs
+
+    config = setup_config(prefix, config_path, name, "4", "png", False)
+    codebook = setup_codebook(config, codebook_path)
+    data_collection = setup_data(config, codebook, (data_path,), ("data",))
+    data = data_collection.data
+    blocks = codebook.blocks[~np.isnan(codebook.blocks)]
+    n_built = 0
+    n_plots = 0
+
+    for plot_name, module, plot_func in [
+        ("barplot", barplot, barplot.plot_barplot),
+        ("lineplot", lineplot, lineplot.plot_lineplot),
+        ("histogram", histogram, histogram.plot_histogram),
+    ]:
+        # reused layouts
+        LAYOUT_POOL.clear()
+        get_layout = module.get_layout
+
+        def counting_get_layout(*args, get_layout=get_layout):
+            nonlocal n_built
+            n_built += 1
+            return get_layout(*args)
+
+        module.get_layout = counting_get_layout
+        try:
+            reused = {}
+            for block in blocks:
+                plot_func(block, data, config, codebook)
+                path = config.get_plot_path(plot_name, block)
+                if path.exists():
+                    reused[block] = mpimg.imread(path)
+        finally:
+            module.get_layout = get_layout
+        n_plots += len(reused)
+
+        # fresh layout for every block
+        for block in reused:
+            LAYOUT_POOL.clear()
+            plot_func(block, data, config, codebook)
+            fresh = mpimg.imread(config.get_plot_path(plot_name, block))
+            np.testing.assert_array_equal(fresh, reused[block])
+    LAYOUT_POOL.clear()
+    # blocks with the same number of variables share their layout
+    assert n_built < n_plots
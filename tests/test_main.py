@@ -1,6 +1,23 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import matplotlib.image as mpimg
+import numpy as np
+import pandas as pd
 import pytest
 
 from niceplots import main
+from niceplots.plotting import barplot, histogram, lineplot
+from niceplots.utils.codebook import setup_codebook
+from niceplots.utils.config import setup_config
+from niceplots.utils.data import setup_data, setup_data_object
+from niceplots.utils.layout_pool import LAYOUT_POOL
+from niceplots.utils.output_writer import DRAFT_DPI
+from niceplots.utils.pipeline import Pipeline
+from niceplots.utils.selection import Selection
 
 
 @pytest.mark.parametrize(
@@ -36,3 +53,510 @@ def test_main(get_test_inputs_main) -> None:
         False,
     )
     main.main(*input_args)
+
+
+@pytest.mark.parametrize(
+    "get_test_inputs_main",
+    [["test_main_aggregates", "all"]],
+    indirect=["get_test_inputs_main"],
+)
+def test_main_aggregates(get_test_inputs_main) -> None:
+    name = get_test_inputs_main[0]
+    prefix = get_test_inputs_main[1]
+    config_path = get_test_inputs_main[2]
+    codebook_path = get_test_inputs_main[3]
+    data_path = get_test_inputs_main[4]
+
+    # run in a fresh interpreter to check that matplotlib is not imported
+    script = f"""
+import sys
+from pathlib import Path
+from niceplots import main
+aggregates = main.aggregates(
+    (Path("{data_path}"),),
+    Path("{codebook_path}"),
+    Path("{config_path}"),
+    "{name}",
+    prefix=Path("{prefix}"),
+    full_rerun=True,
+)
+aggregates.to_csv(sys.stdout, index=False)
+assert "matplotlib" not in sys.modules
+"""
+    result = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True
+    )
+    assert result.returncode == 0, result.stderr
+
+    output_dir = f"{prefix}/{name}"
+    aggregates = pd.read_csv(f"{output_dir}/aggregates_{name}.csv")
+    assert not any(f.endswith(".pdf") for f in os.listdir(output_dir))
+    # only the aggregates are written
+    assert not os.path.exists(f"{output_dir}/statistics_{name}.csv")
+    assert not os.path.exists(f"{output_dir}/data_{name}.xlsx")
+    assert list(aggregates.columns[:6]) == [
+        "data",
+        "block",
+        "variable",
+        "label",
+        "group",
+        "code",
+    ]
+    # counts per code add up to the number of answers
+    n = aggregates.groupby(["variable", "group"]).agg({"count": "sum", "n": "first"})
+    assert (n["count"] == n["n"]).all()
+
+
+@pytest.mark.parametrize(
+    "get_test_inputs_main",
+    [["test_main_report", "all"]],
+    indirect=["get_test_inputs_main"],
+)
+def test_main_report(get_test_inputs_main) -> None:
+    name = get_test_inputs_main[0]
+    prefix = get_test_inputs_main[1]
+    config_path = get_test_inputs_main[2]
+    codebook_path = get_test_inputs_main[3]
+    data_path = get_test_inputs_main[4]
+
+    main.main(
+        (data_path,),
+        codebook_path,
+        config_path,
+        name,
+        ("all",),
+        "pdf",
+        False,
+        "3",
+        ("data",),
+        prefix,
+        True,
+        report=True,
+    )
+
+    output_dir = f"{prefix}/{name}"
+    assert not any(f.endswith(".pdf") for f in os.listdir(output_dir))
+    assert not os.path.exists(f"{output_dir}/statistics_{name}.csv")
+    html = Path(f"{output_dir}/report_{name}.html").read_text(encoding="utf-8")
+    assert "function plotBarplot" in html
+    aggregates = html.split('<script id="aggregates" type="application/json">')[1]
+    report = json.loads(aggregates.split("</script>")[0])
+    assert report["options"]["plot_types"] == ["barplot", "lineplot", "histogram"]
+    assert [block["block"] for block in report["blocks"]] == [1, 2, 3, 4, 5]
+    # counts per code add up to the number of answers of each group
+    for variable in report["data"]["data"]["variables"].values():
+        assert [sum(counts) for counts in variable["counts"]] == variable["n"]
+
+
+@pytest.mark.parametrize(
+    "get_test_inputs_main",
+    [["test_main_draft", "all"]],
+    indirect=["get_test_inputs_main"],
+)
+def test_main_draft(get_test_inputs_main) -> None:
+    name = get_test_inputs_main[0]
+    prefix = get_test_inputs_main[1]
+    config_path = get_test_inputs_main[2]
+    codebook_path = get_test_inputs_main[3]
+    data_path = get_test_inputs_main[4]
+
+    main.main(
+        (data_path,),
+        codebook_path,
+        config_path,
+        name,
+        ("all",),
+        "pdf",
+        False,
+        "3",
+        ("data",),
+        prefix,
+        True,
+        draft=True,
+    )
+
+    # drafts are written as low resolution png files without cropping
+    output_dir = f"{prefix}/{name}"
+    assert not any(f.endswith(".pdf") for f in os.listdir(output_dir))
+    config = setup_config(prefix, config_path, name, "3", "pdf", False, draft=True)
+    codebook = setup_codebook(config, codebook_path)
+    n_variables = int((codebook.codebook.block == 2).sum())
+    height = (n_variables + barplot.N_UNITS_LEGEND) * config.barplots.layout[
+        "height_question"
+    ]
+    image = mpimg.imread(f"{output_dir}/{name}_barplot_2.png")
+    assert image.shape[0] == round(height * DRAFT_DPI)
+
+
+@pytest.mark.parametrize(
+    "get_test_inputs_main",
+    [["test_main_threads", "all"]],
+    indirect=["get_test_inputs_main"],
+)
+def test_main_threads(get_test_inputs_main) -> None:
+    name = get_test_inputs_main[0]
+    prefix = get_test_inputs_main[1]
+    config_path = get_test_inputs_main[2]
+    codebook_path = get_test_inputs_main[3]
+    data_path = get_test_inputs_main[4]
+
+    # render all blocks in threads in a fresh interpreter to check that pyplot
+    # is not used
+    script = f"""
+import sys
+from pathlib import Path
+from niceplots import main
+main.main(
+    (Path("{data_path}"),),
+    Path("{codebook_path}"),
+    Path("{config_path}"),
+    "{name}",
+    ("all",),
+    "png",
+    False,
+    "3",
+    ("data",),
+    Path("{prefix}"),
+    True,
+    n_workers=4,
+)
+assert "matplotlib.pyplot" not in sys.modules
+"""
+    result = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True
+    )
+    assert result.returncode == 0, result.stderr
+
+    # the plots rendered concurrently match the plots rendered one by one
+    output_dir = f"{prefix}/{name}"
+    threaded = {
+        f: mpimg.imread(f"{output_dir}/{f}")
+        for f in os.listdir(output_dir)
+        if f.endswith(".png")
+    }
+    assert len(threaded) > 0
+    config = setup_config(prefix, config_path, name, "4", "png", False)
+    codebook = setup_codebook(config, codebook_path)
+    data = setup_data(config, codebook, (data_path,), ("data",))
+    LAYOUT_POOL.clear()
+    barplot.plot_barplots(config, codebook, data)
+    lineplot.plot_lineplots(config, codebook, data)
+    histogram.plot_histograms(config, codebook, data)
+    for f, image in threaded.items():
+        np.testing.assert_array_equal(mpimg.imread(f"{output_dir}/{f}"), image)
+
+
+def test_main_pages(tmp_path) -> None:
+    example_dir = os.path.dirname(__file__) + "/../examples/"
+    config = Path(example_dir + "example_config.yml").read_text()
+    config_path = tmp_path / "example_config.yml"
+    config_path.write_text(
+        config.replace("max_variables_per_page: 30", "max_variables_per_page: 4")
+    )
+
+    main.main(
+        (Path(example_dir + "example_data.csv"),),
+        Path(example_dir + "example_codebook.csv"),
+        config_path,
+        "test_pages",
+        ("all",),
+        "png",
+        False,
+        "4",
+        ("data",),
+        tmp_path,
+        True,
+    )
+    plots = os.listdir(tmp_path / "test_pages")
+    # block 5 holds 10 variables -> 3 pages
+    for plot_name in ["barplot", "lineplot"]:
+        assert f"test_pages_{plot_name}_5.png" not in plots
+        assert f"test_pages_{plot_name}_5_page4.png" not in plots
+        for page in [1, 2, 3]:
+            assert f"test_pages_{plot_name}_5_page{page}.png" in plots
+        # small blocks are not split
+        assert f"test_pages_{plot_name}_1.png" in plots
+
+
+def test_main_small_multiples(tmp_path) -> None:
+    example_dir = os.path.dirname(__file__) + "/../examples/"
+    config = Path(example_dir + "example_config.yml").read_text()
+    config_path = tmp_path / "example_config.yml"
+    config_path.write_text(
+        config.replace("max_variables_small_block: 0", "max_variables_small_block: 9")
+    )
+
+    main.main(
+        (Path(example_dir + "example_data.csv"),),
+        Path(example_dir + "example_codebook.csv"),
+        config_path,
+        "test_small",
+        ("all",),
+        "png",
+        False,
+        "4",
+        ("data",),
+        tmp_path,
+        True,
+    )
+    plots = os.listdir(tmp_path / "test_small")
+    # blocks 1-4 hold 1 + 9 + 9 + 8 variables, block 5 holds 10
+    for plot_name in ["barplot", "lineplot"]:
+        assert f"test_small_{plot_name}_1-2-3-4.png" in plots
+        assert f"test_small_{plot_name}_5.png" in plots
+        for block in [1, 2, 3, 4]:
+            assert f"test_small_{plot_name}_{block}.png" not in plots
+
+
+def test_main_timelines(tmp_path) -> None:
+    example_dir = os.path.dirname(__file__) + "/../examples/"
+    df = pd.read_csv(example_dir + "example_data.csv")
+    data_paths = []
+    for wave in range(4):
+        data_path = tmp_path / f"wave{wave + 1}.csv"
+        df.sample(frac=0.8, random_state=wave).to_csv(data_path, index=False)
+        data_paths.append(data_path)
+
+    def run(n_waves: int, full_rerun: bool = True) -> main.NicePlots:
+        nice_plots = main.NicePlots(
+            tuple(data_paths[:n_waves]),
+            Path(example_dir + "example_codebook.csv"),
+            Path(example_dir + "example_config.yml"),
+            "test_timelines",
+            ("timelines",),
+            "png",
+            False,
+            "4",
+            tuple(f"w{wave + 1}" for wave in range(n_waves)),
+            tmp_path,
+            full_rerun,
+        )
+        nice_plots.run()
+        return nice_plots
+
+    nice_plots = run(3)
+    plots = os.listdir(tmp_path / "test_timelines")
+    for block in [1, 2, 3, 4, 5]:
+        assert f"test_timelines_timeline_{block}.png" in plots
+    assert not any(f.startswith("test_timelines_barplot") for f in plots)
+
+    # adding a wave only aggregates the new data set
+    nice_plots = run(4)
+    executed = nice_plots.pipeline.executed
+    assert [n for n in executed if n.startswith("aggregates:")] == ["aggregates:w4"]
+    assert len([n for n in executed if n.startswith("timeline:")]) == 5
+
+    # rewriting the nice-plots data file does not invalidate the data sets
+    run(2, full_rerun=False)
+    run(3, full_rerun=False)
+    executed = run(3, full_rerun=False).pipeline.executed
+    assert not any(n.startswith("data:") for n in executed)
+
+    with pytest.raises(ValueError):
+        main.check_arguments(tuple(data_paths[:2]), ("w1", "w1"))
+
+
+def test_main_append(tmp_path) -> None:
+    example_dir = os.path.dirname(__file__) + "/../examples/"
+    df = pd.read_csv(example_dir + "example_data.csv")
+    data_path = tmp_path / "data.csv"
+    df.iloc[:40].to_csv(data_path, index=False)
+
+    nice_plots = main.NicePlots(
+        (data_path,),
+        Path(example_dir + "example_codebook.csv"),
+        Path(example_dir + "example_config.yml"),
+        "test_append",
+        ("barplots",),
+        "png",
+        False,
+        "4",
+        ("data",),
+        tmp_path,
+        True,
+        append=True,
+    )
+    assert len(nice_plots.run()) == 5
+
+    # responses that only answered VAR02 (block 2) only change block 2
+    new_rows = pd.DataFrame({"ID": df.ID.iloc[40:45], "VAR02": 1}, columns=df.columns)
+    new_rows.to_csv(data_path, mode="a", header=False, index=False)
+    assert nice_plots.run() == ["barplot:data:2"]
+
+    df.iloc[45:].to_csv(data_path, mode="a", header=False, index=False)
+    assert len(nice_plots.run()) == 5
+    # the appended data set is aggregated like the complete table
+    data = nice_plots.results["data:data"]
+    full = setup_data_object(
+        nice_plots.results["config"], nice_plots.results["codebook"], data_path, "data"
+    )
+    variables = list(full.variables)
+    assert np.array_equal(
+        data.get_statistics(variables).count, full.get_statistics(variables).count
+    )
+
+
+def test_main_selection(tmp_path) -> None:
+    example_dir = os.path.dirname(__file__) + "/../examples/"
+    data_path = Path(example_dir + "example_data.csv")
+
+    nice_plots = main.NicePlots(
+        (data_path, data_path),
+        Path(example_dir + "example_codebook.csv"),
+        Path(example_dir + "example_config.yml"),
+        "test_selection",
+        ("barplots", "timelines"),
+        "png",
+        False,
+        "4",
+        ("wave1", "wave2"),
+        tmp_path,
+        True,
+        selection=Selection(variables=["VAR02"], labels=["wave2"]),
+    )
+    rendered = nice_plots.run()
+    assert sorted(rendered) == ["barplot:wave2:2", "timeline:2"]
+    # only the columns of the selected block (and the group filters) are read
+    data = nice_plots.results["data:wave2"]
+    codebook = nice_plots.results["codebook:selected"]
+    assert list(data.variables) == list(codebook.codebook.variable)
+    assert "VAR01" not in data.data.columns
+    # the plots are named as in a full run, the data file is not written
+    output_dir = tmp_path / "test_selection"
+    assert sorted(os.listdir(output_dir)) == [
+        "codebook_test_selection.csv",
+        "config_test_selection.yml",
+        "test_selection_barplot_2_wave2.png",
+        "test_selection_timeline_2.png",
+    ]
+
+    # only plots that were written are counted (no histogram applies to blocks 2, 3)
+    nice_plots = main.NicePlots(
+        (data_path,),
+        Path(example_dir + "example_codebook.csv"),
+        Path(example_dir + "example_config.yml"),
+        "test_selection_histograms",
+        ("histograms",),
+        "png",
+        False,
+        "4",
+        ("data",),
+        tmp_path,
+        True,
+        selection=Selection(blocks=["1-3"]),
+    )
+    assert nice_plots.run() == ["histogram:data:1"]
+    assert len(nice_plots.render_nodes) == 3
+
+    with pytest.raises(ValueError):
+        main.NicePlots(
+            (data_path,),
+            Path(example_dir + "example_codebook.csv"),
+            Path(example_dir + "example_config.yml"),
+            "test_selection",
+            ("barplots",),
+            "png",
+            False,
+            "4",
+            ("data",),
+            tmp_path,
+            True,
+            append=True,
+            selection=Selection(blocks=["2"]),
+        )
+
+
+def test_main_resident(tmp_path, monkeypatch) -> None:
+    example_dir = os.path.dirname(__file__) + "/../examples/"
+    config = Path(example_dir + "example_config.yml").read_text()
+    config_path = tmp_path / "example_config.yml"
+    config_path.write_text(
+        config.replace("max_resident_data_sets: null", "max_resident_data_sets: 1")
+    )
+    data_labels = ("w1", "w2", "w3")
+
+    # number of data sets held by the pipeline whenever a stage finished
+    n_resident = []
+    collect = Pipeline._collect
+
+    def count_resident(self, node, entry, results, fingerprints):
+        n_resident.append(len(self.resident))
+        collect(self, node, entry, results, fingerprints)
+
+    monkeypatch.setattr(Pipeline, "_collect", count_resident)
+    nice_plots = main.NicePlots(
+        (Path(example_dir + "example_data.csv"),) * 3,
+        Path(example_dir + "example_codebook.csv"),
+        config_path,
+        "test_resident",
+        ("barplots",),
+        "png",
+        False,
+        "4",
+        data_labels,
+        tmp_path,
+        True,
+    )
+    assert len(nice_plots.run()) == 15
+    assert max(n_resident) == 1
+    # the data sets were dropped from memory, the data file was still written
+    assert all(f"data:{label}" not in nice_plots.results for label in data_labels)
+    assert all(
+        nice_plots.pipeline.cache[f"data:{label}"].released for label in data_labels
+    )
+    assert len(nice_plots.results["data"]._resident) == 1
+    sheets = pd.ExcelFile(tmp_path / "test_resident" / "data_test_resident.xlsx")
+    assert sheets.sheet_names == list(data_labels)
+
+    # unchanged reruns do not load the data sets from the disk cache
+    n_resident.clear()
+    monkeypatch.setattr(Pipeline, "load", lambda self, name: pytest.fail(name))
+    assert nice_plots.run() == []
+    assert max(n_resident) == 1
+
+
+def test_main_style(tmp_path, monkeypatch) -> None:
+    example_dir = os.path.dirname(__file__) + "/../examples/"
+    config = Path(example_dir + "example_config.yml").read_text()
+    config_path = tmp_path / "example_config.yml"
+    config_path.write_text(config)
+
+    def get_nice_plots() -> main.NicePlots:
+        return main.NicePlots(
+            (Path(example_dir + "example_data.csv"),),
+            Path(example_dir + "example_codebook.csv"),
+            config_path,
+            "test_style",
+            ("barplots", "histograms"),
+            "png",
+            False,
+            "4",
+            ("data",),
+            tmp_path,
+            True,
+        )
+
+    rendered = get_nice_plots().run()
+    assert any(n.startswith("histogram:") for n in rendered)
+
+    # results read from the disk cache by a new run
+    loaded = []
+    load = Pipeline._load
+
+    def record_load(self, node, key, with_result=True):
+        if with_result:
+            loaded.append(node.name)
+        return load(self, node, key, with_result)
+
+    monkeypatch.setattr(Pipeline, "_load", record_load)
+    config_path.write_text(
+        config.replace('color_scheme: "RdYlGn"', 'color_scheme: "RdBu"')
+    )
+    nice_plots = get_nice_plots()
+    assert nice_plots.run() == [n for n in rendered if n.startswith("barplot:")]
+    # the barplots are rendered from the aggregates without reading the data set
+    assert "data:data" not in loaded
+    assert "aggregates:data" in loaded
+    executed = nice_plots.pipeline.executed
+    assert not any(n.startswith(("data:", "aggregates:", "counts:")) for n in executed)
+    assert "write:statistics" not in executed
@@ -0,0 +1,66 @@
+import os
+
+import matplotlib.image as mpimg
+import numpy as np
+import pytest
+from matplotlib.figure import Figure
+
+from niceplots.utils.output_writer import OutputWriter, save_figure, write_figure
+from niceplots.utils.plotting_utils import WrapText
+
+
+def test_output_writer(tmp_path):
+    written = []
+    writer = OutputWriter(n_workers=2, max_pending=1)
+    futures = []
+    for i in range(4):
+        fig = Figure(figsize=(1, 1))
+        fig.add_subplot().plot([0, i])
+        futures.append(
+            writer.submit(fig, tmp_path / f"plot_{i}.png", on_written=written.append)
+        )
+    # writing to a missing directory fails without affecting the other plots
+    failed = writer.submit(Figure(), tmp_path / "missing" / "plot.pdf")
+    writer.shutdown()
+
+    assert [future.result() for future in futures] == [
+        tmp_path / f"plot_{i}.png" for i in range(4)
+    ]
+    assert len(written) == 4
+    with pytest.raises(FileNotFoundError):
+        failed.result()
+    # no temporary files are left behind
+    assert sorted(os.listdir(tmp_path)) == [f"plot_{i}.png" for i in range(4)]
+
+    # without writer the figure is written right away
+    assert write_figure(Figure(), tmp_path / "plot.pdf") == tmp_path / "plot.pdf"
+    assert (tmp_path / "plot.pdf").exists()
+
+
+def test_save_figure_extent(tmp_path):
+    fig = Figure(figsize=(4, 3))
+    ax = fig.add_axes([0.3, 0.1, 0.4, 0.6])
+    # like the layouts of the plots without ticks
+    ax.tick_params(bottom=False, labelbottom=False, left=False, labelleft=False)
+    ax.barh([0, 1], [2, 3], label="bars")
+    ax.text(3.2, 1, "outside of the axes")
+    ax.legend(bbox_to_anchor=(0, 1), loc="lower left")
+    fig.add_artist(
+        WrapText(
+            x=0.0,
+            y=0.5,
+            text="a long question label that is wrapped",
+            x_units="inches",
+            y_units="figure",
+            width=1.0,
+            width_units="inches",
+            figure=fig,
+        )
+    )
+
+    # same cropping as bbox_inches="tight" without drawing the figure twice
+    fig.savefig(tmp_path / "tight.png", bbox_inches="tight")
+    save_figure(fig, tmp_path / "plot.png")
+    np.testing.assert_array_equal(
+        mpimg.imread(tmp_path / "plot.png"), mpimg.imread(tmp_path / "tight.png")
+    )
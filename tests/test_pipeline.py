@@ -0,0 +1,210 @@
+import os
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+from niceplots import main
+from niceplots.utils.pipeline import Node, Pipeline
+
+
+def test_pipeline(tmp_path):
+    source = tmp_path / "source.txt"
+    source.write_text("1")
+    calls = []
+
+    def read(path):
+        calls.append("read")
+        return int(path.read_text())
+
+    def double(value):
+        calls.append("double")
+        return 2 * value
+
+    pipeline = Pipeline(tmp_path / "cache", n_workers=2)
+    pipeline.add_node(Node("read", lambda: read(source), files=[source]))
+    pipeline.add_node(Node("double", double, inputs=["read"], persist=True))
+    pipeline.add_node(Node("triple", lambda value: 3 * value, inputs=["read"]))
+    results = pipeline.run()
+    assert results["double"] == 2
+    assert results["triple"] == 3
+
+    # nothing changed -> nothing recomputed
+    pipeline.run()
+    assert pipeline.executed == []
+
+    # persisted results are reused by new pipelines
+    pipeline_new = Pipeline(tmp_path / "cache")
+    pipeline_new.add_node(Node("read", lambda: read(source), files=[source]))
+    pipeline_new.add_node(Node("double", double, inputs=["read"], persist=True))
+    assert pipeline_new.run(["double"])["double"] == 2
+    assert pipeline_new.executed == ["read"]
+
+    # changed input -> dependent nodes recomputed
+    source.write_text("2")
+    assert pipeline.run(["double"])["double"] == 4
+    assert calls.count("double") == 2
+
+    with pytest.raises(ValueError):
+        pipeline.add_node(Node("unknown", double, inputs=["missing"]))
+
+
+def test_pipeline_background(tmp_path):
+    output = tmp_path / "output.txt"
+
+    def write(executor, text):
+        def target():
+            if text is None:
+                raise OSError("disk full")
+            output.write_text(text)
+            return text
+
+        return executor.submit(target)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pipeline = Pipeline(tmp_path / "cache", n_workers=2)
+        pipeline.add_node(
+            Node("write:1", lambda: write(executor, "1"), outputs=[output])
+        )
+        pipeline.add_node(Node("fail:2", lambda: write(executor, None)))
+        # the run waits for all background stages and reports the failed ones
+        with pytest.raises(RuntimeError, match="fail:2: OSError"):
+            pipeline.run()
+        assert output.read_text() == "1"
+        assert pipeline.executed == ["write:1"]
+
+        # only the failed stage is executed again
+        with pytest.raises(RuntimeError):
+            pipeline.run()
+        assert pipeline.executed == []
+
+
+def test_pipeline_cache_entries(tmp_path):
+    source = tmp_path / "source.txt"
+    calls = []
+
+    def get_pipeline():
+        pipeline = Pipeline(tmp_path / "cache", max_cache_entries=2)
+        pipeline.add_node(Node("read", source.read_text, files=[source]))
+        pipeline.add_node(
+            Node(
+                "upper",
+                lambda text: calls.append(text) or text.upper(),
+                ["read"],
+                persist=True,
+            )
+        )
+        return pipeline
+
+    for text in ["a", "b", "c"]:
+        source.write_text(text)
+        assert get_pipeline().run()["upper"] == text.upper()
+    # only the two most recent results of the node are kept
+    assert len(list((tmp_path / "cache").rglob("*.pkl"))) == 2
+    source.write_text("b")
+    assert get_pipeline().run()["upper"] == "B"
+    source.write_text("a")
+    assert get_pipeline().run()["upper"] == "A"
+    assert calls == ["a", "b", "c", "a"]
+    # the result loaded last is kept, the least recently used one removed
+    source.write_text("b")
+    get_pipeline().run()
+    assert calls == ["a", "b", "c", "a"]
+
+
+def test_pipeline_release(tmp_path):
+    pipeline = Pipeline(tmp_path / "cache", n_workers=2, max_resident=1)
+    started = []
+    for i in range(3):
+        pipeline.add_node(
+            Node(
+                f"load:{i}",
+                lambda i=i: started.append(len(pipeline.resident)) or [i] * 10,
+                persist=True,
+                release=True,
+            )
+        )
+        pipeline.add_node(Node(f"sum:{i}", sum, inputs=[f"load:{i}"]))
+    pipeline.add_node(
+        Node(
+            "collect",
+            lambda *loaders: [loader()[0] for loader in loaders],
+            inputs=[f"load:{i}" for i in range(3)],
+            lazy_inputs=[f"load:{i}" for i in range(3)],
+        )
+    )
+    results = pipeline.run()
+    # each result is dropped once its consumer finished, before the next is loaded
+    assert started == [1, 1, 1]
+    assert [results[f"sum:{i}"] for i in range(3)] == [0, 10, 20]
+    assert not any(f"load:{i}" in results for i in range(3))
+    # lazy inputs are loaded from the disk cache
+    assert results["collect"] == [0, 1, 2]
+    assert pipeline.load("load:1") == [1] * 10
+    # targets are kept
+    assert pipeline.run(["load:2"])["load:2"] == [2] * 10
+
+
+def test_pipeline_deferred(tmp_path, monkeypatch):
+    def get_pipeline(offset: int) -> Pipeline:
+        pipeline = Pipeline(tmp_path / "cache")
+        pipeline.add_node(Node("load", lambda: [1] * 10, persist=True, release=True))
+        pipeline.add_node(
+            Node(
+                "sum",
+                lambda loader: sum(loader()) + offset,
+                inputs=["load"],
+                params=offset,
+                persist=True,
+                deferred_inputs=["load"],
+            )
+        )
+        return pipeline
+
+    assert get_pipeline(0).run()["sum"] == 10
+    loads = []
+    load = pickle.load
+    monkeypatch.setattr(pickle, "load", lambda f: loads.append(1) or load(f))
+    # an up to date consumer does not load the result from the disk cache
+    pipeline = get_pipeline(0)
+    results = pipeline.run()
+    assert results["sum"] == 10 and results["load"] is None
+    assert pipeline.executed == [] and len(loads) == 3
+    # a consumer that is executed again loads it
+    assert get_pipeline(1).run()["sum"] == 11
+
+
+@pytest.mark.parametrize(
+    "get_test_inputs_main",
+    [["test_pipeline_rerun", "barplots"]],
+    indirect=["get_test_inputs_main"],
+)
+def test_pipeline_rerun(get_test_inputs_main) -> None:
+    name = get_test_inputs_main[0]
+    prefix = get_test_inputs_main[1]
+    input_args = (
+        (get_test_inputs_main[4],),
+        get_test_inputs_main[3],
+        get_test_inputs_main[2],
+        name,
+        get_test_inputs_main[5],
+        "pdf",
+        False,
+        "4",
+        ("data",),
+        prefix,
+        False,
+    )
+    main.main(*input_args)
+    output_dir = f"{prefix}/{name}"
+    plots = [f for f in os.listdir(output_dir) if f.endswith(".pdf")]
+    mtimes = {f: os.stat(f"{output_dir}/{f}").st_mtime_ns for f in plots}
+    assert len(plots) > 0
+    statistics = pd.read_csv(f"{output_dir}/statistics_{name}.csv")
+    assert set(statistics.group) == {"Group 1", "Others"}
+
+    # unchanged inputs -> plots are not rendered again
+    main.main(*input_args)
+    for f in plots:
+        assert os.stat(f"{output_dir}/{f}").st_mtime_ns == mtimes[f]
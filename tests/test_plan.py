@@ -0,0 +1,53 @@
+import os
+
+import numpy as np
+
+from niceplots.main import plan
+from niceplots.utils.config import Configuration
+from niceplots.utils.group_filter import GroupFilter
+from niceplots.utils.plan import scan_data_file
+
+EXAMPLE_DIR = os.path.dirname(__file__) + "/../examples"
+
+
+def test_plan():
+    config_path = f"{EXAMPLE_DIR}/example_config.yml"
+    codebook_path = f"{EXAMPLE_DIR}/example_codebook.csv"
+    data_path = f"{EXAMPLE_DIR}/example_data.csv"
+    config = Configuration(config_path, "1")
+    group_filter = GroupFilter(config.data.groups)
+
+    # small tables are read completely, larger ones are estimated from their first rows
+    full = scan_data_file(data_path, "data", ",", group_filter)
+    assert full.exact and full.n_rows == 55
+    assert list(full.group_counts) == [10, 21]
+    estimate = scan_data_file(data_path, "data", ",", group_filter, n_sample_rows=20)
+    assert not estimate.exact
+    assert abs(estimate.n_rows - 55) < 10
+
+    run_plan = plan(
+        (data_path, data_path),
+        codebook_path,
+        config_path,
+        ("barplots", "timelines"),
+        verbosity="1",
+        data_labels=("wave1", "wave2"),
+        n_cores=4,
+        memory=2**40,
+    )
+    # one barplot per data set and block, one timeline per block
+    assert list(run_plan.blocks.block) == [1, 2, 3, 4, 5]
+    assert run_plan.get_n_figures("barplots") == 10
+    assert run_plan.get_n_figures("timelines") == 5
+    assert run_plan.get_n_workers() == 4
+    assert run_plan.get_wall_seconds(4) < run_plan.get_wall_seconds(1)
+    assert run_plan.get_shards(4) == [[1, 2, 3, 4, 5]]
+    assert "--n_workers 4" in run_plan.get_summary()
+
+    # the workers are bounded by the memory, long runs are split into jobs
+    run_plan.memory = run_plan.get_peak_bytes(2)
+    assert run_plan.get_n_workers() == 2
+    run_plan.job_seconds = run_plan.get_wall_seconds(1) / 2
+    shards = run_plan.get_shards(1)
+    assert len(shards) > 1
+    assert list(np.concatenate(shards)) == [1, 2, 3, 4, 5]
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from niceplots.plotting import lineplot
+from niceplots.plotting.barplot import get_summary
+from niceplots.utils.codebook import setup_codebook
+from niceplots.utils.config import setup_config
+from niceplots.utils.data import setup_data
+from niceplots.utils.group_filter import GroupFilter
+from niceplots.utils.report import get_data
+from niceplots.utils.sampling import (
+    get_mean_error,
+    get_mean_errors,
+    get_sample_size,
+    get_share_error,
+    read_sample,
+)
+
+
+@pytest.mark.parametrize(
+    "get_test_inputs", [["test_sampling"]], indirect=["get_test_inputs"]
+)
+def test_sampling(get_test_inputs):
+    name = get_test_inputs[0]
+    prefix = get_test_inputs[1]
+    config_path = get_test_inputs[2]
+    codebook_path = get_test_inputs[3]
+    data_path = get_test_inputs[4]
+
+    config = setup_config(prefix, config_path, name, "4", "pdf", False)
+    codebook = setup_codebook(config, codebook_path)
+    full_collection = setup_data(config, codebook, (data_path,), ("data",))
+    full = full_collection.data
+    group_filter = GroupFilter(config.data.groups)
+
+    # the sample is reproducible and does not depend on the chunk size
+    sample = read_sample(data_path, ",", group_filter, 15, seed=1)
+    assert sample.equals(read_sample(data_path, ",", group_filter, 15, 1, 7))
+    assert not sample.equals(read_sample(data_path, ",", group_filter, 15, seed=2))
+
+    config.data.sample_size = 15
+    config.data.sample_seed = 1
+    data_collection = setup_data(config, codebook, (data_path,), ("data",))
+    data = data_collection.data
+    # at most 15 rows of each group, the population is counted in the full table
+    assert list(data.group_counts) == [min(15, n) for n in full.group_counts]
+    assert np.array_equal(data.population_counts, full.group_counts)
+    assert len(data.data) == len(sample)
+    assert np.allclose(
+        data.get_sampling_fractions(), data.group_counts / full.group_counts
+    )
+    assert full.get_sampling_fractions() is None
+    assert data.get_fingerprint() != full.get_fingerprint()
+
+    # the target error defines the sample size, the interval shrinks to 0 for a census
+    assert get_sample_size(sample_error=0.05) == 385
+    assert get_sample_size(100, 0.05) == 385
+    assert get_sample_size() is None
+    assert get_share_error(385, 0.0) <= 0.05
+    assert get_share_error(385, 1.0) == 0
+
+    assert get_summary(10, 2, 2.5, 1.0) == "n = 10\nm = 2.50\ns = 1.00\nE = 2"
+    summary = get_summary(10, 2, 2.5, 1.0, 0.5)
+    assert summary.startswith("n = 10 (50%, ± 22%)\nm = 2.50 ± 0.44")
+
+    # the means of sampled data are shown with their error in the lineplots and
+    # the report
+    statistics = data.get_statistics(list(codebook.codebook.variable[:1]))
+    fractions = data.get_sampling_fractions()
+    errors = get_mean_errors(statistics.count, statistics.std, fractions)
+    assert errors[0, 0] == get_mean_error(
+        statistics.std[0, 0], statistics.count[0, 0], fractions[0]
+    )
+    assert lineplot.plot_lineplot(1, data, config, codebook) is not None
+    report_data = get_data(data_collection, codebook)["data"]
+    assert np.allclose(report_data["fractions"], fractions, atol=1e-4)
+    variable = report_data["variables"][statistics.variables[0]]
+    assert np.allclose(variable["mean_error"], errors[0], atol=1e-4)
+    report_data = get_data(full_collection, codebook)["data"]
+    assert report_data["fractions"] is None
+    assert all(v["mean_error"] is None for v in report_data["variables"].values())
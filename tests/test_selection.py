@@ -0,0 +1,57 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from niceplots.utils.codebook import setup_codebook
+from niceplots.utils.config import Configuration
+from niceplots.utils.plan import format_blocks
+from niceplots.utils.selection import (
+    Selection,
+    expand_packed_blocks,
+    match_blocks,
+    match_names,
+)
+
+EXAMPLE_DIR = os.path.dirname(__file__) + "/../examples"
+
+
+def test_match():
+    names = ["VAR01", "VAR02", "VAR03", "VAR10", "AGE"]
+    assert match_names(["VAR0*"], names, "variable") == ["VAR01", "VAR02", "VAR03"]
+    assert match_names(["AGE", "VAR02"], names, "variable") == ["VAR02", "AGE"]
+    assert match_names(["VAR03..AGE"], names, "variable") == ["VAR03", "VAR10", "AGE"]
+    for items in [["VAR2*"], ["VAR01..VAR99"], ["VAR10..VAR01"]]:
+        with pytest.raises(ValueError):
+            match_names(items, names, "variable")
+
+    blocks = [1, 2, 3, 5, 8]
+    assert match_blocks(["2-5"], blocks) == [2, 3, 5]
+    assert match_blocks(["8", "1..2"], blocks) == [1, 2, 8]
+    for items in [["4"], ["5-2"], ["a"], ["1-2-3"]]:
+        with pytest.raises(ValueError):
+            match_blocks(items, blocks)
+
+    assert expand_packed_blocks([3], [(1,), (2, 3), (4,)]) == [2, 3]
+    assert format_blocks([5, 1, 2, 3, 8]) == "1-3,5,8"
+
+
+def test_selection():
+    config = Configuration(Path(f"{EXAMPLE_DIR}/example_config.yml"), "1")
+    codebook = setup_codebook(config, Path(f"{EXAMPLE_DIR}/example_codebook.csv"))
+
+    selection = Selection(blocks=["1,4-5"], labels=["w*"])
+    assert not selection.is_empty()
+    assert selection.select_blocks(codebook) == [1, 4, 5]
+    assert selection.select_labels(["w1", "w2", "x"]) == ["w1", "w2"]
+    # variables select their whole blocks
+    selection = Selection(variables=["VAR02", "VAR03"])
+    assert selection.select_blocks(codebook) == [2, 3]
+    assert selection.select_labels(["w1", "w2"]) == ["w1", "w2"]
+    with pytest.raises(ValueError):
+        Selection(blocks=["1"], variables=["VAR02"]).select_blocks(codebook)
+
+    selected = codebook.select([2, 3])
+    assert list(selected.blocks) == [2, 3]
+    assert selected.get_fingerprint(2) == codebook.get_fingerprint(2)
+    assert len(codebook.codebook) > len(selected.codebook)
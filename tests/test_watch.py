@@ -0,0 +1,89 @@
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+from niceplots.main import NicePlots
+
+
+def get_nice_plots(tmp_path: Path) -> NicePlots:
+    example_dir = os.path.dirname(__file__) + "/../examples/"
+    for f in ["example_config.yml", "example_codebook.csv", "example_data.csv"]:
+        shutil.copy(example_dir + f, tmp_path / f)
+    return NicePlots(
+        (tmp_path / "example_data.csv",),
+        tmp_path / "example_codebook.csv",
+        tmp_path / "example_config.yml",
+        "test_watch",
+        ("barplots", "lineplots"),
+        "pdf",
+        False,
+        "4",
+        ("data",),
+        tmp_path,
+        True,
+    )
+
+
+def is_data_executed(nice_plots: NicePlots) -> bool:
+    return any(
+        name.split(":")[0] in ["data", "aggregates"]
+        for name in nice_plots.pipeline.executed
+        if ":" in name
+    )
+
+
+def test_watch_affected_blocks(tmp_path):
+    nice_plots = get_nice_plots(tmp_path)
+    assert len(nice_plots.run()) == 10
+    assert nice_plots.run() == []
+
+    # style change of barplots -> only barplots re-rendered
+    config_path = tmp_path / "example_config.yml"
+    config = config_path.read_text()
+    config_path.write_text(
+        config.replace('color_scheme: "RdYlGn"', 'color_scheme: "Blues"')
+    )
+    rendered = nice_plots.run()
+    assert sorted(rendered) == [f"barplot:data:{block}" for block in range(1, 6)]
+    # styling does not affect the data and aggregates
+    assert not is_data_executed(nice_plots)
+
+    # change of a question label in block 3 -> only block 3 re-rendered
+    codebook_path = tmp_path / "example_codebook.csv"
+    codebook = codebook_path.read_text()
+    codebook_path.write_text(codebook.replace("Can be kind of careless", "Careless"))
+    assert sorted(nice_plots.run()) == ["barplot:data:3", "lineplot:data:3"]
+    assert not is_data_executed(nice_plots)
+
+    # cached data and aggregates are reused by new runs
+    config_path.write_text(config.replace("size: 12", "size: 11"))
+    nice_plots = get_nice_plots(tmp_path)
+    assert len(nice_plots.run()) > 0
+    assert not is_data_executed(nice_plots)
+
+    # change of a variable in block 1 -> only block 1 re-rendered
+    data_path = tmp_path / "example_data.csv"
+    data = data_path.read_text().split("\n")
+    data[1] = "1,3" + data[1][2:]
+    data_path.write_text("\n".join(data))
+    assert sorted(nice_plots.run()) == ["barplot:data:1", "lineplot:data:1"]
+    assert is_data_executed(nice_plots)
+
+
+def test_watch(tmp_path):
+    nice_plots = get_nice_plots(tmp_path)
+    nice_plots.run()
+
+    def edit_config():
+        time.sleep(0.5)
+        config_path = tmp_path / "example_config.yml"
+        config = config_path.read_text()
+        config_path.write_text(config.replace("size: 12", "size: 11"))
+
+    thread = threading.Thread(target=edit_config)
+    thread.start()
+    nice_plots.watch(interval=0.1, max_updates=1)
+    thread.join()
+    assert len(nice_plots.pipeline.executed) > 0